@@ -0,0 +1,361 @@
+"""
+Measures the pairing engine and the IO layer on synthetic farms, from a single drive to a thousand, and records the
+results so a change that slows a phase down (or makes it allocate more) shows up against the previous run.
+
+A farm is given as target_drives:existing_plots:source_plots. The first 8 target drives are local, the rest are spread
+over harvesters of 24 drives each, and every drive already holds its share of the existing plots, half of them old
+enough for its timestamp-before plot_replacement policy to give them up. The pairing phases run against a fake
+HotplotsIO that serves those plots from memory:
+
+    pairing_state        PairingState construction, with room on the drives and other plotters' transfers in flight
+    pairing              HotplotsPairingEngine.get_pairings_result, with room on the drives
+    pairing_full         get_pairings_result with every drive full, which ends in a PlotReplacementResult
+    replacement          get_pairings_result_with_replacement of that result
+
+Farms of up to --max-filesystem-plots plots are also laid out as sparse files in a temporary directory (so a 100 GB
+plot takes no space) and run through a real HotplotsIO, with every target drive local:
+
+    fs_source_scan       get_source_info with a fresh plot inventory
+    fs_source_rescan     get_source_info again, with nothing changed
+    fs_target_discovery  get_targets_info
+    fs_farm_index        find_finished_plots of the source plots, which lists and indexes every target drive
+
+Each phase is timed --repeat times (the best run counts), then run once more under tracemalloc for its peak Python
+heap allocations. Results are appended to --results as JSON lines, and compared with the last run of the same farm on
+the same machine and Python version.
+
+    python -m benchmarks.farm_benchmark
+    python -m benchmarks.farm_benchmark --farms 1000:100000:10000 --max-filesystem-plots 0
+    python -m benchmarks.farm_benchmark --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple, Union
+
+from benchmarks.pairing_benchmark import create_source_info
+from hotplots.constants import Constants
+from hotplots.hotplots_config import TargetDriveConfig, LocalHostConfig, RemoteHostConfig, RemoteTargetsConfig, \
+    TargetsConfig, PlotReplacementConfig, SourceConfig, SourceDriveConfig
+from hotplots.hotplots_io import HotplotsIO
+from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, PlotReplacementResult
+from hotplots.models import TargetDriveInfo, LocalTargetsInfo, RemoteHostInfo, RemoteTargetsInfo, TargetsInfo, \
+    InFlightTransfer, PlotNameMetadata, TargetHostId
+from hotplots.pairing_state import PairingState
+from hotplots.plot_headers import PlotHeader
+
+DEFAULT_FARMS = "1:10:50,10:1000:500,100:10000:2000,1000:100000:5000"
+LOCAL_DRIVES = 8
+DRIVES_PER_HARVESTER = 24
+PLOT_REPLACEMENT = PlotReplacementConfig(True, "timestamp-before", "2021-06-01")
+# a phase only counts as slower (or bigger) when it also changed by more than this, so noise on tiny phases doesn't
+MIN_REGRESSION_SECONDS = 0.005
+MIN_REGRESSION_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class FarmSpec:
+    target_drives: int
+    existing_plots: int
+    source_plots: int
+
+    @staticmethod
+    def parse(value: str) -> 'FarmSpec':
+        (target_drives, existing_plots, source_plots) = [int(n) for n in value.split(":")]
+        return FarmSpec(target_drives, existing_plots, source_plots)
+
+    def __str__(self):
+        return "%s:%s:%s" % (self.target_drives, self.existing_plots, self.source_plots)
+
+
+@dataclass(frozen=True)
+class PhaseResult:
+    seconds: float
+    peak_bytes: int
+
+
+class FakeHotplotsIO:
+    """
+    Stands in for HotplotsIO where the pairing engine needs it (the plot replacement planner's listings and headers),
+    answering from the synthetic farm instead of the drives.
+    """
+    def __init__(self, plot_files: dict[Tuple[TargetHostId, str], List[Tuple[int, str]]]):
+        self.__plot_files = plot_files
+
+    def list_plot_files(self, host_config: Union[LocalHostConfig, RemoteHostConfig], directories: List[str]) -> dict[str, List[Tuple[int, str]]]:
+        target_host_id = TargetHostId.from_(host_config)
+        return {directory: self.__plot_files.get((target_host_id, directory), []) for directory in directories}
+
+    def read_plot_headers(self, host_config: Union[LocalHostConfig, RemoteHostConfig], plot_paths: List[str]) -> dict[str, PlotHeader]:
+        return {}
+
+
+def create_plot_filename(rng: random.Random, year: int) -> str:
+    return "plot-k32-%s-%02d-%02d-%02d-%02d-%064x.plot" % (
+        year, rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.getrandbits(256)
+    )
+
+
+def create_targets_config(num_target_drives: int, root: str = "/mnt") -> TargetsConfig:
+    target_drive_configs = [
+        TargetDriveConfig("%s/target%s" % (root, i), 1, PLOT_REPLACEMENT) for i in range(num_target_drives)
+    ]
+    remote_drive_configs = target_drive_configs[LOCAL_DRIVES:]
+    remote_host_configs = [
+        RemoteHostConfig("harvester%s" % (i // DRIVES_PER_HARVESTER), "chia", 22, 4, remote_drive_configs[i:i + DRIVES_PER_HARVESTER])
+        for i in range(0, len(remote_drive_configs), DRIVES_PER_HARVESTER)
+    ]
+    return TargetsConfig(
+        "drive_with_least_space_remaining",
+        LocalHostConfig(target_drive_configs[:LOCAL_DRIVES]),
+        RemoteTargetsConfig(16, remote_host_configs)
+    )
+
+
+def create_existing_plots(targets_config: TargetsConfig, num_existing_plots: int,
+                          rng: random.Random) -> dict[Tuple[TargetHostId, str], List[Tuple[int, str]]]:
+    """
+    (size, path) of the plots on each target drive, by host and drive path. Half of them predate the replacement date.
+    """
+    drives = [(TargetHostId.from_(targets_config.local), d) for d in targets_config.local.drives]
+    for remote_host_config in targets_config.remote.hosts:
+        drives += [(TargetHostId.from_(remote_host_config), d) for d in remote_host_config.drives]
+
+    plot_files = {}
+    for i, (target_host_id, target_drive_config) in enumerate(drives):
+        plot_files[(target_host_id, target_drive_config.path)] = [
+            (Constants.PLOT_BYTES_BY_K[32], os.path.join(target_drive_config.path, create_plot_filename(rng, rng.choice([2020, 2022]))))
+            for _ in range(num_existing_plots // len(drives) + (1 if i < num_existing_plots % len(drives) else 0))
+        ]
+    return plot_files
+
+
+def create_targets_info(targets_config: TargetsConfig, rng: random.Random, full: bool) -> TargetsInfo:
+    """
+    With room for a few plots on each drive, and another plotter's transfer into some of them, or with every drive full.
+    """
+    def create_target_drive_info(target_drive_config: TargetDriveConfig) -> TargetDriveInfo:
+        if full:
+            return TargetDriveInfo(target_drive_config, 18 * Constants.TERABYTE, Constants.PLOT_BYTES_BY_K[32] // 2, [])
+        in_flight_transfers = []
+        if rng.random() < 0.1:
+            filename = "." + create_plot_filename(rng, 2022) + ".Xy12Ab"
+            in_flight_transfers.append(InFlightTransfer(filename, rng.randint(0, Constants.PLOT_BYTES_BY_K[32]), PlotNameMetadata.parse_from_filename(filename)))
+        return TargetDriveInfo(target_drive_config, 18 * Constants.TERABYTE, rng.randint(0, 4) * Constants.PLOT_BYTES_BY_K[32], in_flight_transfers)
+
+    return TargetsInfo(
+        targets_config,
+        LocalTargetsInfo(targets_config.local, [create_target_drive_info(d) for d in targets_config.local.drives]),
+        RemoteTargetsInfo(targets_config.remote, [
+            RemoteHostInfo(remote_host_config, [create_target_drive_info(d) for d in remote_host_config.drives])
+            for remote_host_config in targets_config.remote.hosts
+        ])
+    )
+
+
+def measure(run: Callable, setup: Callable = lambda: None, teardown: Callable = lambda state: None, repeat: int = 3) -> PhaseResult:
+    """
+    The best time of run(setup()) out of repeat runs, and the peak of the Python heap allocated during one more run.
+    setup and teardown aren't measured.
+    """
+    best_seconds = None
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        run(state)
+        seconds = time.perf_counter() - started
+        teardown(state)
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        (_, peak_bytes) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        teardown(state)
+    return PhaseResult(best_seconds, peak_bytes)
+
+
+def run_pairing_phases(farm: FarmSpec, seed: int, repeat: int) -> dict[str, PhaseResult]:
+    rng = random.Random(seed)
+    targets_config = create_targets_config(farm.target_drives)
+    source_info = create_source_info(farm.source_plots, max(1, min(16, farm.source_plots // 100)), "drive_with_least_space_remaining", rng)
+    targets_info = create_targets_info(targets_config, rng, full=False)
+    full_targets_info = create_targets_info(targets_config, rng, full=True)
+    hotplots_io = FakeHotplotsIO(create_existing_plots(targets_config, farm.existing_plots, rng))
+
+    def get_full_pairings_result() -> PlotReplacementResult:
+        result = HotplotsPairingEngine.get_pairings_result(source_info, full_targets_info)
+        assert isinstance(result, PlotReplacementResult), result
+        return result
+
+    return {
+        "pairing_state": measure(lambda _: PairingState(source_info, targets_info), repeat=repeat),
+        "pairing": measure(lambda _: HotplotsPairingEngine.get_pairings_result(source_info, targets_info), repeat=repeat),
+        "pairing_full": measure(lambda _: get_full_pairings_result(), repeat=repeat),
+        "replacement": measure(
+            lambda result: HotplotsPairingEngine.get_pairings_result_with_replacement(result, hotplots_io),
+            setup=get_full_pairings_result,
+            repeat=repeat
+        ),
+    }
+
+
+def create_sparse_file(path: str, size: int):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def run_filesystem_phases(farm: FarmSpec, seed: int, repeat: int, temp_dir: Optional[str]) -> dict[str, PhaseResult]:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory(prefix="hotplots-benchmark-", dir=temp_dir) as root:
+        # every drive is a local directory, so the farm can be laid out without harvesters
+        target_drive_configs = [TargetDriveConfig(os.path.join(root, "target%s" % i), 1, PLOT_REPLACEMENT) for i in range(farm.target_drives)]
+        targets_config = TargetsConfig("drive_with_least_space_remaining", LocalHostConfig(target_drive_configs), RemoteTargetsConfig(16, []))
+        for target_drive_config in target_drive_configs:
+            os.mkdir(target_drive_config.path)
+        for plot_files in create_existing_plots(targets_config, farm.existing_plots, rng).values():
+            for (size, path) in plot_files:
+                create_sparse_file(path, size)
+
+        source_drive_configs = [SourceDriveConfig(os.path.join(root, "source%s" % i), 4) for i in range(max(1, min(16, farm.source_plots // 100)))]
+        source_config = SourceConfig(source_drive_configs, selection_strategy="drive_with_least_space_remaining", watch_source_drives=False)
+        for source_drive_config in source_drive_configs:
+            os.mkdir(source_drive_config.path)
+        source_plot_ids = []
+        for i in range(farm.source_plots):
+            filename = create_plot_filename(rng, 2022)
+            source_plot_ids.append(PlotNameMetadata.parse_from_filename(filename).plot_id)
+            create_sparse_file(os.path.join(source_drive_configs[i % len(source_drive_configs)].path, filename), Constants.PLOT_BYTES_BY_K[32])
+
+        def scanned_hotplots_io() -> HotplotsIO:
+            hotplots_io = HotplotsIO()
+            hotplots_io.get_source_info(source_config)
+            return hotplots_io
+
+        def close(hotplots_io: HotplotsIO):
+            hotplots_io.close()
+
+        return {
+            "fs_source_scan": measure(lambda io: io.get_source_info(source_config), HotplotsIO, close, repeat),
+            "fs_source_rescan": measure(lambda io: io.get_source_info(source_config), scanned_hotplots_io, close, repeat),
+            "fs_target_discovery": measure(lambda io: io.get_targets_info(targets_config), HotplotsIO, close, repeat),
+            "fs_farm_index": measure(lambda io: io.find_finished_plots(targets_config, source_plot_ids), HotplotsIO, close, repeat),
+        }
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous_record(results_path: str, record: dict) -> Optional[dict]:
+    """
+    The last recorded run comparable with record: the same farm, seed and repeat count, on the same machine and Python.
+    """
+    if not os.path.exists(results_path):
+        return None
+    keys = ["benchmark", "farm", "seed", "repeat", "host", "python"]
+    previous = None
+    with open(results_path) as f:
+        for line in f:
+            try:
+                candidate = json.loads(line)
+            except ValueError:
+                continue
+            if all(candidate.get(key) == record[key] for key in keys):
+                previous = candidate
+    return previous
+
+
+def is_regression(value: float, previous_value: float, threshold: float, min_change: float) -> bool:
+    return value > previous_value * (1 + threshold) and value - previous_value > min_change
+
+
+def report(record: dict, previous: Optional[dict], threshold: float) -> List[str]:
+    """
+    Prints the phases of the run against the previous one, and returns the phases that regressed.
+    """
+    print("farm %s (target drives:existing plots:source plots)%s" % (
+        record["farm"], ", compared with %s at %s" % (previous["commit"], previous["time"]) if previous else ""
+    ))
+    print("  %-20s %10s %8s %12s %8s" % ("phase", "seconds", "change", "peak MiB", "change"))
+    regressions = []
+    for (phase, result) in record["phases"].items():
+        previous_result = previous["phases"].get(phase) if previous else None
+        (seconds_change, memory_change) = ("", "")
+        if previous_result is not None:
+            seconds_regressed = is_regression(result["seconds"], previous_result["seconds"], threshold, MIN_REGRESSION_SECONDS)
+            memory_regressed = is_regression(result["peak_bytes"], previous_result["peak_bytes"], threshold, MIN_REGRESSION_BYTES)
+            seconds_change = format_change(result["seconds"], previous_result["seconds"]) + ("!" if seconds_regressed else " ")
+            memory_change = format_change(result["peak_bytes"], previous_result["peak_bytes"]) + ("!" if memory_regressed else " ")
+            if seconds_regressed or memory_regressed:
+                regressions.append(phase)
+        print("  %-20s %10.4f %8s %12.2f %8s" % (phase, result["seconds"], seconds_change, result["peak_bytes"] / (1024 * 1024), memory_change))
+    return regressions
+
+
+def format_change(value: float, previous_value: float) -> str:
+    if previous_value == 0:
+        return "-"
+    return "%+.0f%%" % (100 * (value - previous_value) / previous_value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--farms", default=DEFAULT_FARMS, help="comma separated target_drives:existing_plots:source_plots")
+    parser.add_argument("--max-filesystem-plots", type=int, default=20000, help="largest farm (existing and source plots) laid out on disk")
+    parser.add_argument("--temp-dir", default=None, help="where the sparse files of the filesystem phases go")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=".benchmarks/farm_benchmark.jsonl")
+    parser.add_argument("--regression-threshold", type=float, default=0.2, help="relative slow down or growth reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    all_regressions = []
+    for farm in [FarmSpec.parse(f) for f in args.farms.split(",")]:
+        phases = run_pairing_phases(farm, args.seed, args.repeat)
+        if farm.existing_plots + farm.source_plots <= args.max_filesystem_plots:
+            phases.update(run_filesystem_phases(farm, args.seed, args.repeat, args.temp_dir))
+
+        record = {
+            "benchmark": "farm",
+            "farm": str(farm),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": get_git_commit(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "phases": {phase: asdict(result) for (phase, result) in phases.items()},
+        }
+        previous = load_previous_record(args.results, record)
+        all_regressions += ["%s %s" % (farm, phase) for phase in report(record, previous, args.regression_threshold)]
+
+        if os.path.dirname(args.results):
+            os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        with open(args.results, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    if all_regressions:
+        print("regressed by more than %.0f%%: %s" % (100 * args.regression_threshold, ", ".join(all_regressions)))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures how the pairing engine scales with the number of source plots, using synthetic plots and target drives.
+
+For each size, "queue" pops every plot through the PairingState ranking queue, and "re-sort" re-ranks the remaining
+plots before every pop, the way plots used to be ranked. The re-sort approach is quadratic, so it's only run up to
+--max-resort-plots. "pairing" is a full HotplotsPairingEngine.get_pairings_result call.
+
+    python -m benchmarks.pairing_benchmark
+    python -m benchmarks.pairing_benchmark --plots 1000,10000,50000 --strategy drive_with_least_space_remaining
+    python -m benchmarks.pairing_benchmark --pairing-mode optimal
+"""
+import argparse
+import random
+import time
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import SourceDriveConfig, SourceConfig, TargetDriveConfig, LocalHostConfig, \
+    RemoteTargetsConfig, TargetsConfig
+from hotplots.hotplots_pairing_engine import HotplotsPairingEngine
+from hotplots.models import SourcePlot, SourceDriveInfo, SourceInfo, TargetDriveInfo, LocalTargetsInfo, \
+    RemoteTargetsInfo, TargetsInfo
+from hotplots.pairing_state import PairingState
+
+
+def create_source_info(num_plots: int, num_source_drives: int, strategy: str, rng: random.Random) -> SourceInfo:
+    source_drive_configs = [SourceDriveConfig("/mnt/source%s" % i, 4) for i in range(num_source_drives)]
+    source_drive_infos = []
+    for i, source_drive_config in enumerate(source_drive_configs):
+        source_plots = [
+            SourcePlot(
+                "%s/plot-k32-2021-%02d-%02d-%02d-%02d-%064x.plot" % (
+                    source_drive_config.path, rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59),
+                    rng.getrandbits(256)
+                ),
+                Constants.PLOT_BYTES_BY_K[32]
+            )
+            for _ in range(num_plots // num_source_drives + (1 if i < num_plots % num_source_drives else 0))
+        ]
+        source_drive_infos.append(SourceDriveInfo(
+            source_drive_config, 20 * Constants.TERABYTE, rng.randint(1, 19) * Constants.TERABYTE, source_plots
+        ))
+    return SourceInfo(SourceConfig(source_drive_configs, 60, strategy), source_drive_infos)
+
+
+def create_targets_info(num_target_drives: int, pairing_mode: str) -> TargetsInfo:
+    target_drive_configs = [TargetDriveConfig("/mnt/target%s" % i, 1) for i in range(num_target_drives)]
+    local_host_config = LocalHostConfig(target_drive_configs)
+    local_targets_info = LocalTargetsInfo(local_host_config, [
+        TargetDriveInfo(target_drive_config, 18 * Constants.TERABYTE, (i + 1) * Constants.TERABYTE, [])
+        for i, target_drive_config in enumerate(target_drive_configs)
+    ])
+    remote_targets_config = RemoteTargetsConfig(1, [])
+    targets_config = TargetsConfig("drive_with_least_space_remaining", local_host_config, remote_targets_config, "local", pairing_mode)
+    return TargetsInfo(targets_config, local_targets_info, RemoteTargetsInfo(remote_targets_config, []))
+
+
+def time_queue(source_info: SourceInfo, targets_info: TargetsInfo) -> float:
+    start = time.perf_counter()
+    pairing_state = PairingState(source_info, targets_info)
+    while pairing_state.get_unprocessed_hot_plots_size() > 0:
+        pairing_state.pop_next_unprocessed_hot_plot()
+    return time.perf_counter() - start
+
+
+def time_resort(source_info: SourceInfo, targets_info: TargetsInfo) -> float:
+    start = time.perf_counter()
+    pairing_state = PairingState(source_info, targets_info)
+    unprocessed_hot_plots = []
+    while pairing_state.get_unprocessed_hot_plots_size() > 0:
+        unprocessed_hot_plots.append(pairing_state.pop_next_unprocessed_hot_plot())
+    while unprocessed_hot_plots:
+        unprocessed_hot_plots = pairing_state.rank_hot_plots(unprocessed_hot_plots)
+        unprocessed_hot_plots.pop(0)
+    return time.perf_counter() - start
+
+
+def time_pairing(source_info: SourceInfo, targets_info: TargetsInfo) -> float:
+    start = time.perf_counter()
+    HotplotsPairingEngine.get_pairings_result(source_info, targets_info)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plots", default="1000,5000,20000,50000")
+    parser.add_argument("--max-resort-plots", type=int, default=5000)
+    parser.add_argument("--source-drives", type=int, default=8)
+    parser.add_argument("--target-drives", type=int, default=64)
+    parser.add_argument("--strategy", default="drive_with_least_space_remaining")
+    parser.add_argument("--pairing-mode", default="greedy")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    targets_info = create_targets_info(args.target_drives, args.pairing_mode)
+    print("%-8s %10s %10s %10s" % ("plots", "queue", "re-sort", "pairing"))
+    for num_plots in [int(n) for n in args.plots.split(",")]:
+        source_info = create_source_info(num_plots, args.source_drives, args.strategy, random.Random(args.seed))
+        queue_seconds = time_queue(source_info, targets_info)
+        resort = "%10.3f" % time_resort(source_info, targets_info) if num_plots <= args.max_resort_plots else "%10s" % "-"
+        pairing_seconds = time_pairing(source_info, targets_info)
+        print("%-8s %10.3f %s %10.3f" % (num_plots, queue_seconds, resort, pairing_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the throughput of the remote transfer backends against an ssh server.
+
+By default this uploads to the local sshd (localhost:22 as the current user), which stands in for a harvester.
+Key based authentication to the target has to be set up, and rsync has to be installed for the rsync backend.
+
+    python -m benchmarks.remote_transfer_benchmark --size-mib 2048
+    python -m benchmarks.remote_transfer_benchmark --host harvester.local --remote-dir /mnt/plots1
+"""
+import argparse
+import getpass
+import os
+import tempfile
+import time
+from dataclasses import replace
+
+from hotplots.hotplots_config import RemoteHostConfig, RemoteTransferConfig, SSHConnectionConfig, TargetDriveConfig
+from hotplots.remote_transfer import SftpTransferBackend, StreamTransferBackend, RsyncTransferBackend
+from hotplots.ssh_connection_pool import SSHConnectionPool
+
+MEBIBYTE = 1024 * 1024
+
+
+def create_source_file(directory: str, size_mib: int) -> str:
+    # random data, so neither the ssh compression nor the filesystem can shortcut the copy
+    source_path = os.path.join(directory, "plot-k32-2021-06-01-00-00-benchmark.plot")
+    with open(source_path, "wb") as f:
+        for _ in range(size_mib):
+            f.write(os.urandom(MEBIBYTE))
+    return source_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--username", default=getpass.getuser())
+    parser.add_argument("--remote-dir", default="/tmp")
+    parser.add_argument("--size-mib", type=int, default=1024)
+    parser.add_argument("--backends", default="sftp,stream,rsync")
+    parser.add_argument("--cipher", default="")
+    args = parser.parse_args()
+
+    base_host_config = RemoteHostConfig(
+        args.host, args.username, args.port, 1, [TargetDriveConfig(args.remote_dir, 1)],
+        transfer=RemoteTransferConfig(cipher=args.cipher)
+    )
+    ssh_connection_pool = SSHConnectionPool(SSHConnectionConfig())
+    backends = {
+        "sftp": SftpTransferBackend(),
+        "stream": StreamTransferBackend(ssh_connection_pool),
+        "rsync": RsyncTransferBackend(),
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_path = create_source_file(temp_dir, args.size_mib)
+        remote_path = os.path.join(args.remote_dir, ".%s.benchmark" % os.path.basename(source_path))
+
+        print("%-8s %10s %10s" % ("backend", "seconds", "MiB/s"))
+        for backend_name in args.backends.split(","):
+            remote_host_config = replace(base_host_config, transfer=replace(base_host_config.transfer, backend=backend_name))
+            transfer_config = remote_host_config.transfer
+            with ssh_connection_pool.sftp(remote_host_config, transfer_config.window_size_bytes, transfer_config.max_packet_size_bytes) as sftp:
+                try:
+                    start = time.perf_counter()
+                    backends[backend_name].upload(remote_host_config, sftp, source_path, remote_path)
+                    elapsed = time.perf_counter() - start
+                    print("%-8s %10.2f %10.1f" % (backend_name, elapsed, args.size_mib / elapsed))
+                except Exception as e:
+                    print("%-8s failed: %s" % (backend_name, e))
+                finally:
+                    try:
+                        sftp.remove(remote_path)
+                    except IOError:
+                        pass
+
+    ssh_connection_pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,9 @@ from hotplots._test.helpers.test_helpers import TestHelpers
 from hotplots.constants import Constants
 from hotplots.hotplots_config import SourceDriveConfig, SourceConfig, RemoteTargetsConfig, RemoteHostConfig, \
     TargetDriveConfig, LocalHostConfig, TargetsConfig
-from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, EligiblePairingsResult
+from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, EligiblePairingsResult, NoActionResult
 from hotplots.models import SourceInfo, SourceDriveInfo, HotPlot, RemoteTargetsInfo, RemoteHostInfo, TargetDriveInfo, \
-    TargetsInfo, LocalTargetsInfo, HotPlotTargetDrive
+    TargetsInfo, LocalTargetsInfo, HotPlotTargetDrive, InFlightTransfer
 
 
 class HotplotsPairingEngineTest(unittest.TestCase):
@@ -121,6 +121,78 @@ class HotplotsPairingEngineTest(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_in_flight_pairings_count_against_caps(self):
+        # Source configuration and info
+        source_drive_1_config = SourceDriveConfig("/mnt/source1", 2)
+        source_drive_1_source_plot_1 = TestHelpers.create_mock_source_plot(source_drive_1_config, 32, 2021, 6, 27, 21, 58)
+        source_drive_1_source_plot_2 = TestHelpers.create_mock_source_plot(source_drive_1_config, 32, 2021, 6, 27, 21, 59)
+        source_drive_1_info = SourceDriveInfo(source_drive_1_config, 1 * Constants.TERABYTE, 1 * Constants.TERABYTE, [source_drive_1_source_plot_1, source_drive_1_source_plot_2])
+
+        source_config = SourceConfig([source_drive_1_config], 60, "plot_with_oldest_timestamp")
+        source_info = SourceInfo(source_config, [source_drive_1_info])
+
+        # Local configuration and info
+        local_host_target_drive_1_config = TargetDriveConfig("/mnt/target1", 1)
+        local_host_target_drive_1_info = TargetDriveInfo(local_host_target_drive_1_config, 100 * Constants.TERABYTE, 100 * Constants.TERABYTE, [])
+
+        local_host_config = LocalHostConfig([local_host_target_drive_1_config])
+        local_targets_info = LocalTargetsInfo(local_host_config, [local_host_target_drive_1_info])
+
+        # Remote configuration and info
+        remote_targets_config = RemoteTargetsConfig(1, [])
+        remote_targets_info = RemoteTargetsInfo(remote_targets_config, [])
+
+        # Finally
+        targets_config = TargetsConfig("drive_with_least_space_remaining", local_host_config, remote_targets_config, "local")
+        targets_info = TargetsInfo(targets_config, local_targets_info, remote_targets_info)
+
+        # the oldest plot is already being transferred by this process, but no temp file is visible yet
+        in_flight_pairings = [
+            (HotPlot(source_drive_1_info, source_drive_1_source_plot_1), HotPlotTargetDrive(local_host_config, local_host_target_drive_1_info))
+        ]
+
+        # the only target drive only accepts one inbound transfer at a time, so the second plot has to wait
+        self.assertEqual(NoActionResult(), HotplotsPairingEngine.get_pairings_result(source_info, targets_info, in_flight_pairings))
+
+    def test_stale_partial_transfer_is_resumed_on_its_drive(self):
+        # Source configuration and info
+        source_drive_1_config = SourceDriveConfig("/mnt/source1", 1)
+        source_drive_1_source_plot_1 = TestHelpers.create_mock_source_plot(source_drive_1_config, 32, 2021, 6, 27, 21, 58)
+        source_drive_1_info = SourceDriveInfo(source_drive_1_config, 1 * Constants.TERABYTE, 1 * Constants.TERABYTE, [source_drive_1_source_plot_1])
+
+        source_config = SourceConfig([source_drive_1_config], 60, "plot_with_oldest_timestamp")
+        source_info = SourceInfo(source_config, [source_drive_1_info])
+
+        # Local configuration and info. The interrupted transfer left its partial on the drive that would be ranked last.
+        stale_partial = InFlightTransfer(
+            "." + source_drive_1_source_plot_1.absolute_reference.split("/")[-1] + ".y29pgW",
+            50 * Constants.GIGABYTE,
+            source_drive_1_source_plot_1.plot_name_metadata(),
+            is_stale=True
+        )
+        local_host_target_drive_1_config = TargetDriveConfig("/mnt/target1", 1)
+        local_host_target_drive_1_info = TargetDriveInfo(local_host_target_drive_1_config, 100 * Constants.TERABYTE, 1 * Constants.TERABYTE, [])
+        local_host_target_drive_2_config = TargetDriveConfig("/mnt/target2", 1)
+        local_host_target_drive_2_info = TargetDriveInfo(local_host_target_drive_2_config, 100 * Constants.TERABYTE, 100 * Constants.TERABYTE, [stale_partial])
+
+        local_host_config = LocalHostConfig([local_host_target_drive_1_config, local_host_target_drive_2_config])
+        local_targets_info = LocalTargetsInfo(local_host_config, [local_host_target_drive_1_info, local_host_target_drive_2_info])
+
+        # Remote configuration and info
+        remote_targets_config = RemoteTargetsConfig(1, [])
+        remote_targets_info = RemoteTargetsInfo(remote_targets_config, [])
+
+        # Finally
+        targets_config = TargetsConfig("drive_with_least_space_remaining", local_host_config, remote_targets_config, "local")
+        targets_info = TargetsInfo(targets_config, local_targets_info, remote_targets_info)
+
+        # the stale partial doesn't take the drive's only inbound slot, and the plot goes back to where its partial is
+        expected = EligiblePairingsResult([
+            (HotPlot(source_drive_1_info, source_drive_1_source_plot_1), HotPlotTargetDrive(local_host_config, local_host_target_drive_2_info))
+        ])
+
+        self.assertEqual(expected, HotplotsPairingEngine.get_pairings_result(source_info, targets_info))
+
 
 if __name__ == '__main__':
     unittest.main()
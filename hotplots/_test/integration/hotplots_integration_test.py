@@ -63,6 +63,45 @@ class HotplotsIntegrationTest(HotplotsIntegrationTestBase):
         self.assertFalse(os.path.exists(self.source_path / plot_filename))
         self.assertTrue(os.path.exists(self.target_path / plot_filename))
 
+    def test_plot_already_on_a_target_is_not_transferred_again(self):
+        # e.g. left behind by a crash between finishing the transfer and removing the source
+        plot_filename = "plot-k32-2021-06-01-00-00-dummyid.plot"
+        self.create_dummy_plot(plot_filename)
+        self.create_dummy_plot_in_target2(plot_filename, size_gb=1)
+
+        config = {
+            "logging": {
+                "level": "DEBUG",
+                "stdout": {"enabled": True},
+                "file": {"enabled": False},
+            },
+            "source": {
+                "check_source_drives_sleep_seconds": 1,
+                "selection_strategy": "plot_with_oldest_timestamp",
+                "drives": [{"path": str(self.source_path), "max_concurrent_outbound_transfers": 1}],
+            },
+            "targets": {
+                "target_host_preference": "local",
+                "selection_strategy": "drive_with_most_space_remaining",
+                "local": {
+                    "drives": [
+                        {"path": str(self.target_path), "max_concurrent_inbound_transfers": 1},
+                        {"path": str(self.target_path_2), "max_concurrent_inbound_transfers": 1},
+                    ]
+                },
+                "remote": {"max_concurrent_outbound_transfers": 1, "hosts": []},
+            },
+        }
+
+        # Run hotplots
+        with self.assertLogs(level="WARNING") as logs:
+            self.run_hotplots(config)
+
+        # Assertions
+        self.assertTrue(os.path.exists(self.source_path / plot_filename))
+        self.assertFalse(os.path.exists(self.target_path / plot_filename))
+        self.assertIn("not transferring it again", "\n".join(logs.output))
+
     @patch('shutil.disk_usage')
     def test_plot_replacement(self, mock_disk_usage):
         # Create a dummy plot file in the source
@@ -70,7 +109,7 @@ class HotplotsIntegrationTest(HotplotsIntegrationTestBase):
         self.create_dummy_plot(new_plot_filename)
 
         # Create a plot file in the target that can be replaced
-        old_plot_filename = "plot-k32-2021-01-01-00-00-dummyid.plot"
+        old_plot_filename = "plot-k32-2021-01-01-00-00-oldid.plot"
         self.create_dummy_plot_in_target(old_plot_filename)
 
         # The target drive has an old plot on it, so it doesn't have enough space for a new one.
@@ -37,10 +37,16 @@ class HotplotsIntegrationTestBase(unittest.TestCase):
 
     def run_hotplots(self, config):
         config_path = Path(self.temp_dir.name) / "config.yaml"
+        # keep the measured transfer rates of the test out of the working directory
+        config["targets"].setdefault("throughput_history_path", str(Path(self.temp_dir.name) / "hotplots-throughput.json"))
+        config["targets"].setdefault("plot_header_cache_path", str(Path(self.temp_dir.name) / "hotplots-plot-headers.json"))
+        config["targets"].setdefault("farm_index_path", str(Path(self.temp_dir.name) / "hotplots-farm-index.sqlite"))
         with open(config_path, "w") as f:
             yaml.dump(config, f)
 
-        hotplots_io = HotplotsIO()
-        loaded_config = hotplots_io.load_config_file(str(config_path))
+        loaded_config = HotplotsIO.load_config_file(str(config_path))
+        hotplots_io = HotplotsIO(loaded_config)
         hotplots = Hotplots(loaded_config, hotplots_io)
         hotplots.run()
+        hotplots.wait_for_transfers()
+        hotplots.shutdown()
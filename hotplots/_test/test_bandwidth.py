@@ -0,0 +1,144 @@
+import datetime
+import threading
+import time
+import unittest
+
+from hotplots.bandwidth import BandwidthSchedule, TokenBucket, BandwidthThrottle, BandwidthLimiter
+from hotplots.hotplots_config import BandwidthLimitConfig, BandwidthScheduleConfig, TargetDriveConfig, \
+    RemoteHostConfig, LocalHostConfig
+from hotplots.models import HotPlotTargetDrive, TargetDriveInfo
+
+
+class FakeClock:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.slept.append(seconds)
+            self.now += seconds
+
+
+class TestBandwidthSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.config = BandwidthLimitConfig(
+            max_bytes_per_second=1000,
+            schedule=[
+                BandwidthScheduleConfig("22:00", "06:00", 0),
+                BandwidthScheduleConfig("12:00", "13:00", 500),
+            ]
+        )
+
+    def test_outside_of_every_window(self):
+        self.assertEqual(1000, BandwidthSchedule.get_max_bytes_per_second(self.config, datetime.time(9, 0)))
+
+    def test_window_wrapping_around_midnight(self):
+        self.assertEqual(0, BandwidthSchedule.get_max_bytes_per_second(self.config, datetime.time(23, 30)))
+        self.assertEqual(0, BandwidthSchedule.get_max_bytes_per_second(self.config, datetime.time(5, 59)))
+        self.assertEqual(1000, BandwidthSchedule.get_max_bytes_per_second(self.config, datetime.time(6, 0)))
+
+    def test_daytime_window(self):
+        self.assertEqual(500, BandwidthSchedule.get_max_bytes_per_second(self.config, datetime.time(12, 30)))
+
+    def test_is_limited(self):
+        self.assertFalse(BandwidthSchedule.is_limited(BandwidthLimitConfig()))
+        self.assertTrue(BandwidthSchedule.is_limited(self.config))
+        self.assertTrue(BandwidthSchedule.is_limited(BandwidthLimitConfig(schedule=[BandwidthScheduleConfig("12:00", "13:00", 500)])))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.time_of_day = datetime.datetime(2021, 6, 1, 12, 0)
+
+    def create_token_bucket(self, config):
+        return TokenBucket(config, monotonic=self.clock.monotonic, sleep=self.clock.sleep, now=lambda: self.time_of_day)
+
+    def test_holds_transfers_to_the_rate(self):
+        token_bucket = self.create_token_bucket(BandwidthLimitConfig(max_bytes_per_second=1000))
+
+        for _ in range(10):
+            token_bucket.consume(500)
+
+        # starting from an empty bucket, 5000 bytes at 1000 bytes per second take 5 seconds
+        self.assertAlmostEqual(5.0, self.clock.now)
+
+    def test_idle_time_refills_up_to_the_burst(self):
+        token_bucket = self.create_token_bucket(BandwidthLimitConfig(max_bytes_per_second=1000, burst_bytes=2000))
+
+        self.clock.now += 100
+        token_bucket.consume(2000)
+        self.assertEqual([], self.clock.slept)
+
+        token_bucket.consume(1000)
+        self.assertEqual([1.0], self.clock.slept)
+
+    def test_chunks_larger_than_the_burst(self):
+        token_bucket = self.create_token_bucket(BandwidthLimitConfig(max_bytes_per_second=1000))
+
+        token_bucket.consume(4000)
+
+        self.assertEqual([4.0], self.clock.slept)
+
+    def test_unlimited_schedule_window(self):
+        token_bucket = self.create_token_bucket(BandwidthLimitConfig(
+            max_bytes_per_second=1000,
+            schedule=[BandwidthScheduleConfig("11:00", "13:00", 0)]
+        ))
+
+        token_bucket.consume(100 * 1000)
+        self.assertEqual([], self.clock.slept)
+
+        self.time_of_day = datetime.datetime(2021, 6, 1, 14, 0)
+        token_bucket.consume(2000)
+        self.assertEqual([1.0], self.clock.slept)
+
+    def test_shared_between_threads(self):
+        token_bucket = TokenBucket(BandwidthLimitConfig(max_bytes_per_second=400 * 1000))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=lambda: [token_bucket.consume(2500) for _ in range(10)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 100 kB at 400 kB per second, no matter how it's split between the threads
+        self.assertGreaterEqual(time.monotonic() - start, 0.24)
+
+
+class TestBandwidthLimiter(unittest.TestCase):
+
+    def test_buckets_only_for_configured_limits(self):
+        limited_drive_config = TargetDriveConfig("/mnt/target1", 1, bandwidth=BandwidthLimitConfig(max_bytes_per_second=3000))
+        unlimited_drive_config = TargetDriveConfig("/mnt/target2", 1)
+        remote_host_config = RemoteHostConfig(
+            "host1", "user1", 22, 1, [limited_drive_config, unlimited_drive_config],
+            bandwidth=BandwidthLimitConfig(max_bytes_per_second=2000)
+        )
+        local_host_config = LocalHostConfig([unlimited_drive_config])
+        bandwidth_limiter = BandwidthLimiter(BandwidthLimitConfig(max_bytes_per_second=5000))
+
+        def get_throttle(host_config, drive_config):
+            return bandwidth_limiter.get_throttle(HotPlotTargetDrive(host_config, TargetDriveInfo(drive_config, 1, 1, [])))
+
+        self.assertEqual(2000, get_throttle(remote_host_config, limited_drive_config).get_max_bytes_per_second())
+        self.assertEqual(2000, get_throttle(remote_host_config, unlimited_drive_config).get_max_bytes_per_second())
+        # the global limit is for remote transfers only
+        self.assertEqual(0, get_throttle(local_host_config, unlimited_drive_config).get_max_bytes_per_second())
+
+    def test_unlimited_throttle(self):
+        throttle = BandwidthThrottle()
+        throttle.consume(10 ** 12)
+        self.assertEqual(0, throttle.get_max_bytes_per_second())
+
+
+if __name__ == '__main__':
+    unittest.main()
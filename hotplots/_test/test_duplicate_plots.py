@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock
+
+from hotplots._test.helpers.test_helpers import TestHelpers
+from hotplots.constants import Constants
+from hotplots.duplicate_plots import DuplicatePlots
+from hotplots.hotplots_config import SourceDriveConfig, SourceConfig
+from hotplots.models import SourceInfo, SourceDriveInfo, HotPlot
+
+
+class TestDuplicatePlots(unittest.TestCase):
+
+    def setUp(self):
+        self.source_drive_config_1 = SourceDriveConfig("/mnt/source1", 1)
+        self.source_drive_config_2 = SourceDriveConfig("/mnt/source2", 1)
+        self.plot_1 = TestHelpers.create_mock_source_plot(self.source_drive_config_1, 32, 2022, 1, 1, 0, 0, "1" * 64)
+        self.plot_2 = TestHelpers.create_mock_source_plot(self.source_drive_config_1, 32, 2022, 1, 2, 0, 0, "2" * 64)
+        # a copy of plot_2 on the second drive
+        self.plot_2_copy = TestHelpers.create_mock_source_plot(self.source_drive_config_2, 32, 2022, 1, 2, 0, 0, "2" * 64)
+        self.plot_3 = TestHelpers.create_mock_source_plot(self.source_drive_config_2, 32, 2022, 1, 3, 0, 0, "3" * 64)
+        self.source_drive_info_1 = SourceDriveInfo(self.source_drive_config_1, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, [self.plot_1, self.plot_2])
+        self.source_drive_info_2 = SourceDriveInfo(self.source_drive_config_2, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, [self.plot_2_copy, self.plot_3])
+        self.source_info = SourceInfo(
+            SourceConfig([self.source_drive_config_1, self.source_drive_config_2], 60, "plot_with_oldest_timestamp"),
+            [self.source_drive_info_1, self.source_drive_info_2]
+        )
+
+    def test_find_in_sources(self):
+        duplicates = DuplicatePlots.find_in_sources(self.source_info, {"1" * 64: ["harvester:/mnt/target1/plot-1.plot"]})
+        self.assertEqual({
+            self.plot_1.absolute_reference: ["harvester:/mnt/target1/plot-1.plot"],
+            self.plot_2_copy.absolute_reference: [self.plot_2.absolute_reference],
+        }, duplicates)
+
+    def test_running_transfer_is_not_a_duplicate(self):
+        # its plot is on the target before its source is removed
+        in_flight_pairings = [(HotPlot(self.source_drive_info_1, self.plot_1), MagicMock())]
+        duplicates = DuplicatePlots.find_in_sources(self.source_info, {"1" * 64: ["/mnt/target1/plot-1.plot"]}, in_flight_pairings)
+        self.assertNotIn(self.plot_1.absolute_reference, duplicates)
+
+    def test_without(self):
+        source_info = DuplicatePlots.without(self.source_info, {self.plot_1.absolute_reference, self.plot_2_copy.absolute_reference})
+        self.assertEqual([[self.plot_2], [self.plot_3]], [d.source_plots for d in source_info.source_drive_infos])
+        self.assertEqual(self.source_drive_config_2, source_info.source_drive_infos[1].source_drive_config)
+
+
+if __name__ == '__main__':
+    unittest.main()
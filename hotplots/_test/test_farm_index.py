@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from hotplots.farm_index import FarmIndex
+from hotplots.models import TargetHostId
+from hotplots.plot_headers import PlotHeader
+
+
+def plot_path(directory, plot_id):
+    return "%s/plot-k32-2021-06-01-00-00-%s.plot" % (directory, plot_id)
+
+
+class TestFarmIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "farm-index.sqlite")
+        self.now = 1000.0
+        self.host_id = TargetHostId(False, "harvester")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_farm_index(self):
+        return FarmIndex(self.path, clock=lambda: self.now)
+
+    def test_reconcile(self):
+        farm_index = self.create_farm_index()
+        self.assertFalse(farm_index.is_reconciled_since(self.host_id, "/mnt/target1", 0))
+
+        farm_index.reconcile(self.host_id, "/mnt/target1/", [(100, plot_path("/mnt/target1", "a")), (200, plot_path("/mnt/target1", "b"))])
+        self.assertTrue(farm_index.is_reconciled_since(self.host_id, "/mnt/target1", 1000))
+        self.assertFalse(farm_index.is_reconciled_since(self.host_id, "/mnt/target1", 1001))
+        # a directory is the same with or without the trailing slash, and plots are by host
+        self.assertEqual([(100, plot_path("/mnt/target1", "a")), (200, plot_path("/mnt/target1", "b"))], farm_index.get_plot_files(self.host_id, "/mnt/target1"))
+        self.assertEqual([], farm_index.get_plot_files(TargetHostId(True, "harvester"), "/mnt/target1"))
+
+        farm_index.reconcile(self.host_id, "/mnt/target1", [(200, plot_path("/mnt/target1", "b")), (300, plot_path("/mnt/target1", "c"))])
+        self.assertEqual([(200, plot_path("/mnt/target1", "b")), (300, plot_path("/mnt/target1", "c"))], farm_index.get_plot_files(self.host_id, "/mnt/target1"))
+
+    def test_transfers_and_replacements(self):
+        farm_index = self.create_farm_index()
+        farm_index.reconcile(self.host_id, "/mnt/target1", [(100, plot_path("/mnt/target1", "a"))])
+
+        farm_index.add_plot(self.host_id, plot_path("/mnt/target1", "b"), 200)
+        farm_index.remove_plot(self.host_id, plot_path("/mnt/target1", "a"))
+        self.assertEqual([(200, plot_path("/mnt/target1", "b"))], farm_index.get_plot_files(self.host_id, "/mnt/target1"))
+
+    def test_find_plots(self):
+        farm_index = self.create_farm_index()
+        local_host_id = TargetHostId(True, "plotter")
+        farm_index.reconcile(self.host_id, "/mnt/target1", [(100, plot_path("/mnt/target1", "a")), (100, plot_path("/mnt/target1", "b"))])
+        farm_index.reconcile(local_host_id, "/mnt/target2", [(100, plot_path("/mnt/target2", "b"))])
+
+        self.assertEqual({"a": ["harvester:" + plot_path("/mnt/target1", "a")]}, farm_index.find_plots(["a", "c"]))
+        self.assertEqual({"b": [plot_path("/mnt/target2", "b"), "harvester:" + plot_path("/mnt/target1", "b")]}, farm_index.find_duplicate_plots())
+
+    def test_persisted_with_headers(self):
+        farm_index = self.create_farm_index()
+        farm_index.reconcile(self.host_id, "/mnt/target1", [(100, plot_path("/mnt/target1", "a"))])
+        farm_index.set_plot_headers([PlotHeader("a", 32, "farmer", pool_public_key="pool")])
+        # reconciling again keeps the keys of plots that are still there
+        farm_index.reconcile(self.host_id, "/mnt/target1", [(100, plot_path("/mnt/target1", "a"))])
+        farm_index.close()
+
+        farm_index = self.create_farm_index()
+        self.assertEqual([(100, plot_path("/mnt/target1", "a"))], farm_index.get_plot_files(self.host_id, "/mnt/target1"))
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(
+                [(32, "2021-06-01 00:00", "farmer", "pool", None)],
+                connection.execute("SELECT k, plot_timestamp, farmer_public_key, pool_public_key, pool_contract_puzzle_hash FROM plots").fetchall()
+            )
+
+    def test_unusable_database_is_replaced_in_memory(self):
+        with open(self.path, "w") as f:
+            f.write("not a database" * 100)
+        farm_index = self.create_farm_index()
+        farm_index.add_plot(self.host_id, plot_path("/mnt/target1", "a"), 100)
+        self.assertEqual([(100, plot_path("/mnt/target1", "a"))], farm_index.get_plot_files(self.host_id, "/mnt/target1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,26 @@
+import io
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock, ANY
 
+import yaml
+
+from hotplots._test.test_plot_headers import create_v1_header, POOL_PUBLIC_KEY, FARMER_PUBLIC_KEY, MASTER_SK
+from hotplots.hotplots_config import TransferConfig, SourceConfig, SourceDriveConfig, HotplotsConfig, LoggingConfig, \
+    RemoteTransferConfig, LocalTransferConfig
 from hotplots.hotplots_io import HotplotsIO
-from hotplots.models import HotPlot, HotPlotTargetDrive, SourcePlot, TargetDriveInfo, LocalHostConfig, RemoteHostConfig, TargetDriveConfig
+from hotplots.models import HotPlot, HotPlotTargetDrive, SourcePlot, TargetDriveInfo, LocalHostConfig, RemoteHostConfig, TargetDriveConfig, \
+    RemoteTargetsConfig, RemoteHostInfo, TargetsConfig
+from hotplots.partial_transfers import PartialTransfers
+from hotplots.remote_commands import RemoteCommandError, RemoteCommandUnavailableError
+from hotplots.transfer_slot_leases import TransferSlotLeases
+from hotplots.transfer_verification import TransferVerification
 
 
 class TestHotplotsIO(unittest.TestCase):
@@ -12,10 +30,12 @@ class TestHotplotsIO(unittest.TestCase):
         self.source_plot = SourcePlot(absolute_reference='/source/plot-k32-2021-06-01-00-00-dummyid.plot', size=123)
         self.hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=self.source_plot)
 
+    @patch('hotplots.partial_transfers.PartialTransfers.lock', side_effect=lambda path: os.open(os.devnull, os.O_RDONLY))
+    @patch('hotplots.partial_transfers.PartialTransfers.local_partials', return_value=[])
     @patch('os.remove')
     @patch('os.rename')
-    @patch('shutil.copy2')
-    def test_transfer_plot_local_success(self, mock_copy, mock_rename, mock_remove):
+    @patch('hotplots.local_copy.LocalFileCopier.copy')
+    def test_transfer_plot_local_success(self, mock_copy, mock_rename, mock_remove, mock_local_partials, mock_lock):
         # Arrange
         target_drive_config = TargetDriveConfig(path='/target', max_concurrent_inbound_transfers=1)
         target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
@@ -26,17 +46,21 @@ class TestHotplotsIO(unittest.TestCase):
         self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
 
         # Assert
-        mock_copy.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot', ANY)
+        mock_copy.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot', ANY, 0, ANY, progress=ANY)
         self.assertTrue(mock_copy.call_args[0][1].startswith('/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
         mock_rename.assert_called_once_with(ANY, '/target/plot-k32-2021-06-01-00-00-dummyid.plot')
         self.assertTrue(mock_rename.call_args[0][0].startswith('/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
         mock_remove.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot')
+        self.assertEqual(1, self.hotplots_io.metrics.transfers.get(host='localhost', result='succeeded'))
+        self.assertEqual(1, self.hotplots_io.metrics.transfer_seconds.get_count(host='localhost'))
 
+    @patch('hotplots.partial_transfers.PartialTransfers.lock', side_effect=lambda path: os.open(os.devnull, os.O_RDONLY))
     @patch('os.path.exists', return_value=True)
     @patch('os.remove')
-    @patch('shutil.copy2', side_effect=Exception("Disk full"))
-    def test_transfer_plot_local_failure_cleanup(self, mock_copy, mock_remove, mock_exists):
+    @patch('hotplots.local_copy.LocalFileCopier.copy', side_effect=Exception("Disk full"))
+    def test_transfer_plot_local_failure_cleanup(self, mock_copy, mock_remove, mock_exists, mock_lock):
         # Arrange
+        self.hotplots_io.transfer_config = TransferConfig(resume_partial_transfers=False)
         target_drive_config = TargetDriveConfig(path='/target', max_concurrent_inbound_transfers=1)
         target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
         local_host_config = LocalHostConfig(drives=[target_drive_config])
@@ -50,14 +74,17 @@ class TestHotplotsIO(unittest.TestCase):
         # The first call to remove is the cleanup of the temp file
         mock_remove.assert_called_once_with(ANY)
         self.assertTrue(mock_remove.call_args[0][0].startswith('/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
+        self.assertEqual(1, self.hotplots_io.metrics.transfers.get(host='localhost', result='failed'))
 
     @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
     @patch('paramiko.SSHClient')
     @patch('socket.gethostbyname', return_value='1.2.3.4')
-    def test_transfer_plot_remote_success(self, mock_gethostbyname, mock_ssh_client, mock_os_remove):
+    def test_transfer_plot_remote_success(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_os_remove):
         # Arrange
         mock_sftp = MagicMock()
-        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        mock_from_transport.return_value = mock_sftp
 
         target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
         target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
@@ -68,23 +95,28 @@ class TestHotplotsIO(unittest.TestCase):
         self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
 
         # Assert
-        mock_ssh_client.return_value.connect.assert_called_once_with('1.2.3.4', port=22, username='user')
-        mock_sftp.put.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot', ANY)
-        self.assertTrue(mock_sftp.put.call_args[0][1].startswith('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
+        mock_ssh_client.return_value.connect.assert_called_once_with('1.2.3.4', port=22, username='user', timeout=30)
+        # the sftp channel is opened with the large transfer window
+        mock_from_transport.assert_called_once_with(ANY, 64 * 1024 * 1024, 32 * 1024)
+        mock_upload.assert_called_once_with(remote_host_config, mock_sftp, '/source/plot-k32-2021-06-01-00-00-dummyid.plot', ANY, 0, ANY, progress=ANY)
+        self.assertTrue(mock_upload.call_args[0][3].startswith('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
         mock_sftp.rename.assert_called_once_with(ANY, '/remote/target/plot-k32-2021-06-01-00-00-dummyid.plot')
         self.assertTrue(mock_sftp.rename.call_args[0][0].startswith('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
         mock_os_remove.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot')
         mock_sftp.close.assert_called_once()
-        mock_ssh_client.return_value.close.assert_called_once()
+        # the connection stays in the pool for the next probe or transfer
+        mock_ssh_client.return_value.close.assert_not_called()
 
     @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload', side_effect=Exception("Connection lost"))
+    @patch('paramiko.SFTPClient.from_transport')
     @patch('paramiko.SSHClient')
     @patch('socket.gethostbyname', return_value='1.2.3.4')
-    def test_transfer_plot_remote_failure_cleanup(self, mock_gethostbyname, mock_ssh_client, mock_os_remove):
+    def test_transfer_plot_remote_failure_cleanup(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_os_remove):
         # Arrange
+        self.hotplots_io.transfer_config = TransferConfig(resume_partial_transfers=False)
         mock_sftp = MagicMock()
-        mock_sftp.put.side_effect = Exception("Connection lost")
-        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        mock_from_transport.return_value = mock_sftp
 
         target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
         target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
@@ -95,12 +127,917 @@ class TestHotplotsIO(unittest.TestCase):
         with self.assertRaises(Exception):
             self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
 
-        mock_sftp.put.assert_called_once()
+        mock_upload.assert_called_once()
         mock_sftp.remove.assert_called_once_with(ANY)
         self.assertTrue(mock_sftp.remove.call_args[0][0].startswith('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot'))
         mock_os_remove.assert_not_called()
         mock_sftp.close.assert_called_once()
-        mock_ssh_client.return_value.close.assert_called_once()
+        mock_ssh_client.return_value.close.assert_not_called()
+
+    def test_transfer_plot_local_resumes_partial(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            source_dir = os.path.join(temp_dir, 'source')
+            target_dir = os.path.join(temp_dir, 'target')
+            os.makedirs(source_dir)
+            os.makedirs(target_dir)
+            contents = os.urandom(10 * 1024)
+            source_path = os.path.join(source_dir, 'plot-k32-2021-06-01-00-00-dummyid.plot')
+            with open(source_path, 'wb') as f:
+                f.write(contents)
+
+            # an interrupted transfer left the first 6 KiB behind, followed by a half written garbage block,
+            # plus an older, smaller leftover from another attempt
+            partial_path = os.path.join(target_dir, '.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW')
+            with open(partial_path, 'wb') as f:
+                f.write(contents[:6 * 1024] + b'\0' * 100)
+            leftover_path = os.path.join(target_dir, '.plot-k32-2021-06-01-00-00-dummyid.plot.AbCdEf')
+            with open(leftover_path, 'wb') as f:
+                f.write(contents[:1024])
+
+            self.hotplots_io.transfer_config = TransferConfig(resume_verify_bytes=1024)
+            target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=1)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+            hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, len(contents)))
+
+            # Act
+            with patch.object(self.hotplots_io.local_file_copier, 'copy', wraps=self.hotplots_io.local_file_copier.copy) as mock_copy:
+                self.hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+
+            # Assert
+            # the last verify window holds the garbage, so the copy resumes from the start of that window
+            mock_copy.assert_called_once_with(source_path, partial_path, 6 * 1024 + 100 - 1024, ANY, progress=ANY)
+            self.assertEqual(['plot-k32-2021-06-01-00-00-dummyid.plot'], os.listdir(target_dir))
+            with open(os.path.join(target_dir, 'plot-k32-2021-06-01-00-00-dummyid.plot'), 'rb') as f:
+                self.assertEqual(contents, f.read())
+            self.assertFalse(os.path.exists(source_path))
+
+    @patch('hotplots.partial_transfers.PartialTransfers.lock', side_effect=lambda path: os.open(os.devnull, os.O_RDONLY))
+    @patch('os.remove')
+    @patch('hotplots.local_copy.LocalFileCopier.copy', side_effect=Exception("Disk full"))
+    def test_transfer_plot_local_failure_keeps_partial(self, mock_copy, mock_remove, mock_lock):
+        # Arrange
+        target_drive_config = TargetDriveConfig(path='/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+
+        # Act & Assert
+        with patch('hotplots.partial_transfers.PartialTransfers.local_partials', return_value=[]):
+            with self.assertRaises(Exception):
+                self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        mock_copy.assert_called_once()
+        mock_remove.assert_not_called()
+
+    @patch('hotplots.partial_transfers.PartialTransfers.lock', side_effect=lambda path: os.open(os.devnull, os.O_RDONLY))
+    @patch('os.remove')
+    @patch('hotplots.local_copy.LocalFileCopier.copy')
+    def test_transfer_plot_local_interrupted_keeps_partial(self, mock_copy, mock_remove, mock_lock):
+        # Arrange
+        def copy(source_path, dest_path, offset, throttle, progress):
+            progress(1024)
+            self.hotplots_io.interrupt_transfers()
+            progress(1024)
+        mock_copy.side_effect = copy
+        target_drive_config = TargetDriveConfig(path='/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+
+        # Act
+        with patch('hotplots.partial_transfers.PartialTransfers.local_partials', return_value=[]):
+            transferred = self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+            # nothing is started once transfers are interrupted
+            transferred_after = self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        # Assert
+        self.assertFalse(transferred)
+        self.assertFalse(transferred_after)
+        mock_copy.assert_called_once()
+        mock_remove.assert_not_called()
+
+    @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_resumes_partial(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_os_remove):
+        # Arrange
+        contents = os.urandom(4096)
+        partial_contents = io.BytesIO(contents[:3000])
+        mock_sftp = MagicMock()
+        mock_sftp.listdir_attr.return_value = [
+            MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=3000, st_mtime=0),
+            MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.AbCdEf', st_mode=stat.S_IFREG, st_size=10, st_mtime=0),
+            # still being written, by another plotter or an earlier attempt
+            MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.FrEsH1', st_mode=stat.S_IFREG, st_size=3500, st_mtime=time.time()),
+            MagicMock(filename='.plot-k32-2021-06-01-00-00-otherid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=5000, st_mtime=0),
+        ]
+        mock_sftp.open.return_value.__enter__.return_value = partial_contents
+        mock_from_transport.return_value = mock_sftp
+
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info)
+
+        # Act
+        with patch('builtins.open', return_value=io.BytesIO(contents)), patch('os.path.getsize', return_value=len(contents)):
+            self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        # Assert
+        mock_sftp.remove.assert_called_once_with('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.AbCdEf')
+        mock_sftp.truncate.assert_called_once_with('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', 3000)
+        mock_upload.assert_called_once_with(remote_host_config, mock_sftp, '/source/plot-k32-2021-06-01-00-00-dummyid.plot', '/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', 3000, ANY, progress=ANY)
+        mock_sftp.rename.assert_called_once_with('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', '/remote/target/plot-k32-2021-06-01-00-00-dummyid.plot')
+
+    @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_leaves_a_fresh_partial_alone(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_os_remove):
+        # Arrange
+        mock_sftp = MagicMock()
+        mock_sftp.listdir_attr.return_value = [
+            MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=3000, st_mtime=time.time()),
+        ]
+        mock_from_transport.return_value = mock_sftp
+
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info)
+
+        # Act
+        self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        # Assert
+        mock_sftp.remove.assert_not_called()
+        mock_sftp.truncate.assert_not_called()
+        remote_temp_dest_path = mock_upload.call_args[0][3]
+        self.assertTrue(remote_temp_dest_path.startswith('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.'))
+        self.assertNotEqual('/remote/target/.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', remote_temp_dest_path)
+        self.assertEqual(0, mock_upload.call_args[0][4])
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_batched_probe(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_run_python.return_value = {"time": 2000.0, "drives": {"/remote/target": {
+            "f_bavail": 10, "f_frsize": 4096, "f_blocks": 20,
+            "in_flight": [
+                [".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW", 123, 1990.0],
+                [".plot-k32-2021-06-01-00-00-deadid.plot.AbCdEf", 456, 1000.0]
+            ]
+        }}}
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+
+        # Act
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(RemoteTargetsConfig(1, [remote_host_config]))
+
+        # Assert
+        target_drive_info = remote_targets_info.remote_host_infos[0].target_drive_infos[0]
+        self.assertEqual(10 * 4096, target_drive_info.free_bytes)
+        self.assertEqual(20 * 4096, target_drive_info.total_bytes)
+        self.assertEqual(123, target_drive_info.in_flight_transfers[0].current_file_size)
+        self.assertEqual('dummyid', target_drive_info.in_flight_transfers[0].plot_name_metadata.plot_id)
+        # not written to in the last stale_partial_transfer_seconds, as measured by the remote clock
+        self.assertEqual([False, True], [t.is_stale for t in target_drive_info.in_flight_transfers])
+        mock_ssh_client.return_value.open_sftp.assert_not_called()
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_counts_leased_slots(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=3)
+        drive_lease_name = TransferSlotLeases.get_drive_lease_name(target_drive_config)
+        mock_run_python.return_value = {"time": 2000.0, "drives": {"/remote/target": {
+            "f_bavail": 10, "f_frsize": 4096, "f_blocks": 20,
+            "in_flight": [[".plot-k32-2021-06-01-00-00-writingid.plot.y29pgW", 123, 1000.0]]
+        }}, "leases": [
+            # reserved by another plotter, not written yet
+            [drive_lease_name + ".0.lease", "plotter2", "plot-k32-2021-06-01-00-00-leasedid.plot"],
+            # reserved by another plotter, already counted by its temporary file
+            [drive_lease_name + ".1.lease", "plotter2", "plot-k32-2021-06-01-00-00-writingid.plot"],
+            # this plotter's own
+            [drive_lease_name + ".2.lease", self.hotplots_io.transfer_slot_leases.owner, "plot-k32-2021-06-01-00-00-ownid.plot"],
+            ["host.0.lease", "plotter2", "plot-k32-2021-06-01-00-00-leasedid.plot"],
+        ]}
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config],
+                                              max_concurrent_inbound_transfers=4, coordination="lease_files")
+
+        # Act
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(RemoteTargetsConfig(1, [remote_host_config]))
+
+        # Assert
+        in_flight_transfers = remote_targets_info.remote_host_infos[0].target_drive_infos[0].in_flight_transfers
+        self.assertEqual(['writingid', 'leasedid'], [t.plot_name_metadata.plot_id for t in in_flight_transfers])
+        self.assertEqual(0, in_flight_transfers[1].current_file_size)
+        # not written to for a while, but its plotter still holds the lease, e.g. a throttled transfer
+        self.assertFalse(in_flight_transfers[0].is_stale)
+        mock_run_python.assert_called_once_with(ANY, ANY, ['/remote/target'], {"dir": "/tmp/hotplots-leases", "ttl": 300}, timeout=30)
+
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_counts_leased_slots_over_sftp(self, mock_gethostbyname, mock_ssh_client):
+        # Arrange
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=3)
+        drive_lease_name = TransferSlotLeases.get_drive_lease_name(target_drive_config)
+        leases = {
+            drive_lease_name + ".0.lease": (time.time(), "plot-k32-2021-06-01-00-00-leasedid.plot"),
+            drive_lease_name + ".1.lease": (time.time(), "plot-k32-2021-06-01-00-00-writingid.plot"),
+            # expired, its plotter is gone
+            drive_lease_name + ".2.lease": (time.time() - 3600, "plot-k32-2021-06-01-00-00-expiredid.plot"),
+        }
+        lease_attrs = [MagicMock(filename=lease_filename, st_mtime=mtime) for (lease_filename, (mtime, _)) in leases.items()]
+        writing_attr = MagicMock(filename='.plot-k32-2021-06-01-00-00-writingid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=123, st_mtime=time.time() - 3600)
+
+        def open_lease(path, mode):
+            lease_file = MagicMock()
+            lease_file.__enter__.return_value = io.BytesIO(json.dumps({"owner": "plotter2", "plot": leases[os.path.basename(path)][1]}).encode())
+            return lease_file
+
+        mock_sftp = MagicMock()
+        mock_sftp.statvfs.return_value = MagicMock(f_bavail=10, f_frsize=4096, f_blocks=20)
+        mock_sftp.listdir_attr.side_effect = lambda path: lease_attrs if path == '/tmp/hotplots-leases' else [writing_attr]
+        mock_sftp.open.side_effect = open_lease
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config],
+                                              max_concurrent_inbound_transfers=4, probe_mode="sftp", coordination="lease_files")
+
+        # Act
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(RemoteTargetsConfig(1, [remote_host_config]))
+
+        # Assert
+        in_flight_transfers = remote_targets_info.remote_host_infos[0].target_drive_infos[0].in_flight_transfers
+        self.assertEqual(['writingid', 'leasedid'], [t.plot_name_metadata.plot_id for t in in_flight_transfers])
+        self.assertFalse(in_flight_transfers[0].is_stale)
+
+    @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('hotplots.remote_commands.RemoteCommands.run_python', return_value={"leases": None})
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_without_free_slot(self, mock_gethostbyname, mock_ssh_client, mock_run_python, mock_from_transport, mock_upload, mock_os_remove):
+        # Arrange
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config],
+                                              max_concurrent_inbound_transfers=1, coordination="lease_files")
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info)
+
+        # Act
+        transferred = self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        # Assert: another plotter holds the slot, the plot stays where it is
+        self.assertFalse(transferred)
+        self.assertEqual("acquire", mock_run_python.call_args[0][2]["action"])
+        mock_from_transport.assert_not_called()
+        mock_upload.assert_not_called()
+        mock_os_remove.assert_not_called()
+        self.assertEqual(1, self.hotplots_io.metrics.transfers.get(host='remote-host', result='no_free_slot'))
+        self.assertEqual(0, self.hotplots_io.metrics.transfers.get(host='remote-host', result='succeeded'))
+
+    @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('hotplots.remote_commands.RemoteCommands.run_python')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_with_lease(self, mock_gethostbyname, mock_ssh_client, mock_run_python, mock_from_transport, mock_upload, mock_os_remove):
+        # Arrange
+        leases = ['/tmp/hotplots-leases/host.0.lease', '/tmp/hotplots-leases/drive-abc.0.lease']
+        mock_run_python.side_effect = [{"leases": leases}, {}]
+        mock_from_transport.return_value = MagicMock()
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config],
+                                              max_concurrent_inbound_transfers=2, coordination="lease_files")
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info)
+
+        # Act
+        self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+        self.hotplots_io.transfer_slot_leases.close()
+
+        # Assert
+        acquire_request = mock_run_python.call_args_list[0][0][2]
+        self.assertEqual("plot-k32-2021-06-01-00-00-dummyid.plot", acquire_request["plot"])
+        self.assertEqual([["host", 2], [TransferSlotLeases.get_drive_lease_name(target_drive_config), 1]], acquire_request["groups"])
+        mock_upload.assert_called_once()
+        mock_os_remove.assert_called_once_with('/source/plot-k32-2021-06-01-00-00-dummyid.plot')
+        release_request = mock_run_python.call_args_list[1][0][2]
+        self.assertEqual(("release", leases), (release_request["action"], release_request["leases"]))
+        self.assertEqual(2, mock_run_python.call_count)
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python', side_effect=RemoteCommandUnavailableError("python3: command not found"))
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_falls_back_to_sftp(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_sftp = MagicMock()
+        mock_sftp.statvfs.return_value = MagicMock(f_bavail=10, f_frsize=4096, f_blocks=20)
+        in_flight_attr = MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=123, st_mtime=time.time())
+        finished_attr = MagicMock(filename='plot-k32-2021-05-01-00-00-otherid.plot', st_mode=stat.S_IFREG, st_size=456, st_mtime=0)
+        mock_sftp.listdir_attr.return_value = [in_flight_attr, finished_attr]
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        remote_targets_config = RemoteTargetsConfig(1, [remote_host_config])
+
+        # Act
+        self.hotplots_io.get_remote_targets_info(remote_targets_config)
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(remote_targets_config)
+
+        # Assert
+        target_drive_info = remote_targets_info.remote_host_infos[0].target_drive_infos[0]
+        self.assertEqual(10 * 4096, target_drive_info.free_bytes)
+        self.assertEqual(1, len(target_drive_info.in_flight_transfers))
+        self.assertEqual(123, target_drive_info.in_flight_transfers[0].current_file_size)
+        mock_sftp.stat.assert_not_called()
+        # the batched probe isn't retried once it failed for a host
+        mock_run_python.assert_called_once()
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python', side_effect=RemoteCommandError("remote command exited with status 1: PermissionError"))
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_retries_a_failed_probe(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_sftp = MagicMock()
+        mock_sftp.statvfs.return_value = MagicMock(f_bavail=10, f_frsize=4096, f_blocks=20)
+        mock_sftp.listdir_attr.return_value = []
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        remote_targets_config = RemoteTargetsConfig(1, [remote_host_config])
+
+        # Act
+        self.hotplots_io.get_remote_targets_info(remote_targets_config)
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(remote_targets_config)
+
+        # Assert
+        self.assertEqual(10 * 4096, remote_targets_info.remote_host_infos[0].target_drive_infos[0].free_bytes)
+        # a script that failed, rather than a host without python3, is tried again the next cycle
+        self.assertEqual(2, mock_run_python.call_count)
+
+    @patch('os.remove')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_replaces_only_the_plots_it_needs(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_os_remove):
+        # Arrange
+        mock_sftp = MagicMock()
+        mock_sftp.listdir_attr.return_value = []
+        mock_sftp.statvfs.return_value = MagicMock(f_bavail=23, f_frsize=1)
+        mock_sftp.stat.return_value = MagicMock(st_size=100)
+        mock_from_transport.return_value = mock_sftp
+
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        hot_plot_target_drive = HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info)
+        self.hotplots_io.plan_replacement(self.hot_plot, ['/remote/target/cold1.plot', '/remote/target/cold2.plot'])
+
+        # Act
+        self.hotplots_io.transfer_plot(self.hot_plot, hot_plot_target_drive)
+
+        # Assert
+        # 23 bytes free and 123 needed, so deleting the first cold plot is enough
+        mock_sftp.remove.assert_called_once_with('/remote/target/cold1.plot')
+        mock_upload.assert_called_once()
+
+    def test_read_plot_headers_reads_each_plot_once(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            plot_id = bytes.fromhex("ab" * 32)
+            plot_path = os.path.join(temp_dir, 'plot-k32-2021-06-01-00-00-%s.plot' % plot_id.hex())
+            with open(plot_path, 'wb') as f:
+                f.write(create_v1_header(POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK, plot_id=plot_id) + b'\0' * 8192)
+            garbage_path = os.path.join(temp_dir, 'plot-k32-2021-06-01-00-00-%s.plot' % ("cd" * 32))
+            with open(garbage_path, 'wb') as f:
+                f.write(b'\0' * 8192)
+            local_host_config = LocalHostConfig(drives=[])
+
+            plot_headers = self.hotplots_io.read_plot_headers(local_host_config, [plot_path, garbage_path])
+            self.assertEqual([plot_path], list(plot_headers.keys()))
+            self.assertEqual(POOL_PUBLIC_KEY.hex(), plot_headers[plot_path].pool_public_key)
+
+            with patch('os.open', wraps=os.open) as mock_open:
+                self.assertEqual(plot_headers, self.hotplots_io.read_plot_headers(local_host_config, [plot_path]))
+            mock_open.assert_not_called()
+
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_read_plot_headers_remote(self, mock_gethostbyname, mock_ssh_client):
+        # Arrange
+        plot_id = bytes.fromhex("ab" * 32)
+        mock_sftp = MagicMock()
+        mock_sftp.open.return_value.__enter__.return_value = io.BytesIO(create_v1_header(POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK, plot_id=plot_id) + b'\0' * 8192)
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[], max_concurrent_inbound_transfers=1)
+        plot_path = '/remote/target/plot-k32-2021-06-01-00-00-%s.plot' % plot_id.hex()
+
+        # Act
+        plot_headers = self.hotplots_io.read_plot_headers(remote_host_config, [plot_path])
+
+        # Assert
+        self.assertEqual(FARMER_PUBLIC_KEY.hex(), plot_headers[plot_path].farmer_public_key)
+        mock_sftp.open.assert_called_once_with(plot_path, 'rb')
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_list_plot_files_remote_batched(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_run_python.return_value = {"dirs": {
+            "/remote/target1": {"plots": [["plot-k32-2021-05-01-00-00-otherid.plot", 456]]},
+            "/remote/target2": {"error": "No such file or directory"}
+        }}
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[], max_concurrent_inbound_transfers=1)
+
+        # Act
+        plot_files = self.hotplots_io.list_plot_files(remote_host_config, ["/remote/target1", "/remote/target2"])
+
+        # Assert
+        self.assertEqual({"/remote/target1": [(456, "/remote/target1/plot-k32-2021-05-01-00-00-otherid.plot")]}, plot_files)
+        mock_run_python.assert_called_once()
+        mock_ssh_client.return_value.open_sftp.assert_not_called()
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python', side_effect=RemoteCommandError("could not run remote command: Connection reset by peer"))
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_get_remote_targets_info_retries_command_after_connection_error(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_sftp = MagicMock()
+        mock_sftp.statvfs.return_value = MagicMock(f_bavail=10, f_frsize=4096, f_blocks=20)
+        mock_sftp.listdir_attr.return_value = []
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+        remote_targets_config = RemoteTargetsConfig(1, [remote_host_config])
+
+        # Act
+        self.hotplots_io.get_remote_targets_info(remote_targets_config)
+        remote_targets_info = self.hotplots_io.get_remote_targets_info(remote_targets_config)
+
+        # Assert
+        self.assertEqual(10 * 4096, remote_targets_info.remote_host_infos[0].target_drive_infos[0].free_bytes)
+        # a dropped connection doesn't mean the host can't run the command
+        self.assertEqual(2, mock_run_python.call_count)
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python', side_effect=RemoteCommandUnavailableError("python3: command not found"))
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_list_plot_files_remote_falls_back_to_sftp(self, mock_gethostbyname, mock_ssh_client, mock_run_python):
+        # Arrange
+        mock_sftp = MagicMock()
+        in_flight_attr = MagicMock(filename='.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW', st_mode=stat.S_IFREG, st_size=123)
+        finished_attr = MagicMock(filename='plot-k32-2021-05-01-00-00-otherid.plot', st_mode=stat.S_IFREG, st_size=456)
+        mock_sftp.listdir_attr.return_value = [in_flight_attr, finished_attr]
+        mock_ssh_client.return_value.open_sftp.return_value = mock_sftp
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[], max_concurrent_inbound_transfers=1)
+
+        # Act
+        plot_files = self.hotplots_io.list_plot_files(remote_host_config, ["/remote/target"])
+
+        # Assert
+        self.assertEqual({"/remote/target": [(456, "/remote/target/plot-k32-2021-05-01-00-00-otherid.plot")]}, plot_files)
+        mock_sftp.stat.assert_not_called()
+
+    def test_get_targets_info_skips_hosts_that_time_out(self):
+        # Arrange
+        local_target_drive_config = TargetDriveConfig(path='/target', max_concurrent_inbound_transfers=1)
+        local_host_config = LocalHostConfig(drives=[local_target_drive_config])
+        remote_target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        slow_host_config = RemoteHostConfig(hostname='slow-host', port=22, username='user', drives=[remote_target_drive_config], max_concurrent_inbound_transfers=1)
+        broken_host_config = RemoteHostConfig(hostname='broken-host', port=22, username='user', drives=[remote_target_drive_config], max_concurrent_inbound_transfers=1)
+        fast_host_config = RemoteHostConfig(hostname='fast-host', port=22, username='user', drives=[remote_target_drive_config], max_concurrent_inbound_transfers=1)
+        remote_targets_config = RemoteTargetsConfig(1, [slow_host_config, broken_host_config, fast_host_config], discovery_timeout_seconds=1)
+        targets_config = TargetsConfig("config_order", local_host_config, remote_targets_config)
+
+        local_target_drive_info = TargetDriveInfo(local_target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        remote_target_drive_info = TargetDriveInfo(remote_target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        release_slow_host = threading.Event()
+
+        def get_remote_host_info(remote_host_config):
+            if remote_host_config.hostname == 'slow-host':
+                release_slow_host.wait(5)
+            elif remote_host_config.hostname == 'broken-host':
+                raise OSError("No route to host")
+            return RemoteHostInfo(remote_host_config, [remote_target_drive_info])
+
+        # Act
+        with patch.object(self.hotplots_io, 'get_local_target_drive_info', return_value=local_target_drive_info), \
+                patch.object(self.hotplots_io, 'get_remote_host_info', side_effect=get_remote_host_info) as mock_get_remote_host_info:
+            targets_info = self.hotplots_io.get_targets_info(targets_config)
+            # the slow host's probe is still running, it isn't probed a second time
+            next_targets_info = self.hotplots_io.get_targets_info(targets_config)
+            self.assertEqual(5, mock_get_remote_host_info.call_count)
+        release_slow_host.set()
+        self.assertEqual(RemoteHostInfo(slow_host_config, [], available=False), next_targets_info.remote_targets_info.remote_host_infos[0])
+
+        # Assert
+        self.assertEqual([local_target_drive_info], targets_info.local_targets_info.target_drive_infos)
+        self.assertEqual([
+            RemoteHostInfo(slow_host_config, [], available=False),
+            RemoteHostInfo(broken_host_config, [], available=False),
+            RemoteHostInfo(fast_host_config, [remote_target_drive_info]),
+        ], targets_info.remote_targets_info.remote_host_infos)
+
+    def test_find_finished_plots_skips_hosts_that_time_out(self):
+        # Arrange
+        remote_target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        slow_host_config = RemoteHostConfig(hostname='slow-host', port=22, username='user', drives=[remote_target_drive_config], max_concurrent_inbound_transfers=1)
+        fast_host_config = RemoteHostConfig(hostname='fast-host', port=22, username='user', drives=[remote_target_drive_config], max_concurrent_inbound_transfers=1)
+        remote_targets_config = RemoteTargetsConfig(1, [slow_host_config, fast_host_config], discovery_timeout_seconds=1)
+        targets_config = TargetsConfig("config_order", LocalHostConfig(drives=[]), remote_targets_config)
+        release_slow_host = threading.Event()
+
+        def run_remote_python(remote_host_config, script, directories):
+            if remote_host_config.hostname == 'slow-host':
+                release_slow_host.wait(5)
+            return {"dirs": {"/remote/target": {"plots": [["plot-k32-2021-06-01-00-00-%sid.plot" % remote_host_config.hostname[:4], 100]]}}}
+
+        # Act
+        with patch.object(self.hotplots_io, 'run_remote_python', side_effect=run_remote_python) as mock_run_remote_python:
+            started = time.monotonic()
+            finished_plots = self.hotplots_io.find_finished_plots(targets_config, ['fastid', 'slowid'])
+            # the slow host is still being listed, it isn't listed a second time
+            self.hotplots_io.find_finished_plots(targets_config, ['fastid', 'slowid'])
+            elapsed = time.monotonic() - started
+            self.assertEqual(2, mock_run_remote_python.call_count)
+        release_slow_host.set()
+
+        # Assert
+        self.assertLess(elapsed, 3)
+        self.assertEqual({'fastid': ['fast-host:/remote/target/plot-k32-2021-06-01-00-00-fastid.plot']}, finished_plots)
+
+
+    def test_get_local_target_drive_info_skips_full_drives_until_space_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            target_drive_config = TargetDriveConfig(path=temp_dir, max_concurrent_inbound_transfers=1)
+            full_usage = shutil._ntuple_diskusage(total=10 ** 13, used=10 ** 13 - 10 ** 9, free=10 ** 9)
+            freed_usage = shutil._ntuple_diskusage(total=10 ** 13, used=10 ** 12, free=10 ** 13 - 10 ** 12)
+
+            with patch('shutil.disk_usage', return_value=full_usage), \
+                    patch.object(self.hotplots_io.plot_inventory, 'list_plots', wraps=self.hotplots_io.plot_inventory.list_plots) as mock_list_plots:
+                first = self.hotplots_io.get_local_target_drive_info(target_drive_config)
+                second = self.hotplots_io.get_local_target_drive_info(target_drive_config)
+
+            self.assertIs(first, second)
+            self.assertEqual(1, mock_list_plots.call_count)
+
+            with patch('shutil.disk_usage', return_value=freed_usage):
+                third = self.hotplots_io.get_local_target_drive_info(target_drive_config)
+
+            self.assertEqual(10 ** 13 - 10 ** 12, third.free_bytes)
+
+    def test_get_source_info_reuses_source_plots(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_path = os.path.join(temp_dir, 'plot-k32-2021-06-01-00-00-dummyid.plot')
+            with open(source_path, 'wb') as f:
+                f.write(b'\0' * 100)
+            source_config = SourceConfig([SourceDriveConfig(temp_dir)])
+
+            first = self.hotplots_io.get_source_info(source_config)
+            second = self.hotplots_io.get_source_info(source_config)
+
+            self.assertEqual([SourcePlot(source_path, 100)], first.source_drive_infos[0].source_plots)
+            self.assertIs(first.source_drive_infos[0].source_plots[0], second.source_drive_infos[0].source_plots[0])
+
+    def test_transfer_plot_local_replaces_only_the_plots_it_needs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_path = os.path.join(temp_dir, 'plot-k32-2022-01-01-00-00-dummyid.plot')
+            with open(source_path, 'wb') as f:
+                f.write(b'\0' * 1000)
+            target_dir = os.path.join(temp_dir, 'target')
+            os.makedirs(target_dir)
+            cold_plot_paths = []
+            for i in range(3):
+                cold_plot_path = os.path.join(target_dir, 'plot-k32-2021-01-0%s-00-00-dummyid.plot' % (i + 1))
+                with open(cold_plot_path, 'wb') as f:
+                    f.write(b'\0' * 600)
+                cold_plot_paths.append(cold_plot_path)
+
+            hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, 1000))
+            target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=1)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+
+            self.hotplots_io.plan_replacement(hot_plot, cold_plot_paths)
+            with patch('shutil.disk_usage', return_value=shutil._ntuple_diskusage(total=10 ** 6, used=10 ** 6 - 500, free=500)):
+                self.hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+
+            # 500 bytes free, so one 600 byte plot is enough
+            self.assertEqual([False, True, True], [os.path.exists(p) for p in cold_plot_paths])
+            self.assertTrue(os.path.exists(os.path.join(target_dir, 'plot-k32-2022-01-01-00-00-dummyid.plot')))
+
+    def test_transfer_plot_local_replaces_for_concurrent_transfers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            target_dir = os.path.join(temp_dir, 'target')
+            os.makedirs(target_dir)
+            target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=2)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+            hot_plots = []
+            cold_plot_paths = []
+            for plot_id in ['firstid', 'secondid']:
+                source_path = os.path.join(temp_dir, 'plot-k32-2022-01-01-00-00-%s.plot' % plot_id)
+                with open(source_path, 'wb') as f:
+                    f.write(b'\0' * 1000)
+                cold_plot_path = os.path.join(target_dir, 'plot-k32-2021-01-01-00-00-%s.plot' % plot_id)
+                with open(cold_plot_path, 'wb') as f:
+                    f.write(b'\0' * 1000)
+                hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, 1000))
+                self.hotplots_io.plan_replacement(hot_plot, [cold_plot_path])
+                hot_plots.append(hot_plot)
+                cold_plot_paths.append(cold_plot_path)
+
+            copy = self.hotplots_io.local_file_copier.copy
+            first_copying = threading.Event()
+            first_may_finish = threading.Event()
+
+            def copy_first_slowly(source_path, *args, **kwargs):
+                if source_path == hot_plots[0].source_plot.absolute_reference:
+                    first_copying.set()
+                    first_may_finish.wait(5)
+                return copy(source_path, *args, **kwargs)
+
+            # Act
+            # room for one plot but not two, and the disk usage doesn't show the first transfer until it's written
+            with patch('shutil.disk_usage', return_value=shutil._ntuple_diskusage(total=10 ** 6, used=10 ** 6 - 1200, free=1200)), \
+                    patch.object(self.hotplots_io.local_file_copier, 'copy', side_effect=copy_first_slowly):
+                first = threading.Thread(target=self.hotplots_io.transfer_plot, args=(hot_plots[0], hot_plot_target_drive))
+                first.start()
+                self.assertTrue(first_copying.wait(5))
+                self.hotplots_io.transfer_plot(hot_plots[1], hot_plot_target_drive)
+                first_may_finish.set()
+                first.join(5)
+
+            # Assert
+            # the first transfer fit without replacing, the second one needed its cold plot gone
+            self.assertEqual([True, False], [os.path.exists(p) for p in cold_plot_paths])
+
+    def test_transfer_plot_dry_run_drops_planned_replacements(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            hot_plot, hot_plot_target_drive = self.create_local_transfer(temp_dir)
+            cold_plot_path = os.path.join(hot_plot_target_drive.target_drive_info.target_drive_config.path, 'plot-k32-2021-01-01-00-00-coldid.plot')
+            with open(cold_plot_path, 'wb') as f:
+                f.write(b'\0' * 1000)
+            self.hotplots_io.plan_replacement(hot_plot, [cold_plot_path])
+
+            # Act
+            with patch('hotplots.hotplots_io.dry_run', True):
+                self.hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+            with patch('shutil.disk_usage', return_value=shutil._ntuple_diskusage(total=10 ** 6, used=10 ** 6, free=0)):
+                self.hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+
+            # Assert: the plan was for the dry run, the real transfer had none
+            self.assertTrue(os.path.exists(cold_plot_path))
+
+    def test_load_config_file_keeps_state_files_next_to_it(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open('config-example.yaml') as f:
+                config_objects = yaml.safe_load(f)
+            config_objects['targets']['farm_index_path'] = '/var/lib/hotplots/farm-index.sqlite'
+            del config_objects['targets']['plot_header_cache_path']
+            config_path = os.path.join(temp_dir, 'config.yaml')
+            with open(config_path, 'w') as f:
+                yaml.safe_dump(config_objects, f)
+
+            config = HotplotsIO.load_config_file(config_path)
+
+            self.assertEqual(os.path.join(temp_dir, 'hotplots-throughput.json'), config.targets.throughput_history_path)
+            self.assertIsNone(config.targets.plot_header_cache_path)
+            self.assertEqual('/var/lib/hotplots/farm-index.sqlite', config.targets.farm_index_path)
+
+    def test_transfer_plot_records_the_average_concurrent_host_transfers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            target_dir = os.path.join(temp_dir, 'target')
+            os.makedirs(target_dir)
+            target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=2)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            hot_plot_target_drive = HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+            hot_plots = []
+            for plot_id in ['firstid', 'secondid']:
+                source_path = os.path.join(temp_dir, 'plot-k32-2022-01-01-00-00-%s.plot' % plot_id)
+                with open(source_path, 'wb') as f:
+                    f.write(b'\0' * 2 * 1024 * 1024)
+                hot_plots.append(HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, 2 * 1024 * 1024)))
+
+            copy = self.hotplots_io.local_file_copier.copy
+            first_copying = threading.Event()
+            second_done = threading.Event()
+
+            def copy_slowly(source_path, *args, **kwargs):
+                if source_path == hot_plots[0].source_plot.absolute_reference:
+                    # the second transfer runs during the first half of the first one
+                    first_copying.set()
+                    second_done.wait(5)
+                time.sleep(0.5)
+                return copy(source_path, *args, **kwargs)
+
+            # Act
+            with patch.object(self.hotplots_io.local_file_copier, 'copy', side_effect=copy_slowly), \
+                    patch.object(self.hotplots_io.throughput_history, 'record') as mock_record:
+                first = threading.Thread(target=self.hotplots_io.transfer_plot, args=(hot_plots[0], hot_plot_target_drive))
+                first.start()
+                self.assertTrue(first_copying.wait(5))
+                self.hotplots_io.transfer_plot(hot_plots[1], hot_plot_target_drive)
+                second_done.set()
+                first.join(5)
+
+            # Assert
+            [(second_args, _), (first_args, _)] = mock_record.call_args_list
+            self.assertAlmostEqual(2, second_args[3], delta=0.1)
+            self.assertAlmostEqual(1.5, first_args[3], delta=0.2)
+
+    def test_unknown_transfer_backend(self):
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[], max_concurrent_inbound_transfers=1,
+                                              transfer=RemoteTransferConfig(backend="scp"))
+        targets_config = TargetsConfig("config_order", LocalHostConfig(drives=[]), RemoteTargetsConfig(1, [remote_host_config]),
+                                       throughput_history_path="", plot_header_cache_path="", farm_index_path="")
+
+        with self.assertRaises(ValueError):
+            HotplotsIO(HotplotsConfig(LoggingConfig(), SourceConfig([]), targets_config))
+
+    @staticmethod
+    def create_hotplots_io(transfer_config):
+        # nothing is persisted with empty paths
+        targets_config = TargetsConfig("config_order", LocalHostConfig(drives=[]), RemoteTargetsConfig(1, []),
+                                       throughput_history_path="", plot_header_cache_path="", farm_index_path="")
+        return HotplotsIO(HotplotsConfig(LoggingConfig(), SourceConfig([]), targets_config, transfer_config))
+
+    def create_local_transfer(self, temp_dir):
+        source_path = os.path.join(temp_dir, 'plot-k32-2022-01-01-00-00-dummyid.plot')
+        with open(source_path, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        target_dir = os.path.join(temp_dir, 'target')
+        os.makedirs(target_dir)
+        hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, 64 * 1024))
+        target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=1)
+        target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+        return hot_plot, HotPlotTargetDrive(host_config=LocalHostConfig(drives=[target_drive_config]), target_drive_info=target_drive_info)
+
+    def test_transfer_plot_local_resumes_preallocated_partial(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            hotplots_io = self.create_hotplots_io(TransferConfig(
+                local=LocalTransferConfig(chunk_size_bytes=4096, preallocate=True), resume_verify_bytes=1024
+            ))
+            hot_plot, hot_plot_target_drive = self.create_local_transfer(temp_dir)
+            source_path = hot_plot.source_plot.absolute_reference
+            with open(source_path, 'rb') as f:
+                contents = f.read()
+            target_dir = hot_plot_target_drive.target_drive_info.target_drive_config.path
+
+            # the first attempt dies after 4 chunks, with the rest of the plot reserved on the drive
+            progress = MagicMock()
+            progress.advance.side_effect = [None, None, None, Exception("Connection reset")]
+            with patch.object(hotplots_io.transfer_progress, 'start', return_value=progress), self.assertRaises(Exception):
+                hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+            [partial_filename] = os.listdir(target_dir)
+            partial_path = os.path.join(target_dir, partial_filename)
+            self.assertEqual(4 * 4096, os.path.getsize(partial_path))
+
+            # Act
+            with patch.object(hotplots_io.local_file_copier, 'copy', wraps=hotplots_io.local_file_copier.copy) as mock_copy:
+                hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+
+            # Assert
+            mock_copy.assert_called_once_with(source_path, partial_path, 4 * 4096, ANY, progress=ANY)
+            with open(os.path.join(target_dir, 'plot-k32-2022-01-01-00-00-dummyid.plot'), 'rb') as f:
+                self.assertEqual(contents, f.read())
+
+    def test_get_local_target_drive_info_locked_partial_is_not_stale(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            hotplots_io = self.create_hotplots_io(TransferConfig(stale_partial_transfer_seconds=60))
+            partial_path = os.path.join(temp_dir, '.plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW')
+            with open(partial_path, 'wb') as f:
+                f.write(b'\0' * 1024)
+            # not written to for an hour, e.g. a throttled transfer
+            os.utime(partial_path, (time.time() - 3600, time.time() - 3600))
+            target_drive_config = TargetDriveConfig(path=temp_dir, max_concurrent_inbound_transfers=1)
+
+            # Act
+            temp_file_lock = PartialTransfers.lock(partial_path)
+            try:
+                locked_target_drive_info = hotplots_io.get_local_target_drive_info(target_drive_config)
+            finally:
+                os.close(temp_file_lock)
+            target_drive_info = hotplots_io.get_local_target_drive_info(target_drive_config)
+
+            # Assert
+            self.assertFalse(locked_target_drive_info.in_flight_transfers[0].is_stale)
+            self.assertTrue(target_drive_info.in_flight_transfers[0].is_stale)
+
+    def test_transfer_plot_local_verified(self):
+        for verify_transfers in ["sampled", "full"]:
+            with self.subTest(verify_transfers=verify_transfers), tempfile.TemporaryDirectory() as temp_dir:
+                hotplots_io = self.create_hotplots_io(TransferConfig(verify_transfers=verify_transfers, verify_sample_block_bytes=1024))
+                hot_plot, hot_plot_target_drive = self.create_local_transfer(temp_dir)
+                source_path = hot_plot.source_plot.absolute_reference
+                hash_local_file = TransferVerification.hash_local_file
+                may_verify = threading.Event()
+
+                def hash_when_allowed(path, blocks):
+                    may_verify.wait(5)
+                    return hash_local_file(path, blocks)
+
+                with patch('hotplots.transfer_verification.TransferVerification.hash_local_file', side_effect=hash_when_allowed):
+                    hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+
+                    # the transfer is done, but the source stays until the copy is verified
+                    self.assertTrue(os.path.exists(source_path))
+                    self.assertEqual({source_path}, hotplots_io.get_verifying_source_references())
+                    may_verify.set()
+                    hotplots_io.close()
+
+                self.assertFalse(os.path.exists(source_path))
+                self.assertTrue(os.path.exists(os.path.join(temp_dir, 'target', 'plot-k32-2022-01-01-00-00-dummyid.plot')))
+                self.assertEqual(set(), hotplots_io.get_verifying_source_references())
+
+    def test_transfer_plot_local_verification_mismatch(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hotplots_io = self.create_hotplots_io(TransferConfig(verify_transfers="sampled", verify_sample_block_bytes=1024))
+            hot_plot, hot_plot_target_drive = self.create_local_transfer(temp_dir)
+            copy = hotplots_io.local_file_copier.copy
+
+            def corrupted_copy(source_path, dest_path, start_offset, throttle, progress=None):
+                copy(source_path, dest_path, start_offset, throttle, progress)
+                with open(dest_path, 'r+b') as f:
+                    f.write(b'corrupted')
+
+            with patch.object(hotplots_io.local_file_copier, 'copy', side_effect=corrupted_copy):
+                hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
+            hotplots_io.close()
+
+            # the bad copy is deleted, and the source kept to transfer it again
+            self.assertTrue(os.path.exists(hot_plot.source_plot.absolute_reference))
+            self.assertEqual([], os.listdir(os.path.join(temp_dir, 'target')))
+
+    @patch('hotplots.remote_commands.RemoteCommands.run_python')
+    @patch('hotplots.remote_transfer.SftpTransferBackend.upload')
+    @patch('paramiko.SFTPClient.from_transport')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_transfer_plot_remote_verified_on_the_remote_host(self, mock_gethostbyname, mock_ssh_client, mock_from_transport, mock_upload, mock_run_python):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Arrange
+            hotplots_io = self.create_hotplots_io(TransferConfig(verify_transfers="full"))
+            hot_plot, _ = self.create_local_transfer(temp_dir)
+            source_path = hot_plot.source_plot.absolute_reference
+            mock_from_transport.return_value = MagicMock()
+            mock_run_python.return_value = {"hashes": TransferVerification.hash_local_file(source_path, None)}
+
+            target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+
+            # Act
+            hotplots_io.transfer_plot(hot_plot, HotPlotTargetDrive(host_config=remote_host_config, target_drive_info=target_drive_info))
+            hotplots_io.close()
+
+            # Assert
+            mock_run_python.assert_called_once_with(ANY, ANY, '/remote/target/plot-k32-2022-01-01-00-00-dummyid.plot', None, timeout=900)
+            self.assertFalse(os.path.exists(source_path))
+
+    def test_list_plot_files_from_farm_index(self):
+        with tempfile.TemporaryDirectory() as target_dir:
+            cold_plot_path = os.path.join(target_dir, 'plot-k32-2021-01-01-00-00-coldid.plot')
+            with open(cold_plot_path, 'wb') as f:
+                f.write(b'\0' * 600)
+            open(os.path.join(target_dir, '.plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW'), 'wb').close()
+            local_host_config = LocalHostConfig(drives=[])
+            self.assertEqual({target_dir: [(600, cold_plot_path)]}, self.hotplots_io.list_plot_files(local_host_config, [target_dir]))
+
+            # until it's reconciled again, the directory isn't listed, and transfers and replacements keep it up to date
+            source_path = os.path.join(target_dir, 'source', 'plot-k32-2022-01-01-00-00-hotid.plot')
+            os.makedirs(os.path.dirname(source_path))
+            with open(source_path, 'wb') as f:
+                f.write(b'\0' * 1000)
+            hot_plot = HotPlot(source_drive_info=MagicMock(), source_plot=SourcePlot(source_path, 1000))
+            target_drive_config = TargetDriveConfig(path=target_dir, max_concurrent_inbound_transfers=1)
+            target_drive_info = TargetDriveInfo(target_drive_config=target_drive_config, total_bytes=1, free_bytes=1, in_flight_transfers=[])
+            self.hotplots_io.plan_replacement(hot_plot, [cold_plot_path])
+            with patch('shutil.disk_usage', return_value=shutil._ntuple_diskusage(total=10 ** 6, used=10 ** 6, free=0)):
+                self.hotplots_io.transfer_plot(hot_plot, HotPlotTargetDrive(local_host_config, target_drive_info))
+
+            with patch('os.listdir') as mock_listdir:
+                plot_files = self.hotplots_io.list_plot_files(local_host_config, [target_dir])
+            mock_listdir.assert_not_called()
+            self.assertEqual({target_dir: [(1000, os.path.join(target_dir, 'plot-k32-2022-01-01-00-00-hotid.plot'))]}, plot_files)
+
 
 if __name__ == '__main__':
     unittest.main()
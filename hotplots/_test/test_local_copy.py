@@ -0,0 +1,66 @@
+import errno
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from hotplots.hotplots_config import LocalTransferConfig
+from hotplots.local_copy import LocalFileCopier
+
+
+class TestLocalFileCopier(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, "plot-k32-2021-06-01-00-00-dummyid.plot")
+        self.dest_path = os.path.join(self.temp_dir.name, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW")
+        # not a multiple of the chunk size, so the last chunk is a partial one
+        self.contents = os.urandom(10 * 4096 + 123)
+        with open(self.source_path, "wb") as f:
+            f.write(self.contents)
+        self.copier = LocalFileCopier(LocalTransferConfig(chunk_size_bytes=4096))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_copied(self):
+        with open(self.dest_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+        self.assertEqual(os.stat(self.source_path).st_mtime, os.stat(self.dest_path).st_mtime)
+
+    def test_copy(self):
+        self.copier.copy(self.source_path, self.dest_path)
+        self.assert_copied()
+
+    @patch('os.copy_file_range', side_effect=OSError(errno.EXDEV, "Invalid cross-device link"), create=True)
+    def test_copy_falls_back_to_sendfile(self, mock_copy_file_range):
+        self.copier.copy(self.source_path, self.dest_path)
+        self.assert_copied()
+        mock_copy_file_range.assert_called_once()
+
+    @patch('os.sendfile', side_effect=OSError(errno.EINVAL, "Invalid argument"), create=True)
+    @patch('os.copy_file_range', return_value=0, create=True)
+    def test_copy_falls_back_to_pread_pwrite(self, mock_copy_file_range, mock_sendfile):
+        self.copier.copy(self.source_path, self.dest_path)
+        self.assert_copied()
+
+    @patch('os.copy_file_range', side_effect=OSError(errno.EIO, "Input/output error"), create=True)
+    def test_io_errors_are_raised(self, mock_copy_file_range):
+        with self.assertRaises(OSError):
+            self.copier.copy(self.source_path, self.dest_path)
+
+    def test_copy_without_preallocation_or_cache_dropping(self):
+        LocalFileCopier(LocalTransferConfig(chunk_size_bytes=4096, preallocate=False, drop_page_cache=False)).copy(self.source_path, self.dest_path)
+        self.assert_copied()
+
+    def test_copy_resumes_from_offset(self):
+        # an interrupted copy left the first chunks behind, plus some garbage past the resume offset
+        with open(self.dest_path, "wb") as f:
+            f.write(self.contents[:3 * 4096] + b"\0" * 5000)
+
+        self.copier.copy(self.source_path, self.dest_path, 3 * 4096)
+        self.assert_copied()
+
+
+if __name__ == '__main__':
+    unittest.main()
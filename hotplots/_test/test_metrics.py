@@ -0,0 +1,120 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import MetricsConfig, LocalHostConfig, RemoteTargetsConfig, TargetsConfig, TargetDriveConfig, \
+    RemoteHostConfig
+from hotplots.metrics import Counter, Gauge, Histogram, HotplotsMetrics, MetricsServer, _Metric
+from hotplots.models import TargetsInfo, LocalTargetsInfo, RemoteTargetsInfo, RemoteHostInfo, TargetDriveInfo
+from hotplots.transfer_progress import TransferProgressSnapshot
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter("hotplots_transfers", "Transfers.", ["host", "result"])
+        counter.inc(host="harvester1", result="succeeded")
+        counter.inc(2, host="harvester1", result="succeeded")
+        counter.inc(host="harvester\"2", result="failed")
+
+        self.assertEqual([
+            "# TYPE hotplots_transfers counter",
+            "# HELP hotplots_transfers Transfers.",
+            'hotplots_transfers_total{host="harvester\\"2",result="failed"} 1',
+            'hotplots_transfers_total{host="harvester1",result="succeeded"} 3',
+        ], counter.render())
+        with self.assertRaises(ValueError):
+            counter.inc(host="harvester1")
+
+    def test_metric_without_rendering_cant_be_created(self):
+        class Summary(_Metric):
+            type_name = "summary"
+
+        with self.assertRaises(TypeError):
+            Summary("hotplots_summary", "Not rendered.")
+
+    def test_gauge_snapshot(self):
+        gauge = Gauge("hotplots_target_drive_free_bytes", "Free bytes.", ["drive"])
+        gauge.set(10, drive="/mnt/a")
+        gauge.replace_all([({"drive": "/mnt/b"}, 20)])
+
+        self.assertIsNone(gauge.get(drive="/mnt/a"))
+        self.assertEqual(['hotplots_target_drive_free_bytes{drive="/mnt/b"} 20'], gauge.render()[2:])
+
+    def test_histogram(self):
+        histogram = Histogram("hotplots_cycle_phase_seconds", "Phases.", [0.1, 1], ["phase"])
+        histogram.observe(0.05, phase="pairing")
+        histogram.observe(0.5, phase="pairing")
+        histogram.observe(5, phase="pairing")
+        with histogram.time(phase="source_scan"):
+            pass
+
+        self.assertEqual([
+            'hotplots_cycle_phase_seconds_bucket{phase="pairing",le="0.1"} 1',
+            'hotplots_cycle_phase_seconds_bucket{phase="pairing",le="1"} 2',
+            'hotplots_cycle_phase_seconds_bucket{phase="pairing",le="+Inf"} 3',
+            'hotplots_cycle_phase_seconds_count{phase="pairing"} 3',
+            'hotplots_cycle_phase_seconds_sum{phase="pairing"} 5.55',
+        ], histogram.render()[2:7])
+        self.assertEqual(1, histogram.get_count(phase="source_scan"))
+
+    def test_record_targets_info(self):
+        metrics = HotplotsMetrics()
+        local_drive = TargetDriveInfo(TargetDriveConfig("/mnt/local", 1), 10 * Constants.TERABYTE, 2 * Constants.TERABYTE, [])
+        remote_drives = [
+            TargetDriveInfo(TargetDriveConfig("/mnt/remote1", 1), 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, ["transfer1"]),
+            TargetDriveInfo(TargetDriveConfig("/mnt/remote2", 1), 10 * Constants.TERABYTE, 3 * Constants.TERABYTE, ["transfer2"]),
+        ]
+        remote_host_config = RemoteHostConfig("harvester1", "user", 22, 2, [d.target_drive_config for d in remote_drives])
+        unavailable_host_config = RemoteHostConfig("harvester2", "user", 22, 2, [])
+        local_host_config = LocalHostConfig([local_drive.target_drive_config])
+        remote_targets_config = RemoteTargetsConfig(1, [remote_host_config, unavailable_host_config])
+        metrics.record_targets_info(TargetsInfo(
+            TargetsConfig("config_order", local_host_config, remote_targets_config),
+            LocalTargetsInfo(local_host_config, [local_drive]),
+            RemoteTargetsInfo(remote_targets_config, [
+                RemoteHostInfo(remote_host_config, remote_drives), RemoteHostInfo(unavailable_host_config, [], available=False)
+            ])
+        ))
+
+        self.assertEqual(2 * Constants.TERABYTE, metrics.target_drive_free_bytes.get(host="localhost", drive="/mnt/local"))
+        self.assertEqual(1, metrics.target_drive_slots_in_use.get(host="harvester1", drive="/mnt/remote2"))
+        self.assertEqual(2, metrics.target_host_slots_in_use.get(host="harvester1"))
+        self.assertEqual(0, metrics.target_host_slots_in_use.get(host="localhost"))
+        self.assertIsNone(metrics.target_host_slots_in_use.get(host="harvester2"))
+
+    def test_record_transfer_progress(self):
+        metrics = HotplotsMetrics()
+        metrics.record_transfer_progress([
+            TransferProgressSnapshot("/source/a.plot", "harvester1:/mnt/remote1", "a", 100, 40, 5.0, 4.0, 15.0),
+            TransferProgressSnapshot("/source/b.plot", "/mnt/local", "b", 100, 0, 0.0, 0.0, None),
+        ])
+
+        self.assertEqual(60, metrics.transfer_remaining_bytes.get(source="/source/a.plot", destination="harvester1:/mnt/remote1"))
+        self.assertEqual(15.0, metrics.transfer_eta_seconds.get(source="/source/a.plot", destination="harvester1:/mnt/remote1"))
+        self.assertIsNone(metrics.transfer_eta_seconds.get(source="/source/b.plot", destination="/mnt/local"))
+
+        metrics.record_transfer_progress([])
+        self.assertIsNone(metrics.transfer_remaining_bytes.get(source="/source/a.plot", destination="harvester1:/mnt/remote1"))
+
+    def test_server(self):
+        metrics = HotplotsMetrics()
+        metrics.transfers.inc(host="harvester1", result="succeeded")
+        server = MetricsServer(metrics, MetricsConfig(port=0))
+        port = server.start()
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%s/metrics" % port) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("application/openmetrics-text"))
+                body = response.read().decode()
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen("http://127.0.0.1:%s/other" % port)
+        finally:
+            server.close()
+
+        self.assertIn('hotplots_transfers_total{host="harvester1",result="succeeded"} 1\n', body)
+        self.assertTrue(body.endswith("# EOF\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
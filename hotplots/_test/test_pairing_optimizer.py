@@ -0,0 +1,134 @@
+import random
+import unittest
+from unittest.mock import patch
+
+from hotplots._test.helpers.test_helpers import TestHelpers
+from hotplots.constants import Constants
+from hotplots.hotplots_config import SourceDriveConfig, SourceConfig, RemoteTargetsConfig, RemoteHostConfig, \
+    TargetDriveConfig, LocalHostConfig, TargetsConfig
+from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, EligiblePairingsResult
+from hotplots.models import SourceInfo, SourceDriveInfo, HotPlot, RemoteTargetsInfo, RemoteHostInfo, TargetDriveInfo, \
+    TargetsInfo, LocalTargetsInfo, HotPlotTargetDrive, InFlightTransfer
+
+
+class TestPairingOptimizer(unittest.TestCase):
+
+    def create_stranding_infos(self, pairing_mode, time_budget_seconds=1.0, newer_k32_plot=False, k32_partial_on_large_drive=False):
+        """
+        The oldest plot is a k32, and greedy gives it the drive with the most space, the only one a k33 fits on.
+        """
+        self.source_drive_config = SourceDriveConfig("/mnt/source1", 2)
+        self.k32_plot = TestHelpers.create_mock_source_plot(self.source_drive_config, 32, 2021, 6, 1, 0, 0)
+        self.k33_plot = TestHelpers.create_mock_source_plot(self.source_drive_config, 33, 2021, 6, 2, 0, 0)
+        self.newer_k32_plot = TestHelpers.create_mock_source_plot(self.source_drive_config, 32, 2021, 6, 3, 0, 0)
+        source_plots = [self.k32_plot, self.k33_plot]
+        if newer_k32_plot:
+            # listed first, so only the ranking puts it after the older one
+            source_plots.insert(0, self.newer_k32_plot)
+        self.source_drive_info = SourceDriveInfo(self.source_drive_config, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, source_plots)
+        source_info = SourceInfo(SourceConfig([self.source_drive_config], 60, "plot_with_oldest_timestamp"), [self.source_drive_info])
+
+        small_drive_config = TargetDriveConfig("/mnt/small", 1)
+        large_drive_config = TargetDriveConfig("/mnt/large", 1)
+        large_drive_in_flight_transfers = []
+        if k32_partial_on_large_drive:
+            large_drive_in_flight_transfers.append(InFlightTransfer(
+                "." + self.k32_plot.absolute_reference.split("/")[-1] + ".y29pgW", 50 * Constants.GIGABYTE, self.k32_plot.plot_name_metadata(), is_stale=True
+            ))
+        self.small_drive_info = TargetDriveInfo(small_drive_config, 18 * Constants.TERABYTE, 150 * Constants.GIGABYTE, [])
+        self.large_drive_info = TargetDriveInfo(large_drive_config, 18 * Constants.TERABYTE, 250 * Constants.GIGABYTE, large_drive_in_flight_transfers)
+        self.local_host_config = LocalHostConfig([small_drive_config, large_drive_config])
+
+        remote_targets_config = RemoteTargetsConfig(1, [])
+        targets_config = TargetsConfig(
+            "drive_with_most_space_remaining", self.local_host_config, remote_targets_config, "local", pairing_mode, time_budget_seconds
+        )
+        return source_info, TargetsInfo(
+            targets_config,
+            LocalTargetsInfo(self.local_host_config, [self.small_drive_info, self.large_drive_info]),
+            RemoteTargetsInfo(remote_targets_config, [])
+        )
+
+    def test_greedy_strands_the_bigger_plot(self):
+        result = HotplotsPairingEngine.get_pairings_result(*self.create_stranding_infos("greedy"))
+        self.assertEqual(EligiblePairingsResult([
+            (HotPlot(self.source_drive_info, self.k32_plot), HotPlotTargetDrive(self.local_host_config, self.large_drive_info))
+        ]), result)
+
+    def test_optimal_pairs_both_plots(self):
+        result = HotplotsPairingEngine.get_pairings_result(*self.create_stranding_infos("optimal"))
+        self.assertEqual(EligiblePairingsResult([
+            (HotPlot(self.source_drive_info, self.k32_plot), HotPlotTargetDrive(self.local_host_config, self.small_drive_info)),
+            (HotPlot(self.source_drive_info, self.k33_plot), HotPlotTargetDrive(self.local_host_config, self.large_drive_info)),
+        ]), result)
+
+    def test_optimal_pairs_the_best_ranked_plots_of_a_kind(self):
+        result = HotplotsPairingEngine.get_pairings_result(*self.create_stranding_infos("optimal", newer_k32_plot=True))
+        # of the two k32s, the oldest goes
+        self.assertEqual(EligiblePairingsResult([
+            (HotPlot(self.source_drive_info, self.k32_plot), HotPlotTargetDrive(self.local_host_config, self.small_drive_info)),
+            (HotPlot(self.source_drive_info, self.k33_plot), HotPlotTargetDrive(self.local_host_config, self.large_drive_info)),
+        ]), result)
+
+    def test_optimal_resumes_a_partial_on_its_drive(self):
+        result = HotplotsPairingEngine.get_pairings_result(*self.create_stranding_infos("optimal", k32_partial_on_large_drive=True))
+        # moving both plots would start the k32 over on the small drive, rather than resume it on the large one
+        self.assertEqual(EligiblePairingsResult([
+            (HotPlot(self.source_drive_info, self.k32_plot), HotPlotTargetDrive(self.local_host_config, self.large_drive_info))
+        ]), result)
+
+    def test_greedy_pairings_when_out_of_time(self):
+        with patch("hotplots.pairing_optimizer.NODES_PER_CLOCK_CHECK", 1):
+            result = HotplotsPairingEngine.get_pairings_result(*self.create_stranding_infos("optimal", 0))
+        self.assertEqual(EligiblePairingsResult([
+            (HotPlot(self.source_drive_info, self.k32_plot), HotPlotTargetDrive(self.local_host_config, self.large_drive_info))
+        ]), result)
+
+    def test_never_worse_than_greedy(self):
+        rng = random.Random(0)
+        for _ in range(30):
+            source_drive_configs = [SourceDriveConfig("/mnt/source%s" % i, rng.randint(1, 3)) for i in range(3)]
+            source_drive_infos = [
+                SourceDriveInfo(source_drive_config, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, [
+                    TestHelpers.create_mock_source_plot(source_drive_config, rng.choice([32, 33]), 2021, rng.randint(1, 12), rng.randint(1, 28), 0, 0)
+                    for _ in range(rng.randint(1, 4))
+                ])
+                for source_drive_config in source_drive_configs
+            ]
+            source_info = SourceInfo(SourceConfig(source_drive_configs, 60, "plot_with_oldest_timestamp"), source_drive_infos)
+
+            def create_target_drive_infos(prefix):
+                return [
+                    TargetDriveInfo(TargetDriveConfig("/mnt/%s%s" % (prefix, i), rng.randint(1, 2)), 18 * Constants.TERABYTE, rng.randint(50, 500) * Constants.GIGABYTE, [])
+                    for i in range(3)
+                ]
+
+            local_target_drive_infos = create_target_drive_infos("local")
+            local_host_config = LocalHostConfig([d.target_drive_config for d in local_target_drive_infos])
+            remote_target_drive_infos = create_target_drive_infos("remote")
+            remote_host_config = RemoteHostConfig("harvester", "user", 22, 2, [d.target_drive_config for d in remote_target_drive_infos])
+            remote_targets_config = RemoteTargetsConfig(rng.randint(1, 3), [remote_host_config])
+
+            def get_pairings(pairing_mode):
+                targets_config = TargetsConfig("drive_with_most_space_remaining", local_host_config, remote_targets_config, "unspecified", pairing_mode)
+                targets_info = TargetsInfo(
+                    targets_config,
+                    LocalTargetsInfo(local_host_config, local_target_drive_infos),
+                    RemoteTargetsInfo(remote_targets_config, [RemoteHostInfo(remote_host_config, remote_target_drive_infos)])
+                )
+                result = HotplotsPairingEngine.get_pairings_result(source_info, targets_info)
+                return result.pairings if isinstance(result, EligiblePairingsResult) else []
+
+            greedy_pairings = get_pairings("greedy")
+            optimal_pairings = get_pairings("optimal")
+            self.assertGreaterEqual(
+                sum(hot_plot.source_plot.size for (hot_plot, _) in optimal_pairings),
+                sum(hot_plot.source_plot.size for (hot_plot, _) in greedy_pairings)
+            )
+            paired_plots = [hot_plot.source_plot.absolute_reference for (hot_plot, _) in optimal_pairings]
+            self.assertEqual(len(set(paired_plots)), len(paired_plots))
+            self.assertLessEqual(len([1 for (_, d) in optimal_pairings if not d.is_local()]), remote_targets_config.max_concurrent_outbound_transfers)
+
+
+if __name__ == '__main__':
+    unittest.main()
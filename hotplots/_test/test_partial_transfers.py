@@ -0,0 +1,84 @@
+import io
+import os
+import tempfile
+import unittest
+
+from hotplots.partial_transfers import PartialTransfers
+
+
+class TestPartialTransfers(unittest.TestCase):
+
+    def setUp(self):
+        self.contents = os.urandom(10 * 1024)
+
+    def test_is_partial_of(self):
+        self.assertTrue(PartialTransfers.is_partial_of(".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW", "plot-k32-2021-06-01-00-00-dummyid.plot"))
+        self.assertFalse(PartialTransfers.is_partial_of("plot-k32-2021-06-01-00-00-dummyid.plot", "plot-k32-2021-06-01-00-00-dummyid.plot"))
+        self.assertFalse(PartialTransfers.is_partial_of(".plot-k32-2021-06-01-00-00-otherid.plot.y29pgW", "plot-k32-2021-06-01-00-00-dummyid.plot"))
+
+    def test_select_partial(self):
+        self.assertEqual((None, []), PartialTransfers.select_partial([]))
+        self.assertEqual(
+            (("b", 300), [("c", 200), ("a", 100)]),
+            PartialTransfers.select_partial([("a", 100), ("b", 300), ("c", 200)])
+        )
+
+    def test_find_resume_offset_intact_partial(self):
+        partial = io.BytesIO(self.contents[:6000])
+        self.assertEqual(6000, PartialTransfers.find_resume_offset(io.BytesIO(self.contents), partial, 6000, len(self.contents), 1024))
+
+    def test_find_resume_offset_steps_back_over_a_torn_tail(self):
+        partial_contents = self.contents[:6000] + b"\0" * 100
+        partial = io.BytesIO(partial_contents)
+        self.assertEqual(
+            len(partial_contents) - 1024,
+            PartialTransfers.find_resume_offset(io.BytesIO(self.contents), partial, len(partial_contents), len(self.contents), 1024)
+        )
+
+    def test_local_partials_leaves_out_locked_ones(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for suffix in ["y29pgW", "AbCdEf"]:
+                with open(os.path.join(temp_dir, ".plot-k32-2021-06-01-00-00-dummyid.plot." + suffix), "wb") as f:
+                    f.write(self.contents)
+            temp_file_lock = PartialTransfers.lock(os.path.join(temp_dir, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW"))
+            try:
+                # a second transfer can't take over the one being written
+                self.assertIsNone(PartialTransfers.lock(os.path.join(temp_dir, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW")))
+                self.assertEqual(
+                    [(".plot-k32-2021-06-01-00-00-dummyid.plot.AbCdEf", len(self.contents))],
+                    PartialTransfers.local_partials(temp_dir, "plot-k32-2021-06-01-00-00-dummyid.plot")
+                )
+            finally:
+                os.close(temp_file_lock)
+            self.assertEqual(2, len(PartialTransfers.local_partials(temp_dir, "plot-k32-2021-06-01-00-00-dummyid.plot")))
+
+    def test_find_resume_offset_starts_over_when_nothing_matches(self):
+        partial = io.BytesIO(os.urandom(6000))
+        self.assertEqual(0, PartialTransfers.find_resume_offset(io.BytesIO(self.contents), partial, 6000, len(self.contents), 1024))
+
+    def test_find_resume_offset_never_past_the_source(self):
+        partial = io.BytesIO(self.contents + b"extra")
+        self.assertEqual(
+            len(self.contents),
+            PartialTransfers.find_resume_offset(io.BytesIO(self.contents), partial, len(self.contents) + 5, len(self.contents), 1024)
+        )
+
+    def test_is_stale(self):
+        self.assertTrue(PartialTransfers.is_stale(1000, 1600, 600))
+        self.assertFalse(PartialTransfers.is_stale(1000, 1599, 600))
+
+    def test_local_partials(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for filename, size in [(".plot-a.plot.y29pgW", 10), (".plot-a.plot.AbCdEf", 20), (".plot-b.plot.y29pgW", 30), ("plot-a.plot", 40)]:
+                with open(os.path.join(temp_dir, filename), "wb") as f:
+                    f.write(b"\0" * size)
+            os.mkdir(os.path.join(temp_dir, ".plot-a.plot.dirdir"))
+
+            self.assertEqual(
+                [(".plot-a.plot.AbCdEf", 20), (".plot-a.plot.y29pgW", 10)],
+                sorted(PartialTransfers.local_partials(temp_dir, "plot-a.plot"))
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
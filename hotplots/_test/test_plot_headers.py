@@ -0,0 +1,57 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from hotplots.plot_headers import PlotHeader, PlotHeaderCache, PlotHeaderError
+
+PLOT_ID = bytes(range(32))
+POOL_PUBLIC_KEY = b"\x01" * 48
+FARMER_PUBLIC_KEY = b"\x02" * 48
+POOL_CONTRACT_PUZZLE_HASH = b"\x03" * 32
+MASTER_SK = b"\x04" * 32
+
+
+def create_v1_header(memo, k=32, plot_id=PLOT_ID):
+    return b"Proof of Space Plot" + plot_id + bytes([k]) + struct.pack(">H", 4) + b"v1.0" + struct.pack(">H", len(memo)) + memo
+
+
+def create_v2_header(memo, k=32):
+    return b"PLOT" + struct.pack("<I", 2) + PLOT_ID + bytes([k]) + struct.pack(">H", len(memo)) + memo
+
+
+class TestPlotHeaders(unittest.TestCase):
+
+    def test_og_plot(self):
+        header = PlotHeader.parse(create_v1_header(POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK, k=33) + b"\x00" * 100)
+        self.assertEqual(PlotHeader(PLOT_ID.hex(), 33, FARMER_PUBLIC_KEY.hex(), pool_public_key=POOL_PUBLIC_KEY.hex()), header)
+        self.assertFalse(header.is_pool_plot())
+
+    def test_pool_plot(self):
+        header = PlotHeader.parse(create_v1_header(POOL_CONTRACT_PUZZLE_HASH + FARMER_PUBLIC_KEY + MASTER_SK))
+        self.assertEqual(PlotHeader(PLOT_ID.hex(), 32, FARMER_PUBLIC_KEY.hex(), pool_contract_puzzle_hash=POOL_CONTRACT_PUZZLE_HASH.hex()), header)
+        self.assertTrue(header.is_pool_plot())
+
+    def test_v2_plot(self):
+        header = PlotHeader.parse(create_v2_header(POOL_CONTRACT_PUZZLE_HASH + FARMER_PUBLIC_KEY + MASTER_SK))
+        self.assertEqual(PLOT_ID.hex(), header.plot_id)
+        self.assertEqual(FARMER_PUBLIC_KEY.hex(), header.farmer_public_key)
+
+    def test_not_a_plot(self):
+        with self.assertRaises(PlotHeaderError):
+            PlotHeader.parse(b"\x00" * 4096)
+        with self.assertRaises(PlotHeaderError):
+            PlotHeader.parse(create_v1_header(POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK)[:100])
+
+    def test_cache_persisted(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "plot-headers.json")
+            header = PlotHeader.parse(create_v1_header(POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK))
+            PlotHeaderCache(path).put_all([header])
+
+            self.assertEqual(header, PlotHeaderCache(path).get(PLOT_ID.hex()))
+            self.assertIsNone(PlotHeaderCache(path).get("otherid"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from hotplots.plot_inventory import PlotInventory
+
+
+class TestPlotInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+        self.plot_inventory = PlotInventory(settle_seconds=60)
+        self.directory_mtime = time.time() - 10
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, filename, size, age_seconds=0):
+        file_path = os.path.join(self.path, filename)
+        with open(file_path, "wb") as f:
+            f.write(b"\0" * size)
+        mtime = time.time() - age_seconds
+        os.utime(file_path, (mtime, mtime))
+
+    def age_directory(self):
+        # an unchanged directory is only trusted once its mtime is safely in the past
+        os.utime(self.path, (self.directory_mtime, self.directory_mtime))
+
+    def test_lists_finished_and_partial_plots(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100)
+        self.write_file(".plot-k32-2021-06-01-00-00-b.plot.y29pgW", 50)
+        self.write_file("notes.txt", 10)
+        self.write_file("plot-weird.plot", 10)
+        os.mkdir(os.path.join(self.path, "plot-k32-2021-06-01-00-00-c.plot"))
+
+        listing = self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        self.assertEqual(["plot-k32-2021-06-01-00-00-a.plot"], list(listing.finished_plots))
+        self.assertEqual(100, listing.finished_plots["plot-k32-2021-06-01-00-00-a.plot"].size)
+        self.assertEqual("a", listing.finished_plots["plot-k32-2021-06-01-00-00-a.plot"].plot_name_metadata.plot_id)
+        self.assertEqual([".plot-k32-2021-06-01-00-00-b.plot.y29pgW"], list(listing.partial_plots))
+
+    def test_finished_plots_are_left_out_for_targets(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100)
+
+        listing = self.plot_inventory.list_plots(self.path, include_finished_plots=False)
+
+        self.assertEqual({}, listing.finished_plots)
+
+    def test_unchanged_directory_is_not_listed_again(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100, age_seconds=3600)
+        self.write_file(".plot-k32-2021-06-01-00-00-b.plot.y29pgW", 50)
+        self.age_directory()
+        self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        # the temporary file grows, which doesn't change the directory
+        self.write_file(".plot-k32-2021-06-01-00-00-b.plot.y29pgW", 80)
+        self.age_directory()
+        with patch('os.scandir', side_effect=AssertionError("directory was listed again")):
+            listing = self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        self.assertEqual(80, listing.partial_plots[".plot-k32-2021-06-01-00-00-b.plot.y29pgW"].size)
+        self.assertEqual(100, listing.finished_plots["plot-k32-2021-06-01-00-00-a.plot"].size)
+
+    def test_recently_written_finished_plots_are_stat_again(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100)
+        self.age_directory()
+        self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        # still being written in place
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 200)
+        self.age_directory()
+        listing = self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        self.assertEqual(200, listing.finished_plots["plot-k32-2021-06-01-00-00-a.plot"].size)
+
+    def test_changed_directory_is_listed_again(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100)
+        self.age_directory()
+        self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        os.remove(os.path.join(self.path, "plot-k32-2021-06-01-00-00-a.plot"))
+        self.write_file("plot-k32-2021-06-01-00-00-b.plot", 100)
+        listing = self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        self.assertEqual(["plot-k32-2021-06-01-00-00-b.plot"], list(listing.finished_plots))
+
+    def test_recently_modified_directory_is_listed_again(self):
+        self.write_file("plot-k32-2021-06-01-00-00-a.plot", 100)
+        self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        with patch('os.scandir', wraps=os.scandir) as mock_scandir:
+            self.plot_inventory.list_plots(self.path, include_finished_plots=True)
+
+        mock_scandir.assert_called_once_with(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import random
+import unittest
+
+from hotplots._test.helpers.test_helpers import TestHelpers
+from hotplots.constants import Constants
+from hotplots.hotplots_config import SourceDriveConfig
+from hotplots.models import SourceDriveInfo, HotPlot
+from hotplots.plot_ranking import HotPlotRankingQueue
+
+
+class TestHotPlotRankingQueue(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.hot_plots = []
+        self.source_drive_infos = []
+        for i in range(5):
+            source_drive_config = SourceDriveConfig("/mnt/source%s" % i, 1)
+            source_plots = [
+                TestHelpers.create_mock_source_plot(source_drive_config, 32, 2021, rng.randint(1, 12), rng.randint(1, 28), 0, 0)
+                for _ in range(20)
+            ]
+            # drives never tie, re-sorting breaks ties between drives by their previous order
+            source_drive_info = SourceDriveInfo(source_drive_config, 10 * Constants.TERABYTE, rng.randint(1, 3) * Constants.TERABYTE + i, source_plots)
+            self.source_drive_infos.append(source_drive_info)
+            self.hot_plots += [HotPlot(source_drive_info, source_plot) for source_plot in source_plots]
+        rng.shuffle(self.hot_plots)
+
+    def assert_same_order_as_resorting(self, drive_key_func, plot_key_func, bytes_in_flight):
+        """
+        Pops every plot, adding to the bytes in flight of its drive each time, and compares against re-sorting the
+        remaining plots before every pop.
+        """
+        def rank_key(hot_plot):
+            return drive_key_func(hot_plot.source_drive_info), plot_key_func(hot_plot)
+
+        queue = HotPlotRankingQueue(self.hot_plots, drive_key_func, plot_key_func)
+        queue_order = []
+        while len(queue) > 0:
+            hot_plot = queue.pop()
+            queue_order.append(hot_plot)
+            bytes_in_flight[hot_plot.source_drive_info.source_drive_config] += Constants.PLOT_BYTES_BY_K[32]
+            queue.update_drive(hot_plot.source_drive_info.source_drive_config)
+
+        for source_drive_config in bytes_in_flight:
+            bytes_in_flight[source_drive_config] = 0
+        remaining = list(self.hot_plots)
+        resort_order = []
+        while remaining:
+            remaining = sorted(remaining, key=rank_key)
+            hot_plot = remaining.pop(0)
+            resort_order.append(hot_plot)
+            bytes_in_flight[hot_plot.source_drive_info.source_drive_config] += Constants.PLOT_BYTES_BY_K[32]
+
+        self.assertEqual(resort_order, queue_order)
+
+    def test_drive_keys_changing_while_popping(self):
+        bytes_in_flight = {source_drive_info.source_drive_config: 0 for source_drive_info in self.source_drive_infos}
+        self.assert_same_order_as_resorting(
+            lambda source_drive_info: source_drive_info.free_bytes + bytes_in_flight[source_drive_info.source_drive_config],
+            lambda hot_plot: 0,
+            bytes_in_flight
+        )
+
+    def test_decreasing_drive_keys(self):
+        bytes_in_flight = {source_drive_info.source_drive_config: 0 for source_drive_info in self.source_drive_infos}
+        self.assert_same_order_as_resorting(
+            lambda source_drive_info: source_drive_info.total_bytes / (source_drive_info.free_bytes + bytes_in_flight[source_drive_info.source_drive_config]),
+            lambda hot_plot: 0,
+            bytes_in_flight
+        )
+
+    def test_plot_keys(self):
+        bytes_in_flight = {source_drive_info.source_drive_config: 0 for source_drive_info in self.source_drive_infos}
+
+        def plot_key_func(hot_plot):
+            m = hot_plot.source_plot.plot_name_metadata()
+            return m.year, m.month, m.day, m.hour, m.minute
+
+        self.assert_same_order_as_resorting(lambda source_drive_info: 0, plot_key_func, bytes_in_flight)
+
+    def test_empty(self):
+        self.assertEqual(0, len(HotPlotRankingQueue([], lambda source_drive_info: 0, lambda hot_plot: 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+
+from hotplots._test.helpers.test_helpers import TestHelpers
+from hotplots._test.test_plot_headers import create_v1_header, POOL_PUBLIC_KEY, FARMER_PUBLIC_KEY, MASTER_SK, \
+    POOL_CONTRACT_PUZZLE_HASH
+from hotplots.constants import Constants
+from hotplots.hotplots_config import SourceDriveConfig, SourceConfig, RemoteTargetsConfig, TargetDriveConfig, \
+    LocalHostConfig, TargetsConfig, PlotReplacementConfig
+from hotplots.hotplots_io import HotplotsIO
+from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, EligiblePairingsResult, PlotReplacementResult, \
+    NoActionResult
+from hotplots.models import SourceInfo, SourceDriveInfo, HotPlot, RemoteTargetsInfo, TargetDriveInfo, TargetsInfo, \
+    LocalTargetsInfo, HotPlotTargetDrive, InFlightTransfer, PlotNameMetadata
+
+
+class TestPlotReplacementPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.target_path = os.path.join(self.temp_dir.name, "target")
+        os.makedirs(self.target_path)
+
+        # plots from before the replacement date, of different sizes
+        self.cold_plot_paths = {}
+        for (size_gb, day) in [(60, 1), (80, 2), (120, 3)]:
+            path = os.path.join(self.target_path, "plot-k32-2021-01-%02d-00-00-%s.plot" % (day, "%064d" % size_gb))
+            with open(path, "w"):
+                pass
+            os.truncate(path, size_gb * Constants.GIGABYTE)
+            self.cold_plot_paths[size_gb] = path
+        self.warm_plot_path = os.path.join(self.target_path, "plot-k32-2021-07-01-00-00-%s.plot" % ("1" * 64))
+        with open(self.warm_plot_path, "w"):
+            pass
+
+        self.source_drive_config = SourceDriveConfig("/mnt/source1", 2)
+        self.source_plot = TestHelpers.create_mock_source_plot(self.source_drive_config, 32, 2022, 1, 1, 0, 0)
+        self.source_drive_info = SourceDriveInfo(self.source_drive_config, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, [self.source_plot])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_pairings_result(self, free_bytes, max_concurrent_inbound_transfers, in_flight_transfers,
+                            plot_replacement_config=PlotReplacementConfig(True, "timestamp-before", "2021-06-01")):
+        target_drive_config = TargetDriveConfig(self.target_path, max_concurrent_inbound_transfers, plot_replacement_config)
+        self.target_drive_info = TargetDriveInfo(target_drive_config, 18 * Constants.TERABYTE, free_bytes, in_flight_transfers)
+        self.local_host_config = LocalHostConfig([target_drive_config])
+        remote_targets_config = RemoteTargetsConfig(1, [])
+        targets_info = TargetsInfo(
+            TargetsConfig("drive_with_most_space_remaining", self.local_host_config, remote_targets_config),
+            LocalTargetsInfo(self.local_host_config, [self.target_drive_info]),
+            RemoteTargetsInfo(remote_targets_config, [])
+        )
+        source_info = SourceInfo(SourceConfig([self.source_drive_config], 60, "plot_with_oldest_timestamp"), [self.source_drive_info])
+
+        pairings_result = HotplotsPairingEngine.get_pairings_result(source_info, targets_info)
+        self.assertIsInstance(pairings_result, PlotReplacementResult)
+        return HotplotsPairingEngine.get_pairings_result_with_replacement(pairings_result, HotplotsIO())
+
+    def create_in_flight_transfer(self, current_file_size):
+        filename = "plot-k32-2021-12-01-00-00-%s.plot" % ("2" * 64)
+        return InFlightTransfer("." + filename + ".abcdef", current_file_size, PlotNameMetadata.parse_from_filename(filename))
+
+    def test_smallest_sufficient_cold_plot(self):
+        result = self.get_pairings_result(50 * Constants.GIGABYTE, 1, [])
+        self.assertEqual(EligiblePairingsResult(
+            [(HotPlot(self.source_drive_info, self.source_plot), HotPlotTargetDrive(self.local_host_config, self.target_drive_info))],
+            {self.source_plot.absolute_reference: [self.cold_plot_paths[60]]}
+        ), result)
+        # deleting is left to the transfer
+        for path in self.cold_plot_paths.values():
+            self.assertTrue(os.path.exists(path))
+
+    def test_counts_staged_bytes(self):
+        # 150 GB free, but most of it is taken by the rest of a transfer already running to the drive
+        in_flight_transfer = self.create_in_flight_transfer(8 * Constants.GIGABYTE)
+        result = self.get_pairings_result(150 * Constants.GIGABYTE, 2, [in_flight_transfer])
+        self.assertEqual({self.source_plot.absolute_reference: [self.cold_plot_paths[80]]}, result.cold_plots_to_replace)
+
+    def test_several_cold_plots(self):
+        result = self.get_pairings_result(0, 1, [])
+        self.assertEqual({self.source_plot.absolute_reference: [self.cold_plot_paths[120]]}, result.cold_plots_to_replace)
+
+        os.remove(self.cold_plot_paths[120])
+        result = self.get_pairings_result(0, 1, [])
+        self.assertEqual({self.source_plot.absolute_reference: [self.cold_plot_paths[80], self.cold_plot_paths[60]]}, result.cold_plots_to_replace)
+
+    def test_transfer_slots_left(self):
+        second_source_plot = TestHelpers.create_mock_source_plot(self.source_drive_config, 32, 2022, 1, 2, 0, 0)
+        self.source_drive_info = SourceDriveInfo(self.source_drive_config, 10 * Constants.TERABYTE, 1 * Constants.TERABYTE, [self.source_plot, second_source_plot])
+
+        # there's room to replace plots for both, but the running transfer leaves one slot on the drive
+        in_flight_transfer = self.create_in_flight_transfer(100 * Constants.GIGABYTE)
+        result = self.get_pairings_result(0, 2, [in_flight_transfer])
+        self.assertEqual([HotPlot(self.source_drive_info, self.source_plot)], [hot_plot for (hot_plot, _) in result.pairings])
+
+    def test_pool_key(self):
+        # the 60 and 120 GB plots are OG plots for the pool key, the 80 GB one is a pool plot
+        for (size_gb, memo) in [
+            (60, POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK),
+            (80, POOL_CONTRACT_PUZZLE_HASH + FARMER_PUBLIC_KEY + MASTER_SK),
+            (120, POOL_PUBLIC_KEY + FARMER_PUBLIC_KEY + MASTER_SK),
+        ]:
+            with open(self.cold_plot_paths[size_gb], "r+b") as f:
+                f.write(create_v1_header(memo, plot_id=bytes.fromhex("%064d" % size_gb)))
+
+        result = self.get_pairings_result(0, 1, [], PlotReplacementConfig(True, "pool-key", "0x" + POOL_PUBLIC_KEY.hex()))
+        self.assertEqual({self.source_plot.absolute_reference: [self.cold_plot_paths[120]]}, result.cold_plots_to_replace)
+
+        os.remove(self.cold_plot_paths[120])
+        result = self.get_pairings_result(0, 1, [], PlotReplacementConfig(True, "pool-key", POOL_PUBLIC_KEY.hex()))
+        self.assertIsInstance(result, NoActionResult)
+
+    def test_k_size(self):
+        k33_plot_path = os.path.join(self.target_path, "plot-k33-2022-01-01-00-00-%s.plot" % ("3" * 64))
+        with open(k33_plot_path, "w"):
+            pass
+        os.truncate(k33_plot_path, 210 * Constants.GIGABYTE)
+
+        result = self.get_pairings_result(0, 1, [], PlotReplacementConfig(True, "k-size", "33"))
+        self.assertEqual({self.source_plot.absolute_reference: [k33_plot_path]}, result.cold_plots_to_replace)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from hotplots.hotplots_config import RemoteHostConfig, TargetDriveConfig, ReceiverConfig
+from hotplots.hotplots_io import HotplotsIO
+from hotplots.receiver import HotplotsReceiver, ReceiverClient, ReceiverError, main
+from hotplots.remote_commands import RemoteCommands, RemoteCommandError
+
+
+class TestReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.drive = os.path.join(self.temp_dir.name, "drive")
+        os.makedirs(self.drive)
+        # a stand-in for the harvester, on localhost
+        self.lease_dir = os.path.join(self.temp_dir.name, "leases")
+        self.receiver = HotplotsReceiver("127.0.0.1", 0, [self.drive], token="secret", lease_dir=self.lease_dir, request_timeout_seconds=1)
+        self.receiver_thread = threading.Thread(target=self.receiver.serve_forever)
+        self.receiver_thread.start()
+        self.remote_host_config = self.create_remote_host_config("secret")
+        self.receiver_client = ReceiverClient(ssh_connection_pool=None)
+
+    def tearDown(self):
+        self.receiver.shutdown()
+        self.receiver_thread.join()
+        self.receiver.server_close()
+        self.temp_dir.cleanup()
+
+    def create_remote_host_config(self, token, port=None, timeout_seconds=900):
+        receiver_config = ReceiverConfig(port=port or self.receiver.server_address[1], connection="direct", token=token,
+                                         timeout_seconds=timeout_seconds)
+        target_drive_config = TargetDriveConfig(path=self.drive, max_concurrent_inbound_transfers=1)
+        return RemoteHostConfig(hostname="127.0.0.1", port=22, username="user", drives=[target_drive_config],
+                                max_concurrent_inbound_transfers=1, receiver=receiver_config)
+
+    def create_source(self, size):
+        source_path = os.path.join(self.temp_dir.name, "plot-k32-2022-01-01-00-00-dummyid.plot")
+        contents = os.urandom(size)
+        with open(source_path, "wb") as f:
+            f.write(contents)
+        return source_path, contents
+
+    def test_run_python(self):
+        open(os.path.join(self.drive, ".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW"), "wb").close()
+
+        result = self.receiver_client.run_python(self.remote_host_config, RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [self.drive])
+
+        self.assertEqual(".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW", result["drives"][self.drive]["in_flight"][0][0])
+
+    def test_remote_commands_go_through_the_receiver(self):
+        hotplots_io = HotplotsIO()
+        result = hotplots_io.run_remote_python(self.remote_host_config, RemoteCommands.LIST_PLOTS_SCRIPT, [self.drive])
+        self.assertEqual({"plots": []}, result["dirs"][self.drive])
+
+    def test_invalid_token(self):
+        with self.assertRaises(RemoteCommandError):
+            self.receiver_client.run_python(self.create_remote_host_config("wrong"), RemoteCommands.LIST_PLOTS_SCRIPT, [self.drive])
+
+    @patch("hotplots.receiver.WRITE_BUFFER_BYTES", 8192)
+    def test_upload(self):
+        source_path, contents = self.create_source(50000)
+        remote_path = os.path.join(self.drive, ".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW")
+
+        size = self.receiver_client.upload(self.remote_host_config, source_path, remote_path)
+
+        self.assertEqual(50000, size)
+        with open(remote_path, "rb") as f:
+            self.assertEqual(contents, f.read())
+
+    @patch("hotplots.receiver.WRITE_BUFFER_BYTES", 8192)
+    def test_upload_resumes(self):
+        source_path, contents = self.create_source(50000)
+        remote_path = os.path.join(self.drive, ".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW")
+        # an unaligned partial, the rest is written from there
+        with open(remote_path, "wb") as f:
+            f.write(contents[:5000])
+
+        size = self.receiver_client.upload(self.remote_host_config, source_path, remote_path, 5000)
+
+        self.assertEqual(50000, size)
+        with open(remote_path, "rb") as f:
+            self.assertEqual(contents, f.read())
+
+    def test_upload_outside_the_drives(self):
+        source_path, _ = self.create_source(100)
+        with self.assertRaises((ReceiverError, OSError)):
+            self.receiver_client.upload(self.remote_host_config, source_path, os.path.join(self.temp_dir.name, "elsewhere.plot"))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, "elsewhere.plot")))
+
+    def test_upload_through_a_symlink(self):
+        source_path, _ = self.create_source(100)
+        elsewhere_path = os.path.join(self.temp_dir.name, "elsewhere")
+        with open(elsewhere_path, "wb") as f:
+            f.write(b"untouched")
+        remote_path = os.path.join(self.drive, ".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW")
+        os.symlink(elsewhere_path, remote_path)
+
+        with self.assertRaises((ReceiverError, OSError)):
+            self.receiver_client.upload(self.remote_host_config, source_path, remote_path)
+
+        with open(elsewhere_path, "rb") as f:
+            self.assertEqual(b"untouched", f.read())
+
+    def test_run_python_outside_the_drives(self):
+        elsewhere_path = os.path.join(self.temp_dir.name, "elsewhere")
+        open(elsewhere_path, "wb").close()
+
+        for (script, args) in [
+            (RemoteCommands.HASH_FILE_SCRIPT, [elsewhere_path, None]),
+            (RemoteCommands.LIST_PLOTS_SCRIPT, [[self.drive, self.temp_dir.name]]),
+            (RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [[self.drive], {"dir": self.temp_dir.name, "ttl": 300}]),
+            (RemoteCommands.LEASE_SCRIPT, [{"action": "release", "dir": self.temp_dir.name, "owner": "plotter", "leases": [elsewhere_path]}]),
+            (RemoteCommands.LEASE_SCRIPT, [{"action": "release", "dir": self.lease_dir, "owner": "plotter", "leases": [elsewhere_path]}]),
+            (RemoteCommands.LEASE_SCRIPT, [{"action": "acquire", "dir": self.lease_dir, "ttl": 300, "owner": "plotter",
+                                            "plot": "plot-k32-2022-01-01-00-00-dummyid.plot", "groups": [["../escaped", 1]]}]),
+        ]:
+            with self.subTest(script=script[:40], args=args):
+                with self.assertRaises(RemoteCommandError):
+                    self.receiver_client.run_python(self.remote_host_config, script, *args)
+        self.assertTrue(os.path.exists(elsewhere_path))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, "escaped.0.lease")))
+
+    def test_lease_in_the_lease_dir(self):
+        result = self.receiver_client.run_python(self.remote_host_config, RemoteCommands.LEASE_SCRIPT, {
+            "action": "acquire", "dir": self.lease_dir, "ttl": 300, "owner": "plotter",
+            "plot": "plot-k32-2022-01-01-00-00-dummyid.plot", "groups": [["host", 1]]
+        })
+
+        self.assertEqual([os.path.join(self.lease_dir, "host.0.lease")], result["leases"])
+
+    def test_token_needed(self):
+        # on localhost too, any local user could connect
+        with self.assertRaises(ValueError):
+            HotplotsReceiver("127.0.0.1", 0, [self.drive])
+        with patch.dict(os.environ, {"HOTPLOTS_RECEIVER_TOKEN": ""}), patch("sys.stderr"), self.assertRaises(SystemExit):
+            main(["--drive", self.drive, "--port", "0"])
+        HotplotsReceiver("127.0.0.1", 0, [self.drive], insecure_no_token=True).server_close()
+
+    def test_silent_client_is_disconnected(self):
+        with socket.create_connection(self.receiver.server_address, timeout=5) as silent_client:
+            # the receiver gives up on the request after its timeout, answers and closes the connection
+            response = silent_client.makefile("rb").read()
+        self.assertIn(b"error", response)
+
+    def test_invalid_arguments(self):
+        for (script, args) in [
+            (RemoteCommands.LIST_PLOTS_SCRIPT, []),
+            (RemoteCommands.LIST_PLOTS_SCRIPT, [self.drive]),
+            (RemoteCommands.HASH_FILE_SCRIPT, [[self.drive], None]),
+            (RemoteCommands.LEASE_SCRIPT, [{"action": "acquire", "dir": self.lease_dir, "groups": "host"}]),
+        ]:
+            with self.subTest(script=script[:40], args=args):
+                with self.assertRaises(RemoteCommandError):
+                    self.receiver_client.run_python(self.remote_host_config, script, *args)
+
+    @patch("hotplots.receiver.WRITE_BUFFER_BYTES", 8192)
+    def test_upload_from_the_start_replaces_a_longer_file(self):
+        source_path, contents = self.create_source(5000)
+        remote_path = os.path.join(self.drive, ".plot-k32-2022-01-01-00-00-dummyid.plot.y29pgW")
+        with open(remote_path, "wb") as f:
+            f.write(os.urandom(50000))
+
+        size = self.receiver_client.upload(self.remote_host_config, source_path, remote_path)
+
+        self.assertEqual(5000, size)
+        with open(remote_path, "rb") as f:
+            self.assertEqual(contents, f.read())
+
+    def test_hung_receiver_times_out(self):
+        # accepts connections (into its backlog) but never answers
+        with socket.socket() as hung_receiver:
+            hung_receiver.bind(("127.0.0.1", 0))
+            hung_receiver.listen()
+            remote_host_config = self.create_remote_host_config("secret", hung_receiver.getsockname()[1], timeout_seconds=1)
+
+            with self.assertRaises(RemoteCommandError):
+                self.receiver_client.run_python(remote_host_config, RemoteCommands.LIST_PLOTS_SCRIPT, [self.drive])
+
+
+if __name__ == '__main__':
+    unittest.main()
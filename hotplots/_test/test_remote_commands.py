@@ -0,0 +1,151 @@
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import paramiko
+
+from hotplots.remote_commands import RemoteCommands, RemoteCommandError, RemoteCommandUnavailableError
+from hotplots.transfer_verification import TransferVerification
+
+
+class TestRemoteCommands(unittest.TestCase):
+
+    def run_locally(self, script, *args):
+        # runs the exact command line that would be sent over ssh, in a local shell
+        command = RemoteCommands.build_python_command(script, *args).replace("python3", shlex.quote(sys.executable), 1)
+        completed = subprocess.run(command, shell=True, capture_output=True)
+
+        stdout = MagicMock()
+        stdout.read.return_value = completed.stdout
+        stdout.channel.recv_exit_status.return_value = completed.returncode
+        stderr = MagicMock()
+        stderr.read.return_value = completed.stderr
+        client = MagicMock()
+        client.exec_command.return_value = (MagicMock(), stdout, stderr)
+        return RemoteCommands.run_python(client, script, *args)
+
+    def test_probe_target_drives(self):
+        with tempfile.TemporaryDirectory() as drive:
+            with open(os.path.join(drive, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW"), "wb") as f:
+                f.write(b"x" * 10)
+            open(os.path.join(drive, "plot-k32-2021-05-01-00-00-otherid.plot"), "wb").close()
+            os.mkdir(os.path.join(drive, ".plot-directory"))
+
+            result = self.run_locally(RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [drive, "/does/not/exist"])
+
+        probed_drive = result["drives"][drive]
+        self.assertEqual(1, len(probed_drive["in_flight"]))
+        self.assertEqual([".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW", 10], probed_drive["in_flight"][0][:2])
+        self.assertLessEqual(probed_drive["in_flight"][0][2], result["time"])
+        self.assertGreater(probed_drive["f_blocks"], 0)
+        self.assertIn("error", result["drives"]["/does/not/exist"])
+
+    def test_probe_target_drives_with_an_unreadable_lease_dir(self):
+        with tempfile.TemporaryDirectory() as drive:
+            # a file where the lease directory should be
+            lease_dir = os.path.join(drive, "leases")
+            open(lease_dir, "wb").close()
+
+            result = self.run_locally(RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [drive], {"dir": lease_dir, "ttl": 300})
+
+        self.assertEqual([], result["leases"])
+        self.assertGreater(result["drives"][drive]["f_blocks"], 0)
+
+    def test_list_plots(self):
+        with tempfile.TemporaryDirectory() as drive:
+            with open(os.path.join(drive, "plot-k32-2021-05-01-00-00-otherid.plot"), "wb") as f:
+                f.write(b"x" * 10)
+            open(os.path.join(drive, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW"), "wb").close()
+            open(os.path.join(drive, "notes.txt"), "wb").close()
+            os.mkdir(os.path.join(drive, "directory.plot"))
+
+            result = self.run_locally(RemoteCommands.LIST_PLOTS_SCRIPT, [drive, "/does/not/exist"])
+
+        self.assertEqual([["plot-k32-2021-05-01-00-00-otherid.plot", 10]], result["dirs"][drive]["plots"])
+        self.assertIn("error", result["dirs"]["/does/not/exist"])
+
+    def test_hash_file(self):
+        contents = os.urandom(10000)
+        with tempfile.TemporaryDirectory() as drive:
+            path = os.path.join(drive, "plot-k32-2021-05-01-00-00-otherid.plot")
+            with open(path, "wb") as f:
+                f.write(contents)
+
+            blocks = [[0, 100], [9000, 1000]]
+            self.assertEqual(TransferVerification.hash_local_file(path, blocks), self.run_locally(RemoteCommands.HASH_FILE_SCRIPT, path, blocks)["hashes"])
+            self.assertEqual(TransferVerification.hash_local_file(path, None), self.run_locally(RemoteCommands.HASH_FILE_SCRIPT, path, None)["hashes"])
+
+    def test_leases(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            lease_dir = os.path.join(temp_dir, "leases")
+
+            def acquire(owner, plot):
+                request = {"action": "acquire", "dir": lease_dir, "ttl": 60, "owner": owner, "plot": plot, "groups": [["host", 2], ["drive-a", 1]]}
+                return self.run_locally(RemoteCommands.LEASE_SCRIPT, request)["leases"]
+
+            def renew(owner, leases):
+                return self.run_locally(RemoteCommands.LEASE_SCRIPT, {"action": "renew", "dir": lease_dir, "owner": owner, "leases": leases})["lost"]
+
+            leases = acquire("plotter1", "plot-1.plot")
+            self.assertEqual([os.path.join(lease_dir, "host.0.lease"), os.path.join(lease_dir, "drive-a.0.lease")], leases)
+            # the drive's only slot is taken, and the host slot taken on the way is given back
+            self.assertIsNone(acquire("plotter2", "plot-2.plot"))
+            self.assertEqual(["drive-a.0.lease", "host.0.lease"], sorted(os.listdir(lease_dir)))
+
+            probed = self.run_locally(RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [], {"dir": lease_dir, "ttl": 60})
+            self.assertEqual([["drive-a.0.lease", "plotter1", "plot-1.plot"], ["host.0.lease", "plotter1", "plot-1.plot"]], sorted(probed["leases"]))
+            self.assertEqual([], renew("plotter1", leases))
+            self.assertEqual(leases, renew("plotter2", leases))
+
+            # plotter1 stopped renewing, its leases expire and can be taken over
+            for path in leases:
+                os.utime(path, (0, 0))
+            self.assertEqual([], self.run_locally(RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, [], {"dir": lease_dir, "ttl": 60})["leases"])
+            self.assertEqual(leases, acquire("plotter2", "plot-2.plot"))
+            self.assertEqual(leases, renew("plotter1", leases))
+
+            # only the owner releases its leases
+            self.run_locally(RemoteCommands.LEASE_SCRIPT, {"action": "release", "dir": lease_dir, "owner": "plotter1", "leases": leases})
+            self.assertEqual(2, len(os.listdir(lease_dir)))
+            self.run_locally(RemoteCommands.LEASE_SCRIPT, {"action": "release", "dir": lease_dir, "owner": "plotter2", "leases": leases})
+            self.assertEqual([], os.listdir(lease_dir))
+
+    def test_failed_command_raises(self):
+        client = MagicMock()
+        stdout = MagicMock()
+        stdout.channel.recv_exit_status.return_value = 127
+        stderr = MagicMock()
+        stderr.read.return_value = b"python3: command not found"
+        client.exec_command.return_value = (MagicMock(), stdout, stderr)
+
+        with self.assertRaises(RemoteCommandUnavailableError):
+            RemoteCommands.run_python(client, RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, ["/mnt/target1"])
+
+    def test_failed_script_is_not_unavailable(self):
+        client = MagicMock()
+        stdout = MagicMock()
+        stdout.channel.recv_exit_status.return_value = 1
+        stderr = MagicMock()
+        stderr.read.return_value = b"PermissionError: [Errno 13] Permission denied: '/mnt/target1'"
+        client.exec_command.return_value = (MagicMock(), stdout, stderr)
+
+        with self.assertRaises(RemoteCommandError) as raised:
+            RemoteCommands.run_python(client, RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, ["/mnt/target1"], timeout=30)
+        self.assertNotIsInstance(raised.exception, RemoteCommandUnavailableError)
+        self.assertEqual(30, client.exec_command.call_args[1]["timeout"])
+
+    def test_connection_error_is_not_unavailable(self):
+        client = MagicMock()
+        client.exec_command.side_effect = paramiko.SSHException("SSH session not active")
+
+        with self.assertRaises(RemoteCommandError) as raised:
+            RemoteCommands.run_python(client, RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT, ["/mnt/target1"])
+        self.assertNotIsInstance(raised.exception, RemoteCommandUnavailableError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from hotplots.hotplots_config import RemoteHostConfig, TargetDriveConfig, RemoteTransferConfig
+from hotplots.remote_transfer import RemoteTransferBackend, SftpTransferBackend, StreamTransferBackend, RsyncTransferBackend
+
+
+class LocalSFTPFile:
+    def __init__(self, path, mode):
+        self.file = open(path, mode)
+        self.pipelined = False
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+
+class LocalSFTPClient:
+    """
+    Stands in for paramiko's SFTPClient, backed by the local filesystem.
+    """
+    def __init__(self):
+        self.opened_files = []
+
+    def open(self, path, mode):
+        sftp_file = LocalSFTPFile(path, mode)
+        self.opened_files.append(sftp_file)
+        return sftp_file
+
+    def stat(self, path):
+        return os.stat(path)
+
+
+class TestRemoteTransferBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, "plot-k32-2021-06-01-00-00-dummyid.plot")
+        self.remote_path = os.path.join(self.temp_dir.name, ".plot-k32-2021-06-01-00-00-dummyid.plot.y29pgW")
+        self.contents = os.urandom(3 * 1024 + 5)
+        with open(self.source_path, "wb") as f:
+            f.write(self.contents)
+
+        target_drive_config = TargetDriveConfig(path=self.temp_dir.name, max_concurrent_inbound_transfers=1)
+        self.remote_host_config = RemoteHostConfig(
+            hostname='remote-host', port=2222, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1,
+            transfer=RemoteTransferConfig(chunk_size_bytes=1024, cipher="aes128-gcm@openssh.com")
+        )
+        self.sftp = LocalSFTPClient()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_sftp_backend_pipelines_writes(self):
+        SftpTransferBackend().upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path)
+
+        with open(self.remote_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+        self.assertTrue(self.sftp.opened_files[0].pipelined)
+
+    def test_sftp_backend_resumes_from_offset(self):
+        with open(self.remote_path, "wb") as f:
+            f.write(self.contents[:1000])
+
+        SftpTransferBackend().upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path, 1000)
+
+        with open(self.remote_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+
+    def test_stream_backend(self):
+        remote_file = open(self.remote_path, "wb")
+        channel = MagicMock()
+        channel.sendall.side_effect = remote_file.write
+        channel.shutdown_write.side_effect = lambda: remote_file.close()
+        channel.recv_exit_status.return_value = 0
+        ssh_connection_pool = MagicMock()
+        ssh_connection_pool.get_client.return_value.get_transport.return_value.open_session.return_value = channel
+
+        StreamTransferBackend(ssh_connection_pool).upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path)
+
+        with open(self.remote_path, "rb") as f:
+            self.assertEqual(self.contents, f.read())
+        channel.exec_command.assert_called_once_with("cat > %s" % self.remote_path)
+        channel.close.assert_called_once()
+
+    def test_stream_backend_remote_failure(self):
+        channel = MagicMock()
+        channel.recv_exit_status.return_value = 1
+        channel.recv_stderr.return_value = b"No space left on device"
+        ssh_connection_pool = MagicMock()
+        ssh_connection_pool.get_client.return_value.get_transport.return_value.open_session.return_value = channel
+
+        with self.assertRaises(IOError):
+            StreamTransferBackend(ssh_connection_pool).upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path)
+        channel.close.assert_called_once()
+
+    @patch('subprocess.Popen')
+    def test_rsync_backend(self, mock_popen):
+        def fake_rsync(command, stdout, stderr):
+            with open(self.remote_path, "wb") as f:
+                f.write(self.contents)
+            return MagicMock(**{"wait.return_value": 0, "poll.return_value": 0})
+        mock_popen.side_effect = fake_rsync
+
+        RsyncTransferBackend().upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path)
+
+        command = mock_popen.call_args[0][0]
+        self.assertEqual("rsync", command[0])
+        self.assertIn("--inplace", command)
+        self.assertEqual("ssh -p 2222 -o BatchMode=yes -c aes128-gcm@openssh.com", command[command.index("-e") + 1])
+        self.assertEqual([self.source_path, "user@remote-host:%s" % self.remote_path], command[-2:])
+
+    @patch('subprocess.Popen')
+    def test_rsync_backend_stops_when_progress_raises(self, mock_popen):
+        process = mock_popen.return_value
+        process.wait.side_effect = [subprocess.TimeoutExpired("rsync", 1), -9]
+        process.poll.return_value = None
+        progress = MagicMock(side_effect=InterruptedError("shutting down"))
+
+        with self.assertRaises(InterruptedError):
+            RsyncTransferBackend().upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path, progress=progress)
+
+        progress.assert_called_once_with(0)
+        process.kill.assert_called_once()
+
+    @patch('subprocess.Popen', return_value=MagicMock(**{"wait.return_value": 0, "poll.return_value": 0}))
+    def test_short_upload_is_detected(self, mock_popen):
+        with open(self.remote_path, "wb") as f:
+            f.write(self.contents[:10])
+
+        with self.assertRaises(IOError):
+            RsyncTransferBackend().upload(self.remote_host_config, self.sftp, self.source_path, self.remote_path)
+
+    def test_backend_without_upload_cant_be_created(self):
+        class IncompleteTransferBackend(RemoteTransferBackend):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteTransferBackend()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from hotplots.cycle_trigger import CycleTrigger
+from hotplots.hotplots_config import SourceConfig, SourceDriveConfig
+from hotplots.source_watcher import SourceWatcher
+
+
+class TestCycleTrigger(unittest.TestCase):
+
+    def test_timeout(self):
+        self.assertIsNone(CycleTrigger().wait(0.01))
+
+    def test_first_reason_wins_until_waited_for(self):
+        cycle_trigger = CycleTrigger()
+        cycle_trigger.trigger("a transfer finished")
+        cycle_trigger.trigger("new plot")
+
+        self.assertEqual("a transfer finished", cycle_trigger.wait(1))
+        self.assertIsNone(cycle_trigger.wait(0.01))
+
+    def test_trigger_from_another_thread(self):
+        cycle_trigger = CycleTrigger()
+        threading.Timer(0.05, lambda: cycle_trigger.trigger("new plot")).start()
+
+        self.assertEqual("new plot", cycle_trigger.wait(5))
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestSourceWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.temp_dir.name, "source")
+        os.makedirs(self.source_dir)
+        self.cycle_trigger = CycleTrigger()
+        source_config = SourceConfig([SourceDriveConfig(self.source_dir)], watch_debounce_seconds=0.1)
+        self.source_watcher = SourceWatcher(source_config, self.cycle_trigger)
+        self.assertTrue(self.source_watcher.start())
+
+    def tearDown(self):
+        self.source_watcher.close()
+        self.temp_dir.cleanup()
+
+    def write_file(self, path):
+        with open(path, "wb") as f:
+            f.write(b"\0" * 100)
+
+    def test_plot_renamed_into_place(self):
+        temp_path = os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-dummyid.plot.2.tmp")
+        self.write_file(temp_path)
+        os.rename(temp_path, os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-dummyid.plot"))
+
+        self.assertEqual(
+            "new plot %s" % os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-dummyid.plot"),
+            self.cycle_trigger.wait(5)
+        )
+
+    def test_plot_written_in_place(self):
+        self.write_file(os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-dummyid.plot"))
+
+        self.assertIsNotNone(self.cycle_trigger.wait(5))
+
+    def test_burst_triggers_once(self):
+        for plot_id in ["a", "b", "c"]:
+            self.write_file(os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-%s.plot" % plot_id))
+
+        self.assertIsNotNone(self.cycle_trigger.wait(5))
+        self.assertIsNone(self.cycle_trigger.wait(0.3))
+
+    def test_other_files_are_ignored(self):
+        self.write_file(os.path.join(self.source_dir, "plot-k32-2021-06-01-00-00-dummyid.plot.2.tmp"))
+
+        self.assertIsNone(self.cycle_trigger.wait(0.3))
+
+    def test_missing_source_drive_is_only_polled(self):
+        source_config = SourceConfig([SourceDriveConfig(os.path.join(self.temp_dir.name, "missing"))])
+        self.assertFalse(SourceWatcher(source_config, CycleTrigger()).start())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+
+from hotplots.hotplots_config import SSHConnectionConfig, RemoteHostConfig, TargetDriveConfig, RemoteTransferConfig
+from hotplots.ssh_connection_pool import SSHConnectionPool, SSHConnectionUnavailableError
+
+
+class TestSSHConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        target_drive_config = TargetDriveConfig(path='/remote/target', max_concurrent_inbound_transfers=1)
+        self.remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[target_drive_config], max_concurrent_inbound_transfers=1)
+
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_connection_is_reused(self, mock_gethostbyname, mock_ssh_client):
+        pool = SSHConnectionPool(SSHConnectionConfig())
+
+        with pool.sftp(self.remote_host_config):
+            pass
+        with pool.sftp(self.remote_host_config):
+            pass
+
+        mock_ssh_client.return_value.connect.assert_called_once()
+        mock_gethostbyname.assert_called_once_with('remote-host')
+        mock_ssh_client.return_value.get_transport.return_value.set_keepalive.assert_called_once_with(30)
+        self.assertEqual(2, mock_ssh_client.return_value.open_sftp.return_value.close.call_count)
+
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_reconnects_when_transport_is_dead(self, mock_gethostbyname, mock_ssh_client):
+        pool = SSHConnectionPool(SSHConnectionConfig())
+        pool.get_client(self.remote_host_config)
+
+        mock_ssh_client.return_value.get_transport.return_value.is_active.return_value = False
+        pool.get_client(self.remote_host_config)
+
+        self.assertEqual(2, mock_ssh_client.return_value.connect.call_count)
+        mock_ssh_client.return_value.close.assert_called_once()
+
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_cipher_disables_the_others(self, mock_gethostbyname, mock_ssh_client):
+        remote_host_config = RemoteHostConfig(hostname='remote-host', port=22, username='user', drives=[], max_concurrent_inbound_transfers=1,
+                                              transfer=RemoteTransferConfig(cipher="aes128-gcm@openssh.com"))
+        SSHConnectionPool(SSHConnectionConfig()).get_client(remote_host_config)
+
+        disabled_ciphers = mock_ssh_client.return_value.connect.call_args.kwargs["disabled_algorithms"]["ciphers"]
+        self.assertIn("aes256-ctr", disabled_ciphers)
+        self.assertNotIn("aes128-gcm@openssh.com", disabled_ciphers)
+        self.assertEqual(set(SSHConnectionPool.get_supported_ciphers()) - {"aes128-gcm@openssh.com"}, set(disabled_ciphers))
+
+    @patch('time.monotonic')
+    @patch('paramiko.SSHClient')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_backoff_after_failed_connect(self, mock_gethostbyname, mock_ssh_client, mock_monotonic):
+        mock_monotonic.return_value = 1000.0
+        mock_ssh_client.return_value.connect.side_effect = OSError("No route to host")
+        pool = SSHConnectionPool(SSHConnectionConfig(reconnect_backoff_seconds=5))
+
+        with self.assertRaises(OSError):
+            pool.get_client(self.remote_host_config)
+
+        # still within the backoff window, no new connection attempt is made
+        mock_monotonic.return_value = 1004.0
+        with self.assertRaises(SSHConnectionUnavailableError):
+            pool.get_client(self.remote_host_config)
+        self.assertEqual(1, mock_ssh_client.return_value.connect.call_count)
+
+        # the window doubles on the second consecutive failure
+        mock_monotonic.return_value = 1006.0
+        with self.assertRaises(OSError):
+            pool.get_client(self.remote_host_config)
+        mock_monotonic.return_value = 1015.0
+        with self.assertRaises(SSHConnectionUnavailableError):
+            pool.get_client(self.remote_host_config)
+
+        mock_ssh_client.return_value.connect.side_effect = None
+        mock_monotonic.return_value = 1017.0
+        pool.get_client(self.remote_host_config)
+        self.assertEqual(3, mock_ssh_client.return_value.connect.call_count)
+
+    @patch('time.monotonic')
+    @patch('socket.gethostbyname', return_value='1.2.3.4')
+    def test_dns_cache_ttl(self, mock_gethostbyname, mock_monotonic):
+        pool = SSHConnectionPool(SSHConnectionConfig(dns_cache_ttl_seconds=60))
+
+        mock_monotonic.return_value = 0.0
+        self.assertEqual('1.2.3.4', pool.resolve('remote-host'))
+        mock_monotonic.return_value = 59.0
+        self.assertEqual('1.2.3.4', pool.resolve('remote-host'))
+        mock_gethostbyname.assert_called_once()
+
+        mock_monotonic.return_value = 61.0
+        pool.resolve('remote-host')
+        self.assertEqual(2, mock_gethostbyname.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import random
+import tempfile
+import unittest
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import TargetDriveConfig, LocalHostConfig, RemoteHostConfig
+from hotplots.models import HotPlotTargetDrive, TargetDriveInfo, TargetHostId, TargetDriveId
+from hotplots.target_drive_index import TargetDriveIndex
+from hotplots.throughput_history import ThroughputHistory
+
+STRATEGIES = [
+    "config_order",
+    "drive_with_least_space_remaining",
+    "drive_with_most_space_remaining",
+    "drive_with_lowest_percent_space_remaining",
+    "drive_with_highest_percent_space_remaining",
+    "fastest_expected_completion",
+]
+
+
+class TestTargetDriveIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.hot_plot_target_drives = []
+
+        local_drive_configs = [TargetDriveConfig("/mnt/local%s" % i, rng.randint(1, 3)) for i in range(6)]
+        local_host_config = LocalHostConfig(local_drive_configs)
+        remote_host_configs = [
+            RemoteHostConfig("remote%s" % h, "user", 22, rng.randint(2, 6), [TargetDriveConfig("/mnt/remote%s" % i, rng.randint(1, 3)) for i in range(6)])
+            for h in range(3)
+        ]
+        for host_config in [local_host_config] + remote_host_configs:
+            for target_drive_config in host_config.drives:
+                # drives never tie, so the order between them doesn't depend on tie breaking
+                free_bytes = rng.randint(0, 40) * Constants.PLOT_BYTES_BY_K[32] + len(self.hot_plot_target_drives)
+                self.hot_plot_target_drives.append(HotPlotTargetDrive(
+                    host_config, TargetDriveInfo(target_drive_config, 20 * Constants.TERABYTE, free_bytes, [])
+                ))
+
+    def create_index(self, strategy, target_host_preference):
+        index = TargetDriveIndex(strategy, target_host_preference)
+        for position, hot_plot_target_drive in enumerate(self.hot_plot_target_drives):
+            index.add_target_drive(hot_plot_target_drive, position)
+        return index
+
+    @staticmethod
+    def find_best_by_scanning(index, needed_bytes):
+        eligible = [d for d in index.get_all() if not index.is_capped(d) and d.get_available_bytes() >= needed_bytes]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda d: (index.get_partition(d),) + index.get_rank_key(d))
+
+    def test_same_drive_as_scanning(self):
+        for strategy in STRATEGIES:
+            for target_host_preference in ["local", "remote", "unspecified"]:
+                with self.subTest(strategy=strategy, target_host_preference=target_host_preference):
+                    rng = random.Random(1)
+                    index = self.create_index(strategy, target_host_preference)
+                    while True:
+                        needed_bytes = Constants.PLOT_BYTES_BY_K[rng.choice([32, 32, 33])]
+                        expected = self.find_best_by_scanning(index, needed_bytes)
+                        self.assertIs(expected, index.find_best(needed_bytes))
+                        if expected is None:
+                            break
+                        index.add_transfer(expected.target_drive_id, expected.target_host_id, needed_bytes)
+
+    def test_capped_drives(self):
+        index = self.create_index("config_order", "unspecified")
+        self.assertFalse(index.has_capped_target_drives())
+
+        first = index.get_all()[0]
+        for _ in range(first.hot_plot_target_drive.target_drive_info.target_drive_config.max_concurrent_inbound_transfers):
+            self.assertIs(first, index.find_best(0))
+            index.add_transfer(first.target_drive_id, first.target_host_id, 0)
+
+        self.assertTrue(index.has_capped_target_drives())
+        self.assertTrue(index.is_capped(first))
+        self.assertFalse(index.is_eligible(first, 0))
+        self.assertIs(index.get_all()[1], index.find_best(0))
+
+    def test_exact_bytes_in_flight(self):
+        index = self.create_index("config_order", "unspecified")
+        first = index.get_all()[0]
+        free_bytes = first.hot_plot_target_drive.target_drive_info.free_bytes
+
+        index.add_transfer(first.target_drive_id, first.target_host_id, Constants.PLOT_BYTES_BY_K[32])
+        index.add_transfer(first.target_drive_id, first.target_host_id, Constants.PLOT_BYTES_BY_K[32], exact=True)
+
+        self.assertEqual(2, first.transfers_in_flight)
+        # only the estimated transfer gets the fudge factor
+        self.assertEqual(free_bytes - Constants.PLOT_BYTES_BY_K[32] * (Constants.STAGED_FILES_ERROR_TERM + 1), first.get_available_bytes())
+        self.assertEqual(free_bytes - 2 * Constants.PLOT_BYTES_BY_K[32], first.get_uncommitted_bytes())
+
+    def test_host_cap_drops_every_drive_of_the_host(self):
+        index = self.create_index("config_order", "unspecified")
+        remote_drives = [d for d in index.get_all() if not d.hot_plot_target_drive.is_local()]
+        target_host_id = remote_drives[0].target_host_id
+        host_config = remote_drives[0].hot_plot_target_drive.host_config
+
+        for _ in range(host_config.max_concurrent_inbound_transfers):
+            index.add_host_transfer(target_host_id)
+
+        for indexed_target_drive in remote_drives:
+            self.assertEqual(indexed_target_drive.target_host_id == target_host_id, index.is_capped(indexed_target_drive))
+
+    def test_host_cap_leaves_the_index_entries(self):
+        index = self.create_index("drive_with_least_space_remaining", "unspecified")
+        remote_drives = [d for d in index.get_all() if not d.hot_plot_target_drive.is_local()]
+        target_host_id = remote_drives[0].target_host_id
+        host_drives = [d for d in remote_drives if d.target_host_id == target_host_id]
+        host_config = remote_drives[0].hot_plot_target_drive.host_config
+        index_entries = [d.index_entry for d in host_drives]
+
+        for _ in range(host_config.max_concurrent_inbound_transfers):
+            index.add_host_transfer(target_host_id)
+
+        # the host's drives are skipped, rather than moved out of the index
+        self.assertEqual(index_entries, [d.index_entry for d in host_drives])
+        self.assertTrue(index.has_capped_target_drives())
+        for indexed_target_drive in host_drives:
+            self.assertFalse(index.is_eligible(indexed_target_drive, 0))
+        self.assertNotEqual(target_host_id, index.find_best(0).target_host_id)
+
+    def test_random(self):
+        index = self.create_index("random", "local")
+        needed_bytes = Constants.PLOT_BYTES_BY_K[32]
+        found = index.find_best(needed_bytes)
+        self.assertTrue(found.hot_plot_target_drive.is_local())
+        self.assertTrue(index.is_eligible(found, needed_bytes))
+
+    def test_fastest_expected_completion(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            history = ThroughputHistory(os.path.join(temp_dir, "throughput.json"))
+            local_drives = [d for d in self.hot_plot_target_drives if d.is_local()]
+            remote_drives = [d for d in self.hot_plot_target_drives if not d.is_local()]
+            fast_local_drive, slow_local_drive, remote_drive = local_drives[0], local_drives[1], remote_drives[0]
+
+            def drive_id(hot_plot_target_drive):
+                return TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
+
+            # a SATA drive, a USB 2.0 drive, and a drive on a harvester behind a link shared by its drives
+            history.record(drive_id(fast_local_drive), 100 * Constants.GIGABYTE, 500)
+            history.record(drive_id(slow_local_drive), 100 * Constants.GIGABYTE, 3000)
+            history.record(drive_id(remote_drive), 100 * Constants.GIGABYTE, 400, concurrent_host_transfers=2)
+
+            index = TargetDriveIndex("fastest_expected_completion", "unspecified", history)
+            for position, hot_plot_target_drive in enumerate([slow_local_drive, fast_local_drive, remote_drive]):
+                index.add_target_drive(hot_plot_target_drive, position)
+            (slow, fast, remote) = index.get_all()
+
+            self.assertIs(remote, index.find_best(0))
+            # a transfer to the remote drive halves its rate, and takes a share of its host's link
+            index.add_transfer(remote.target_drive_id, remote.target_host_id, 0)
+            self.assertIs(fast, index.find_best(0))
+            index.add_transfer(fast.target_drive_id, fast.target_host_id, 0)
+            self.assertLess(index.get_expected_seconds_per_byte(fast), index.get_expected_seconds_per_byte(slow))
+            self.assertLess(index.get_expected_seconds_per_byte(remote), index.get_expected_seconds_per_byte(slow))
+
+    def test_unmeasured_drives_assumed_fastest(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            history = ThroughputHistory(os.path.join(temp_dir, "throughput.json"))
+            (measured_drive, unmeasured_drive) = self.hot_plot_target_drives[:2]
+            measured_drive_id = TargetDriveId.from_(TargetHostId.from_(measured_drive.host_config), measured_drive.target_drive_info.target_drive_config)
+            history.record(measured_drive_id, 100 * Constants.GIGABYTE, 1000)
+
+            index = TargetDriveIndex("fastest_expected_completion", "unspecified", history)
+            index.add_target_drive(measured_drive, 0)
+            index.add_target_drive(unmeasured_drive, 1)
+            (measured, unmeasured) = index.get_all()
+            self.assertEqual(index.get_expected_seconds_per_byte(measured), index.get_expected_seconds_per_byte(unmeasured))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from hotplots.models import TargetHostId, TargetDriveId
+from hotplots.throughput_history import ThroughputHistory
+
+GB = 1000 * 1000 * 1000
+
+
+class TestThroughputHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "throughput.json")
+        self.host_id = TargetHostId(False, "harvester")
+        self.drive_id = TargetDriveId(self.host_id, "/mnt/target1")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_moving_average(self):
+        history = ThroughputHistory(self.path, smoothing=0.5)
+        self.assertIsNone(history.get_drive_bytes_per_second(self.drive_id))
+
+        history.record(self.drive_id, 100 * GB, 1000)
+        self.assertEqual(100 * 1000 * 1000, history.get_drive_bytes_per_second(self.drive_id))
+        history.record(self.drive_id, 100 * GB, 500)
+        self.assertEqual(150 * 1000 * 1000, history.get_drive_bytes_per_second(self.drive_id))
+
+    def test_host_rate_is_aggregate(self):
+        history = ThroughputHistory(self.path)
+        history.record(self.drive_id, 100 * GB, 1000, concurrent_host_transfers=3)
+        self.assertEqual(100 * 1000 * 1000, history.get_drive_bytes_per_second(self.drive_id))
+        self.assertEqual(300 * 1000 * 1000, history.get_host_bytes_per_second(self.host_id))
+
+    def test_short_transfers_are_not_measured(self):
+        history = ThroughputHistory(self.path)
+        history.record(self.drive_id, 1000, 0.001)
+        self.assertIsNone(history.get_drive_bytes_per_second(self.drive_id))
+        self.assertIsNone(history.get_fastest_drive_bytes_per_second())
+
+    def test_persisted(self):
+        ThroughputHistory(self.path).record(self.drive_id, 100 * GB, 1000)
+
+        history = ThroughputHistory(self.path)
+        self.assertEqual(100 * 1000 * 1000, history.get_drive_bytes_per_second(self.drive_id))
+        self.assertEqual(100 * 1000 * 1000, history.get_host_bytes_per_second(self.host_id))
+        # the same path on the local host is a different drive
+        self.assertIsNone(history.get_drive_bytes_per_second(TargetDriveId(TargetHostId(True, "harvester"), "/mnt/target1")))
+
+    def test_unreadable_history_is_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        history = ThroughputHistory(self.path)
+        self.assertIsNone(history.get_drive_bytes_per_second(self.drive_id))
+
+        history.record(self.drive_id, 100 * GB, 1000)
+        self.assertEqual(100 * 1000 * 1000, ThroughputHistory(self.path).get_drive_bytes_per_second(self.drive_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from hotplots.models import HotPlot, SourcePlot
+from hotplots.transfer_executor import TransferExecutor
+
+
+class TestTransferExecutor(unittest.TestCase):
+
+    def create_hot_plot(self, plot_id):
+        source_plot = SourcePlot('/source/plot-k32-2021-06-01-00-00-%s.plot' % plot_id, 123)
+        return HotPlot(source_drive_info=MagicMock(), source_plot=source_plot)
+
+    def test_transfers_run_concurrently(self):
+        started = threading.Barrier(2, timeout=5)
+        transfer_func = MagicMock(side_effect=lambda hot_plot, target: started.wait())
+        executor = TransferExecutor(transfer_func, 2)
+
+        executor.submit(self.create_hot_plot("a"), MagicMock())
+        executor.submit(self.create_hot_plot("b"), MagicMock())
+        executor.wait_for_all()
+        executor.shutdown()
+
+        # both transfers had to be running at the same time to get past the barrier
+        self.assertEqual(2, transfer_func.call_count)
+        self.assertFalse(started.broken)
+
+    def test_failed_transfer_is_released(self):
+        executor = TransferExecutor(MagicMock(side_effect=Exception("Connection lost")), 1)
+        executor.submit(self.create_hot_plot("a"), MagicMock())
+        executor.wait_for_all()
+        executor.shutdown()
+
+        self.assertEqual(0, executor.get_in_flight_count())
+
+
+    def test_on_transfer_finished_callback(self):
+        transfer_finished = threading.Event()
+        executor = TransferExecutor(lambda hot_plot, target: True, 1, transfer_finished.set)
+
+        executor.submit(self.create_hot_plot("a"), MagicMock())
+
+        self.assertTrue(transfer_finished.wait(5))
+        executor.shutdown()
+
+    def test_failed_transfer_does_not_call_back(self):
+        on_transfer_finished = MagicMock()
+        executor = TransferExecutor(MagicMock(side_effect=OSError("No space left on device")), 1, on_transfer_finished)
+
+        executor.submit(self.create_hot_plot("a"), MagicMock())
+        executor.wait_for_all()
+        executor.shutdown()
+
+        on_transfer_finished.assert_not_called()
+
+    def test_transfer_that_did_not_go_ahead_does_not_call_back(self):
+        on_transfer_finished = MagicMock()
+        executor = TransferExecutor(MagicMock(return_value=False), 1, on_transfer_finished)
+
+        executor.submit(self.create_hot_plot("a"), MagicMock())
+        executor.wait_for_all()
+        executor.shutdown()
+
+        on_transfer_finished.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
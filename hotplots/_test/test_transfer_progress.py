@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import MagicMock
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import LocalHostConfig, RemoteHostConfig, TargetDriveConfig
+from hotplots.models import HotPlot, HotPlotTargetDrive, SourcePlot, TargetDriveInfo
+from hotplots.transfer_progress import TransferProgressTable
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTransferProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.table = TransferProgressTable(clock=self.clock)
+        self.hot_plot = HotPlot(MagicMock(), SourcePlot("/source/plot-k32-2021-06-01-00-00-plotid.plot", 100 * Constants.GIGABYTE))
+        target_drive_config = TargetDriveConfig("/mnt/remote1", 1)
+        self.remote_target_drive = HotPlotTargetDrive(
+            RemoteHostConfig("harvester1", "user", 22, 1, [target_drive_config]),
+            TargetDriveInfo(target_drive_config, 10 * Constants.TERABYTE, Constants.TERABYTE, [])
+        )
+
+    def test_rate_and_eta(self):
+        progress = self.table.start(self.hot_plot, self.remote_target_drive, 0)
+        snapshot = progress.get_snapshot()
+        self.assertEqual("harvester1:/mnt/remote1", snapshot.destination)
+        self.assertEqual("plotid", snapshot.plot_id)
+        self.assertIsNone(snapshot.eta_seconds)
+
+        for _ in range(10):
+            self.clock.now += 1
+            progress.advance(100 * Constants.MEGABYTE)
+        snapshot = progress.get_snapshot()
+        self.assertEqual(Constants.GIGABYTE, snapshot.bytes_done)
+        self.assertAlmostEqual(100 * Constants.MEGABYTE, snapshot.average_bytes_per_second)
+        self.assertAlmostEqual(100 * Constants.MEGABYTE, snapshot.current_bytes_per_second)
+        self.assertAlmostEqual(99 * Constants.GIGABYTE / (100 * Constants.MEGABYTE), snapshot.eta_seconds)
+
+        # the current rate follows a slow down, the average lags behind
+        for _ in range(20):
+            self.clock.now += 1
+            progress.advance(10 * Constants.MEGABYTE)
+        snapshot = progress.get_snapshot()
+        self.assertLess(snapshot.current_bytes_per_second, 11 * Constants.MEGABYTE)
+        self.assertGreater(snapshot.average_bytes_per_second, 30 * Constants.MEGABYTE)
+        self.assertAlmostEqual(snapshot.get_remaining_bytes() / snapshot.current_bytes_per_second, snapshot.eta_seconds)
+
+    def test_resumed_transfer(self):
+        progress = self.table.start(self.hot_plot, self.remote_target_drive, 60 * Constants.GIGABYTE)
+        self.clock.now += 10
+        progress.advance(Constants.GIGABYTE)
+
+        snapshot = progress.get_snapshot()
+        self.assertEqual(39 * Constants.GIGABYTE, snapshot.get_remaining_bytes())
+        # the bytes the transfer resumed from weren't copied at this rate
+        self.assertAlmostEqual(Constants.GIGABYTE / 10, snapshot.average_bytes_per_second)
+
+    def test_table(self):
+        local_target_drive = HotPlotTargetDrive(
+            LocalHostConfig([TargetDriveConfig("/mnt/local", 1)]),
+            TargetDriveInfo(TargetDriveConfig("/mnt/local", 1), 10 * Constants.TERABYTE, Constants.TERABYTE, [])
+        )
+        other_hot_plot = HotPlot(MagicMock(), SourcePlot("/source/plot-k32-2021-06-01-00-00-otherid.plot", 100 * Constants.GIGABYTE))
+        progress = self.table.start(self.hot_plot, self.remote_target_drive, 0)
+        other_progress = self.table.start(other_hot_plot, local_target_drive, 0)
+        self.assertEqual(
+            [("/source/plot-k32-2021-06-01-00-00-plotid.plot", "harvester1:/mnt/remote1"), ("/source/plot-k32-2021-06-01-00-00-otherid.plot", "/mnt/local")],
+            [(s.source_reference, s.destination) for s in self.table.get_all()]
+        )
+
+        self.table.finish(progress)
+        self.assertEqual(["otherid"], [s.plot_id for s in self.table.get_all()])
+        # finishing twice, or a transfer that was replaced by a retry, leaves the table as is
+        self.table.finish(progress)
+        retry = self.table.start(other_hot_plot, local_target_drive, 0)
+        self.table.finish(other_progress)
+        self.assertEqual(["otherid"], [s.plot_id for s in self.table.get_all()])
+        self.table.finish(retry)
+        self.assertEqual([], self.table.get_all())
+
+    def test_periodic_log(self):
+        table = TransferProgressTable(log_seconds=60, clock=self.clock)
+        progress = table.start(self.hot_plot, self.remote_target_drive, 0)
+        with self.assertLogs(level="INFO") as logs:
+            for _ in range(120):
+                self.clock.now += 1
+                progress.advance(100 * Constants.MEGABYTE)
+        self.assertEqual(2, len(logs.output))
+        self.assertIn("harvester1:/mnt/remote1", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+
+from hotplots.transfer_verification import TransferVerification
+
+
+class TestTransferVerification(unittest.TestCase):
+
+    def test_sample_blocks(self):
+        blocks = TransferVerification.get_sample_blocks(10 * 1024 * 1024, 4, 1024, random.Random(0))
+        self.assertEqual(4, len(blocks))
+        # the ends of the file are always compared
+        self.assertEqual((0, 1024), blocks[0])
+        self.assertEqual((10 * 1024 * 1024 - 1024, 1024), blocks[-1])
+        self.assertEqual(sorted(blocks), blocks)
+        for (offset, length) in blocks:
+            self.assertLessEqual(offset + length, 10 * 1024 * 1024)
+
+    def test_small_file_is_compared_whole(self):
+        self.assertEqual([(0, 3000)], TransferVerification.get_sample_blocks(3000, 4, 1024))
+
+    def test_hash_local_file(self):
+        contents = os.urandom(3 * 1024 * 1024 + 17)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "plot")
+            with open(path, "wb") as f:
+                f.write(contents)
+
+            self.assertEqual([hashlib.sha256(contents).hexdigest()], TransferVerification.hash_local_file(path, None))
+            self.assertEqual(
+                [hashlib.sha256(contents[:10]).hexdigest(), hashlib.sha256(contents[-10:]).hexdigest()],
+                TransferVerification.hash_local_file(path, [(0, 10), (len(contents) - 10, 10)])
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import datetime
+import threading
+import time
+from typing import Callable, List, Optional
+
+from hotplots.hotplots_config import BandwidthLimitConfig, TargetDriveConfig, BandwidthScheduleConfig
+from hotplots.models import HotPlotTargetDrive, TargetHostId, TargetDriveId
+
+
+class BandwidthSchedule:
+    """
+    Resolves the bytes per second limit of a BandwidthLimitConfig at a given time of day. The first schedule entry whose
+    window contains the time wins; outside every window the config's own max_bytes_per_second applies. 0 is unlimited.
+    """
+
+    @staticmethod
+    def get_max_bytes_per_second(bandwidth_limit_config: BandwidthLimitConfig, time_of_day: datetime.time) -> int:
+        for schedule_config in bandwidth_limit_config.schedule:
+            if BandwidthSchedule.is_in_window(schedule_config, time_of_day):
+                return schedule_config.max_bytes_per_second
+        return bandwidth_limit_config.max_bytes_per_second
+
+    @staticmethod
+    def is_in_window(schedule_config: BandwidthScheduleConfig, time_of_day: datetime.time) -> bool:
+        start = datetime.time.fromisoformat(schedule_config.start)
+        end = datetime.time.fromisoformat(schedule_config.end)
+        if start <= end:
+            return start <= time_of_day < end
+        # window wraps around midnight, e.g. 22:00 - 06:00
+        return time_of_day >= start or time_of_day < end
+
+    @staticmethod
+    def is_limited(bandwidth_limit_config: BandwidthLimitConfig) -> bool:
+        return bandwidth_limit_config.max_bytes_per_second > 0 or any(
+            schedule_config.max_bytes_per_second > 0 for schedule_config in bandwidth_limit_config.schedule
+        )
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket where a token is a byte. Callers take the bytes they are about to send, and sleep off any
+    debt outside of the lock, so concurrent transfers sharing the bucket queue up behind each other in order and
+    together stay under the rate. The rate is looked up on every call, so schedule changes apply mid-transfer.
+    """
+    def __init__(
+            self,
+            bandwidth_limit_config: BandwidthLimitConfig,
+            monotonic: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+            now: Callable[[], datetime.datetime] = datetime.datetime.now
+    ):
+        self.__bandwidth_limit_config = bandwidth_limit_config
+        self.__monotonic = monotonic
+        self.__sleep = sleep
+        self.__now = now
+        self.__lock = threading.Lock()
+        self.__tokens = 0.0
+        self.__last_refill = monotonic()
+
+    def get_max_bytes_per_second(self) -> int:
+        return BandwidthSchedule.get_max_bytes_per_second(self.__bandwidth_limit_config, self.__now().time())
+
+    def consume(self, num_bytes: int):
+        with self.__lock:
+            max_bytes_per_second = self.get_max_bytes_per_second()
+            burst_bytes = self.__bandwidth_limit_config.burst_bytes or max_bytes_per_second
+            now = self.__monotonic()
+            elapsed = now - self.__last_refill
+            self.__last_refill = now
+
+            if max_bytes_per_second <= 0:
+                # unlimited right now, the next limited period starts with a full bucket
+                self.__tokens = float("inf")
+                return
+
+            self.__tokens = min(float(burst_bytes), self.__tokens + elapsed * max_bytes_per_second)
+            self.__tokens -= num_bytes
+            wait_seconds = -self.__tokens / max_bytes_per_second if self.__tokens < 0 else 0.0
+
+        if wait_seconds > 0:
+            self.__sleep(wait_seconds)
+
+
+class BandwidthThrottle:
+    """
+    The token buckets a single transfer has to pass: the global remote bucket, its host's and its drive's.
+    """
+    def __init__(self, token_buckets: List[TokenBucket] = ()):
+        self.__token_buckets = list(token_buckets)
+
+    def consume(self, num_bytes: int):
+        for token_bucket in self.__token_buckets:
+            token_bucket.consume(num_bytes)
+
+    def get_max_bytes_per_second(self) -> int:
+        """
+        The tightest limit that applies right now, or 0 if the transfer is unlimited.
+        """
+        limits = [
+            max_bytes_per_second
+            for max_bytes_per_second in (token_bucket.get_max_bytes_per_second() for token_bucket in self.__token_buckets)
+            if max_bytes_per_second > 0
+        ]
+        return min(limits) if limits else 0
+
+
+class BandwidthLimiter:
+    """
+    Owns the token buckets shared by all transfers: one for all remote transfers, one per remote host and one per
+    target drive, each only if a limit is configured for it.
+    """
+    def __init__(self, remote_bandwidth_limit_config: BandwidthLimitConfig = BandwidthLimitConfig()):
+        self.__lock = threading.Lock()
+        self.__remote_token_bucket = self.__create_token_bucket(remote_bandwidth_limit_config)
+        self.__host_token_buckets: dict[TargetHostId, Optional[TokenBucket]] = {}
+        self.__drive_token_buckets: dict[TargetDriveId, Optional[TokenBucket]] = {}
+
+    def get_throttle(self, hot_plot_target_drive: HotPlotTargetDrive) -> BandwidthThrottle:
+        host_config = hot_plot_target_drive.host_config
+        target_host_id = TargetHostId.from_(host_config)
+        target_drive_config: TargetDriveConfig = hot_plot_target_drive.target_drive_info.target_drive_config
+        target_drive_id = TargetDriveId.from_(target_host_id, target_drive_config)
+
+        with self.__lock:
+            token_buckets = []
+            if not host_config.is_local():
+                token_buckets.append(self.__remote_token_bucket)
+                if target_host_id not in self.__host_token_buckets:
+                    self.__host_token_buckets[target_host_id] = self.__create_token_bucket(host_config.bandwidth)
+                token_buckets.append(self.__host_token_buckets[target_host_id])
+            if target_drive_id not in self.__drive_token_buckets:
+                self.__drive_token_buckets[target_drive_id] = self.__create_token_bucket(target_drive_config.bandwidth)
+            token_buckets.append(self.__drive_token_buckets[target_drive_id])
+
+        return BandwidthThrottle([token_bucket for token_bucket in token_buckets if token_bucket is not None])
+
+    @staticmethod
+    def __create_token_bucket(bandwidth_limit_config: BandwidthLimitConfig) -> Optional[TokenBucket]:
+        if not BandwidthSchedule.is_limited(bandwidth_limit_config):
+            return None
+        return TokenBucket(bandwidth_limit_config)
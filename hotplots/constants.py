@@ -17,5 +17,6 @@ class Constants:
     }
 
     # Is there no better way to do this?
+    MEGABYTE = 1_000_000
     GIGABYTE = 1_000_000_000
     TERABYTE = 1_000_000_000_000
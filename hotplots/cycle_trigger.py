@@ -0,0 +1,31 @@
+import threading
+from typing import Optional
+
+
+class CycleTrigger:
+    """
+    Lets anything that knows there's new work (a finished transfer, a new plot on a source drive) start the next
+    pairing cycle early, instead of it waiting out the full poll interval.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__triggered = threading.Event()
+        self.__reason: Optional[str] = None
+
+    def trigger(self, reason: str):
+        with self.__lock:
+            if self.__reason is None:
+                self.__reason = reason
+            self.__triggered.set()
+
+    def wait(self, timeout: float) -> Optional[str]:
+        """
+        Blocks until triggered or the timeout elapses. Returns the reason of the first trigger since the last wait, or
+        None if the timeout elapsed.
+        """
+        self.__triggered.wait(timeout)
+        with self.__lock:
+            reason = self.__reason
+            self.__reason = None
+            self.__triggered.clear()
+        return reason
@@ -0,0 +1,49 @@
+import dataclasses
+from typing import AbstractSet, List, Tuple
+
+from hotplots.models import SourceInfo, HotPlot, HotPlotTargetDrive
+
+
+class DuplicatePlots:
+    """
+    Plots are unique by plot id, and a plot that's already on a target (e.g. hotplots crashed between renaming the
+    finished transfer and removing the source) or on another source drive would only take its space twice.
+    """
+
+    @staticmethod
+    def find_in_sources(source_info: SourceInfo, finished_plots: dict[str, List[str]],
+                        in_flight_pairings: List[Tuple[HotPlot, HotPlotTargetDrive]] = ()) -> dict[str, List[str]]:
+        """
+        The source plots that shouldn't be transferred, by absolute reference, with where their other copies are.
+        finished_plots is where plots already are on the targets, by plot id. Of the copies of a plot on several
+        source drives, the first (in config order) is kept.
+        """
+        # a running transfer's plot is on its target before its source is removed
+        in_flight_plot_ids = {hot_plot.source_plot.plot_name_metadata().plot_id for (hot_plot, _) in in_flight_pairings}
+
+        source_references_by_plot_id: dict[str, str] = {}
+        duplicates = {}
+        for source_drive_info in source_info.source_drive_infos:
+            for source_plot in source_drive_info.source_plots:
+                plot_id = source_plot.plot_name_metadata().plot_id
+                if plot_id in finished_plots and plot_id not in in_flight_plot_ids:
+                    duplicates[source_plot.absolute_reference] = finished_plots[plot_id]
+                elif plot_id in source_references_by_plot_id:
+                    duplicates[source_plot.absolute_reference] = [source_references_by_plot_id[plot_id]]
+                else:
+                    source_references_by_plot_id[plot_id] = source_plot.absolute_reference
+        return duplicates
+
+    @staticmethod
+    def without(source_info: SourceInfo, source_references: AbstractSet[str]) -> SourceInfo:
+        """
+        The source info, leaving out the given source plots.
+        """
+        if not source_references:
+            return source_info
+        return dataclasses.replace(source_info, source_drive_infos=[
+            dataclasses.replace(source_drive_info, source_plots=[
+                source_plot for source_plot in source_drive_info.source_plots if source_plot.absolute_reference not in source_references
+            ])
+            for source_drive_info in source_info.source_drive_infos
+        ])
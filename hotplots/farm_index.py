@@ -0,0 +1,178 @@
+import logging
+import posixpath
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from hotplots.models import PlotNameMetadata, TargetHostId
+from hotplots.plot_headers import PlotHeader
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plots (
+    host TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    k INTEGER,
+    plot_timestamp TEXT,
+    plot_id TEXT,
+    pool_public_key TEXT,
+    pool_contract_puzzle_hash TEXT,
+    farmer_public_key TEXT,
+    PRIMARY KEY (host, path)
+);
+CREATE INDEX IF NOT EXISTS plots_by_directory ON plots (host, directory);
+CREATE INDEX IF NOT EXISTS plots_by_plot_id ON plots (plot_id);
+CREATE TABLE IF NOT EXISTS directories (
+    host TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    reconciled_at REAL NOT NULL,
+    PRIMARY KEY (host, directory)
+);
+"""
+
+MAX_QUERY_PARAMETERS = 500
+
+
+class FarmIndex:
+    """
+    The finished plots on the target drives, in an SQLite database so it survives restarts. Each directory is
+    reconciled with a listing of it now and then, and kept up to date in between by the transfers into it and the
+    replacements out of it, so looking plots up doesn't take a directory walk.
+    """
+    def __init__(self, path: Optional[str], clock: Callable[[], float] = time.time):
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # shared by the transfer threads, every use is under the lock
+        self.__connection = FarmIndex.__connect(path)
+
+    @staticmethod
+    def __connect(path: Optional[str]) -> sqlite3.Connection:
+        if path:
+            try:
+                connection = sqlite3.connect(path, check_same_thread=False)
+                connection.executescript(SCHEMA)
+                return connection
+            except sqlite3.DatabaseError as e:
+                # only an index, everything in it can be listed again
+                logging.warning("farm index %s can't be used, keeping it in memory instead: %s" % (path, e))
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        connection.executescript(SCHEMA)
+        return connection
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def is_reconciled_since(self, target_host_id: TargetHostId, directory: str, since: float) -> bool:
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT reconciled_at FROM directories WHERE host = ? AND directory = ?",
+                (self.__get_host_key(target_host_id), self.__normalize(directory))
+            ).fetchone()
+        return row is not None and row[0] >= since
+
+    def reconcile(self, target_host_id: TargetHostId, directory: str, plot_files: List[Tuple[int, str]]):
+        """
+        Replaces what's indexed for the directory with a listing of it. Header-derived keys already indexed for a
+        plot are kept.
+        """
+        host = self.__get_host_key(target_host_id)
+        directory = self.__normalize(directory)
+        with self.__lock, self.__connection:
+            listed_paths = {path for (_, path) in plot_files}
+            indexed_paths = [row[0] for row in self.__connection.execute(
+                "SELECT path FROM plots WHERE host = ? AND directory = ?", (host, directory)
+            )]
+            self.__connection.executemany(
+                "DELETE FROM plots WHERE host = ? AND path = ?",
+                [(host, path) for path in indexed_paths if path not in listed_paths]
+            )
+            for (size, path) in plot_files:
+                self.__upsert(host, directory, path, size)
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO directories (host, directory, reconciled_at) VALUES (?, ?, ?)",
+                (host, directory, self.__clock())
+            )
+
+    def add_plot(self, target_host_id: TargetHostId, path: str, size: int):
+        with self.__lock, self.__connection:
+            self.__upsert(self.__get_host_key(target_host_id), self.__normalize(posixpath.dirname(path)), path, size)
+
+    def remove_plot(self, target_host_id: TargetHostId, path: str):
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM plots WHERE host = ? AND path = ?", (self.__get_host_key(target_host_id), path))
+
+    def set_plot_headers(self, plot_headers: Iterable[PlotHeader]):
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "UPDATE plots SET pool_public_key = ?, pool_contract_puzzle_hash = ?, farmer_public_key = ? WHERE plot_id = ?",
+                [(h.pool_public_key, h.pool_contract_puzzle_hash, h.farmer_public_key, h.plot_id) for h in plot_headers]
+            )
+
+    def get_plot_files(self, target_host_id: TargetHostId, directory: str) -> List[Tuple[int, str]]:
+        """
+        (size, path) of the plots indexed in the directory.
+        """
+        with self.__lock:
+            return [(size, path) for (size, path) in self.__connection.execute(
+                "SELECT size, path FROM plots WHERE host = ? AND directory = ? ORDER BY path",
+                (self.__get_host_key(target_host_id), self.__normalize(directory))
+            )]
+
+    def find_plots(self, plot_ids: Iterable[str]) -> dict[str, List[str]]:
+        """
+        Where each of the plots is on the targets (as host:path for remote hosts), for those that are anywhere.
+        """
+        plot_ids = list(set(plot_ids))
+        rows = []
+        with self.__lock:
+            # sqlite limits the number of parameters in a statement
+            for start in range(0, len(plot_ids), MAX_QUERY_PARAMETERS):
+                chunk = plot_ids[start:start + MAX_QUERY_PARAMETERS]
+                rows.extend(self.__connection.execute(
+                    "SELECT plot_id, host, path FROM plots WHERE plot_id IN (%s)" % ", ".join("?" * len(chunk)), chunk
+                ))
+        return self.__group_locations(rows)
+
+    def find_duplicate_plots(self) -> dict[str, List[str]]:
+        """
+        Plots that are on the targets more than once, with where each copy is.
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT plot_id, host, path FROM plots WHERE plot_id IN "
+                "(SELECT plot_id FROM plots WHERE plot_id IS NOT NULL GROUP BY plot_id HAVING COUNT(*) > 1)"
+            ).fetchall()
+        return self.__group_locations(rows)
+
+    @staticmethod
+    def __group_locations(rows: Iterable[Tuple[str, str, str]]) -> dict[str, List[str]]:
+        locations = {}
+        for (plot_id, host, path) in sorted(rows):
+            (kind, hostname) = host.split(":", 1)
+            locations.setdefault(plot_id, []).append(path if kind == "local" else "%s:%s" % (hostname, path))
+        return locations
+
+    def __upsert(self, host: str, directory: str, path: str, size: int):
+        try:
+            metadata = PlotNameMetadata.parse_from_filename(path)
+            (k, plot_id) = (metadata.k, metadata.plot_id)
+            plot_timestamp = "%04d-%02d-%02d %02d:%02d" % (metadata.year, metadata.month, metadata.day, metadata.hour, metadata.minute)
+        except ValueError:
+            (k, plot_id, plot_timestamp) = (None, None, None)
+        self.__connection.execute(
+            "INSERT INTO plots (host, directory, path, size, k, plot_timestamp, plot_id) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (host, path) DO UPDATE SET size = excluded.size",
+            (host, directory, path, size, k, plot_timestamp, plot_id)
+        )
+
+    @staticmethod
+    def __get_host_key(target_host_id: TargetHostId) -> str:
+        return ("local:" if target_host_id.is_local else "remote:") + target_host_id.hostname
+
+    @staticmethod
+    def __normalize(directory: str) -> str:
+        # the same directory may be configured with or without a trailing slash
+        return posixpath.normpath(directory)
@@ -1,10 +1,16 @@
 import logging
+from typing import List
 
+from hotplots.cycle_trigger import CycleTrigger
+from hotplots.duplicate_plots import DuplicatePlots
 from hotplots.hotplots_config import HotplotsConfig
 from hotplots.hotplots_io import HotplotsIO
 from hotplots.hotplots_pairing_engine import EligiblePairingsResult
 from hotplots.hotplots_pairing_engine import HotplotsPairingEngine, PlotReplacementResult
+from hotplots.metrics import MetricsServer
 from hotplots.models import SourceInfo, TargetsInfo
+from hotplots.source_watcher import SourceWatcher
+from hotplots.transfer_executor import TransferExecutor
 
 
 class Hotplots:
@@ -12,41 +18,130 @@ class Hotplots:
         self.config = config
         self.hotplots_io = hotplots_io
 
+        # every transfer occupies one outbound slot of its source drive, so the pairing caps can never commit more
+        # transfers than this at once.
+        max_concurrent_transfers = sum(d.max_concurrent_outbound_transfers for d in self.config.source.drives)
+
+        # successful transfers and new plots on the source drives start the next cycle early, failed ones (and ones that
+        # found no free transfer slot) wait for it
+        self.cycle_trigger = CycleTrigger()
+        self.transfer_executor = TransferExecutor(
+            self.hotplots_io.transfer_plot,
+            max_concurrent_transfers,
+            lambda: self.cycle_trigger.trigger("a transfer finished")
+        )
+        self.source_watcher = SourceWatcher(self.config.source, self.cycle_trigger)
+        # duplicate plots already logged, so each is only reported once
+        self.reported_duplicates = set()
+        if self.config.source.watch_source_drives:
+            self.source_watcher.start()
+        self.metrics = self.hotplots_io.metrics
+        self.metrics_server = MetricsServer(self.metrics, self.config.metrics)
+        if self.config.metrics.port:
+            self.metrics_server.start()
+
     def run(self):
+        phase_seconds = self.metrics.cycle_phase_seconds
+        in_flight_pairings = self.transfer_executor.get_in_flight_pairings()
+        self.metrics.transfers_in_flight.set(len(in_flight_pairings))
+        self.metrics.record_transfer_progress(self.hotplots_io.transfer_progress.get_all())
+
         # First check all sources to see if there are any plots at all
-        source_info: SourceInfo = self.hotplots_io.get_source_info(self.config.source)
+        with phase_seconds.time(phase="source_scan"):
+            source_info: SourceInfo = self.hotplots_io.get_source_info(self.config.source)
 
         # If no plot files, there's definitely nothing to do
         if all([not s.source_plots for s in source_info.source_drive_infos]):
             logging.info("didn't find any source plot files")
+            self.metrics.source_plots_waiting.set(0)
             return
 
+        with phase_seconds.time(phase="duplicate_check"):
+            # A plot whose transfer is being verified is already on its target, its source is removed once it passes
+            source_info = DuplicatePlots.without(source_info, self.hotplots_io.get_verifying_source_references())
+
+            # A plot that's already on a target, or on another source drive, isn't transferred again. Which plots are on
+            # the targets comes from the farm index, so this doesn't list the targets every cycle.
+            finished_plots = self.hotplots_io.find_finished_plots(
+                self.config.targets,
+                [p.plot_name_metadata().plot_id for s in source_info.source_drive_infos for p in s.source_plots]
+            )
+            duplicate_source_plots = DuplicatePlots.find_in_sources(source_info, finished_plots, in_flight_pairings)
+            self.report_duplicates(duplicate_source_plots, self.hotplots_io.farm_index.find_duplicate_plots())
+            source_info = DuplicatePlots.without(source_info, duplicate_source_plots.keys())
+
+        in_flight_source_references = {hot_plot.source_plot.absolute_reference for (hot_plot, _) in in_flight_pairings}
+        self.metrics.source_plots_waiting.set(len([
+            p for s in source_info.source_drive_infos for p in s.source_plots if p.absolute_reference not in in_flight_source_references
+        ]))
+
         # Next, let's fetch disk space and staged plots information from all targets
         # These are fairly light operations, and provides all the info we need to know
-        # to determine if pairings can be made.
-        targets_info: TargetsInfo = TargetsInfo(
-            self.config.targets,
-            self.hotplots_io.get_local_target_info(self.config.targets.local),
-            self.hotplots_io.get_remote_targets_info(self.config.targets.remote)
-        )
+        # to determine if pairings can be made. Targets are probed in parallel, and any that
+        # don't answer in time are left out of this cycle.
+        with phase_seconds.time(phase="target_discovery"):
+            targets_info: TargetsInfo = self.hotplots_io.get_targets_info(self.config.targets)
+        self.metrics.record_targets_info(targets_info)
 
-        pairings_result = HotplotsPairingEngine.get_pairings_result(source_info, targets_info)
+        with phase_seconds.time(phase="pairing"):
+            pairings_result = HotplotsPairingEngine.get_pairings_result(
+                source_info,
+                targets_info,
+                in_flight_pairings,
+                self.hotplots_io.throughput_history
+            )
 
         if isinstance(pairings_result, PlotReplacementResult):
             # not an eligible pairing, but we can try to replace plots
             # if successful, will update pairings_request with an eligible pairing
-            logging.info("Let's try plot replacement for local drives")
-            pairings_result = HotplotsPairingEngine.get_pairings_result_with_replacement(pairings_result)
+            logging.info("Let's try plot replacement")
+            with phase_seconds.time(phase="replacement"):
+                pairings_result = HotplotsPairingEngine.get_pairings_result_with_replacement(pairings_result, self.hotplots_io)
 
         if isinstance(pairings_result, EligiblePairingsResult):
-            [
-                self.hotplots_io.transfer_plot(hot_plot, hot_plot_target_drive)
-                for (hot_plot, hot_plot_target_drive)
-                in pairings_result.pairings
-            ]
+            # transfers run in the background, the next cycle will see them through the executor's in-flight set
+            for (hot_plot, hot_plot_target_drive) in pairings_result.pairings:
+                cold_plot_paths = pairings_result.cold_plots_to_replace.get(hot_plot.source_plot.absolute_reference)
+                if cold_plot_paths:
+                    # deleted by the transfer once it needs the space
+                    self.hotplots_io.plan_replacement(hot_plot, cold_plot_paths)
+                self.transfer_executor.submit(hot_plot, hot_plot_target_drive)
         else:
             # no action, we could arrive here by a capping ineligility or a failed replacement
             logging.info("No action available to take at this time.")
             return
 
+    def report_duplicates(self, duplicate_source_plots: dict[str, List[str]], duplicate_target_plots: dict[str, List[str]]):
+        duplicates = set()
+        for (source_reference, locations) in duplicate_source_plots.items():
+            duplicates.add(source_reference)
+            if source_reference not in self.reported_duplicates:
+                logging.warning("%s is already at %s, not transferring it again. Delete one of the copies to reclaim its space."
+                                % (source_reference, ", ".join(locations)))
+        for (plot_id, locations) in duplicate_target_plots.items():
+            duplicates.add(plot_id)
+            if plot_id not in self.reported_duplicates:
+                logging.warning("plot %s is on the targets more than once, at %s. Delete all but one of the copies to reclaim their space."
+                                % (plot_id, ", ".join(locations)))
+        # a duplicate that comes back is reported again
+        self.reported_duplicates = duplicates
+
+    def wait_for_next_cycle(self, timeout_seconds: float):
+        # wake up early when a transfer finishes, so its freed slot can be filled right away, or when a new plot shows
+        # up. The timeout is the poll fallback.
+        reason = self.cycle_trigger.wait(timeout_seconds)
+        if reason is not None:
+            logging.info("%s, starting next cycle" % reason)
+
+    def wait_for_transfers(self):
+        self.transfer_executor.wait_for_all()
+
+    def shutdown(self):
+        self.metrics_server.close()
+        self.source_watcher.close()
+        # the running transfers stop at their next chunk, leaving their temporary files to be resumed on the next start
+        self.hotplots_io.interrupt_transfers()
+        self.transfer_executor.shutdown()
+        self.hotplots_io.close()
+
 
@@ -1,6 +1,6 @@
 import sys
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 
 @dataclass(frozen=True)
@@ -32,6 +32,10 @@ class SourceConfig:
     drives: List[SourceDriveConfig]
     check_source_drives_sleep_seconds: int = 60
     selection_strategy: str = "least_available_space"
+    # start a cycle as soon as a new plot lands on a source drive (Linux only), instead of waiting for the next poll
+    watch_source_drives: bool = True
+    # new plots arriving in a burst are picked up in one cycle, once none has arrived for this long
+    watch_debounce_seconds: float = 2.0
 
 
 @dataclass(frozen=True)
@@ -41,11 +45,32 @@ class PlotReplacementConfig:
     value: str = ""
 
 
+@dataclass(frozen=True)
+class BandwidthScheduleConfig:
+    # time of day window, HH:MM in local time. A window whose end is before its start wraps around midnight.
+    start: str
+    end: str
+    # limit while inside the window, 0 is unlimited
+    max_bytes_per_second: int = 0
+
+
+@dataclass(frozen=True)
+class BandwidthLimitConfig:
+    # 0 is unlimited
+    max_bytes_per_second: int = 0
+    # how far a transfer may run ahead of the limit after being idle, defaults to one second's worth
+    burst_bytes: int = 0
+    # the first matching window overrides max_bytes_per_second, e.g. to allow full speed overnight.
+    # Left out of the hash, so configs holding a limit can still be used as dict keys.
+    schedule: List[BandwidthScheduleConfig] = field(default_factory=list, hash=False)
+
+
 @dataclass(frozen=True)
 class TargetDriveConfig:
     path: str
     max_concurrent_inbound_transfers: int
     plot_replacement: PlotReplacementConfig = PlotReplacementConfig()
+    bandwidth: BandwidthLimitConfig = BandwidthLimitConfig()
 
 
 @dataclass(frozen=True)
@@ -63,6 +88,35 @@ class LocalHostConfig:
     def get_hostname(self):
         return "localhost"
 
+@dataclass(frozen=True)
+class RemoteTransferConfig:
+    # sftp: pipelined sftp writes over the pooled paramiko connection
+    # rsync: rsync over the system ssh client (rsync must be installed on both machines)
+    # stream: raw byte stream over an ssh exec channel, written to disk by `cat` on the remote host
+    # receiver: raw byte stream to `hotplots receive` on the remote host, which preallocates and writes with direct I/O
+    backend: str = "sftp"
+    # bytes read from the source plot per write
+    chunk_size_bytes: int = 4 * 1024 * 1024
+    # ssh channel flow control window and max packet size for the sftp and stream backends
+    window_size_bytes: int = 64 * 1024 * 1024
+    max_packet_size_bytes: int = 32 * 1024
+    # preferred ssh cipher, e.g. aes128-gcm@openssh.com. Empty uses the ssh defaults.
+    cipher: str = ""
+
+
+@dataclass(frozen=True)
+class ReceiverConfig:
+    # port `hotplots receive` listens on, on the host. 0 doesn't use a receiver.
+    port: int = 0
+    # tunnel: through the ssh connection, to a receiver listening on the host's localhost
+    # direct: plain TCP to the host, unencrypted, for trusted networks
+    connection: str = "tunnel"
+    # the receiver's --token
+    token: str = ""
+    # a request to the receiver fails when nothing is sent or received for this long, long enough to hash a whole plot
+    timeout_seconds: int = 900
+
+
 @dataclass(frozen=True)
 class RemoteHostConfig:
     hostname: str
@@ -70,6 +124,22 @@ class RemoteHostConfig:
     port: int
     max_concurrent_inbound_transfers: int
     drives: List[TargetDriveConfig]
+    # command: probe every drive with a single remote python3 command, falling back to sftp if that fails
+    # sftp: probe each drive over sftp
+    probe_mode: str = "command"
+    transfer: RemoteTransferConfig = RemoteTransferConfig()
+    # shared by all transfers to this host
+    bandwidth: BandwidthLimitConfig = BandwidthLimitConfig()
+    # none: each plotter only knows about the transfers it can see on the host's drives
+    # lease_files: transfer slots of the host and its drives are reserved with lease files on the host, so plotters
+    # sharing it can't take more slots than configured between probing it and starting their transfers
+    coordination: str = "none"
+    coordination_directory: str = "/tmp/hotplots-leases"
+    # a lease is renewed while its transfer runs, and expires this long after its plotter stops renewing it
+    lease_ttl_seconds: int = 300
+    # with a receiver, remote commands run through it instead of over ssh exec, and the receiver transfer backend
+    # can be used
+    receiver: ReceiverConfig = ReceiverConfig()
 
     def is_local(self):
         return False
@@ -78,10 +148,26 @@ class RemoteHostConfig:
         return self.hostname
 
 
+@dataclass(frozen=True)
+class SSHConnectionConfig:
+    # connections to remote hosts are kept open between cycles and checked with keepalives
+    keepalive_seconds: int = 30
+    connect_timeout_seconds: int = 30
+    # after a failed connection attempt the host is skipped for this long, doubling on each further failure
+    reconnect_backoff_seconds: int = 5
+    max_reconnect_backoff_seconds: int = 300
+    dns_cache_ttl_seconds: int = 300
+
+
 @dataclass(frozen=True)
 class RemoteTargetsConfig:
     max_concurrent_outbound_transfers: int
     hosts: List[RemoteHostConfig]
+    connection: SSHConnectionConfig = SSHConnectionConfig()
+    # targets (remote hosts and local drives) that don't answer within this many seconds are skipped for the cycle
+    discovery_timeout_seconds: int = 30
+    # shared by all remote transfers
+    bandwidth: BandwidthLimitConfig = BandwidthLimitConfig()
 
 
 @dataclass(frozen=True)
@@ -90,6 +176,57 @@ class TargetsConfig:
     local: LocalHostConfig
     remote: RemoteTargetsConfig
     target_host_preference: str = "local"
+    # greedy: pair one plot at a time with its best ranked drive
+    # optimal: search for the pairings that move the most bytes this cycle, e.g. so a small plot doesn't take the
+    # only drive a big one fits on. Keeps the greedy pairings if the search can't beat them in time.
+    pairing_mode: str = "greedy"
+    optimal_pairing_time_budget_seconds: float = 1.0
+    # where measured transfer rates per drive and host are kept, for the fastest_expected_completion strategy.
+    # The state files are kept in memory only without a path, relative paths are relative to the config file.
+    throughput_history_path: Optional[str] = None
+    # where plot headers read for the pool-key and farmer-key plot replacement types are kept, so each is read once
+    plot_header_cache_path: Optional[str] = None
+    # the finished plots on the targets, see FarmIndex. Each directory is listed again when its index is this old.
+    farm_index_path: Optional[str] = None
+    farm_index_reconcile_seconds: int = 3600
+
+
+@dataclass(frozen=True)
+class LocalTransferConfig:
+    # bytes handed to the kernel per copy call
+    chunk_size_bytes: int = 64 * 1024 * 1024
+    # reserve the full plot size on the target before copying, so the drive can't fill up halfway through. The file's
+    # size still only counts the copied bytes, which is what an interrupted copy is resumed from
+    preallocate: bool = True
+    # drop copied pages from the page cache as the copy goes, so a 100 GiB copy doesn't evict the plotter's cache
+    drop_page_cache: bool = True
+
+
+@dataclass(frozen=True)
+class TransferConfig:
+    local: LocalTransferConfig = LocalTransferConfig()
+    # keep the temporary file of a failed transfer, and continue from it on the next attempt
+    resume_partial_transfers: bool = True
+    # a temporary file no running transfer holds, that hasn't been written to for this long, belongs to a dead
+    # transfer and can be resumed
+    stale_partial_transfer_seconds: int = 600
+    # how many bytes at the end of a partial file are compared against the source before resuming
+    resume_verify_bytes: int = 4 * 1024 * 1024
+    # check a finished transfer against its source before removing the source, in the background:
+    # none, sampled (hash verify_sample_blocks blocks at random offsets of both) or full (hash both whole)
+    verify_transfers: str = "none"
+    verify_sample_blocks: int = 16
+    verify_sample_block_bytes: int = 1024 * 1024
+    max_concurrent_verifications: int = 2
+    # log the progress of each running transfer this often, 0 only logs its start and end
+    progress_log_seconds: int = 300
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    # port of an http endpoint serving /metrics in the OpenMetrics text format, for Prometheus. 0 doesn't serve it.
+    port: int = 0
+    bind: str = "127.0.0.1"
 
 
 @dataclass(frozen=True)
@@ -97,4 +234,6 @@ class HotplotsConfig:
     logging: LoggingConfig
     source: SourceConfig
     targets: TargetsConfig
+    transfer: TransferConfig = TransferConfig()
+    metrics: MetricsConfig = MetricsConfig()
 
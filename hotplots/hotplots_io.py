@@ -1,30 +1,145 @@
+import dataclasses
+import json
 import logging
 import os
+import posixpath
 import random
 import shutil
-import socket
+import stat
 import string
-from glob import glob
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Hashable, List, Optional, Tuple, Union
 
 import desert
-import paramiko
 import yaml
 
-from hotplots.hotplots_config import HotplotsConfig
+from hotplots.bandwidth import BandwidthLimiter
+from hotplots.constants import Constants
+from hotplots.hotplots_config import HotplotsConfig, SSHConnectionConfig, RemoteHostConfig, TargetDriveConfig, \
+    TargetsConfig, TransferConfig, BandwidthLimitConfig
+from hotplots.farm_index import FarmIndex
+from hotplots.local_copy import LocalFileCopier
+from hotplots.metrics import HotplotsMetrics
+from hotplots.partial_transfers import PartialTransfers
+from hotplots.plot_headers import HEADER_READ_BYTES, PlotHeader, PlotHeaderCache, PlotHeaderError
+from hotplots.plot_inventory import PlotInventory
 from hotplots.models import PlotNameMetadata, InFlightTransfer, SourceDriveInfo, RemoteHostInfo, SourceConfig, \
     SourcePlot, SourceInfo, LocalHostConfig, LocalTargetsInfo, RemoteTargetsConfig, RemoteTargetsInfo, TargetDriveInfo, \
-    HotPlotTargetDrive, HotPlot
+    HotPlotTargetDrive, HotPlot, TargetHostId, TargetDriveId, TargetsInfo
+from hotplots.remote_commands import RemoteCommands, RemoteCommandError, RemoteCommandUnavailableError
+from hotplots.receiver import ReceiverClient
+from hotplots.remote_transfer import RemoteTransferBackend, SftpTransferBackend, StreamTransferBackend, \
+    RsyncTransferBackend, ReceiverTransferBackend
+from hotplots.ssh_connection_pool import SSHConnectionPool
+from hotplots.throughput_history import ThroughputHistory
+from hotplots.transfer_progress import TransferProgressTable
+from hotplots.transfer_slot_leases import TransferSlotLeases
+from hotplots.transfer_verification import TransferVerification
 
 dry_run = False
 
+
+class TransferInterruptedError(Exception):
+    """
+    A transfer stopped part way because hotplots is shutting down.
+    """
+    pass
+
+
 class HotplotsIO:
-    def __init__(self):
-        # cache of target_config -> plot absolute reference -> memo data to avoid unnecessary disk reads
-        # self.memo_cache = {}
+    def __init__(self, config: HotplotsConfig = None):
+        # plot files in source and target directories, kept between cycles to avoid relisting unchanged directories
+        self.plot_inventory = PlotInventory()
+        # source plots by absolute reference, so their parsed name metadata is reused while their size is unchanged
+        self.__source_plots: dict[str, SourcePlot] = {}
+
+        # the last probe of each local drive and remote host (and plot listing of each host), a probe isn't submitted
+        # again while it hasn't returned
+        self.__outstanding_probes: dict[Hashable, Future] = {}
+
+        # don't have to check drives that are full, until their free space changes
+        self.__full_target_drive_infos: dict[TargetDriveConfig, TargetDriveInfo] = {}
+
+        # SSH transports are shared by probes and transfers, and kept open between cycles
+        connection_config = config.targets.remote.connection if config else SSHConnectionConfig()
+        self.ssh_connection_pool = SSHConnectionPool(connection_config)
+
+        self.transfer_config = config.transfer if config else TransferConfig()
+        self.local_file_copier = LocalFileCopier(self.transfer_config.local)
+        # `hotplots receive` on the hosts that run it
+        self.receiver_client = ReceiverClient(self.ssh_connection_pool)
+        self.remote_transfer_backends: dict[str, RemoteTransferBackend] = {
+            "sftp": SftpTransferBackend(),
+            "stream": StreamTransferBackend(self.ssh_connection_pool),
+            "rsync": RsyncTransferBackend(),
+            "receiver": ReceiverTransferBackend(self.receiver_client),
+        }
+        for remote_host_config in (config.targets.remote.hosts if config else []):
+            if remote_host_config.transfer.backend not in self.remote_transfer_backends:
+                raise ValueError("unknown transfer backend %s for %s" % (remote_host_config.transfer.backend, remote_host_config.hostname))
+        # token buckets shared by all transfers, for the configured bandwidth limits
+        self.bandwidth_limiter = BandwidthLimiter(config.targets.remote.bandwidth if config else BandwidthLimitConfig())
+        # bytes done, rate and ETA of the running transfers, reported by their copy loops
+        self.transfer_progress = TransferProgressTable(self.transfer_config.progress_log_seconds)
+        # set on shutdown, the copy loops then stop at their next chunk
+        self.__interrupting_transfers = threading.Event()
+        # cycle and transfer measurements, served by the metrics endpoint
+        self.metrics = HotplotsMetrics()
+        # measured by transfers, for the fastest_expected_completion target selection strategy
+        self.throughput_history = ThroughputHistory(config.targets.throughput_history_path if config else None)
+        # headers of plots on the targets, for the pool-key and farmer-key plot replacement types
+        self.plot_header_cache = PlotHeaderCache(config.targets.plot_header_cache_path if config else None)
+        # finished plots on the targets, listed now and then and kept up to date by transfers and replacements
+        self.farm_index = FarmIndex(config.targets.farm_index_path if config else None)
+        self.__farm_index_reconcile_seconds = config.targets.farm_index_reconcile_seconds if config else TargetsConfig.farm_index_reconcile_seconds
+        self.__host_transfers_running: dict[TargetHostId, int] = defaultdict(lambda: 0)
+        # the transfers running to each host integrated over time (in transfer seconds), up to when it last changed
+        self.__host_transfer_seconds: dict[TargetHostId, float] = defaultdict(lambda: 0.0)
+        self.__host_transfers_changed_at: dict[TargetHostId, float] = {}
+        self.__host_transfers_running_lock = threading.Lock()
+        # (hostname, path) of the temporary files this process' remote transfers are writing, which are never stale
+        self.__active_remote_temp_files: set[Tuple[str, str]] = set()
+        self.__active_remote_temp_files_lock = threading.Lock()
+
+        # cold plots to delete to make room for a transfer, by the hot plot's absolute reference
+        self.__planned_replacements: dict[str, List[str]] = {}
+        self.__planned_replacements_lock = threading.Lock()
+        # bytes the running transfers to a drive are still to write, by the hot plot's absolute reference, which the free
+        # space they'll take up isn't showing yet. Making room on a drive is done one transfer at a time.
+        self.__reserved_bytes: dict[TargetDriveId, dict[str, int]] = defaultdict(dict)
+        self.__reserved_bytes_lock = threading.Lock()
+        self.__make_room_locks: dict[TargetDriveId, threading.Lock] = defaultdict(threading.Lock)
+
+        # finished transfers being checked against their source, which is only removed once they pass
+        if self.transfer_config.verify_transfers not in ("none", "sampled", "full"):
+            raise ValueError("unknown transfer verification %s" % self.transfer_config.verify_transfers)
+        self.__verification_executor = ThreadPoolExecutor(
+            max_workers=max(1, self.transfer_config.max_concurrent_verifications), thread_name_prefix="hotplots-verify"
+        )
+        self.__verifying_source_references = set()
+        self.__verifying_lock = threading.Lock()
 
-        # don't have to check drives that are full
-        # self.full_target_drives_cache = {}
-        pass
+        # hosts that can't run the batched commands (no python3), these are probed over sftp from then on. A command
+        # that fails otherwise (the connection, a timeout, an error in the script) is tried again next time.
+        self.__command_probe_unavailable_hosts = set()
+        # a hung host doesn't hold a probe thread for longer than the discovery deadline
+        self.__remote_command_timeout_seconds = config.targets.remote.discovery_timeout_seconds if config else RemoteTargetsConfig.discovery_timeout_seconds
+
+        # transfer slots reserved on remote hosts shared with other plotters
+        for remote_host_config in (config.targets.remote.hosts if config else []):
+            if remote_host_config.coordination not in ("none", "lease_files"):
+                raise ValueError("unknown coordination %s for %s" % (remote_host_config.coordination, remote_host_config.hostname))
+        self.transfer_slot_leases = TransferSlotLeases(self.run_remote_python)
+
+    def close(self):
+        # verifications still running decide whether their source is removed, let them finish
+        self.__verification_executor.shutdown(wait=True)
+        self.transfer_slot_leases.close()
+        self.ssh_connection_pool.close_all()
+        self.farm_index.close()
 
     """
     The goal here is to encapsulate all IO access, so things can more easily be tested and mocked.
@@ -32,16 +147,18 @@ class HotplotsIO:
     def get_source_info(self, source_config: SourceConfig) -> SourceInfo:
         logging.info("getting source info %s" % source_config)
         source_drive_infos = []
+        source_plots_by_reference = {}
         for source_drive_config in source_config.drives:
             # find all the plots in the drive
             source_plots = []
-            for source_plot_absolute_reference in glob(os.path.join(source_drive_config.path, "*.plot")):
-                source_plot = SourcePlot(
-                    source_plot_absolute_reference,
-                    os.path.getsize(source_plot_absolute_reference)
-                )
-
+            listing = self.plot_inventory.list_plots(source_drive_config.path, include_finished_plots=True)
+            for (filename, inventory_entry) in listing.finished_plots.items():
+                source_plot_absolute_reference = os.path.join(source_drive_config.path, filename)
+                source_plot = self.__source_plots.get(source_plot_absolute_reference)
+                if source_plot is None or source_plot.size != inventory_entry.size:
+                    source_plot = SourcePlot(source_plot_absolute_reference, inventory_entry.size)
                 source_plots.append(source_plot)
+                source_plots_by_reference[source_plot_absolute_reference] = source_plot
 
             # find out how much space is available on the drive
             usage = shutil.disk_usage(source_drive_config.path)
@@ -56,45 +173,104 @@ class HotplotsIO:
             )
             source_drive_infos.append(source_drive_info)
 
+        self.__source_plots = source_plots_by_reference
         return SourceInfo(
             source_config,
             source_drive_infos
         )
 
-    def get_local_target_info(self, local_target_config: LocalHostConfig) -> LocalTargetsInfo:
-        logging.info("getting local target info for %s" % local_target_config)
-
-        target_disk_infos = []
-        for target_drive_config in local_target_config.drives:
-            usage = shutil.disk_usage(target_drive_config.path)
-            free_bytes = usage.free
-            total_bytes = usage.total
+    def get_targets_info(self, targets_config: TargetsConfig) -> TargetsInfo:
+        """
+        Probes every local drive and every remote host in parallel. Anything that doesn't answer within
+        discovery_timeout_seconds (or fails) is left out of this cycle, so one slow harvester can't hold up pairing
+        for the targets that did answer. A probe that timed out keeps running in the background, and its drive or host
+        isn't probed again until it returns.
+        """
+        local_host_config = targets_config.local
+        remote_targets_config = targets_config.remote
+        timeout_seconds = remote_targets_config.discovery_timeout_seconds
 
-            in_flight_transfer_filenames = [
-                f for f in os.listdir(target_drive_config.path)
-                if f.startswith('.') and '.plot' in f and os.path.isfile(os.path.join(target_drive_config.path, f))
+        thread_pool = ThreadPoolExecutor(
+            max_workers=max(1, len(local_host_config.drives) + len(remote_targets_config.hosts)),
+            thread_name_prefix="hotplots-discovery"
+        )
+        try:
+            local_futures = [
+                (target_drive_config, self.__submit_probe(
+                    thread_pool, target_drive_config, self.__timed_discovery, local_host_config, self.get_local_target_drive_info, target_drive_config
+                ))
+                for target_drive_config in local_host_config.drives
+            ]
+            remote_futures = [
+                (remote_host_config, self.__submit_probe(
+                    thread_pool, TargetHostId.from_(remote_host_config), self.__timed_discovery, remote_host_config, self.get_remote_host_info, remote_host_config
+                ))
+                for remote_host_config in remote_targets_config.hosts
             ]
+            deadline = time.monotonic() + timeout_seconds
 
-            in_flight_transfers = []
-            for in_flight_transfer_filename in in_flight_transfer_filenames:
-                in_flight_transfer_absolute_reference = os.path.join(target_drive_config.path,
-                                                                       in_flight_transfer_filename)
-                current_file_size = os.path.getsize(in_flight_transfer_absolute_reference)
-                in_flight_transfer = InFlightTransfer(
-                    in_flight_transfer_filename,
-                    current_file_size,
-                    PlotNameMetadata.parse_from_filename(in_flight_transfer_filename)
-                )
-                in_flight_transfers.append(in_flight_transfer)
+            target_drive_infos = []
+            for target_drive_config, future in local_futures:
+                if future is None:
+                    logging.warning("local drive %s still hasn't answered an earlier probe, skipping it this cycle" % target_drive_config.path)
+                    continue
+                try:
+                    target_drive_infos.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+                except FutureTimeoutError:
+                    logging.warning("local drive %s didn't answer within %s seconds, skipping it this cycle" % (target_drive_config.path, timeout_seconds))
+                except Exception:
+                    logging.exception("error while getting local drive info for %s, skipping it this cycle" % target_drive_config.path)
 
-            target_disk_info = TargetDriveInfo(
-                target_drive_config,
-                total_bytes,
-                free_bytes,
-                in_flight_transfers
-            )
+            remote_host_infos = []
+            for remote_host_config, future in remote_futures:
+                if future is None:
+                    logging.warning("remote host %s still hasn't answered an earlier probe, marking it unavailable this cycle" % remote_host_config.hostname)
+                    remote_host_infos.append(RemoteHostInfo(remote_host_config, [], available=False))
+                    continue
+                try:
+                    remote_host_infos.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+                except FutureTimeoutError:
+                    logging.warning("remote host %s didn't answer within %s seconds, marking it unavailable this cycle" % (remote_host_config.hostname, timeout_seconds))
+                    remote_host_infos.append(RemoteHostInfo(remote_host_config, [], available=False))
+                except Exception:
+                    logging.exception("error while getting remote info for %s, marking it unavailable this cycle" % remote_host_config.hostname)
+                    remote_host_infos.append(RemoteHostInfo(remote_host_config, [], available=False))
+        finally:
+            # don't wait for probes that timed out, they finish (or fail) in the background
+            thread_pool.shutdown(wait=False)
+
+        local_targets_info = LocalTargetsInfo(local_host_config, target_drive_infos)
+        logging.info("got local target info %s" % local_targets_info)
+
+        return TargetsInfo(
+            targets_config,
+            local_targets_info,
+            RemoteTargetsInfo(remote_targets_config, remote_host_infos)
+        )
+
+    def __submit_probe(self, thread_pool: ThreadPoolExecutor, key: Hashable, probe: Callable, *args) -> Optional[Future]:
+        """
+        Returns None instead if the previous probe with the same key (of a drive or host) is still running, so a hung
+        host ties up one thread, not one more every cycle.
+        """
+        outstanding_probe = self.__outstanding_probes.get(key)
+        if outstanding_probe is not None and not outstanding_probe.done():
+            return None
+        future = thread_pool.submit(probe, *args)
+        self.__outstanding_probes[key] = future
+        return future
+
+    def __timed_discovery(self, host_config: Union[LocalHostConfig, RemoteHostConfig], probe: Callable, probe_config):
+        with self.metrics.target_discovery_seconds.time(host=host_config.get_hostname()):
+            return probe(probe_config)
+
+    def get_local_target_info(self, local_target_config: LocalHostConfig) -> LocalTargetsInfo:
+        logging.info("getting local target info for %s" % local_target_config)
 
-            target_disk_infos.append(target_disk_info)
+        target_disk_infos = [
+            self.get_local_target_drive_info(target_drive_config)
+            for target_drive_config in local_target_config.drives
+        ]
 
         local_target_info = LocalTargetsInfo(
             local_target_config,
@@ -104,49 +280,180 @@ class HotplotsIO:
 
         return local_target_info
 
-    def get_remote_targets_info(self, remote_targets_config: RemoteTargetsConfig) -> RemoteTargetsInfo:
-        remote_host_infos = []
-        for remote_host_config in remote_targets_config.hosts:
-            logging.info("getting remote info for %s" % remote_host_config)
-
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            resolved_ip = socket.gethostbyname(remote_host_config.hostname)
-            client.connect(
-                resolved_ip,
-                port=remote_host_config.port,
-                username=remote_host_config.username
+    def get_local_target_drive_info(self, target_drive_config: TargetDriveConfig) -> TargetDriveInfo:
+        usage = shutil.disk_usage(target_drive_config.path)
+        free_bytes = usage.free
+        total_bytes = usage.total
+
+        full_target_drive_info = self.__full_target_drive_infos.get(target_drive_config)
+        if full_target_drive_info is not None and full_target_drive_info.free_bytes == free_bytes:
+            return full_target_drive_info
+
+        listing = self.plot_inventory.list_plots(target_drive_config.path, include_finished_plots=False)
+
+        now = time.time()
+        in_flight_transfers = [
+            InFlightTransfer(
+                in_flight_transfer_filename,
+                inventory_entry.size,
+                inventory_entry.plot_name_metadata,
+                # a running transfer holds its temporary file locked, however long it goes without writing
+                self.__is_stale_partial(inventory_entry.mtime, now) and
+                not PartialTransfers.is_locked(os.path.join(target_drive_config.path, in_flight_transfer_filename))
             )
+            for (in_flight_transfer_filename, inventory_entry) in listing.partial_plots.items()
+        ]
 
-            sftp = client.open_sftp()
+        target_drive_info = TargetDriveInfo(
+            target_drive_config,
+            total_bytes,
+            free_bytes,
+            in_flight_transfers
+        )
+
+        # a drive that can't take even the smallest plot, with nothing being written to it, stays that way until
+        # something frees up space on it
+        if free_bytes < min(Constants.PLOT_BYTES_BY_K.values()) and not in_flight_transfers:
+            self.__full_target_drive_infos[target_drive_config] = target_drive_info
+        else:
+            self.__full_target_drive_infos.pop(target_drive_config, None)
+
+        return target_drive_info
+
+    def get_remote_targets_info(self, remote_targets_config: RemoteTargetsConfig) -> RemoteTargetsInfo:
+        remote_host_infos = [
+            self.get_remote_host_info(remote_host_config)
+            for remote_host_config in remote_targets_config.hosts
+        ]
+
+        return RemoteTargetsInfo(
+            remote_targets_config,
+            remote_host_infos
+        )
+
+    def run_remote_python(self, remote_host_config: RemoteHostConfig, script: str, *args, timeout: float = None):
+        """
+        Runs one of the RemoteCommands scripts on the host, through its receiver if it has one. Over SSH it's timed
+        out after timeout seconds, the discovery timeout by default.
+        """
+        if remote_host_config.receiver.port:
+            return self.receiver_client.run_python(remote_host_config, script, *args)
+        return RemoteCommands.run_python(
+            self.ssh_connection_pool.get_client(remote_host_config), script, *args,
+            timeout=timeout if timeout is not None else self.__remote_command_timeout_seconds
+        )
+
+    def get_remote_host_info(self, remote_host_config: RemoteHostConfig) -> RemoteHostInfo:
+        logging.info("getting remote info for %s" % remote_host_config)
+
+        remote_host_info = RemoteHostInfo(
+            remote_host_config,
+            self.__get_remote_target_drive_infos(remote_host_config)
+        )
+        logging.info("got remote host info %s" % remote_host_info)
+
+        return remote_host_info
+
+    def __get_remote_target_drive_infos(self, remote_host_config: RemoteHostConfig) -> List[TargetDriveInfo]:
+        target_host_id = TargetHostId.from_(remote_host_config)
+        if remote_host_config.probe_mode == "command" and target_host_id not in self.__command_probe_unavailable_hosts:
+            try:
+                return self.__probe_remote_target_drives_with_command(remote_host_config)
+            except RemoteCommandUnavailableError as e:
+                logging.warning("batched probe of %s is unavailable, falling back to sftp: %s" % (remote_host_config.hostname, e))
+                self.__command_probe_unavailable_hosts.add(target_host_id)
+            except RemoteCommandError as e:
+                # e.g. a dropped connection, the command is tried again next time
+                logging.warning("batched probe of %s failed, probing over sftp this time: %s" % (remote_host_config.hostname, e))
+
+        return self.__probe_remote_target_drives_with_sftp(remote_host_config)
+
+    def __probe_remote_target_drives_with_command(self, remote_host_config: RemoteHostConfig) -> List[TargetDriveInfo]:
+        lease_args = []
+        if remote_host_config.coordination == "lease_files":
+            # the other plotters' reservations come along in the same round trip
+            lease_args = [{"dir": remote_host_config.coordination_directory, "ttl": remote_host_config.lease_ttl_seconds}]
+        result = self.run_remote_python(
+            remote_host_config,
+            RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT,
+            [target_drive_config.path for target_drive_config in remote_host_config.drives],
+            *lease_args
+        )
+
+        target_drive_infos = []
+        for target_drive_config in remote_host_config.drives:
+            drive = result["drives"][target_drive_config.path]
+            if "error" in drive:
+                raise OSError("could not probe %s:%s: %s" % (remote_host_config.hostname, target_drive_config.path, drive["error"]))
+
+            # staleness is judged by the remote clock, the hosts' clocks may not agree
+            in_flight_transfers = [
+                InFlightTransfer(
+                    in_flight_transfer_filename,
+                    current_file_size,
+                    PlotNameMetadata.parse_from_filename(in_flight_transfer_filename),
+                    self.__is_stale_partial(last_modified, result["time"]) and not self.__is_live_remote_partial(
+                        remote_host_config, target_drive_config, in_flight_transfer_filename, result.get("leases", [])
+                    )
+                )
+                for (in_flight_transfer_filename, current_file_size, last_modified) in drive["in_flight"]
+            ]
+            in_flight_transfers.extend(self.__get_leased_transfers(target_drive_config, result.get("leases", []), in_flight_transfers))
+
+            target_drive_infos.append(TargetDriveInfo(
+                target_drive_config,
+                drive["f_blocks"] * drive["f_frsize"],
+                drive["f_bavail"] * drive["f_frsize"],
+                in_flight_transfers
+            ))
+
+        return target_drive_infos
+
+    def __get_leased_transfers(self, target_drive_config: TargetDriveConfig, leases: List[List[str]],
+                               in_flight_transfers: List[InFlightTransfer]) -> List[InFlightTransfer]:
+        """
+        Transfers other plotters reserved a slot on the drive for, but haven't started writing yet, so pairing counts
+        their slot and the whole plot's size as taken.
+        """
+        drive_lease_name = TransferSlotLeases.get_drive_lease_name(target_drive_config)
+        leased_transfers = []
+        for (lease_filename, owner, plot_filename) in leases:
+            # this plotter's own transfers are already counted while they're in flight
+            if owner == self.transfer_slot_leases.owner or TransferSlotLeases.get_lease_name(lease_filename) != drive_lease_name:
+                continue
+            if any(plot_filename in in_flight_transfer.filename for in_flight_transfer in in_flight_transfers):
+                continue
+            try:
+                plot_name_metadata = PlotNameMetadata.parse_from_filename(plot_filename)
+            except ValueError:
+                continue
+            leased_transfers.append(InFlightTransfer("." + plot_filename + "." + lease_filename, 0, plot_name_metadata))
+        return leased_transfers
+
+    def __probe_remote_target_drives_with_sftp(self, remote_host_config: RemoteHostConfig) -> List[TargetDriveInfo]:
+        with self.ssh_connection_pool.sftp(remote_host_config) as sftp:
+            leases = self.__read_leases_with_sftp(sftp, remote_host_config)
             target_drive_infos = []
             for target_drive_config in remote_host_config.drives:
                 stats = sftp.statvfs(target_drive_config.path)
                 free_bytes = stats.f_bavail * stats.f_frsize
                 total_bytes = stats.f_blocks * stats.f_frsize
 
-                in_flight_transfer_filenames = []
-                for filename in sftp.listdir(target_drive_config.path):
-                    if filename.startswith('.') and '.plot' in filename:
-                        filepath = os.path.join(target_drive_config.path, filename)
-                        try:
-                            if sftp.stat(filepath).st_mode & 0o100000:  # S_ISREG
-                                in_flight_transfer_filenames.append(filename)
-                        except FileNotFoundError:
-                            # File might have been deleted between listdir and stat
-                            pass
-
+                # listdir_attr returns the attributes along with the names, so no per-file stat round trips
+                now = time.time()
                 in_flight_transfers = []
-                for in_flight_transfer_filename in in_flight_transfer_filenames:
-                    in_flight_transfer_absolute_reference = os.path.join(target_drive_config.path,
-                                                                           in_flight_transfer_filename)
-                    current_file_size = sftp.stat(in_flight_transfer_absolute_reference).st_size
-                    in_flight_transfer = InFlightTransfer(
-                        in_flight_transfer_filename,
-                        current_file_size,
-                        PlotNameMetadata.parse_from_filename(in_flight_transfer_filename)
-                    )
-                    in_flight_transfers.append(in_flight_transfer)
+                for attr in sftp.listdir_attr(target_drive_config.path):
+                    if attr.filename.startswith('.') and '.plot' in attr.filename and stat.S_ISREG(attr.st_mode):
+                        in_flight_transfer = InFlightTransfer(
+                            attr.filename,
+                            attr.st_size,
+                            PlotNameMetadata.parse_from_filename(attr.filename),
+                            self.__is_stale_partial(attr.st_mtime, now) and not self.__is_live_remote_partial(
+                                remote_host_config, target_drive_config, attr.filename, leases
+                            )
+                        )
+                        in_flight_transfers.append(in_flight_transfer)
+                in_flight_transfers.extend(self.__get_leased_transfers(target_drive_config, leases, in_flight_transfers))
 
                 target_drive_info = TargetDriveInfo(
                     target_drive_config,
@@ -156,22 +463,297 @@ class HotplotsIO:
                 )
                 target_drive_infos.append(target_drive_info)
 
-            sftp.close()
-            client.close()
+        return target_drive_infos
 
-            remote_host_info = RemoteHostInfo(
-                remote_host_config,
-                target_drive_infos
-            )
-            logging.info("got remote host info %s" % remote_host_info)
-            remote_host_infos.append(remote_host_info)
+    @staticmethod
+    def __read_leases_with_sftp(sftp, remote_host_config: RemoteHostConfig) -> List[List[str]]:
+        """
+        The live transfer slot leases on the host, as the probe command lists them, so pairing counts the other
+        plotters' slots without it too. Expiry is judged by this plotter's clock.
+        """
+        if remote_host_config.coordination != "lease_files":
+            return []
+        try:
+            attrs = sftp.listdir_attr(remote_host_config.coordination_directory)
+        except FileNotFoundError:
+            # no plotter has taken a lease yet
+            return []
 
-        return RemoteTargetsInfo(
-            remote_targets_config,
-            remote_host_infos
+        now = time.time()
+        leases = []
+        for attr in attrs:
+            if not attr.filename.endswith(".lease") or now - attr.st_mtime > remote_host_config.lease_ttl_seconds:
+                continue
+            try:
+                with sftp.open(posixpath.join(remote_host_config.coordination_directory, attr.filename), "r") as lease_file:
+                    lease = json.loads(lease_file.read())
+                leases.append([attr.filename, lease["owner"], lease["plot"]])
+            except (OSError, ValueError, KeyError):
+                # gone, or just created and not written yet
+                continue
+        return leases
+
+    def list_plot_files(self, host_config: Union[LocalHostConfig, RemoteHostConfig], directories: List[str]) -> dict[str, List[Tuple[int, str]]]:
+        """
+        (size, path) of the finished plot files in each directory, e.g. to find plots to replace. They come from the farm
+        index, directories not reconciled within farm_index_reconcile_seconds are listed (all the directories of a
+        remote host in one round trip) and reconciled first. A directory that can't be listed is left out.
+        """
+        target_host_id = TargetHostId.from_(host_config)
+        reconciled_since = self.__reconcile_farm_index(host_config, directories)
+        return {
+            directory: self.farm_index.get_plot_files(target_host_id, directory)
+            for directory in directories
+            # reconciled just now, unless it couldn't be listed
+            if self.farm_index.is_reconciled_since(target_host_id, directory, reconciled_since)
+        }
+
+    def find_finished_plots(self, targets_config: TargetsConfig, plot_ids: List[str]) -> dict[str, List[str]]:
+        """
+        Where each of the plots already is on the target drives (as host:path for remote ones), for those that are.
+        Answered by the farm index, after listing the drives not reconciled within farm_index_reconcile_seconds. The
+        hosts are listed in parallel, like get_targets_info probes them, and a host that can't be listed within
+        discovery_timeout_seconds is answered for from what the index already has.
+        """
+        host_configs = [targets_config.local] + targets_config.remote.hosts
+        timeout_seconds = targets_config.remote.discovery_timeout_seconds
+
+        thread_pool = ThreadPoolExecutor(max_workers=len(host_configs), thread_name_prefix="hotplots-discovery")
+        try:
+            futures = [
+                (host_config, self.__submit_probe(
+                    thread_pool, ("plot listing", TargetHostId.from_(host_config)), self.__reconcile_farm_index, host_config, [d.path for d in host_config.drives]
+                ))
+                for host_config in host_configs
+            ]
+            deadline = time.monotonic() + timeout_seconds
+
+            for host_config, future in futures:
+                if future is None:
+                    logging.warning("the plots on %s are still being listed since an earlier cycle" % host_config.get_hostname())
+                    continue
+                try:
+                    future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    logging.warning("could not list the plots on %s within %s seconds" % (host_config.get_hostname(), timeout_seconds))
+                except Exception as e:
+                    logging.warning("could not list the plots on %s: %s" % (host_config.get_hostname(), e))
+        finally:
+            # a listing that timed out finishes in the background, and updates the index for a later cycle
+            thread_pool.shutdown(wait=False)
+        return self.farm_index.find_plots(plot_ids)
+
+    def __reconcile_farm_index(self, host_config: Union[LocalHostConfig, RemoteHostConfig], directories: List[str]) -> float:
+        """
+        Lists and reconciles the directories whose index is too old, and returns since when the index is up to date.
+        """
+        target_host_id = TargetHostId.from_(host_config)
+        reconciled_since = time.time() - self.__farm_index_reconcile_seconds
+        stale_directories = [d for d in directories if not self.farm_index.is_reconciled_since(target_host_id, d, reconciled_since)]
+        if stale_directories:
+            for directory, plot_files in self.__scan_plot_files(host_config, stale_directories).items():
+                self.farm_index.reconcile(target_host_id, directory, plot_files)
+        return reconciled_since
+
+    def __scan_plot_files(self, host_config: Union[LocalHostConfig, RemoteHostConfig], directories: List[str]) -> dict[str, List[Tuple[int, str]]]:
+        if host_config.is_local():
+            plot_files = {}
+            for directory in directories:
+                try:
+                    plot_files[directory] = [
+                        (size, file_path) for (size, file_path) in HotplotsIO.get_files_with_sizes_in_dir(directory)
+                        if file_path.endswith(".plot") and not os.path.basename(file_path).startswith(".")
+                    ]
+                except OSError as e:
+                    logging.warning("could not list plots in %s: %s" % (directory, e))
+            return plot_files
+
+        target_host_id = TargetHostId.from_(host_config)
+        if host_config.probe_mode == "command" and target_host_id not in self.__command_probe_unavailable_hosts:
+            try:
+                return self.__list_remote_plot_files_with_command(host_config, directories)
+            except RemoteCommandUnavailableError as e:
+                logging.warning("batched listing of %s is unavailable, falling back to sftp: %s" % (host_config.hostname, e))
+                self.__command_probe_unavailable_hosts.add(target_host_id)
+            except RemoteCommandError as e:
+                logging.warning("batched listing of %s failed, listing over sftp this time: %s" % (host_config.hostname, e))
+
+        return self.__list_remote_plot_files_with_sftp(host_config, directories)
+
+    def __list_remote_plot_files_with_command(self, remote_host_config: RemoteHostConfig, directories: List[str]) -> dict[str, List[Tuple[int, str]]]:
+        result = self.run_remote_python(remote_host_config, RemoteCommands.LIST_PLOTS_SCRIPT, directories)
+
+        plot_files = {}
+        for directory in directories:
+            listing = result["dirs"][directory]
+            if "error" in listing:
+                logging.warning("could not list plots in %s:%s: %s" % (remote_host_config.hostname, directory, listing["error"]))
+                continue
+            # paths on the harvester are posix paths
+            plot_files[directory] = [(size, posixpath.join(directory, filename)) for (filename, size) in listing["plots"]]
+        return plot_files
+
+    def __list_remote_plot_files_with_sftp(self, remote_host_config: RemoteHostConfig, directories: List[str]) -> dict[str, List[Tuple[int, str]]]:
+        plot_files = {}
+        with self.ssh_connection_pool.sftp(remote_host_config) as sftp:
+            for directory in directories:
+                try:
+                    # listdir_attr returns the attributes along with the names, so no per-file stat round trips
+                    plot_files[directory] = [
+                        (attr.st_size, posixpath.join(directory, attr.filename))
+                        for attr in sftp.listdir_attr(directory)
+                        if attr.filename.endswith(".plot") and not attr.filename.startswith(".") and stat.S_ISREG(attr.st_mode)
+                    ]
+                except OSError as e:
+                    logging.warning("could not list plots in %s:%s: %s" % (remote_host_config.hostname, directory, e))
+        return plot_files
+
+    def read_plot_headers(self, host_config: Union[LocalHostConfig, RemoteHostConfig], plot_paths: List[str]) -> dict[str, PlotHeader]:
+        """
+        The headers of the plot files, by path. Headers are cached by plot id, so only plots not seen before are read,
+        and only their first few KB. A plot whose header can't be read is left out.
+        """
+        plot_headers = {}
+        uncached_plot_paths = []
+        for plot_path in plot_paths:
+            try:
+                plot_header = self.plot_header_cache.get(PlotNameMetadata.parse_from_filename(plot_path).plot_id)
+            except ValueError:
+                # no plot id in the name to look it up by
+                plot_header = None
+            if plot_header is not None:
+                plot_headers[plot_path] = plot_header
+            else:
+                uncached_plot_paths.append(plot_path)
+        if not uncached_plot_paths:
+            return plot_headers
+
+        if host_config.is_local():
+            read_plot_headers = self.__read_local_plot_headers(uncached_plot_paths)
+        else:
+            read_plot_headers = self.__read_remote_plot_headers(host_config, uncached_plot_paths)
+        self.plot_header_cache.put_all(list(read_plot_headers.values()))
+        plot_headers.update(read_plot_headers)
+        self.farm_index.set_plot_headers(plot_headers.values())
+        return plot_headers
+
+    @staticmethod
+    def __read_local_plot_headers(plot_paths: List[str]) -> dict[str, PlotHeader]:
+        plot_headers = {}
+        for plot_path in plot_paths:
+            try:
+                fd = os.open(plot_path, os.O_RDONLY)
+                try:
+                    plot_headers[plot_path] = PlotHeader.parse(os.pread(fd, HEADER_READ_BYTES, 0))
+                finally:
+                    os.close(fd)
+            except (OSError, PlotHeaderError) as e:
+                logging.warning("could not read the plot header of %s: %s" % (plot_path, e))
+        return plot_headers
+
+    def __read_remote_plot_headers(self, remote_host_config: RemoteHostConfig, plot_paths: List[str]) -> dict[str, PlotHeader]:
+        plot_headers = {}
+        with self.ssh_connection_pool.sftp(remote_host_config) as sftp:
+            for plot_path in plot_paths:
+                try:
+                    with sftp.open(plot_path, "rb") as plot_file:
+                        plot_headers[plot_path] = PlotHeader.parse(plot_file.read(HEADER_READ_BYTES))
+                except (OSError, PlotHeaderError) as e:
+                    logging.warning("could not read the plot header of %s:%s: %s" % (remote_host_config.hostname, plot_path, e))
+        return plot_headers
+
+    def __is_stale_partial(self, last_modified: float, now: float) -> bool:
+        # without resuming, a leftover temporary file keeps counting as an in-flight transfer like it always has
+        return self.transfer_config.resume_partial_transfers and \
+            PartialTransfers.is_stale(last_modified, now, self.transfer_config.stale_partial_transfer_seconds)
+
+    def __is_live_remote_partial(self, remote_host_config: RemoteHostConfig, target_drive_config: TargetDriveConfig,
+                                 partial_filename: str, leases: List[List[str]]) -> bool:
+        """
+        Whether a transfer is still writing the remote temporary file, e.g. a throttled one that hasn't written for a
+        while: one of this process' own, or one another plotter holds a lease for. Without lease files, another
+        plotter's transfers are only told apart from leftovers by when they last wrote.
+        """
+        with self.__active_remote_temp_files_lock:
+            if (remote_host_config.hostname, os.path.join(target_drive_config.path, partial_filename)) in self.__active_remote_temp_files:
+                return True
+        drive_lease_name = TransferSlotLeases.get_drive_lease_name(target_drive_config)
+        return any(
+            TransferSlotLeases.get_lease_name(lease_filename) == drive_lease_name and
+            PartialTransfers.is_partial_of(partial_filename, plot_filename)
+            for (lease_filename, _, plot_filename) in leases
         )
 
-    def transfer_plot(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive):
+    def transfer_plot(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive) -> bool:
+        """
+        Returns whether the plot was transferred, rather than left for a later cycle (e.g. no free transfer slot).
+        """
+        if self.__interrupting_transfers.is_set():
+            return False
+        throttle = self.bandwidth_limiter.get_throttle(hot_plot_target_drive)
+
+        # transfers to a host share its link, which the throughput history takes into account
+        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+        self.__count_host_transfers(target_host_id, 1)
+        host = target_host_id.hostname
+        try:
+            transferred = self.__transfer_plot(hot_plot, hot_plot_target_drive, throttle)
+            if transferred:
+                self.metrics.transfers.inc(host=host, result="succeeded")
+            return transferred
+        except TransferInterruptedError:
+            dest = hot_plot_target_drive.target_drive_info.target_drive_config.path
+            if not hot_plot_target_drive.is_local():
+                dest = f"{host}:{dest}"
+            if self.transfer_config.resume_partial_transfers:
+                logging.warning(f"Interrupted the transfer of {hot_plot.source_plot.absolute_reference} to {dest}, it's resumed from its temporary file on the next start")
+            else:
+                logging.warning(f"Interrupted the transfer of {hot_plot.source_plot.absolute_reference} to {dest}")
+            self.metrics.transfers.inc(host=host, result="interrupted")
+            return False
+        except Exception:
+            self.metrics.transfers.inc(host=host, result="failed")
+            raise
+        finally:
+            self.__count_host_transfers(target_host_id, -1)
+            # cold plots planned for a transfer that didn't get as far as making room, e.g. in a dry run
+            with self.__planned_replacements_lock:
+                self.__planned_replacements.pop(hot_plot.source_plot.absolute_reference, None)
+
+    def interrupt_transfers(self):
+        """
+        Stops the running transfers at their next chunk, and any that haven't started yet, for shutting down.
+        """
+        self.__interrupting_transfers.set()
+
+    def __interruptible(self, progress: Callable[[int], None]) -> Callable[[int], None]:
+        """
+        Wraps a copy loop's progress callback, which then stops the copy once transfers are interrupted.
+        """
+        def advance(size: int):
+            if self.__interrupting_transfers.is_set():
+                raise TransferInterruptedError("hotplots is shutting down")
+            progress(size)
+        return advance
+
+    def __count_host_transfers(self, target_host_id: TargetHostId, change: int) -> Tuple[float, float]:
+        """
+        Changes the number of transfers running to the host, and returns (now, the transfers to the host integrated
+        over time up to now). Between two of these, the transfers that ran to the host on average are the difference
+        in transfer seconds over the time in between, however much the transfers overlapped.
+        """
+        with self.__host_transfers_running_lock:
+            now = time.monotonic()
+            changed_at = self.__host_transfers_changed_at.get(target_host_id, now)
+            self.__host_transfer_seconds[target_host_id] += self.__host_transfers_running[target_host_id] * (now - changed_at)
+            self.__host_transfers_changed_at[target_host_id] = now
+            self.__host_transfers_running[target_host_id] += change
+            return now, self.__host_transfer_seconds[target_host_id]
+
+    def __transfer_plot(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, throttle) -> bool:
+        """
+        Returns whether the plot was transferred.
+        """
         source_path = hot_plot.source_plot.absolute_reference
         dest_dir = hot_plot_target_drive.target_drive_info.target_drive_config.path
         source_basename = os.path.basename(source_path)
@@ -180,66 +762,388 @@ class HotplotsIO:
         if hot_plot_target_drive.host_config.is_local():
             logging.info(f"Starting local transfer of {source_path} to {dest_dir}")
             if not dry_run:
-                # Create a temporary file name
-                random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
-                temp_dest_path = os.path.join(dest_dir, f".{source_basename}.{random_suffix}")
-
+                # Create a temporary file name, or pick up the one an interrupted transfer left behind
+                temp_dest_path, resume_offset, temp_file_lock = self.__prepare_local_temp_file(source_path, dest_dir)
                 try:
-                    logging.info(f"Copying to temporary file: {temp_dest_path}")
-                    shutil.copy2(source_path, temp_dest_path)
-                    logging.info(f"Renaming temporary file to final destination: {final_dest_path}")
-                    os.rename(temp_dest_path, final_dest_path)
-                    logging.info(f"Removing source file: {source_path}")
-                    os.remove(source_path)
-                    logging.info(f"Successfully transferred {source_path} to {final_dest_path}")
+                    self.__make_room(
+                        hot_plot,
+                        hot_plot_target_drive,
+                        dest_dir,
+                        hot_plot.source_plot.size - resume_offset,
+                        lambda: shutil.disk_usage(dest_dir).free,
+                        os.path.getsize,
+                        lambda cold_plot_path: HotplotsIO.delete_file(cold_plot_path, True)
+                    )
+
+                    progress = self.transfer_progress.start(hot_plot, hot_plot_target_drive, resume_offset)
+                    try:
+                        logging.info(f"Copying to temporary file: {temp_dest_path} from byte {resume_offset}")
+                        started = self.__count_host_transfers(TargetHostId.from_(hot_plot_target_drive.host_config), 0)
+                        self.local_file_copier.copy(source_path, temp_dest_path, resume_offset, throttle, progress=self.__interruptible(progress.advance))
+                        self.__record_throughput(hot_plot, hot_plot_target_drive, resume_offset, started)
+                        logging.info(f"Renaming temporary file to final destination: {final_dest_path}")
+                        os.rename(temp_dest_path, final_dest_path)
+                        self.farm_index.add_plot(TargetHostId.from_(hot_plot_target_drive.host_config), final_dest_path, hot_plot.source_plot.size)
+                        self.__finish_transfer(hot_plot, hot_plot_target_drive, final_dest_path)
+                        return True
+                    finally:
+                        self.transfer_progress.finish(progress)
                 except Exception as e:
                     logging.error(f"Error during local transfer: {e}")
+                    if self.transfer_config.resume_partial_transfers:
+                        logging.info(f"Leaving temporary file {temp_dest_path} in place to resume from later")
                     # cleanup partial file if it exists
-                    if os.path.exists(temp_dest_path):
+                    elif os.path.exists(temp_dest_path):
                         os.remove(temp_dest_path)
                     raise
+                finally:
+                    self.__release_room(hot_plot, hot_plot_target_drive)
+                    # the temporary file is left to be resumed, or cleaned up, by whichever transfer comes next
+                    os.close(temp_file_lock)
         else:
             logging.info(f"Starting remote transfer of {source_path} to {hot_plot_target_drive.host_config.hostname}:{dest_dir}")
             if not dry_run:
-                client = paramiko.SSHClient()
-                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                resolved_ip = socket.gethostbyname(hot_plot_target_drive.host_config.hostname)
-                sftp = None
+                remote_host_config = hot_plot_target_drive.host_config
+
+                lease = None
+                if remote_host_config.coordination == "lease_files":
+                    try:
+                        lease = self.transfer_slot_leases.acquire(remote_host_config, hot_plot_target_drive.target_drive_info.target_drive_config, source_basename)
+                    except RemoteCommandError as e:
+                        logging.warning(f"could not reserve a transfer slot on {remote_host_config.hostname}, transferring without one: {e}")
+                    else:
+                        if lease is None:
+                            # another plotter took the last slot since the probe, the plot stays for a later cycle
+                            logging.info(f"no free transfer slot on {remote_host_config.hostname}:{dest_dir}, leaving {source_path} for a later cycle")
+                            self.metrics.transfers.inc(host=remote_host_config.hostname, result="no_free_slot")
+                            return False
+
                 try:
-                    client.connect(
-                        resolved_ip,
-                        port=hot_plot_target_drive.host_config.port,
-                        username=hot_plot_target_drive.host_config.username
-                    )
+                    self.__transfer_plot_remote(hot_plot, hot_plot_target_drive, throttle)
+                    return True
+                finally:
+                    if lease is not None:
+                        self.transfer_slot_leases.release(lease)
+        return False
 
-                    sftp = client.open_sftp()
+    def __transfer_plot_remote(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, throttle):
+        source_path = hot_plot.source_plot.absolute_reference
+        dest_dir = hot_plot_target_drive.target_drive_info.target_drive_config.path
+        source_basename = os.path.basename(source_path)
+        remote_host_config = hot_plot_target_drive.host_config
+        remote_final_dest_path = os.path.join(dest_dir, source_basename)
+        remote_transfer_config = remote_host_config.transfer
+        remote_transfer_backend = self.remote_transfer_backends[remote_transfer_config.backend]
 
-                    # Create a temporary file name
-                    random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
-                    remote_temp_dest_path = os.path.join(dest_dir, f".{source_basename}.{random_suffix}")
-                    remote_final_dest_path = os.path.join(dest_dir, source_basename)
+        with self.ssh_connection_pool.sftp(
+                remote_host_config,
+                remote_transfer_config.window_size_bytes,
+                remote_transfer_config.max_packet_size_bytes
+        ) as sftp:
+            # Create a temporary file name, or pick up the one an interrupted transfer left behind
+            remote_temp_dest_path, resume_offset = self.__prepare_remote_temp_file(remote_host_config, sftp, source_path, dest_dir)
+            active_temp_file = (remote_host_config.hostname, remote_temp_dest_path)
+            with self.__active_remote_temp_files_lock:
+                self.__active_remote_temp_files.add(active_temp_file)
+            try:
+                self.__make_room(
+                    hot_plot,
+                    hot_plot_target_drive,
+                    f"{remote_host_config.hostname}:{dest_dir}",
+                    hot_plot.source_plot.size - resume_offset,
+                    lambda: HotplotsIO.__get_sftp_free_bytes(sftp, dest_dir),
+                    lambda cold_plot_path: sftp.stat(cold_plot_path).st_size,
+                    lambda cold_plot_path: HotplotsIO.__delete_remote_file(sftp, cold_plot_path)
+                )
 
-                    logging.info(f"Uploading to temporary file: {remote_temp_dest_path}")
-                    sftp.put(source_path, remote_temp_dest_path)
+                progress = self.transfer_progress.start(hot_plot, hot_plot_target_drive, resume_offset)
+                try:
+                    logging.info(f"Uploading to temporary file: {remote_temp_dest_path} from byte {resume_offset} using {remote_transfer_config.backend}")
+                    started = self.__count_host_transfers(TargetHostId.from_(remote_host_config), 0)
+                    remote_transfer_backend.upload(
+                        remote_host_config, sftp, source_path, remote_temp_dest_path, resume_offset, throttle, progress=self.__interruptible(progress.advance)
+                    )
+                    self.__record_throughput(hot_plot, hot_plot_target_drive, resume_offset, started)
                     logging.info(f"Renaming remote temporary file to final destination: {remote_final_dest_path}")
                     sftp.rename(remote_temp_dest_path, remote_final_dest_path)
-                    logging.info(f"Removing source file: {source_path}")
-                    os.remove(source_path)
-                    logging.info(f"Successfully transferred {source_path} to {hot_plot_target_drive.host_config.hostname}:{remote_final_dest_path}")
+                    self.farm_index.add_plot(TargetHostId.from_(remote_host_config), remote_final_dest_path, hot_plot.source_plot.size)
+                    self.__finish_transfer(hot_plot, hot_plot_target_drive, remote_final_dest_path)
 
                 except Exception as e:
                     logging.error(f"Error during remote transfer: {e}")
+                    if self.transfer_config.resume_partial_transfers:
+                        logging.info(f"Leaving remote temporary file {remote_temp_dest_path} in place to resume from later")
+                        raise
+
                     # Attempt to clean up remote temp file
-                    if sftp:
-                        try:
-                            sftp.remove(remote_temp_dest_path)
-                        except Exception as cleanup_e:
-                            logging.error(f"Failed to cleanup remote temp file {remote_temp_dest_path}: {cleanup_e}")
+                    try:
+                        sftp.remove(remote_temp_dest_path)
+                    except Exception as cleanup_e:
+                        logging.error(f"Failed to cleanup remote temp file {remote_temp_dest_path}: {cleanup_e}")
                     raise
                 finally:
-                    if sftp:
-                        sftp.close()
-                    client.close()
+                    self.transfer_progress.finish(progress)
+            finally:
+                self.__release_room(hot_plot, hot_plot_target_drive)
+                with self.__active_remote_temp_files_lock:
+                    self.__active_remote_temp_files.discard(active_temp_file)
+
+    def __finish_transfer(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, dest_path: str):
+        source_path = hot_plot.source_plot.absolute_reference
+        dest = dest_path if hot_plot_target_drive.is_local() else f"{hot_plot_target_drive.host_config.hostname}:{dest_path}"
+        if self.transfer_config.verify_transfers == "none":
+            logging.info(f"Removing source file: {source_path}")
+            os.remove(source_path)
+            logging.info(f"Successfully transferred {source_path} to {dest}")
+            return
+
+        # verified in the background, so the transfer slot is free for the next plot in the meantime. The source
+        # stays until then, and isn't paired again, see get_verifying_source_references.
+        with self.__verifying_lock:
+            self.__verifying_source_references.add(source_path)
+        logging.info(f"Transferred {source_path} to {dest}, verifying before removing the source")
+        self.__verification_executor.submit(self.__verify_transfer, hot_plot, hot_plot_target_drive, dest_path)
+
+    def get_verifying_source_references(self) -> set[str]:
+        """
+        Source plots whose transfer is being verified. They're already on their target, and are removed once it passes.
+        """
+        with self.__verifying_lock:
+            return set(self.__verifying_source_references)
+
+    def __verify_transfer(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, dest_path: str):
+        source_path = hot_plot.source_plot.absolute_reference
+        try:
+            blocks = self.__get_verification_blocks(hot_plot, hot_plot_target_drive)
+            # both copies are hashed where they live, at the same time
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="hotplots-verify-dest") as dest_hasher:
+                dest_hashes = dest_hasher.submit(self.__hash_dest, hot_plot_target_drive, dest_path, blocks)
+                source_hashes = TransferVerification.hash_local_file(source_path, blocks)
+                dest_hashes = dest_hashes.result()
+
+            if source_hashes == dest_hashes:
+                logging.info(f"Verified {dest_path}, removing source file: {source_path}")
+                os.remove(source_path)
+                return
+
+            logging.error(f"{dest_path} doesn't match its source {source_path}, deleting it so the plot is transferred again")
+            self.__delete_unverified_copy(hot_plot_target_drive, dest_path)
+        except Exception as e:
+            # neither copy is deleted, the duplicate is reported until one of them is
+            logging.error(f"Could not verify {dest_path} against {source_path}, keeping both: {e}")
+        finally:
+            with self.__verifying_lock:
+                self.__verifying_source_references.discard(source_path)
+
+    def __get_verification_blocks(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive) -> Optional[List[Tuple[int, int]]]:
+        """
+        The (offset, length) blocks to compare, or None to compare the whole files.
+        """
+        if self.transfer_config.verify_transfers == "full":
+            if hot_plot_target_drive.is_local() or TargetHostId.from_(hot_plot_target_drive.host_config) not in self.__command_probe_unavailable_hosts:
+                return None
+            # hashing the whole copy over sftp would read it back over the network
+            logging.warning("full verification needs python3 on %s, verifying sampled blocks instead" % hot_plot_target_drive.host_config.hostname)
+        return TransferVerification.get_sample_blocks(
+            hot_plot.source_plot.size, self.transfer_config.verify_sample_blocks, self.transfer_config.verify_sample_block_bytes
+        )
+
+    def __hash_dest(self, hot_plot_target_drive: HotPlotTargetDrive, dest_path: str, blocks: Optional[List[Tuple[int, int]]]) -> List[str]:
+        if hot_plot_target_drive.is_local():
+            return TransferVerification.hash_local_file(dest_path, blocks)
+
+        remote_host_config = hot_plot_target_drive.host_config
+        target_host_id = TargetHostId.from_(remote_host_config)
+        if target_host_id not in self.__command_probe_unavailable_hosts:
+            try:
+                # hashing a whole plot takes a while, as long as the receiver is given for it
+                return self.run_remote_python(
+                    remote_host_config, RemoteCommands.HASH_FILE_SCRIPT, dest_path, blocks,
+                    timeout=remote_host_config.receiver.timeout_seconds
+                )["hashes"]
+            except RemoteCommandError as e:
+                if blocks is None:
+                    raise
+                logging.warning("hashing on %s is unavailable, falling back to sftp: %s" % (remote_host_config.hostname, e))
+
+        with self.ssh_connection_pool.sftp(remote_host_config) as sftp:
+            return TransferVerification.hash_sftp_file(sftp, dest_path, blocks)
+
+    def __delete_unverified_copy(self, hot_plot_target_drive: HotPlotTargetDrive, dest_path: str):
+        if hot_plot_target_drive.is_local():
+            deleted = HotplotsIO.delete_file(dest_path, True)
+        else:
+            with self.ssh_connection_pool.sftp(hot_plot_target_drive.host_config) as sftp:
+                deleted = HotplotsIO.__delete_remote_file(sftp, dest_path)
+        if deleted:
+            self.farm_index.remove_plot(TargetHostId.from_(hot_plot_target_drive.host_config), dest_path)
+
+    def plan_replacement(self, hot_plot: HotPlot, cold_plot_paths: List[str]):
+        """
+        Cold plots the transfer of hot_plot may delete, in order, if its target drive doesn't have room for it.
+        """
+        with self.__planned_replacements_lock:
+            self.__planned_replacements[hot_plot.source_plot.absolute_reference] = cold_plot_paths
+
+    def __make_room(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, dest: str, needed_bytes: int,
+                    get_free_bytes: Callable[[], int], get_size: Callable[[str], int], delete: Callable[[str], bool]):
+        """
+        Deletes the cold plots planned for hot_plot, as many as it takes for the drive to fit needed_bytes on top of
+        what the other running transfers to it are still to write, and reserves needed_bytes until __release_room.
+        """
+        with self.__planned_replacements_lock:
+            cold_plot_paths = self.__planned_replacements.pop(hot_plot.source_plot.absolute_reference, [])
+
+        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+        target_drive_id = TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)
+        with self.__reserved_bytes_lock:
+            make_room_lock = self.__make_room_locks[target_drive_id]
+        # two transfers reading the same free space would each count on the other's deletions
+        with make_room_lock:
+            with self.__reserved_bytes_lock:
+                reserved_bytes = sum(self.__reserved_bytes[target_drive_id].values())
+                self.__reserved_bytes[target_drive_id][hot_plot.source_plot.absolute_reference] = needed_bytes
+            if not cold_plot_paths:
+                return
+
+            # the free space is read just before writing, a failed transfer or deleted file since planning may have made room
+            free_bytes = get_free_bytes() - reserved_bytes
+            for cold_plot_path in cold_plot_paths:
+                if free_bytes >= needed_bytes:
+                    break
+                try:
+                    cold_plot_size = get_size(cold_plot_path)
+                except OSError:
+                    # already gone
+                    self.farm_index.remove_plot(target_host_id, cold_plot_path)
+                    continue
+                logging.info(f"Replacing {cold_plot_path} to make room for {hot_plot.source_plot.absolute_reference}")
+                if delete(cold_plot_path):
+                    self.farm_index.remove_plot(target_host_id, cold_plot_path)
+                    free_bytes += cold_plot_size
+
+            if free_bytes < needed_bytes:
+                logging.warning(f"Only {free_bytes} bytes free in {dest} after replacing plots, {needed_bytes} are needed")
+
+    def __release_room(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive):
+        target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
+        with self.__reserved_bytes_lock:
+            self.__reserved_bytes[target_drive_id].pop(hot_plot.source_plot.absolute_reference, None)
+
+    @staticmethod
+    def __get_sftp_free_bytes(sftp, path: str) -> int:
+        stats = sftp.statvfs(path)
+        return stats.f_bavail * stats.f_frsize
+
+    @staticmethod
+    def __delete_remote_file(sftp, file_path: str) -> bool:
+        logging.info("Deleting remote file " + file_path)
+        try:
+            sftp.remove(file_path)
+            return True
+        except OSError as e:
+            logging.error(f"Failed to delete remote file {file_path}: {e}")
+            return False
+
+    def __record_throughput(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, resume_offset: int,
+                            started: Tuple[float, float]):
+        """
+        started is what __count_host_transfers returned when the transfer started writing.
+        """
+        target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
+        (started_at, host_transfer_seconds_at_start) = started
+        (now, host_transfer_seconds) = self.__count_host_transfers(target_drive_id.target_host_id, 0)
+        (transferred_bytes, seconds) = (hot_plot.source_plot.size - resume_offset, now - started_at)
+        # the transfers that shared the host's link with this one, on average over its whole duration
+        concurrent_host_transfers = (host_transfer_seconds - host_transfer_seconds_at_start) / seconds if seconds > 0 else 1
+        self.throughput_history.record(target_drive_id, transferred_bytes, seconds, concurrent_host_transfers)
+
+        host = target_drive_id.target_host_id.hostname
+        self.metrics.transferred_bytes.inc(transferred_bytes, host=host)
+        self.metrics.transfer_seconds.observe(seconds, host=host)
+        if seconds > 0:
+            self.metrics.transfer_bytes_per_second.observe(transferred_bytes / seconds, host=host)
+
+    @staticmethod
+    def __new_temp_file_path(dest_dir: str, source_basename: str) -> str:
+        random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+        return os.path.join(dest_dir, f".{source_basename}.{random_suffix}")
+
+    def __prepare_local_temp_file(self, source_path: str, dest_dir: str) -> Tuple[str, int, int]:
+        """
+        Returns the temporary file to copy to, the offset to copy from and the file descriptor holding the lock on
+        the temporary file, to close once the transfer is done.
+        """
+        source_basename = os.path.basename(source_path)
+        if not self.transfer_config.resume_partial_transfers:
+            return self.__new_local_temp_file(dest_dir, source_basename)
+
+        # partials a running transfer holds are neither resumed nor removed
+        partial, leftovers = PartialTransfers.select_partial(PartialTransfers.local_partials(dest_dir, source_basename))
+        for (leftover_filename, _) in leftovers:
+            logging.info(f"Removing leftover partial transfer {leftover_filename}")
+            os.remove(os.path.join(dest_dir, leftover_filename))
+        if partial is None:
+            return self.__new_local_temp_file(dest_dir, source_basename)
+
+        (partial_filename, partial_size) = partial
+        partial_path = os.path.join(dest_dir, partial_filename)
+        temp_file_lock = PartialTransfers.lock(partial_path)
+        if temp_file_lock is None:
+            # another transfer picked it up since it was listed
+            return self.__new_local_temp_file(dest_dir, source_basename)
+        try:
+            with open(source_path, "rb") as source_file, open(partial_path, "rb") as partial_file:
+                resume_offset = PartialTransfers.find_resume_offset(
+                    source_file, partial_file, partial_size, os.path.getsize(source_path),
+                    self.transfer_config.resume_verify_bytes
+                )
+        except BaseException:
+            os.close(temp_file_lock)
+            raise
+        logging.info(f"Resuming partial transfer {partial_path} ({partial_size} bytes) from byte {resume_offset}")
+        return partial_path, resume_offset, temp_file_lock
+
+    def __new_local_temp_file(self, dest_dir: str, source_basename: str) -> Tuple[str, int, int]:
+        temp_dest_path = self.__new_temp_file_path(dest_dir, source_basename)
+        return temp_dest_path, 0, PartialTransfers.lock(temp_dest_path)
+
+    def __prepare_remote_temp_file(self, remote_host_config: RemoteHostConfig, sftp, source_path: str, dest_dir: str) -> Tuple[str, int]:
+        source_basename = os.path.basename(source_path)
+        if not self.transfer_config.resume_partial_transfers:
+            return self.__new_temp_file_path(dest_dir, source_basename), 0
+
+        # only stale partials are resumed or removed. One that was written to lately may still be written by another
+        # plotter, or by an upload of an earlier attempt that's still running, there's no lock to tell remotely.
+        now = time.time()
+        stale_partials = []
+        for attr in sftp.listdir_attr(dest_dir):
+            if not PartialTransfers.is_partial_of(attr.filename, source_basename) or not stat.S_ISREG(attr.st_mode):
+                continue
+            with self.__active_remote_temp_files_lock:
+                active = (remote_host_config.hostname, os.path.join(dest_dir, attr.filename)) in self.__active_remote_temp_files
+            if active or not PartialTransfers.is_stale(attr.st_mtime, now, self.transfer_config.stale_partial_transfer_seconds):
+                logging.info(f"Leaving remote partial transfer {attr.filename} alone, it may still be written to")
+                continue
+            stale_partials.append((attr.filename, attr.st_size))
+        partial, leftovers = PartialTransfers.select_partial(stale_partials)
+        for (leftover_filename, _) in leftovers:
+            logging.info(f"Removing leftover remote partial transfer {leftover_filename}")
+            sftp.remove(os.path.join(dest_dir, leftover_filename))
+        if partial is None:
+            return self.__new_temp_file_path(dest_dir, source_basename), 0
+
+        (partial_filename, partial_size) = partial
+        partial_path = os.path.join(dest_dir, partial_filename)
+        with open(source_path, "rb") as source_file, sftp.open(partial_path, "rb") as partial_file:
+            resume_offset = PartialTransfers.find_resume_offset(
+                source_file, partial_file, partial_size, os.path.getsize(source_path),
+                self.transfer_config.resume_verify_bytes
+            )
+        # anything past the last verified byte is rewritten, whichever backend does the upload
+        sftp.truncate(partial_path, resume_offset)
+        logging.info(f"Resuming remote partial transfer {partial_path} ({partial_size} bytes) from byte {resume_offset}")
+        return partial_path, resume_offset
 
     HOTPLOTS_CONFIG_SCHEMA = desert.schema(HotplotsConfig)
 
@@ -274,4 +1178,15 @@ class HotplotsIO:
         with open(filename, "r") as config_file:
             config_file_contents = config_file.read()
         config_objects = yaml.load(config_file_contents, Loader=yaml.SafeLoader)
-        return HotplotsIO.HOTPLOTS_CONFIG_SCHEMA.load(config_objects)
+        config = HotplotsIO.HOTPLOTS_CONFIG_SCHEMA.load(config_objects)
+
+        # state files are kept next to the config, wherever hotplots is started from
+        config_dir = os.path.dirname(os.path.abspath(filename))
+        return dataclasses.replace(config, targets=dataclasses.replace(
+            config.targets,
+            **{
+                name: os.path.join(config_dir, getattr(config.targets, name))
+                for name in ["throughput_history_path", "plot_header_cache_path", "farm_index_path"]
+                if getattr(config.targets, name)
+            }
+        ))
@@ -0,0 +1,142 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import shutil
+from typing import Callable
+
+from hotplots.bandwidth import BandwidthThrottle
+from hotplots.hotplots_config import LocalTransferConfig
+
+# errors meaning "this copy method isn't supported for these two files", as opposed to an actual IO failure
+UNSUPPORTED_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF, errno.ENOTSUP}
+# fallocate mode that reserves the blocks without growing the file, so its size still says how much was written
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def reserve_blocks(fd: int, offset: int, length: int) -> bool:
+    """
+    Reserves the blocks of length bytes from offset, so the drive can lay the file out contiguously and a full drive
+    fails right away, without changing the file's size. The size of a partial transfer keeps saying how much of it
+    was written, which is what it's resumed from. Returns False where the platform or filesystem can't, raises
+    OSError if the drive doesn't have the space.
+    """
+    if length <= 0:
+        return False
+    libc_name = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+    if libc is None or not hasattr(libc, "fallocate"):
+        return False
+    if libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, ctypes.c_longlong(offset), ctypes.c_longlong(length)) != 0:
+        error = ctypes.get_errno()
+        if error not in UNSUPPORTED_COPY_ERRNOS:
+            raise OSError(error, os.strerror(error))
+        logging.debug("preallocation not supported on this filesystem: %s" % os.strerror(error))
+        return False
+    return True
+
+
+class LocalFileCopier:
+    """
+    Copies a plot between local drives without going through python's buffered copy loop. Uses copy_file_range
+    (in-kernel, possibly offloaded by the filesystem), falling back to sendfile and then to a large-buffer
+    pread/pwrite loop. Copied pages are dropped from the page cache behind the copy.
+    """
+    def __init__(self, local_transfer_config: LocalTransferConfig):
+        self.__local_transfer_config = local_transfer_config
+
+    def copy(self, source_path: str, dest_path: str, start_offset: int = 0, throttle: BandwidthThrottle = None,
+             progress: Callable[[int], None] = None):
+        """
+        Copies source_path to dest_path. With a start_offset, dest_path is expected to already hold the first
+        start_offset bytes of the source (from an interrupted copy), and only the rest is copied.
+        With a throttle, every copied chunk is paid for in its token buckets. With progress, it's called with the size
+        of every copied chunk, and can raise to stop the copy.
+        """
+        chunk_size = self.__local_transfer_config.chunk_size_bytes
+
+        with open(source_path, "rb") as source_file, open(dest_path, "r+b" if start_offset else "wb") as dest_file:
+            source_fd = source_file.fileno()
+            dest_fd = dest_file.fileno()
+            size = os.fstat(source_fd).st_size
+            if start_offset:
+                os.ftruncate(dest_fd, start_offset)
+
+            self.__fadvise(source_fd, start_offset, 0, "POSIX_FADV_SEQUENTIAL")
+            if self.__local_transfer_config.preallocate:
+                reserve_blocks(dest_fd, start_offset, size - start_offset)
+
+            copy_methods = [self.__copy_file_range_chunk, self.__sendfile_chunk, self.__pread_pwrite_chunk]
+            buffer = None
+            offset = start_offset
+            while offset < size:
+                count = min(chunk_size, size - offset)
+                try:
+                    copied = copy_methods[0](source_fd, dest_fd, offset, count, buffer)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_COPY_ERRNOS or len(copy_methods) == 1:
+                        raise
+                    copied = 0
+
+                if copied == 0:
+                    if len(copy_methods) == 1:
+                        raise IOError("source %s ended at %s bytes, expected %s" % (source_path, offset, size))
+                    # copy_file_range can also report 0 bytes for filesystems it can't handle, try the next method
+                    copy_methods.pop(0)
+                    logging.debug("falling back to %s for %s" % (copy_methods[0].__name__, source_path))
+                    if copy_methods[0] == self.__pread_pwrite_chunk:
+                        buffer = bytearray(chunk_size)
+                    continue
+
+                if self.__local_transfer_config.drop_page_cache:
+                    self.__drop_page_cache(source_fd, dest_fd, offset, copied, chunk_size, start_offset)
+                if throttle is not None:
+                    throttle.consume(copied)
+                if progress is not None:
+                    progress(copied)
+                offset += copied
+
+            if self.__local_transfer_config.drop_page_cache:
+                os.fdatasync(dest_fd)
+                self.__fadvise(dest_fd, 0, 0, "POSIX_FADV_DONTNEED")
+
+        shutil.copystat(source_path, dest_path)
+
+    @staticmethod
+    def __copy_file_range_chunk(source_fd, dest_fd, offset, count, buffer):
+        if not hasattr(os, "copy_file_range"):
+            raise OSError(errno.ENOSYS, "copy_file_range is not available")
+        return os.copy_file_range(source_fd, dest_fd, count, offset, offset)
+
+    @staticmethod
+    def __sendfile_chunk(source_fd, dest_fd, offset, count, buffer):
+        if not hasattr(os, "sendfile"):
+            raise OSError(errno.ENOSYS, "sendfile is not available")
+        # sendfile writes at the current position of the destination
+        os.lseek(dest_fd, offset, os.SEEK_SET)
+        return os.sendfile(dest_fd, source_fd, offset, count)
+
+    @staticmethod
+    def __pread_pwrite_chunk(source_fd, dest_fd, offset, count, buffer):
+        view = memoryview(buffer)[:count]
+        read = os.preadv(source_fd, [view], offset)
+        written = 0
+        while written < read:
+            written += os.pwrite(dest_fd, view[written:read], offset + written)
+        return read
+
+    @staticmethod
+    def __drop_page_cache(source_fd, dest_fd, offset, copied, chunk_size, start_offset):
+        # source pages are clean and can be dropped right away. For the destination, DONTNEED on dirty pages only
+        # starts their writeback, so the previous chunk (whose writeback was started last time) is dropped now.
+        LocalFileCopier.__fadvise(source_fd, offset, copied, "POSIX_FADV_DONTNEED")
+        LocalFileCopier.__fadvise(dest_fd, offset, copied, "POSIX_FADV_DONTNEED")
+        if offset > start_offset:
+            previous_offset = max(start_offset, offset - chunk_size)
+            LocalFileCopier.__fadvise(dest_fd, previous_offset, offset - previous_offset, "POSIX_FADV_DONTNEED")
+
+    @staticmethod
+    def __fadvise(fd, offset, length, advice_name):
+        if hasattr(os, "posix_fadvise") and hasattr(os, advice_name):
+            os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
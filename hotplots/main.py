@@ -1,27 +1,35 @@
 import logging
-import time
+import sys
 
+from hotplots import receiver
 from hotplots.hotplots_io import HotplotsIO
 from hotplots.hotplots import Hotplots
 from hotplots.hotplots_logging import HotplotsLogging
 
 def main():
-    hotplots_io = HotplotsIO()
+    # `hotplots receive` runs the receiver on a harvester
+    if sys.argv[1:2] == ["receive"]:
+        receiver.main(sys.argv[2:])
+        return
 
     # TODO get config filename from commandline args
-    config = hotplots_io.load_config_file("config-example.yaml")
+    config = HotplotsIO.load_config_file("config-example.yaml")
     HotplotsLogging.initialize_logging(config.logging)
 
+    hotplots_io = HotplotsIO(config)
     hotplots = Hotplots(config, hotplots_io)
 
-    while True:
-        try:
-            hotplots.run()
-        except Exception:
-            logging.exception("error while running hotplots")
+    try:
+        while True:
+            try:
+                hotplots.run()
+            except Exception:
+                logging.exception("error while running hotplots")
 
-        logging.info("sleeping %s seconds" % config.source.check_source_drives_sleep_seconds)
-        time.sleep(config.source.check_source_drives_sleep_seconds)
+            logging.info("sleeping up to %s seconds" % config.source.check_source_drives_sleep_seconds)
+            hotplots.wait_for_next_cycle(config.source.check_source_drives_sleep_seconds)
+    finally:
+        hotplots.shutdown()
 
 if __name__ == '__main__':
     main()
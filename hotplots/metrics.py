@@ -0,0 +1,286 @@
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import MetricsConfig
+from hotplots.models import TargetsInfo
+from hotplots.transfer_progress import TransferProgressSnapshot
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+PHASE_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+TRANSFER_SECONDS_BUCKETS = (60, 300, 600, 1200, 1800, 3600, 7200, 14400)
+TRANSFER_BYTES_PER_SECOND_BUCKETS = tuple(mb * Constants.MEGABYTE for mb in (10, 25, 50, 100, 200, 400, 800, 1600))
+
+
+class _Metric(ABC):
+    """
+    A metric family, with a value per combination of label values. Updates only take a lock and touch a dict, so they
+    can sit on the hot paths.
+    """
+    type_name = None
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _get_key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError("%s takes labels %s, got %s" % (self.name, self.label_names, sorted(labels)))
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for (name, value) in pairs)
+
+    def render(self) -> List[str]:
+        lines = ["# TYPE %s %s" % (self.name, self.type_name), "# HELP %s %s" % (self.name, self.help_text)]
+        with self._lock:
+            values = sorted((key, self._copy_value(value)) for (key, value) in self._values.items())
+        for (key, value) in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _copy_value(self, value):
+        return value
+
+    @abstractmethod
+    def _render_value(self, key: Tuple[str, ...], value) -> List[str]:
+        pass
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._get_key(labels), 0)
+
+    def _render_value(self, key, value):
+        return ["%s_total%s %s" % (self.name, self._format_labels(key), _format_number(value))]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace_all(self, values: List[Tuple[dict, float]]):
+        """
+        Sets the values of a snapshot, dropping those of label values that aren't in it anymore (e.g. a drive that
+        wasn't probed this cycle).
+        """
+        new_values = {self._get_key(labels): value for (labels, value) in values}
+        with self._lock:
+            self._values = new_values
+
+    def get(self, **labels) -> Optional[float]:
+        with self._lock:
+            return self._values.get(self._get_key(labels))
+
+    def _render_value(self, key, value):
+        return ["%s%s %s" % (self.name, self._format_labels(key), _format_number(value))]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            # [count per bucket, sum]
+            observations = self._values.setdefault(key, [[0] * len(self.buckets), 0.0])
+            for (i, upper_bound) in enumerate(self.buckets):
+                if value <= upper_bound:
+                    observations[0][i] += 1
+                    break
+            observations[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get_count(self, **labels) -> int:
+        with self._lock:
+            observations = self._values.get(self._get_key(labels))
+            return sum(observations[0]) if observations else 0
+
+    def _copy_value(self, value):
+        # the bucket counts are updated in place
+        return [list(value[0]), value[1]]
+
+    def _render_value(self, key, value):
+        (bucket_counts, total) = value
+        lines = []
+        cumulative = 0
+        for (upper_bound, count) in zip(self.buckets, bucket_counts):
+            cumulative += count
+            le = "+Inf" if upper_bound == math.inf else _format_number(upper_bound)
+            lines.append("%s_bucket%s %s" % (self.name, self._format_labels(key, [("le", le)]), cumulative))
+        lines.append("%s_count%s %s" % (self.name, self._format_labels(key), cumulative))
+        lines.append("%s_sum%s %s" % (self.name, self._format_labels(key), _format_number(total)))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class HotplotsMetrics:
+    """
+    What hotplots measures about its cycles and transfers, in the OpenMetrics text format.
+    """
+    def __init__(self):
+        self.cycle_phase_seconds = Histogram(
+            "hotplots_cycle_phase_seconds", "Time spent in each phase of a cycle.", PHASE_SECONDS_BUCKETS, ["phase"]
+        )
+        self.target_discovery_seconds = Histogram(
+            "hotplots_target_discovery_seconds", "Time to probe a target host (local for each local drive).",
+            PHASE_SECONDS_BUCKETS, ["host"]
+        )
+        self.transfer_seconds = Histogram(
+            "hotplots_transfer_seconds", "Duration of finished transfers.", TRANSFER_SECONDS_BUCKETS, ["host"]
+        )
+        self.transfer_bytes_per_second = Histogram(
+            "hotplots_transfer_bytes_per_second", "Throughput of finished transfers.", TRANSFER_BYTES_PER_SECOND_BUCKETS, ["host"]
+        )
+        self.transfers = Counter(
+            "hotplots_transfers", "Transfers by how they ended: succeeded, failed, no_free_slot or interrupted.", ["host", "result"]
+        )
+        self.transferred_bytes = Counter(
+            "hotplots_transferred_bytes", "Bytes written to the targets by finished transfers.", ["host"]
+        )
+        self.target_drive_slots_in_use = Gauge(
+            "hotplots_target_drive_slots_in_use", "Transfers into each target drive, from all plotters, as last probed.", ["host", "drive"]
+        )
+        self.target_host_slots_in_use = Gauge(
+            "hotplots_target_host_slots_in_use", "Transfers into each target host, from all plotters, as last probed.", ["host"]
+        )
+        self.target_drive_free_bytes = Gauge(
+            "hotplots_target_drive_free_bytes", "Free bytes of each target drive, as last probed.", ["host", "drive"]
+        )
+        self.transfers_in_flight = Gauge("hotplots_transfers_in_flight", "Transfers this plotter is running.")
+        self.source_plots_waiting = Gauge("hotplots_source_plots_waiting", "Source plots waiting for a transfer.")
+        self.transfer_remaining_bytes = Gauge(
+            "hotplots_transfer_remaining_bytes", "Bytes left to copy of each running transfer.", ["source", "destination"]
+        )
+        self.transfer_current_bytes_per_second = Gauge(
+            "hotplots_transfer_current_bytes_per_second", "Recent rate of each running transfer.", ["source", "destination"]
+        )
+        self.transfer_eta_seconds = Gauge(
+            "hotplots_transfer_eta_seconds", "Estimated time left of each running transfer, at its recent rate.", ["source", "destination"]
+        )
+
+    def record_targets_info(self, targets_info: TargetsInfo):
+        host_infos = [(targets_info.local_targets_info.local_host_config, targets_info.local_targets_info.target_drive_infos)]
+        host_infos += [(h.remote_host_config, h.target_drive_infos) for h in targets_info.remote_targets_info.remote_host_infos if h.available]
+
+        drive_slots, host_slots, free_bytes = [], [], []
+        for (host_config, target_drive_infos) in host_infos:
+            host = host_config.get_hostname()
+            for target_drive_info in target_drive_infos:
+                labels = {"host": host, "drive": target_drive_info.target_drive_config.path}
+                drive_slots.append((labels, len(target_drive_info.in_flight_transfers)))
+                free_bytes.append((labels, target_drive_info.free_bytes))
+            host_slots.append(({"host": host}, sum(len(d.in_flight_transfers) for d in target_drive_infos)))
+        self.target_drive_slots_in_use.replace_all(drive_slots)
+        self.target_host_slots_in_use.replace_all(host_slots)
+        self.target_drive_free_bytes.replace_all(free_bytes)
+
+    def record_transfer_progress(self, snapshots: List[TransferProgressSnapshot]):
+        labels = [({"source": s.source_reference, "destination": s.destination}, s) for s in snapshots]
+        self.transfer_remaining_bytes.replace_all([(l, s.get_remaining_bytes()) for (l, s) in labels])
+        self.transfer_current_bytes_per_second.replace_all([(l, s.current_bytes_per_second) for (l, s) in labels])
+        # transfers without an estimate yet are left out
+        self.transfer_eta_seconds.replace_all([(l, s.eta_seconds) for (l, s) in labels if s.eta_seconds is not None])
+
+    def render(self) -> str:
+        lines = []
+        for metric in [
+            self.cycle_phase_seconds, self.target_discovery_seconds, self.transfer_seconds, self.transfer_bytes_per_second,
+            self.transfers, self.transferred_bytes, self.target_drive_slots_in_use, self.target_host_slots_in_use,
+            self.target_drive_free_bytes, self.transfers_in_flight, self.source_plots_waiting, self.transfer_remaining_bytes,
+            self.transfer_current_bytes_per_second, self.transfer_eta_seconds,
+        ]:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics over http for scraping, on a background thread.
+    """
+    def __init__(self, metrics: HotplotsMetrics, metrics_config: MetricsConfig):
+        self.__metrics = metrics
+        self.__metrics_config = metrics_config
+        self.__server: Optional[ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self) -> int:
+        """
+        Returns the port it listens on.
+        """
+        metrics = self.__metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics request: " + format % args)
+
+        self.__server = ThreadingHTTPServer((self.__metrics_config.bind, self.__metrics_config.port), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="hotplots-metrics", daemon=True)
+        self.__thread.start()
+        port = self.__server.server_address[1]
+        logging.info("serving metrics on http://%s:%s/metrics" % (self.__metrics_config.bind, port))
+        return port
+
+    def close(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__server.server_close()
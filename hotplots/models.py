@@ -49,6 +49,8 @@ class InFlightTransfer:
     filename: str
     current_file_size: int
     plot_name_metadata: PlotNameMetadata
+    # True when the file hasn't been written to in a while, i.e. it was left behind by an interrupted transfer
+    is_stale: bool = False
 
 
 @dataclass(frozen=True)
@@ -94,6 +96,8 @@ class SourceInfo:
 class RemoteHostInfo:
     remote_host_config: RemoteHostConfig
     target_drive_infos: list[TargetDriveInfo]
+    # False when the host didn't answer in time this cycle, in which case target_drive_infos is empty
+    available: bool = True
 
 
 @dataclass(frozen=True)
@@ -0,0 +1,283 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import SourceDriveConfig
+from hotplots.models import HotPlot, HotPlotTargetDrive, TargetHostId
+from hotplots.pairing_state import PairingState
+
+# how many search nodes are visited between looks at the clock
+NODES_PER_CLOCK_CHECK = 256
+
+
+@dataclass
+class _PlotKind:
+    # plots of the same size on the same source drive are interchangeable for the search
+    source_index: int
+    size: int
+    # in the source selection strategy's order, the best ranked plots of a kind are paired first
+    hot_plots: List[HotPlot]
+
+
+@dataclass
+class _SearchDrive:
+    hot_plot_target_drive: HotPlotTargetDrive
+    host_index: int
+    is_remote: bool
+    remaining_transfers: int
+    available_bytes: float
+    # upper bound of the bytes this drive can take
+    capacity: float
+
+
+class PairingOptimizer:
+    """
+    Searches for the pairings of hot plots to target drives that move the most bytes this cycle, under the same
+    capacity and concurrency caps the greedy pairing loop checks. Greedy pairs one plot at a time, so with mixed plot
+    sizes and nearly full drives it can give a small plot the only drive a big one would have fit on.
+
+    The search is a depth first branch and bound over the target drives, tightest first. Each drive gets a multiset of
+    plot kinds (source drive, size) that fits its transfer slots and space, bigger fillings first, and a branch is cut
+    when even filling every remaining drive to its capacity can't beat the best found so far. It stops at the time
+    budget, and its result is only used if it beats the greedy pairings.
+    A plot with a partial copy on a drive it can still go to is paired with that drive up front, as greedy pairing
+    would, and left out of the search, so the transfer resumes instead of starting over somewhere else.
+    """
+    def __init__(self, pairing_state: PairingState, time_budget_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.__pairing_state = pairing_state
+        self.__time_budget_seconds = time_budget_seconds
+        self.__clock = clock
+
+        self.__source_drive_configs: List[SourceDriveConfig] = []
+        self.__source_remaining: List[int] = []
+        self.__kinds: List[_PlotKind] = []
+        self.__kind_remaining: List[int] = []
+        self.__host_remaining: List[int] = []
+        self.__remote_remaining = 0
+        self.__drives: List[_SearchDrive] = []
+        # plots paired up front with the drive holding their partial copy
+        self.__resumed_pairings: List[Tuple[HotPlot, HotPlotTargetDrive]] = []
+
+    def find_better_pairings(self, greedy_pairings: List[Tuple[HotPlot, HotPlotTargetDrive]]) -> Optional[List[Tuple[HotPlot, HotPlotTargetDrive]]]:
+        """
+        Pairings that move more bytes than greedy_pairings, or None if none were found within the time budget.
+        The pairing state must be fresh, with nothing popped or committed yet.
+        """
+        greedy_bytes = sum(hot_plot.source_plot.size for (hot_plot, _) in greedy_pairings)
+        self.__initialize()
+        resumed_bytes = sum(hot_plot.source_plot.size for (hot_plot, _) in self.__resumed_pairings)
+
+        started = self.__clock()
+        (best_bytes, best_choices, complete) = self.__search(greedy_bytes - resumed_bytes, started + self.__time_budget_seconds)
+        logging.info("optimal pairing %s in %.3fs: %s bytes, greedy pairing: %s bytes" % (
+            "searched every assignment" if complete else "ran out of time", self.__clock() - started, resumed_bytes + best_bytes, greedy_bytes
+        ))
+        if best_choices is None:
+            return None
+
+        pairings = self.__to_pairings(best_choices)
+        if not self.__commit_pairings(pairings):
+            logging.warning("optimal pairings didn't pass the pairing checks, using the greedy pairings")
+            return None
+        return self.__resumed_pairings + pairings
+
+    def __initialize(self):
+        pairing_state = self.__pairing_state
+
+        kinds_by_key: dict[Tuple[SourceDriveConfig, int], _PlotKind] = {}
+        source_indices: dict[SourceDriveConfig, int] = {}
+        # plots come out in the source selection strategy's order, and keep it within their kind
+        while pairing_state.get_unprocessed_hot_plots_size() > 0:
+            hot_plot = pairing_state.pop_next_unprocessed_hot_plot()
+            hot_plot_target_drive = pairing_state.find_best_eligible_target_drive(hot_plot)
+            if hot_plot_target_drive is not None and pairing_state.get_resumable_partial_bytes(hot_plot, hot_plot_target_drive) > 0:
+                pairing_state.commit_pairing(hot_plot, hot_plot_target_drive)
+                self.__resumed_pairings.append((hot_plot, hot_plot_target_drive))
+                continue
+
+            source_drive_config = hot_plot.source_drive_info.source_drive_config
+            if source_drive_config not in source_indices:
+                source_indices[source_drive_config] = len(self.__source_drive_configs)
+                self.__source_drive_configs.append(source_drive_config)
+
+            key = (source_drive_config, hot_plot.source_plot.size)
+            if key not in kinds_by_key:
+                kinds_by_key[key] = _PlotKind(source_indices[source_drive_config], hot_plot.source_plot.size, [])
+            kinds_by_key[key].hot_plots.append(hot_plot)
+
+        # what's left of the source drives' slots after the resumed transfers
+        self.__source_remaining = [
+            max(0, pairing_state.get_remaining_source_drive_transfers(source_drive_config)) for source_drive_config in self.__source_drive_configs
+        ]
+        # biggest first, so the first fillings tried for a drive are the fullest
+        self.__kinds = sorted(kinds_by_key.values(), key=lambda kind: -kind.size)
+        self.__kind_remaining = [len(kind.hot_plots) for kind in self.__kinds]
+        self.__remote_remaining = max(0, pairing_state.get_remaining_remote_transfers())
+        if not self.__kinds or self.__remote_remaining == 0:
+            # the remote cap stops every pairing, local ones included
+            return
+
+        smallest_size = self.__kinds[-1].size
+        largest_size = self.__kinds[0].size
+        host_indices: dict[TargetHostId, int] = {}
+        for hot_plot_target_drive in pairing_state.get_all_hot_plot_target_drives():
+            remaining_transfers = min(
+                pairing_state.get_remaining_target_drive_transfers(hot_plot_target_drive),
+                pairing_state.get_remaining_target_host_transfers(hot_plot_target_drive)
+            )
+            available_bytes = pairing_state.get_available_bytes(hot_plot_target_drive)
+            if remaining_transfers <= 0 or available_bytes < smallest_size:
+                continue
+
+            target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+            if target_host_id not in host_indices:
+                host_indices[target_host_id] = len(self.__host_remaining)
+                self.__host_remaining.append(pairing_state.get_remaining_target_host_transfers(hot_plot_target_drive))
+
+            self.__drives.append(_SearchDrive(
+                hot_plot_target_drive,
+                host_indices[target_host_id],
+                not hot_plot_target_drive.is_local(),
+                remaining_transfers,
+                available_bytes,
+                min(available_bytes, remaining_transfers * largest_size)
+            ))
+
+        # the tightest drives have the fewest fillings, deciding them first keeps the search narrow at the top
+        self.__drives.sort(key=lambda drive: drive.available_bytes)
+
+    def __search(self, greedy_bytes: int, deadline: float) -> Tuple[int, Optional[List[Tuple[int, ...]]], bool]:
+        """
+        Returns the most bytes found, the fillings (kind indices) of the first drives that move them, if they beat
+        greedy_bytes, and whether every assignment was searched.
+        """
+        num_drives = len(self.__drives)
+        capacity_from = [0.0] * (num_drives + 1)
+        for i in range(num_drives - 1, -1, -1):
+            capacity_from[i] = capacity_from[i + 1] + self.__drives[i].capacity
+
+        best_bytes = greedy_bytes
+        best_choices: Optional[List[Tuple[int, ...]]] = None
+        current_bytes = 0
+        applied: List[Optional[Tuple[int, ...]]] = [None] * num_drives
+        # one [fillings, next filling] frame per drive being decided
+        stack = [[self.__get_fillings(0), 0]] if num_drives > 0 else []
+        nodes = 0
+
+        while stack:
+            nodes += 1
+            if nodes % NODES_PER_CLOCK_CHECK == 0 and self.__clock() >= deadline:
+                return best_bytes, best_choices, False
+
+            depth = len(stack) - 1
+            if applied[depth] is not None:
+                current_bytes -= self.__apply(depth, applied[depth], -1)
+                applied[depth] = None
+
+            frame = stack[-1]
+            (fillings, next_filling) = frame
+            if next_filling == len(fillings) or current_bytes + min(capacity_from[depth], self.__get_plot_bytes_bound()) <= best_bytes:
+                stack.pop()
+                continue
+
+            frame[1] += 1
+            filling = fillings[next_filling]
+            current_bytes += self.__apply(depth, filling, 1)
+            applied[depth] = filling
+            if current_bytes > best_bytes:
+                best_bytes = current_bytes
+                best_choices = list(applied[:depth + 1])
+            if depth + 1 < num_drives:
+                stack.append([self.__get_fillings(depth + 1), 0])
+
+        return best_bytes, best_choices, True
+
+    def __get_fillings(self, depth: int) -> List[Tuple[int, ...]]:
+        """
+        Every multiset of plot kinds drive depth can take given what's left, fullest first, ending with leaving the
+        drive empty.
+        """
+        drive = self.__drives[depth]
+        max_transfers = min(drive.remaining_transfers, self.__host_remaining[drive.host_index])
+        if drive.is_remote:
+            max_transfers = min(max_transfers, self.__remote_remaining)
+
+        fillings: List[Tuple[int, Tuple[int, ...]]] = []
+        kind_used = [0] * len(self.__kinds)
+        source_used = [0] * len(self.__source_drive_configs)
+
+        def extend(first_kind: int, filling: Tuple[int, ...], filling_bytes: int, largest_size: int):
+            if filling:
+                fillings.append((filling_bytes, filling))
+            if len(filling) == max_transfers:
+                return
+            for kind_index in range(first_kind, len(self.__kinds)):
+                kind = self.__kinds[kind_index]
+                if kind_used[kind_index] >= self.__kind_remaining[kind_index] or source_used[kind.source_index] >= self.__source_remaining[kind.source_index]:
+                    continue
+                if not self.__fits(drive.available_bytes, filling_bytes + kind.size, max(largest_size, kind.size)):
+                    continue
+                kind_used[kind_index] += 1
+                source_used[kind.source_index] += 1
+                extend(kind_index, filling + (kind_index,), filling_bytes + kind.size, max(largest_size, kind.size))
+                kind_used[kind_index] -= 1
+                source_used[kind.source_index] -= 1
+
+        if max_transfers > 0:
+            extend(0, (), 0, 0)
+        fillings.sort(key=lambda f: -f[0])
+        return [filling for (_, filling) in fillings] + [()]
+
+    @staticmethod
+    def __fits(available_bytes: float, filling_bytes: int, largest_size: int) -> bool:
+        # the pairing checks count a drive's bytes in flight with a fudge factor, committing the largest plot last
+        # leaves the most room for it
+        return available_bytes - (filling_bytes - largest_size) * Constants.STAGED_FILES_ERROR_TERM >= largest_size
+
+    def __apply(self, depth: int, filling: Tuple[int, ...], sign: int) -> int:
+        drive = self.__drives[depth]
+        filling_bytes = 0
+        for kind_index in filling:
+            kind = self.__kinds[kind_index]
+            self.__kind_remaining[kind_index] -= sign
+            self.__source_remaining[kind.source_index] -= sign
+            filling_bytes += kind.size
+        self.__host_remaining[drive.host_index] -= sign * len(filling)
+        if drive.is_remote:
+            self.__remote_remaining -= sign * len(filling)
+        return filling_bytes
+
+    def __get_plot_bytes_bound(self) -> int:
+        """
+        The most bytes the plots left could move, taking the biggest plots each source drive still has slots for.
+        """
+        source_slots = list(self.__source_remaining)
+        plot_bytes = 0
+        for kind_index, kind in enumerate(self.__kinds):
+            taken = min(self.__kind_remaining[kind_index], source_slots[kind.source_index])
+            source_slots[kind.source_index] -= taken
+            plot_bytes += taken * kind.size
+        return plot_bytes
+
+    def __to_pairings(self, choices: List[Tuple[int, ...]]) -> List[Tuple[HotPlot, HotPlotTargetDrive]]:
+        next_plot = [0] * len(self.__kinds)
+        pairings = []
+        for depth, filling in enumerate(choices):
+            for kind_index in filling:
+                kind = self.__kinds[kind_index]
+                pairings.append((kind.hot_plots[next_plot[kind_index]], self.__drives[depth].hot_plot_target_drive))
+                next_plot[kind_index] += 1
+        # local pairings first, since reaching the remote cap stops every pairing, and the largest plots last, see __fits
+        return sorted(pairings, key=lambda pairing: (not pairing[1].is_local(), pairing[0].source_plot.size))
+
+    def __commit_pairings(self, pairings: List[Tuple[HotPlot, HotPlotTargetDrive]]) -> bool:
+        """
+        Runs the pairings through the same checks as greedy pairing.
+        """
+        for (hot_plot, hot_plot_target_drive) in pairings:
+            if self.__pairing_state.is_frequency_capped(hot_plot, hot_plot_target_drive) or not self.__pairing_state.has_enough_space(hot_plot, hot_plot_target_drive):
+                return False
+            self.__pairing_state.commit_pairing(hot_plot, hot_plot_target_drive)
+        return True
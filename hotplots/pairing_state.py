@@ -1,19 +1,24 @@
-import random
 from collections import defaultdict
-from typing import Tuple, Union, List
+from typing import Tuple, Union, List, Optional
 
 from hotplots.constants import Constants
 from hotplots.hotplots_config import SourceDriveConfig, LocalHostConfig, RemoteHostConfig, TargetDriveConfig
-from hotplots.models import SourceInfo, TargetsInfo, HotPlot, HotPlotTargetDrive, TargetDriveId, TargetHostId
+from hotplots.models import SourceInfo, TargetsInfo, HotPlot, HotPlotTargetDrive, TargetDriveId, TargetHostId, \
+    TargetDriveInfo, SourceDriveInfo
+from hotplots.plot_ranking import HotPlotRankingQueue
+from hotplots.target_drive_index import TargetDriveIndex
+from hotplots.throughput_history import ThroughputHistory
 
 
 class PairingState:
-    def __init__(self, source_info: SourceInfo, targets_info: TargetsInfo):
+    def __init__(self, source_info: SourceInfo, targets_info: TargetsInfo,
+                 in_flight_pairings: List[Tuple[HotPlot, HotPlotTargetDrive]] = (),
+                 throughput_history: Optional[ThroughputHistory] = None):
         self.__source_info: SourceInfo = source_info
         self.__targets_info: TargetsInfo = targets_info
 
         self.__initially_skipped_hot_plots: List[HotPlot] = []
-        self.__unprocessed_hot_plots: List[HotPlot] = []
+        unprocessed_hot_plots: List[HotPlot] = []
 
         self.__pairings: List[Tuple[HotPlot, HotPlotTargetDrive]] = []
         self.__unpaired_hot_plots_due_to_capping: List[HotPlot] = []
@@ -24,13 +29,19 @@ class PairingState:
         self.__source_drive_bytes_in_flight: dict[SourceDriveConfig, int] = defaultdict(lambda: 0)
         self.__source_drive_transfers_in_flight: dict[SourceDriveConfig, int] = defaultdict(lambda: 0)
 
-        self.__target_host_transfers_in_flight: dict[TargetHostId, int] = defaultdict(lambda: 0)
-
-        self.__target_drive_bytes_in_flight: dict[TargetDriveId, int] = defaultdict(lambda: 0)
-        self.__target_drive_transfers_in_flight: dict[TargetDriveId, int] = defaultdict(lambda: 0)
+        # transfers and bytes in flight to each target drive and host, and which drives are eligible
+        self.__target_drive_index = TargetDriveIndex(
+            self.__targets_info.targets_config.selection_strategy,
+            self.__targets_info.targets_config.target_host_preference,
+            throughput_history
+        )
 
         self.__total_remote_transfers_from_source_host: int = 0
 
+        # bytes already on a target drive from an interrupted transfer of a plot, that a new transfer can resume from.
+        # plot id -> target drive -> bytes
+        self.__resumable_partial_bytes: dict[str, dict[TargetDriveId, int]] = {}
+
         self.__source_drive_config_order_lookup: dict[SourceDriveConfig, int] = {}
         self.__target_drive_config_order_lookup: dict[TargetDriveConfig, int] = {}
 
@@ -38,42 +49,39 @@ class PairingState:
 
         initial_transfers_map: dict[str, Tuple[Union[LocalHostConfig, RemoteHostConfig], TargetDriveConfig]] = {}
 
+        # the exact sizes of the plots this process is transferring, instead of an estimate from their k
+        self.__in_flight_plot_sizes: dict[str, int] = {
+            hot_plot.source_plot.plot_name_metadata().plot_id: hot_plot.source_plot.size for (hot_plot, _) in in_flight_pairings
+        }
+
         # update state w/ local target info
-        target_host_config = self.__targets_info.local_targets_info.local_host_config
-        target_host_id = TargetHostId.from_(target_host_config)
+        local_host_config = self.__targets_info.local_targets_info.local_host_config
         for target_drive_info in self.__targets_info.local_targets_info.target_drive_infos:
-            for in_flight_transfer in target_drive_info.in_flight_transfers:
-                initial_transfers_map[in_flight_transfer.plot_name_metadata.plot_id] = (self.__targets_info.local_targets_info.local_host_config, target_drive_info.target_drive_config)
-                self.__target_host_transfers_in_flight[target_host_id] += 1
-                target_drive_id = TargetDriveId.from_(target_host_id, target_drive_info.target_drive_config)
-                self.__target_drive_bytes_in_flight[target_drive_id] += (Constants.PLOT_BYTES_BY_K[in_flight_transfer.plot_name_metadata.k] - in_flight_transfer.current_file_size)
-
-            hot_plot_target_drive = HotPlotTargetDrive(
-                target_host_config,
-                target_drive_info
-            )
-            self.__all_hot_plot_target_drives.append(hot_plot_target_drive)
+            self.__initialize_target_drive(local_host_config, target_drive_info, initial_transfers_map)
 
         # update state w/ remote target info
         for remote_host_info in self.__targets_info.remote_targets_info.remote_host_infos:
-            target_host_config = remote_host_info.remote_host_config
-            target_host_id = TargetHostId.from_(target_host_config)
             for target_drive_info in remote_host_info.target_drive_infos:
-                for in_flight_transfer in target_drive_info.in_flight_transfers:
-                    initial_transfers_map[in_flight_transfer.plot_name_metadata.plot_id] = (remote_host_info.remote_host_config, target_drive_info.target_drive_config)
-                    self.__target_host_transfers_in_flight[target_host_id] += 1
-                    target_drive_id = TargetDriveId.from_(target_host_id, target_drive_info.target_drive_config)
-                    self.__target_drive_bytes_in_flight[target_drive_id] += (Constants.PLOT_BYTES_BY_K[in_flight_transfer.plot_name_metadata.k] - in_flight_transfer.current_file_size)
-
-                hot_plot_target_drive = HotPlotTargetDrive(
-                    target_host_config,
-                    target_drive_info
-                )
-                self.__all_hot_plot_target_drives.append(hot_plot_target_drive)
+                self.__initialize_target_drive(remote_host_info.remote_host_config, target_drive_info, initial_transfers_map)
+
+        # update state w/ transfers that this process is running right now. Their temporary file may not exist yet
+        # (or the target may not have answered this cycle), so only count them if the target scan didn't already.
+        in_flight_hot_plots_by_plot_id: dict[str, HotPlot] = {}
+        for (hot_plot, hot_plot_target_drive) in in_flight_pairings:
+            plot_id = hot_plot.source_plot.plot_name_metadata().plot_id
+            in_flight_hot_plots_by_plot_id[plot_id] = hot_plot
+            if plot_id in initial_transfers_map:
+                continue
+
+            initial_transfers_map[plot_id] = (hot_plot_target_drive.host_config, hot_plot_target_drive.target_drive_info.target_drive_config)
+            target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+            target_drive_id = TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)
+            self.__target_drive_index.add_transfer(target_drive_id, target_host_id, hot_plot.source_plot.size, exact=True)
 
         # update state w/ source drive info
         for source_info in self.__source_info.source_drive_infos:
             for source_plot in source_info.source_plots:
+                in_flight_hot_plots_by_plot_id.pop(source_plot.plot_name_metadata().plot_id, None)
                 if source_plot.plot_name_metadata().plot_id in initial_transfers_map:
                     (host_config, target_drive_config) = initial_transfers_map[source_plot.plot_name_metadata().plot_id]
                     if not host_config.is_local():
@@ -83,7 +91,51 @@ class PairingState:
                     self.__source_drive_bytes_in_flight[source_info.source_drive_config] += source_plot.size
                     self.__initially_skipped_hot_plots.append(HotPlot(source_info, source_plot))
                 else:
-                    self.__unprocessed_hot_plots.append(HotPlot(source_info, source_plot))
+                    unprocessed_hot_plots.append(HotPlot(source_info, source_plot))
+
+        self.__unprocessed_hot_plots = HotPlotRankingQueue(unprocessed_hot_plots, self.__source_drive_rank_key, self.__hot_plot_rank_key)
+
+        # a live transfer whose source file has already been removed from the source scan (e.g. it's finishing up)
+        # still holds its source drive slot until the executor reports it as done.
+        for plot_id, hot_plot in in_flight_hot_plots_by_plot_id.items():
+            (host_config, _) = initial_transfers_map[plot_id]
+            if not host_config.is_local():
+                self.__total_remote_transfers_from_source_host += 1
+            self.__source_drive_transfers_in_flight[hot_plot.source_drive_info.source_drive_config] += 1
+
+    def __initialize_target_drive(self, target_host_config: Union[LocalHostConfig, RemoteHostConfig], target_drive_info: TargetDriveInfo,
+                                  initial_transfers_map: dict[str, Tuple[Union[LocalHostConfig, RemoteHostConfig], TargetDriveConfig]]):
+        hot_plot_target_drive = HotPlotTargetDrive(
+            target_host_config,
+            target_drive_info
+        )
+        self.__all_hot_plot_target_drives.append(hot_plot_target_drive)
+        indexed_target_drive = self.__target_drive_index.add_target_drive(
+            hot_plot_target_drive,
+            self.__target_drive_config_order_lookup[target_drive_info.target_drive_config]
+        )
+
+        for in_flight_transfer in target_drive_info.in_flight_transfers:
+            plot_id = in_flight_transfer.plot_name_metadata.plot_id
+            if in_flight_transfer.is_stale:
+                # left behind by an interrupted transfer. The plot can be paired again, and resumed on this drive.
+                resumable_partial_bytes = self.__resumable_partial_bytes.setdefault(plot_id, {})
+                resumable_partial_bytes[indexed_target_drive.target_drive_id] = max(
+                    resumable_partial_bytes.get(indexed_target_drive.target_drive_id, 0), in_flight_transfer.current_file_size
+                )
+                continue
+
+            initial_transfers_map[plot_id] = (target_host_config, target_drive_info.target_drive_config)
+            # the temporary file's size was read along with the drive's free space, so what's left of one of this
+            # process's transfers is exact. Other transfers' plot sizes are estimated.
+            plot_size = self.__in_flight_plot_sizes.get(plot_id)
+            self.__target_drive_index.add_transfer(
+                indexed_target_drive.target_drive_id,
+                indexed_target_drive.target_host_id,
+                (plot_size if plot_size is not None else Constants.PLOT_BYTES_BY_K[in_flight_transfer.plot_name_metadata.k])
+                - in_flight_transfer.current_file_size,
+                exact=plot_size is not None
+            )
 
     def commit_pairing(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive):
         self.__pairings.append((hot_plot, hot_plot_target_drive))
@@ -94,13 +146,67 @@ class PairingState:
         source_drive_config = hot_plot.source_drive_info.source_drive_config
         self.__source_drive_transfers_in_flight[source_drive_config] += 1
         self.__source_drive_bytes_in_flight[source_drive_config] += hot_plot.source_plot.size
+        self.__unprocessed_hot_plots.update_drive(source_drive_config)
+
+        indexed_target_drive = self.__target_drive_index.get(hot_plot_target_drive)
+        self.__target_drive_index.add_transfer(
+            indexed_target_drive.target_drive_id,
+            indexed_target_drive.target_host_id,
+            hot_plot.source_plot.size - self.get_resumable_partial_bytes(hot_plot, hot_plot_target_drive)
+        )
+
+    def get_resumable_partial_bytes(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive) -> int:
+        resumable_partial_bytes = self.__resumable_partial_bytes.get(hot_plot.source_plot.plot_name_metadata().plot_id)
+        if not resumable_partial_bytes:
+            return 0
+        return resumable_partial_bytes.get(self.__target_drive_index.get(hot_plot_target_drive).target_drive_id, 0)
+
+    def find_best_eligible_target_drive(self, hot_plot: HotPlot) -> Optional[HotPlotTargetDrive]:
+        """
+        The best ranked target drive that isn't capped and has room for the plot, or None. A drive holding a partial
+        copy of the plot from an interrupted transfer wins, so the transfer can be resumed there.
+        """
+        if self.__is_source_capped(hot_plot):
+            return None
+
+        size = hot_plot.source_plot.size
+        resumable_target_drives = []
+        for (target_drive_id, partial_bytes) in self.__resumable_partial_bytes.get(hot_plot.source_plot.plot_name_metadata().plot_id, {}).items():
+            indexed_target_drive = self.__target_drive_index.get_by_id(target_drive_id)
+            if indexed_target_drive is not None and self.__target_drive_index.is_eligible(indexed_target_drive, size - partial_bytes):
+                resumable_target_drives.append(indexed_target_drive)
+        if resumable_target_drives:
+            return min(
+                resumable_target_drives,
+                key=lambda d: (self.__target_drive_index.get_partition(d),) + self.__target_drive_index.get_rank_key(d)
+            ).hot_plot_target_drive
+
+        indexed_target_drive = self.__target_drive_index.find_best(size)
+        return indexed_target_drive.hot_plot_target_drive if indexed_target_drive is not None else None
+
+    def has_frequency_capped_target_drives(self, hot_plot: HotPlot) -> bool:
+        if self.__is_source_capped(hot_plot):
+            return len(self.__all_hot_plot_target_drives) > 0
+        return self.__target_drive_index.has_capped_target_drives()
+
+    def get_remaining_source_drive_transfers(self, source_drive_config: SourceDriveConfig) -> int:
+        return source_drive_config.max_concurrent_outbound_transfers - self.__source_drive_transfers_in_flight[source_drive_config]
+
+    def get_remaining_remote_transfers(self) -> int:
+        max_concurrent_remote_transfers = self.__targets_info.remote_targets_info.remote_targets_config.max_concurrent_outbound_transfers
+        return max_concurrent_remote_transfers - self.__total_remote_transfers_from_source_host
+
+    def get_remaining_target_drive_transfers(self, hot_plot_target_drive: HotPlotTargetDrive) -> int:
+        indexed_target_drive = self.__target_drive_index.get(hot_plot_target_drive)
+        return hot_plot_target_drive.target_drive_info.target_drive_config.max_concurrent_inbound_transfers - indexed_target_drive.transfers_in_flight
 
-        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
-        self.__target_host_transfers_in_flight[target_host_id] += 1
+    def get_remaining_target_host_transfers(self, hot_plot_target_drive: HotPlotTargetDrive) -> int:
+        indexed_target_drive = self.__target_drive_index.get(hot_plot_target_drive)
+        host_transfers_in_flight = self.__target_drive_index.get_host_transfers_in_flight(indexed_target_drive.target_host_id)
+        return hot_plot_target_drive.host_config.max_concurrent_inbound_transfers - host_transfers_in_flight
 
-        target_drive_id = TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)
-        self.__target_drive_transfers_in_flight[target_drive_id] += 1
-        self.__target_drive_bytes_in_flight[target_drive_id] += hot_plot.source_plot.size
+    def get_available_bytes(self, hot_plot_target_drive: HotPlotTargetDrive) -> float:
+        return self.__target_drive_index.get(hot_plot_target_drive).get_available_bytes()
 
     def get_pairings(self):
         return self.__pairings
@@ -121,85 +227,43 @@ class PairingState:
         return len(self.__unprocessed_hot_plots)
 
     def pop_next_unprocessed_hot_plot(self):
-        self.__unprocessed_hot_plots = self.rank_hot_plots(self.__unprocessed_hot_plots)
-        return self.__unprocessed_hot_plots.pop(0)
+        return self.__unprocessed_hot_plots.pop()
 
     def get_all_hot_plot_target_drives(self) -> List[HotPlotTargetDrive]:
         return self.__all_hot_plot_target_drives
 
     def rank_hot_plots(self, hot_plots: List[HotPlot]) -> List[HotPlot]:
+        return sorted(hot_plots, key=lambda hot_plot: (self.__source_drive_rank_key(hot_plot.source_drive_info), self.__hot_plot_rank_key(hot_plot)))
+
+    def __source_drive_rank_key(self, source_drive_info: SourceDriveInfo):
+        """
+        The part of a hot plot's rank that depends on its source drive. It can change as pairings are committed.
+        """
         selection_strategy = self.__source_info.source_config.selection_strategy
-        if selection_strategy == "plot_with_oldest_timestamp":
-            def key_func(hot_plot: HotPlot):
-                m = hot_plot.source_plot.plot_name_metadata()
-                return m.year, m.month, m.day, m.hour, m.minute
-            return sorted(hot_plots, key=key_func)
-        elif selection_strategy == "drive_with_least_space_remaining":
-            def key_func(hot_plot: HotPlot):
-                bytes_in_flight = self.__source_drive_bytes_in_flight[hot_plot.source_drive_info.source_drive_config]
-                return hot_plot.source_drive_info.free_bytes + bytes_in_flight
-            return sorted(hot_plots, key=key_func)
+        if selection_strategy == "drive_with_least_space_remaining":
+            bytes_in_flight = self.__source_drive_bytes_in_flight[source_drive_info.source_drive_config]
+            return source_drive_info.free_bytes + bytes_in_flight
         elif selection_strategy == "drive_with_lowest_percent_space_remaining":
-            def key_func(hot_plot: HotPlot):
-                bytes_in_flight = self.__source_drive_bytes_in_flight[hot_plot.source_drive_info.source_drive_config]
-                return hot_plot.source_drive_info.total_bytes / (hot_plot.source_drive_info.free_bytes + bytes_in_flight)
-            return sorted(hot_plots, key=key_func)
+            bytes_in_flight = self.__source_drive_bytes_in_flight[source_drive_info.source_drive_config]
+            return source_drive_info.total_bytes / (source_drive_info.free_bytes + bytes_in_flight)
         elif selection_strategy == "config_order":
-            def key_func(hot_plot: HotPlot):
-                return self.__source_drive_config_order_lookup[hot_plot.source_drive_info.source_drive_config]
-            return sorted(hot_plots, key=key_func)
+            return self.__source_drive_config_order_lookup[source_drive_info.source_drive_config]
+        elif selection_strategy in ("plot_with_oldest_timestamp", "random"):
+            return 0
+        raise ValueError("unknown source selection strategy %s" % selection_strategy)
+
+    def __hot_plot_rank_key(self, hot_plot: HotPlot):
+        """
+        The part of a hot plot's rank that only depends on the plot itself.
+        """
+        selection_strategy = self.__source_info.source_config.selection_strategy
+        if selection_strategy == "plot_with_oldest_timestamp":
+            m = hot_plot.source_plot.plot_name_metadata()
+            return m.year, m.month, m.day, m.hour, m.minute
         elif selection_strategy == "random":
-            def key_func(hot_plot: HotPlot):
-                # for random, we'll just sort by the plot_id which is randomly generated under normal circumstances
-                return hot_plot.source_plot.plot_name_metadata().plot_id
-            return sorted(hot_plots, key=key_func)
-
-    def rank_eligible_hot_plot_target_drives(self, eligible_hot_plot_target_drives: List[HotPlotTargetDrive]) -> List[HotPlotTargetDrive]:
-        def naive_rank_hot_plot_target_drives():
-            selection_strategy = self.__targets_info.targets_config.selection_strategy
-            if selection_strategy == "config_order":
-                def key_func(hot_plot_target_drive: HotPlotTargetDrive):
-                    return self.__target_drive_config_order_lookup[hot_plot_target_drive.target_drive_info.target_drive_config]
-                return sorted(eligible_hot_plot_target_drives, key=key_func)
-            elif selection_strategy == "drive_with_least_space_remaining":
-                def key_func(hot_plot_target_drive: HotPlotTargetDrive):
-                    target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
-                    return hot_plot_target_drive.target_drive_info.free_bytes - self.__target_drive_bytes_in_flight[target_drive_id]
-                return sorted(eligible_hot_plot_target_drives, key=key_func)
-            elif selection_strategy == "drive_with_most_space_remaining":
-                def key_func(hot_plot_target_drive: HotPlotTargetDrive):
-                    target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
-                    return hot_plot_target_drive.target_drive_info.free_bytes - self.__target_drive_bytes_in_flight[target_drive_id]
-                return sorted(eligible_hot_plot_target_drives, key=key_func, reverse=True)
-            elif selection_strategy == "drive_with_lowest_percent_space_remaining":
-                def key_func(hot_plot_target_drive: HotPlotTargetDrive):
-                    target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
-                    uncommitted_bytes = hot_plot_target_drive.target_drive_info.free_bytes - self.__target_drive_bytes_in_flight[target_drive_id]
-                    return uncommitted_bytes / hot_plot_target_drive.target_drive_info.total_bytes
-                return sorted(eligible_hot_plot_target_drives, key=key_func)
-            elif selection_strategy == "drive_with_highest_percent_space_remaining":
-                def key_func(hot_plot_target_drive: HotPlotTargetDrive):
-                    target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
-                    uncommitted_bytes = hot_plot_target_drive.target_drive_info.free_bytes - self.__target_drive_bytes_in_flight[target_drive_id]
-                    return uncommitted_bytes / hot_plot_target_drive.target_drive_info.total_bytes
-                return sorted(eligible_hot_plot_target_drives, key=key_func, reverse=True)
-            elif selection_strategy == "random":
-                # TODO: any way to do this pseudo-randomly based for repeatable tests?
-                return sorted(eligible_hot_plot_target_drives, key=lambda x: random.random())
-
-        naive_ranked_hot_plot_target_drives = naive_rank_hot_plot_target_drives()
-
-        if self.__targets_info.targets_config.target_host_preference == "unspecified":
-            return naive_ranked_hot_plot_target_drives
-
-        # partition by local or remote, maintaining naive ranking
-        ranked_local_hot_plot_target_drives = [x for x in naive_ranked_hot_plot_target_drives if x.is_local()]
-        ranked_remote_hot_plot_target_drives = [x for x in naive_ranked_hot_plot_target_drives if not x.is_local()]
-
-        if self.__targets_info.targets_config.target_host_preference == "local":
-            return ranked_local_hot_plot_target_drives + ranked_remote_hot_plot_target_drives
-        elif self.__targets_info.targets_config.target_host_preference == "remote":
-            return ranked_remote_hot_plot_target_drives + ranked_local_hot_plot_target_drives
+            # for random, we'll just sort by the plot_id which is randomly generated under normal circumstances
+            return hot_plot.source_plot.plot_name_metadata().plot_id
+        return 0
 
     def is_frequency_capped(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive):
         """
@@ -209,37 +273,28 @@ class PairingState:
           - target host max inbound transfers
           - target drive max concurrent inbound transfers
         """
-        max_concurrent_remote_transfers = self.__targets_info.remote_targets_info.remote_targets_config.max_concurrent_outbound_transfers
-        if self.__total_remote_transfers_from_source_host >= max_concurrent_remote_transfers:
-            return True
-
-        source_drive_max_concurrent_outbound_transfers = hot_plot.source_drive_info.source_drive_config.max_concurrent_outbound_transfers
-        if self.__source_drive_transfers_in_flight[hot_plot.source_drive_info.source_drive_config] >= source_drive_max_concurrent_outbound_transfers:
+        if self.__is_source_capped(hot_plot):
             return True
 
-        target_host_max_concurrent_inbound_transfers = hot_plot_target_drive.host_config.max_concurrent_inbound_transfers
-        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
-        if self.__target_host_transfers_in_flight[target_host_id] >= target_host_max_concurrent_inbound_transfers:
-            return True
-
-        target_drive_max_concurrent_inbound_transfers = hot_plot_target_drive.target_drive_info.target_drive_config.max_concurrent_inbound_transfers
-        target_drive_id = TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)
-        if self.__target_drive_transfers_in_flight[target_drive_id] >= target_drive_max_concurrent_inbound_transfers:
-            return True
-
-        return False
+        indexed_target_drive = self.__target_drive_index.get(hot_plot_target_drive)
+        return self.__target_drive_index.is_capped(indexed_target_drive)
 
     def has_enough_space(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive):
         # Need to check if the target drive has enough space for the hot_plot, while taking into account
         # active transfers (and some fudge factor because our disk space reading and active transfers size reading
         # don't happen at exactly the same time)
-        target_drive_id = TargetDriveId.from_(TargetHostId.from_(hot_plot_target_drive.host_config), hot_plot_target_drive.target_drive_info.target_drive_config)
-        committed_bytes = self.__target_drive_bytes_in_flight[target_drive_id] * Constants.STAGED_FILES_ERROR_TERM
-        available_bytes = hot_plot_target_drive.target_drive_info.free_bytes - committed_bytes
-        if available_bytes >= hot_plot.source_plot.size:
+        indexed_target_drive = self.__target_drive_index.get(hot_plot_target_drive)
+        # a resumed transfer only needs the bytes that aren't on the drive yet
+        needed_bytes = hot_plot.source_plot.size - self.get_resumable_partial_bytes(hot_plot, hot_plot_target_drive)
+        return indexed_target_drive.get_available_bytes() >= needed_bytes
+
+    def __is_source_capped(self, hot_plot: HotPlot) -> bool:
+        max_concurrent_remote_transfers = self.__targets_info.remote_targets_info.remote_targets_config.max_concurrent_outbound_transfers
+        if self.__total_remote_transfers_from_source_host >= max_concurrent_remote_transfers:
             return True
 
-        return False
+        source_drive_max_concurrent_outbound_transfers = hot_plot.source_drive_info.source_drive_config.max_concurrent_outbound_transfers
+        return self.__source_drive_transfers_in_flight[hot_plot.source_drive_info.source_drive_config] >= source_drive_max_concurrent_outbound_transfers
 
     def __initialize_config_order_lookups(self):
         for source_drive_config in self.__source_info.source_config.drives:
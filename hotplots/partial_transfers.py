@@ -0,0 +1,112 @@
+import fcntl
+import os
+from typing import List, Optional, Tuple
+
+
+class PartialTransfers:
+    """
+    Helpers for resuming a transfer from the temporary file an interrupted transfer left behind.
+    Temporary files are named .<plot filename>.<6 random characters>, in the target drive's directory. A local
+    transfer holds an exclusive flock on its temporary file until it's done, which tells a live transfer's file apart
+    from a leftover one, however long the transfer goes without writing.
+    """
+
+    @staticmethod
+    def is_partial_of(filename: str, source_basename: str) -> bool:
+        return filename.startswith("." + source_basename + ".")
+
+    @staticmethod
+    def select_partial(partials: List[Tuple[str, int]]) -> Tuple[Optional[Tuple[str, int]], List[Tuple[str, int]]]:
+        """
+        Given (filename, size) of every partial of one plot on a drive, returns the one to resume (the largest) and the
+        rest, which are stale leftovers to delete.
+        """
+        if not partials:
+            return None, []
+        ordered = sorted(partials, key=lambda p: p[1], reverse=True)
+        return ordered[0], ordered[1:]
+
+    @staticmethod
+    def find_resume_offset(source_file, partial_file, partial_size: int, source_size: int, verify_bytes: int,
+                           max_windows: int = 4) -> int:
+        """
+        Compares the tail of the partial file against the source, stepping back a window at a time if the very end
+        doesn't match (e.g. a half written last block), and returns the offset up to which the partial is known good.
+        Returns 0 if no good offset is found, in which case the transfer starts over.
+        """
+        end = min(partial_size, source_size)
+        for _ in range(max_windows):
+            start = max(0, end - verify_bytes)
+            if start == end:
+                return 0
+
+            source_file.seek(start)
+            partial_file.seek(start)
+            if PartialTransfers.__read_exactly(source_file, end - start) == PartialTransfers.__read_exactly(partial_file, end - start):
+                return end
+            end = start
+
+        return 0
+
+    @staticmethod
+    def __read_exactly(f, size: int) -> bytes:
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = f.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def is_stale(last_modified: float, now: float, stale_seconds: int) -> bool:
+        return now - last_modified >= stale_seconds
+
+    @staticmethod
+    def local_partials(dest_dir: str, source_basename: str) -> List[Tuple[str, int]]:
+        """
+        (filename, size) of the partials of a plot on a local drive that no running transfer holds.
+        """
+        return [
+            (entry.name, entry.stat().st_size)
+            for entry in os.scandir(dest_dir)
+            if PartialTransfers.is_partial_of(entry.name, source_basename) and entry.is_file(follow_symlinks=False)
+            and not PartialTransfers.is_locked(entry.path)
+        ]
+
+    @staticmethod
+    def lock(path: str) -> Optional[int]:
+        """
+        Opens the temporary file, creating it if needed, and takes the lock a transfer holds on it until it's done.
+        Returns the file descriptor to close once the transfer is done, or None if another transfer holds it.
+        """
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    @staticmethod
+    def is_locked(path: str) -> bool:
+        """
+        Whether a running transfer, of this process or another one, holds the temporary file.
+        """
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            # closing the descriptor drops the shared lock taken to check
+            os.close(fd)
+        return False
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import struct
+import threading
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+# the header, memo included, is a couple hundred bytes, this is plenty and still a single read
+HEADER_READ_BYTES = 4096
+
+V1_MAGIC = b"Proof of Space Plot"
+# bladebit's v2 format, used by compressed plots
+V2_MAGIC = b"PLOT"
+
+PLOT_ID_BYTES = 32
+PUBLIC_KEY_BYTES = 48
+PUZZLE_HASH_BYTES = 32
+MASTER_SK_BYTES = 32
+
+# pool public key, farmer public key, local master secret key
+OG_MEMO_BYTES = PUBLIC_KEY_BYTES + PUBLIC_KEY_BYTES + MASTER_SK_BYTES
+# pool contract puzzle hash, farmer public key, local master secret key
+POOL_MEMO_BYTES = PUZZLE_HASH_BYTES + PUBLIC_KEY_BYTES + MASTER_SK_BYTES
+
+
+class PlotHeaderError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class PlotHeader:
+    # all hex strings, without a 0x prefix
+    plot_id: str
+    k: int
+    farmer_public_key: str
+    # an OG plot has a pool public key, a pool plot has a pool contract puzzle hash instead
+    pool_public_key: Optional[str] = None
+    pool_contract_puzzle_hash: Optional[str] = None
+
+    def is_pool_plot(self) -> bool:
+        return self.pool_contract_puzzle_hash is not None
+
+    @staticmethod
+    def parse(data: bytes) -> "PlotHeader":
+        """
+        Parses the header out of the first bytes of a plot file (at least up to the end of the memo).
+        """
+        reader = _HeaderReader(data)
+        if data.startswith(V1_MAGIC):
+            reader.read(len(V1_MAGIC))
+            plot_id = reader.read(PLOT_ID_BYTES)
+            k = reader.read(1)[0]
+            format_description_length = reader.read_uint16()
+            reader.read(format_description_length)
+        elif data.startswith(V2_MAGIC):
+            reader.read(len(V2_MAGIC))
+            # version, little endian unlike the rest of the header
+            reader.read(4)
+            plot_id = reader.read(PLOT_ID_BYTES)
+            k = reader.read(1)[0]
+        else:
+            raise PlotHeaderError("not a plot file")
+
+        memo = reader.read(reader.read_uint16())
+        if len(memo) == OG_MEMO_BYTES:
+            return PlotHeader(
+                plot_id.hex(), k,
+                farmer_public_key=memo[PUBLIC_KEY_BYTES:2 * PUBLIC_KEY_BYTES].hex(),
+                pool_public_key=memo[:PUBLIC_KEY_BYTES].hex()
+            )
+        elif len(memo) == POOL_MEMO_BYTES:
+            return PlotHeader(
+                plot_id.hex(), k,
+                farmer_public_key=memo[PUZZLE_HASH_BYTES:PUZZLE_HASH_BYTES + PUBLIC_KEY_BYTES].hex(),
+                pool_contract_puzzle_hash=memo[:PUZZLE_HASH_BYTES].hex()
+            )
+        raise PlotHeaderError("unexpected memo length %s" % len(memo))
+
+
+class _HeaderReader:
+    def __init__(self, data: bytes):
+        self.__data = data
+        self.__offset = 0
+
+    def read(self, length: int) -> bytes:
+        if self.__offset + length > len(self.__data):
+            raise PlotHeaderError("header is truncated")
+        value = self.__data[self.__offset:self.__offset + length]
+        self.__offset += length
+        return value
+
+    def read_uint16(self) -> int:
+        return struct.unpack(">H", self.read(2))[0]
+
+
+class PlotHeaderCache:
+    """
+    Plot headers by plot id, kept in a JSON file so each plot's header is only read once, ever. A plot's header never
+    changes, and its id is in its file name, so a cached header is looked up without touching the file.
+    """
+    def __init__(self, path: Optional[str]):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__headers: dict[str, PlotHeader] = {}
+        self.__load()
+
+    def get(self, plot_id: str) -> Optional[PlotHeader]:
+        with self.__lock:
+            return self.__headers.get(plot_id)
+
+    def put_all(self, plot_headers: List[PlotHeader]):
+        if not plot_headers:
+            return
+        with self.__lock:
+            for plot_header in plot_headers:
+                self.__headers[plot_header.plot_id] = plot_header
+            self.__save()
+
+    def __load(self):
+        if not self.__path or not os.path.exists(self.__path):
+            return
+        try:
+            with open(self.__path, "r") as cache_file:
+                contents = json.load(cache_file)
+            self.__headers = {plot_id: PlotHeader(**header) for plot_id, header in contents.get("plots", {}).items()}
+        except (OSError, ValueError, TypeError) as e:
+            # only a cache, the headers can be read again
+            logging.warning("ignoring plot header cache %s, it can't be read: %s" % (self.__path, e))
+
+    def __save(self):
+        if not self.__path:
+            return
+        contents = {"plots": {plot_id: asdict(header) for plot_id, header in self.__headers.items()}}
+        temp_path = self.__path + ".tmp"
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(contents, cache_file, sort_keys=True)
+            os.replace(temp_path, self.__path)
+        except OSError as e:
+            logging.warning("could not save plot header cache to %s: %s" % (self.__path, e))
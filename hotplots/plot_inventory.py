@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from hotplots.models import PlotNameMetadata
+
+# a directory modified this close to its scan may have changed again within the same mtime tick, so its listing can't
+# be trusted on the next scan (the same "racy" problem git has with its index)
+RACY_DIRECTORY_NANOSECONDS = 2_000_000_000
+
+
+@dataclass
+class InventoryEntry:
+    size: int
+    mtime: float
+    plot_name_metadata: PlotNameMetadata
+
+
+@dataclass
+class DirectoryListing:
+    # finished plots (plot-*.plot) and temporary files of transfers into the directory (.plot-*.plot.xxxxxx)
+    finished_plots: dict[str, InventoryEntry] = field(default_factory=dict)
+    partial_plots: dict[str, InventoryEntry] = field(default_factory=dict)
+    includes_finished_plots: bool = False
+    dir_mtime_ns: int = 0
+    trusted: bool = False
+
+
+class PlotInventory:
+    """
+    Incrementally keeps track of the plot files in source and target directories between cycles.
+    A directory is only listed again when its mtime changes (a file was added, removed or renamed). Otherwise only the
+    entries that can still be changing are stat'ed again: temporary files, which grow while their transfer runs, and
+    finished plots that were written to in the last settle_seconds. Parsed plot name metadata is kept per file name.
+    """
+    def __init__(self, settle_seconds: int = 60, clock: Callable[[], float] = time.time):
+        self.__settle_seconds = settle_seconds
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__listings: dict[str, DirectoryListing] = {}
+
+    def list_plots(self, path: str, include_finished_plots: bool) -> DirectoryListing:
+        """
+        Target directories can hold thousands of finished plots, which aren't needed there, so finished plots are
+        only tracked when include_finished_plots is set.
+        """
+        scan_started_ns = time.time_ns()
+        dir_mtime_ns = os.stat(path).st_mtime_ns
+        with self.__lock:
+            cached = self.__listings.get(path)
+
+        if (
+            cached is not None
+            and cached.trusted
+            and cached.dir_mtime_ns == dir_mtime_ns
+            and (cached.includes_finished_plots or not include_finished_plots)
+        ):
+            listing = self.__refresh(path, cached)
+        else:
+            listing = self.__scan(path, include_finished_plots, cached)
+
+        listing.dir_mtime_ns = dir_mtime_ns
+        listing.trusted = listing.trusted and scan_started_ns - dir_mtime_ns > RACY_DIRECTORY_NANOSECONDS
+        with self.__lock:
+            self.__listings[path] = listing
+        return listing
+
+    def __scan(self, path: str, include_finished_plots: bool, cached: Optional[DirectoryListing]) -> DirectoryListing:
+        logging.debug("listing %s" % path)
+        listing = DirectoryListing(includes_finished_plots=include_finished_plots, trusted=True)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                is_partial = entry.name.startswith(".") and ".plot" in entry.name
+                is_finished = not is_partial and include_finished_plots and entry.name.endswith(".plot") and not entry.name.startswith(".")
+                if not (is_partial or is_finished):
+                    continue
+
+                try:
+                    if not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    # removed while listing, the directory mtime will differ next time
+                    continue
+
+                entries_by_name = listing.partial_plots if is_partial else listing.finished_plots
+                cached_entry = None
+                if cached is not None:
+                    cached_entry = (cached.partial_plots if is_partial else cached.finished_plots).get(entry.name)
+
+                plot_name_metadata = cached_entry.plot_name_metadata if cached_entry is not None else self.__parse(path, entry.name)
+                if plot_name_metadata is None:
+                    continue
+                entries_by_name[entry.name] = InventoryEntry(entry_stat.st_size, entry_stat.st_mtime, plot_name_metadata)
+
+        return listing
+
+    def __refresh(self, path: str, cached: DirectoryListing) -> DirectoryListing:
+        now = self.__clock()
+        listing = DirectoryListing(includes_finished_plots=cached.includes_finished_plots, trusted=True)
+        for (entries_by_name, cached_entries_by_name, always_refresh) in [
+            (listing.partial_plots, cached.partial_plots, True),
+            (listing.finished_plots, cached.finished_plots, False),
+        ]:
+            for (name, cached_entry) in cached_entries_by_name.items():
+                if not always_refresh and now - cached_entry.mtime >= self.__settle_seconds:
+                    entries_by_name[name] = cached_entry
+                    continue
+
+                try:
+                    entry_stat = os.stat(os.path.join(path, name))
+                except FileNotFoundError:
+                    # the directory mtime should have changed, don't rely on it next time
+                    listing.trusted = False
+                    continue
+                entries_by_name[name] = InventoryEntry(entry_stat.st_size, entry_stat.st_mtime, cached_entry.plot_name_metadata)
+
+        return listing
+
+    @staticmethod
+    def __parse(path: str, filename: str) -> Optional[PlotNameMetadata]:
+        try:
+            return PlotNameMetadata.parse_from_filename(filename)
+        except ValueError:
+            logging.warning("ignoring %s in %s, its name isn't a plot file name" % (filename, path))
+            return None
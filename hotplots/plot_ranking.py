@@ -0,0 +1,69 @@
+import heapq
+from typing import Any, Callable, List, Tuple
+
+from hotplots.hotplots_config import SourceDriveConfig
+from hotplots.models import HotPlot, SourceDriveInfo
+
+
+class HotPlotRankingQueue:
+    """
+    Priority queue of the hot plots that still need a pairing, in source selection strategy order.
+    A plot's rank is (source drive key, plot key). Drive keys can change while pairing (e.g. with the bytes committed
+    from a drive), plot keys can't. So each source drive keeps its plots in a heap by plot key, and the drives are kept
+    in a heap by (drive key, key of their best plot). When a drive's key changes, a fresh entry is pushed and the old
+    one is recognized as stale (by its version) and skipped when it comes up, so nothing is re-sorted.
+    Remaining ties are broken by the order the plots were added in.
+    """
+    def __init__(
+            self,
+            hot_plots: List[HotPlot],
+            drive_key_func: Callable[[SourceDriveInfo], Any],
+            plot_key_func: Callable[[HotPlot], Any]
+    ):
+        self.__drive_key_func = drive_key_func
+        self.__size = len(hot_plots)
+
+        self.__source_drive_infos: dict[SourceDriveConfig, SourceDriveInfo] = {}
+        self.__plot_heaps: dict[SourceDriveConfig, List[Tuple[Any, int, HotPlot]]] = {}
+        for sequence, hot_plot in enumerate(hot_plots):
+            source_drive_config = hot_plot.source_drive_info.source_drive_config
+            self.__source_drive_infos[source_drive_config] = hot_plot.source_drive_info
+            self.__plot_heaps.setdefault(source_drive_config, []).append((plot_key_func(hot_plot), sequence, hot_plot))
+
+        self.__drive_versions: dict[SourceDriveConfig, int] = {}
+        self.__drive_heap: List[Tuple[Any, Any, int, int, SourceDriveConfig]] = []
+        for source_drive_config, plot_heap in self.__plot_heaps.items():
+            heapq.heapify(plot_heap)
+            self.__push_drive(source_drive_config)
+
+    def __len__(self):
+        return self.__size
+
+    def pop(self) -> HotPlot:
+        while True:
+            (_, _, _, version, source_drive_config) = heapq.heappop(self.__drive_heap)
+            if version == self.__drive_versions[source_drive_config]:
+                break
+
+        (_, _, hot_plot) = heapq.heappop(self.__plot_heaps[source_drive_config])
+        self.__size -= 1
+        self.__push_drive(source_drive_config)
+        return hot_plot
+
+    def update_drive(self, source_drive_config: SourceDriveConfig):
+        """
+        Re-ranks a source drive whose key may have changed.
+        """
+        if source_drive_config in self.__plot_heaps:
+            self.__push_drive(source_drive_config)
+
+    def __push_drive(self, source_drive_config: SourceDriveConfig):
+        version = self.__drive_versions.get(source_drive_config, -1) + 1
+        self.__drive_versions[source_drive_config] = version
+
+        plot_heap = self.__plot_heaps[source_drive_config]
+        if not plot_heap:
+            return
+        (plot_key, sequence, _) = plot_heap[0]
+        # the sequence is unique, so comparisons never get as far as the version or the config
+        heapq.heappush(self.__drive_heap, (self.__drive_key_func(self.__source_drive_infos[source_drive_config]), plot_key, sequence, version, source_drive_config))
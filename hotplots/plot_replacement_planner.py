@@ -0,0 +1,270 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+
+from hotplots.constants import Constants
+from hotplots.hotplots_config import TargetDriveConfig, LocalHostConfig, RemoteHostConfig
+from hotplots.hotplots_io import HotplotsIO
+from hotplots.models import HotPlot, HotPlotTargetDrive, PlotNameMetadata, TargetHostId
+from hotplots.pairing_state import PairingState
+from hotplots.plot_headers import PlotHeader
+
+# replacement types that tell cold plots by their header, rather than by their file name or directory
+HEADER_REPLACEMENT_TYPES = ["pool-key", "farmer-key"]
+
+
+@dataclass
+class PlannedReplacement:
+    hot_plot: HotPlot
+    hot_plot_target_drive: HotPlotTargetDrive
+    # deleted in this order when the transfer starts, only as far as it needs the space
+    cold_plot_paths: List[str]
+
+
+@dataclass
+class _ReplacementDrive:
+    hot_plot_target_drive: HotPlotTargetDrive
+    remaining_transfers: int
+    # free bytes after the transfers already staged to the drive, see PairingState.has_enough_space
+    available_bytes: float
+    # (size, path) of the plots that may be deleted, and aren't planned to be yet
+    cold_plots: List[Tuple[int, str]]
+
+
+class PlotReplacementPlanner:
+    """
+    Plans which cold plots (per each target drive's plot_replacement policy) to give up for the hot plots that don't
+    fit anywhere. The whole plan is made before anything is deleted, counting the bytes and transfers already staged
+    to each drive, and nothing is deleted here. Each transfer deletes its cold plots when it starts, and only as many
+    as it turns out to need, so the farm keeps as many plots as it can for as long as it can.
+    """
+    def __init__(self, pairing_state: PairingState, hotplots_io: HotplotsIO):
+        self.__pairing_state = pairing_state
+        self.__hotplots_io = hotplots_io
+
+    def plan(self, unpaired_hot_plots: List[HotPlot], filled_target_drives: List[HotPlotTargetDrive]) -> List[PlannedReplacement]:
+        pairing_state = self.__pairing_state
+        remaining_remote_transfers = pairing_state.get_remaining_remote_transfers()
+        if remaining_remote_transfers <= 0:
+            # the remote cap stops every pairing, local ones included
+            return []
+
+        # the drives that can take a replacement, and the directory their cold plots are in
+        replaceable_drives: List[Tuple[HotPlotTargetDrive, int, str]] = []
+        for hot_plot_target_drive in filled_target_drives:
+            target_drive_config = hot_plot_target_drive.target_drive_info.target_drive_config
+            if not target_drive_config.plot_replacement.enabled:
+                continue
+
+            remaining_transfers = min(
+                pairing_state.get_remaining_target_drive_transfers(hot_plot_target_drive),
+                pairing_state.get_remaining_target_host_transfers(hot_plot_target_drive)
+            )
+            if remaining_transfers <= 0:
+                continue
+            cold_plot_directory = self.get_cold_plot_directory(target_drive_config)
+            if cold_plot_directory is not None:
+                replaceable_drives.append((hot_plot_target_drive, remaining_transfers, cold_plot_directory))
+
+        plot_files = self.__list_plot_files(replaceable_drives)
+        plot_headers = self.__read_plot_headers(replaceable_drives, plot_files)
+        drives: List[_ReplacementDrive] = []
+        for (hot_plot_target_drive, remaining_transfers, cold_plot_directory) in replaceable_drives:
+            target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+            cold_plots = self.get_cold_plots(
+                hot_plot_target_drive.target_drive_info.target_drive_config,
+                plot_files.get((target_host_id, cold_plot_directory), []),
+                plot_headers.get(target_host_id, {})
+            )
+            if cold_plots:
+                drives.append(_ReplacementDrive(
+                    hot_plot_target_drive, remaining_transfers, pairing_state.get_available_bytes(hot_plot_target_drive), cold_plots
+                ))
+
+        source_remaining_transfers = {}
+        planned_replacements = []
+        # the biggest hot plots are the hardest to place, so they go first (sorted is stable, keeping the rank order)
+        for hot_plot in sorted(unpaired_hot_plots, key=lambda p: -p.source_plot.size):
+            source_drive_config = hot_plot.source_drive_info.source_drive_config
+            if source_drive_config not in source_remaining_transfers:
+                source_remaining_transfers[source_drive_config] = pairing_state.get_remaining_source_drive_transfers(source_drive_config)
+            if source_remaining_transfers[source_drive_config] <= 0:
+                continue
+
+            best: Optional[Tuple[_ReplacementDrive, List[Tuple[int, str]]]] = None
+            for drive in drives:
+                if drive.remaining_transfers <= 0:
+                    continue
+                if not drive.hot_plot_target_drive.is_local() and remaining_remote_transfers <= 0:
+                    continue
+                cold_plots = self.__select_cold_plots(drive, hot_plot.source_plot.size)
+                if cold_plots is None:
+                    continue
+                # give up as few farmed bytes as possible
+                if best is None or sum(size for (size, _) in cold_plots) < sum(size for (size, _) in best[1]):
+                    best = (drive, cold_plots)
+
+            if best is None:
+                continue
+            (drive, cold_plots) = best
+            drive.remaining_transfers -= 1
+            drive.available_bytes += sum(size for (size, _) in cold_plots) - hot_plot.source_plot.size * Constants.STAGED_FILES_ERROR_TERM
+            drive.cold_plots = [cold_plot for cold_plot in drive.cold_plots if cold_plot not in cold_plots]
+            source_remaining_transfers[source_drive_config] -= 1
+            if not drive.hot_plot_target_drive.is_local():
+                remaining_remote_transfers -= 1
+            planned_replacements.append(PlannedReplacement(hot_plot, drive.hot_plot_target_drive, [path for (_, path) in cold_plots]))
+
+        return planned_replacements
+
+    @staticmethod
+    def __select_cold_plots(drive: _ReplacementDrive, hot_plot_size: int) -> Optional[List[Tuple[int, str]]]:
+        """
+        The cold plots to delete for the hot plot to fit, or None if deleting every one of them isn't enough.
+        """
+        shortfall = hot_plot_size - drive.available_bytes
+        if shortfall <= 0:
+            return []
+
+        # the smallest plot that makes enough room on its own
+        for cold_plot in sorted(drive.cold_plots):
+            if cold_plot[0] >= shortfall:
+                return [cold_plot]
+
+        # otherwise as few plots as possible, biggest first
+        cold_plots = []
+        for cold_plot in sorted(drive.cold_plots, reverse=True):
+            cold_plots.append(cold_plot)
+            shortfall -= cold_plot[0]
+            if shortfall <= 0:
+                return cold_plots
+        return None
+
+    def __list_plot_files(self, replaceable_drives: List[Tuple[HotPlotTargetDrive, int, str]]) -> dict[Tuple[TargetHostId, str], List[Tuple[int, str]]]:
+        """
+        Lists the cold plot directories of all drives, one round trip per remote host.
+        """
+        directories_by_host: dict[TargetHostId, Tuple[Union[LocalHostConfig, RemoteHostConfig], List[str]]] = {}
+        for (hot_plot_target_drive, _, cold_plot_directory) in replaceable_drives:
+            host_config = hot_plot_target_drive.host_config
+            (_, directories) = directories_by_host.setdefault(TargetHostId.from_(host_config), (host_config, []))
+            if cold_plot_directory not in directories:
+                directories.append(cold_plot_directory)
+
+        plot_files = {}
+        for target_host_id, (host_config, directories) in directories_by_host.items():
+            try:
+                for directory, files in self.__hotplots_io.list_plot_files(host_config, directories).items():
+                    plot_files[(target_host_id, directory)] = files
+            except Exception:
+                logging.exception("could not list plots to replace on %s" % host_config.get_hostname())
+        return plot_files
+
+    def __read_plot_headers(self, replaceable_drives: List[Tuple[HotPlotTargetDrive, int, str]],
+                            plot_files: dict[Tuple[TargetHostId, str], List[Tuple[int, str]]]) -> dict[TargetHostId, dict[str, PlotHeader]]:
+        """
+        The headers of the listed plots on the drives whose replacement type needs them, by host and path.
+        """
+        plot_paths_by_host: dict[TargetHostId, Tuple[Union[LocalHostConfig, RemoteHostConfig], List[str]]] = {}
+        for (hot_plot_target_drive, _, cold_plot_directory) in replaceable_drives:
+            if hot_plot_target_drive.target_drive_info.target_drive_config.plot_replacement.type not in HEADER_REPLACEMENT_TYPES:
+                continue
+            host_config = hot_plot_target_drive.host_config
+            target_host_id = TargetHostId.from_(host_config)
+            (_, plot_paths) = plot_paths_by_host.setdefault(target_host_id, (host_config, []))
+            plot_paths.extend(path for (_, path) in plot_files.get((target_host_id, cold_plot_directory), []))
+
+        plot_headers = {}
+        for target_host_id, (host_config, plot_paths) in plot_paths_by_host.items():
+            try:
+                plot_headers[target_host_id] = self.__hotplots_io.read_plot_headers(host_config, plot_paths)
+            except Exception:
+                logging.exception("could not read plot headers on %s" % host_config.get_hostname())
+        return plot_headers
+
+    @staticmethod
+    def get_cold_plot_directory(target_drive_config: TargetDriveConfig) -> Optional[str]:
+        """
+        Where the drive's plot_replacement policy looks for plots to delete, or None if the policy is misconfigured.
+        """
+        target_path = target_drive_config.path
+        plot_replacement = target_drive_config.plot_replacement
+        if plot_replacement.type in ["timestamp-before", "k-size"] + HEADER_REPLACEMENT_TYPES:
+            return target_path
+        elif plot_replacement.type == "from-directory":
+            value = plot_replacement.value
+            # confirm that we have the same base dir (doesn't necessarily mean we're on the
+            # same drive for a bad config, but it helps foot-shooting)
+            if not (value.startswith(target_path) or target_path.startswith(value)):
+                logging.warning("Bad config for " + target_path + ", from-directory replacement value " + value + " doesn't have same prefix")
+                return None
+            return value
+
+        logging.warning("unknown plot replacement type %s for %s" % (plot_replacement.type, target_path))
+        return None
+
+    @staticmethod
+    def get_cold_plots(target_drive_config: TargetDriveConfig, plot_files: List[Tuple[int, str]],
+                       plot_headers: dict[str, PlotHeader]) -> List[Tuple[int, str]]:
+        """
+        (size, path) of the plots, out of the drive's cold plot directory, that its plot_replacement policy allows deleting.
+        plot_headers are the headers of the plot files by path, needed by the pool-key and farmer-key types.
+        """
+        plot_replacement = target_drive_config.plot_replacement
+        if plot_replacement.type == "timestamp-before":
+            try:
+                replacement_date = datetime.strptime(plot_replacement.value, "%Y-%m-%d").date()
+            except ValueError:
+                logging.warning("Bad config for " + target_drive_config.path + ", timestamp-before replacement value " + plot_replacement.value + " is not a valid date")
+                return []
+
+            cold_plots = []
+            for size, file_path in plot_files:
+                try:
+                    metadata = PlotNameMetadata.parse_from_filename(file_path)
+                    plot_date = datetime(metadata.year, metadata.month, metadata.day).date()
+                    if plot_date < replacement_date:
+                        cold_plots.append((size, file_path))
+                except ValueError:
+                    # couldn't parse filename, so we can't determine timestamp, skip
+                    continue
+            return cold_plots
+
+        elif plot_replacement.type == "k-size":
+            # the k size is in the name, no need for the header
+            try:
+                k = int(plot_replacement.value)
+            except ValueError:
+                logging.warning("Bad config for " + target_drive_config.path + ", k-size replacement value " + plot_replacement.value + " is not a number")
+                return []
+
+            cold_plots = []
+            for size, file_path in plot_files:
+                try:
+                    if PlotNameMetadata.parse_from_filename(file_path).k == k:
+                        cold_plots.append((size, file_path))
+                except ValueError:
+                    continue
+            return cold_plots
+
+        elif plot_replacement.type in HEADER_REPLACEMENT_TYPES:
+            # keys are configured as hex, as `chia keys show` prints them
+            public_key = plot_replacement.value.lower().removeprefix("0x")
+            cold_plots = []
+            for size, file_path in plot_files:
+                plot_header = plot_headers.get(file_path)
+                if plot_header is None:
+                    # couldn't read the header, so we can't tell which keys the plot is for, skip
+                    continue
+                if plot_replacement.type == "pool-key":
+                    # pool plots have no pool public key, so this only ever picks OG plots
+                    plot_public_key = plot_header.pool_public_key
+                else:
+                    plot_public_key = plot_header.farmer_public_key
+                if plot_public_key == public_key:
+                    cold_plots.append((size, file_path))
+            return cold_plots
+
+        # from-directory: every plot in the directory may go
+        return list(plot_files)
@@ -0,0 +1,352 @@
+import argparse
+import errno
+import hmac
+import json
+import logging
+import mmap
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+from typing import Callable, List, Optional
+
+from hotplots.bandwidth import BandwidthThrottle
+from hotplots.hotplots_config import RemoteHostConfig
+from hotplots.local_copy import reserve_blocks
+from hotplots.remote_commands import RemoteCommands, RemoteCommandError
+from hotplots.ssh_connection_pool import SSHConnectionPool
+
+DEFAULT_PORT = 8459
+# the plotters' default coordination_directory
+DEFAULT_LEASE_DIR = "/tmp/hotplots-leases"
+# the plotters' default receiver timeout_seconds, long enough to hash a whole plot
+DEFAULT_TIMEOUT_SECONDS = 900
+MAX_REQUEST_LINE_BYTES = 1024 * 1024
+# uploads are received into an aligned buffer of this size and written with one call each
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+# O_DIRECT writes need their offset and length aligned to the logical block size, 4096 covers all current drives
+DIRECT_IO_ALIGNMENT = 4096
+
+# the remote commands the receiver runs for the plotter, by name
+SCRIPTS = {
+    "probe_target_drives": RemoteCommands.PROBE_TARGET_DRIVES_SCRIPT,
+    "list_plots": RemoteCommands.LIST_PLOTS_SCRIPT,
+    "hash_file": RemoteCommands.HASH_FILE_SCRIPT,
+    "lease": RemoteCommands.LEASE_SCRIPT,
+}
+SCRIPT_NAMES = {script: name for (name, script) in SCRIPTS.items()}
+# (min, max) number of arguments of each script
+SCRIPT_ARG_COUNTS = {
+    "probe_target_drives": (1, 2),
+    "list_plots": (1, 1),
+    "hash_file": (2, 2),
+    "lease": (1, 1),
+}
+
+
+class ReceiverError(Exception):
+    pass
+
+
+class PlotFileWriter:
+    """
+    Writes an upload into its file on the harvester. The rest of the plot is reserved up front, so the drive can lay it
+    out contiguously and a full drive fails the upload before any of it is sent, and writes bypass the page cache with
+    O_DIRECT where the filesystem supports it, so multi-hundred GB of plot data don't evict what the harvester has
+    cached. Whatever can't be written directly (an unaligned start or end) is written through the page cache.
+    """
+    def __init__(self, path: str, offset: int, length: int, direct_io: bool = True):
+        # a symlink put in place of the file after the path was checked isn't followed off the drive, and an upload
+        # from the start doesn't leave an older, longer file's tail behind
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0) | (os.O_TRUNC if offset == 0 else 0)
+        self.__fd = os.open(path, flags, 0o644)
+        self.__direct_fd = None
+        self.offset = offset
+        try:
+            reserve_blocks(self.__fd, offset, length)
+            if direct_io and hasattr(os, "O_DIRECT"):
+                try:
+                    self.__direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT | getattr(os, "O_NOFOLLOW", 0))
+                except OSError:
+                    # e.g. tmpfs
+                    logging.info("direct I/O is not supported for %s, writing through the page cache" % path)
+        except Exception:
+            os.close(self.__fd)
+            raise
+
+    def get_fill_bytes(self, remaining: int) -> int:
+        """
+        How much to receive into the buffer for the next write, so writes after the first one start aligned.
+        """
+        return min(remaining, WRITE_BUFFER_BYTES - self.offset % DIRECT_IO_ALIGNMENT)
+
+    def write(self, data: memoryview):
+        length = len(data)
+        if self.__direct_fd is not None and self.offset % DIRECT_IO_ALIGNMENT == 0 and length % DIRECT_IO_ALIGNMENT == 0:
+            try:
+                self.__write_fully(self.__direct_fd, data)
+                return
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                logging.info("direct I/O writes are rejected, writing through the page cache instead")
+                os.close(self.__direct_fd)
+                self.__direct_fd = None
+        self.__write_fully(self.__fd, data)
+
+    def close(self):
+        try:
+            os.fsync(self.__fd)
+        finally:
+            if self.__direct_fd is not None:
+                os.close(self.__direct_fd)
+            os.close(self.__fd)
+
+    def __write_fully(self, fd: int, data: memoryview):
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], self.offset + written)
+        self.offset += written
+
+
+class _ReceiverRequestHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        # a client that stops sending (or never starts) is disconnected rather than holding a thread forever
+        self.timeout = self.server.request_timeout_seconds
+        super().setup()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline(MAX_REQUEST_LINE_BYTES))
+            if not hmac.compare_digest(str(request.get("token", "")), self.server.token):
+                raise ReceiverError("invalid token")
+            if request["op"] == "run":
+                response = {"result": self.__run(request["script"], request["args"])}
+            elif request["op"] == "upload":
+                response = {"size": self.__upload(request["path"], request["offset"], request["length"])}
+            else:
+                raise ReceiverError("unknown operation %s" % request["op"])
+        except Exception as e:
+            logging.warning("receiver request from %s failed: %s" % (self.client_address[0], e))
+            response = {"error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+    def __run(self, script_name: str, args: list):
+        if script_name not in SCRIPTS:
+            raise ReceiverError("unknown script %s" % script_name)
+        self.__check_script_args(script_name, args)
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-c", SCRIPTS[script_name]] + [json.dumps(arg) for arg in args],
+                capture_output=True, timeout=self.server.request_timeout_seconds
+            )
+        except subprocess.TimeoutExpired:
+            # e.g. hashing a file on a hung drive
+            raise ReceiverError("%s didn't finish within %s seconds" % (script_name, self.server.request_timeout_seconds))
+        if completed.returncode != 0:
+            raise ReceiverError("%s exited with status %s: %s" % (script_name, completed.returncode, completed.stderr.decode(errors="replace").strip()))
+        return json.loads(completed.stdout)
+
+    def __check_script_args(self, script_name: str, args: list):
+        """
+        The scripts only get to read and write on the receiver's drives and in its lease directory.
+        """
+        (min_count, max_count) = SCRIPT_ARG_COUNTS[script_name]
+        if not isinstance(args, list) or not min_count <= len(args) <= max_count:
+            raise ReceiverError("invalid arguments for %s" % script_name)
+
+        if script_name in ("probe_target_drives", "list_plots"):
+            for path in self.__check_type(args[0], list):
+                self.__check_on_drives(path)
+            if len(args) > 1:
+                self.__check_lease_dir(self.__check_type(args[1], dict).get("dir"))
+        elif script_name == "hash_file":
+            self.__check_on_drives(args[0])
+        elif script_name == "lease":
+            request = self.__check_type(args[0], dict)
+            self.__check_lease_dir(request.get("dir"))
+            for group in self.__check_type(request.get("groups", []), list):
+                name = self.__check_type(group, list)[0] if group else None
+                if not isinstance(name, str) or os.path.basename(name) != name or name in ("", ".", ".."):
+                    raise ReceiverError("invalid lease name %s" % name)
+            for path in self.__check_type(request.get("leases", []), list):
+                self.__check_lease_dir(os.path.dirname(self.__check_type(path, str)))
+
+    @staticmethod
+    def __check_type(value, expected_type: type):
+        if not isinstance(value, expected_type):
+            raise ReceiverError("invalid argument %r" % (value,))
+        return value
+
+    def __check_on_drives(self, path: str):
+        self.__check_type(path, str)
+        # the whole path is resolved, so neither a symlinked directory nor a symlink at the file name leads off the drive
+        real_path = os.path.realpath(path)
+        if not any(real_path == drive or real_path.startswith(drive + os.sep) for drive in self.server.drives):
+            raise ReceiverError("%s is not on one of the receiver's drives" % path)
+
+    def __check_lease_dir(self, path: str):
+        if os.path.realpath(self.__check_type(path, str)) != self.server.lease_dir:
+            raise ReceiverError("%s is not the receiver's lease directory" % path)
+
+    def __upload(self, path: str, offset: int, length: int) -> int:
+        self.__check_on_drives(path)
+
+        writer = PlotFileWriter(path, offset, length, self.server.direct_io)
+        try:
+            # page aligned, as O_DIRECT needs
+            with mmap.mmap(-1, WRITE_BUFFER_BYTES) as buffer:
+                view = memoryview(buffer)
+                try:
+                    remaining = length
+                    while remaining > 0:
+                        fill_bytes = writer.get_fill_bytes(remaining)
+                        received = 0
+                        while received < fill_bytes:
+                            count = self.rfile.readinto(view[received:fill_bytes])
+                            if not count:
+                                raise ReceiverError("connection closed after %s of %s bytes" % (length - remaining + received, length))
+                            received += count
+                        writer.write(view[:fill_bytes])
+                        remaining -= fill_bytes
+                finally:
+                    view.release()
+        finally:
+            writer.close()
+        return os.path.getsize(path)
+
+
+class HotplotsReceiver(socketserver.ThreadingTCPServer):
+    """
+    `hotplots receive`, run on a harvester. It answers the plotters' remote commands (drive probes, plot listings,
+    hashes and transfer slot leases) and takes uploads as a raw byte stream written straight to disk, each over a
+    single connection: either plain TCP, or tunnelled through the plotter's ssh connection to a receiver listening
+    on localhost.
+
+    A request is one JSON line, {"token", "op": "run", "script", "args"} or {"token", "op": "upload", "path",
+    "offset", "length"} followed by length bytes, answered by one JSON line with "result", "size" or "error".
+    Paths outside the drives (and for leases, the lease directory) are refused. A token is required, even on
+    localhost where any local user could connect, unless insecure_no_token says otherwise.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, bind: str, port: int, drives: List[str], token: str = "", direct_io: bool = True,
+                 lease_dir: str = DEFAULT_LEASE_DIR, request_timeout_seconds: int = DEFAULT_TIMEOUT_SECONDS,
+                 insecure_no_token: bool = False):
+        if not token and not insecure_no_token:
+            raise ValueError("a token is needed to receive plots")
+        super().__init__((bind, port), _ReceiverRequestHandler)
+        self.drives = [os.path.realpath(drive) for drive in drives]
+        self.lease_dir = os.path.realpath(lease_dir)
+        self.token = token
+        self.direct_io = direct_io
+        # a request fails when its client sends nothing, or its script doesn't finish, for this long
+        self.request_timeout_seconds = request_timeout_seconds
+
+
+class ReceiverClient:
+    """
+    The plotter's side of `hotplots receive`.
+    """
+    def __init__(self, ssh_connection_pool: SSHConnectionPool):
+        self.__ssh_connection_pool = ssh_connection_pool
+
+    def run_python(self, remote_host_config: RemoteHostConfig, script: str, *args):
+        """
+        Runs one of the RemoteCommands scripts on the host through its receiver. Raises RemoteCommandError like
+        RemoteCommands.run_python, so callers fall back the same way. The receiver runs python3 itself, so it's never
+        unavailable for good, a failing script is tried again next time.
+        Timed out by the host's receiver timeout_seconds.
+        """
+        try:
+            with self.__connect(remote_host_config) as connection:
+                request = {"op": "run", "script": SCRIPT_NAMES[script], "args": list(args)}
+                connection.sendall(self.__encode(remote_host_config, request))
+                return self.__read_response(connection)["result"]
+        except ReceiverError as e:
+            raise RemoteCommandError("the receiver could not run the remote command: %s" % e) from e
+        except OSError as e:
+            raise RemoteCommandError("could not run remote command through the receiver: %s" % e) from e
+
+    def upload(self, remote_host_config: RemoteHostConfig, source_path: str, remote_path: str, offset: int = 0,
+               throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None) -> int:
+        """
+        Uploads the source plot from offset on, returns the size of the remote file afterwards.
+        """
+        length = os.path.getsize(source_path) - offset
+        chunk_size = remote_host_config.transfer.chunk_size_bytes
+        with self.__connect(remote_host_config) as connection, open(source_path, "rb") as source_file:
+            request = {"op": "upload", "path": remote_path, "offset": offset, "length": length}
+            connection.sendall(self.__encode(remote_host_config, request))
+            source_file.seek(offset)
+            while True:
+                data = source_file.read(chunk_size)
+                if not data:
+                    break
+                if throttle is not None:
+                    throttle.consume(len(data))
+                connection.sendall(data)
+                if progress is not None:
+                    progress(len(data))
+            return self.__read_response(connection)["size"]
+
+    def __connect(self, remote_host_config: RemoteHostConfig):
+        receiver_config = remote_host_config.receiver
+        if receiver_config.connection == "direct":
+            # a receiver that hangs fails the request, rather than the probe or transfer waiting on it forever
+            connection = socket.create_connection((remote_host_config.hostname, receiver_config.port), receiver_config.timeout_seconds)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return connection
+        # the receiver only listens on the harvester's localhost, reached through the ssh connection
+        transport = self.__ssh_connection_pool.get_client(remote_host_config).get_transport()
+        channel = transport.open_channel(
+            "direct-tcpip", ("127.0.0.1", receiver_config.port), ("127.0.0.1", 0),
+            window_size=remote_host_config.transfer.window_size_bytes,
+            max_packet_size=remote_host_config.transfer.max_packet_size_bytes,
+            timeout=receiver_config.timeout_seconds
+        )
+        channel.settimeout(receiver_config.timeout_seconds)
+        return channel
+
+    @staticmethod
+    def __encode(remote_host_config: RemoteHostConfig, request: dict) -> bytes:
+        return json.dumps(dict(request, token=remote_host_config.receiver.token)).encode() + b"\n"
+
+    @staticmethod
+    def __read_response(connection) -> dict:
+        line = b""
+        while not line.endswith(b"\n"):
+            data = connection.recv(4096)
+            if not data:
+                raise ConnectionError("connection closed before the receiver answered")
+            line += data
+        response = json.loads(line)
+        if "error" in response:
+            raise ReceiverError(response["error"])
+        return response
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="hotplots receive", description="Receives plots from hotplots on a harvester.")
+    parser.add_argument("--drive", action="append", required=True, help="directory plots may be uploaded to, repeatable")
+    parser.add_argument("--bind", default="127.0.0.1", help="address to listen on, localhost is enough for ssh tunnelled connections")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=os.environ.get("HOTPLOTS_RECEIVER_TOKEN", ""), help="shared secret the plotters send along")
+    parser.add_argument("--insecure-no-token", action="store_true",
+                        help="accept requests without a token, from anyone who can connect (on localhost, any local user)")
+    parser.add_argument("--lease-dir", default=DEFAULT_LEASE_DIR, help="the plotters' coordination_directory")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT_SECONDS,
+                        help="seconds a client may send nothing, or a remote command may run, before its request fails")
+    parser.add_argument("--no-direct-io", action="store_true", help="write through the page cache")
+    options = parser.parse_args(args)
+    if not options.token and not options.insecure_no_token:
+        parser.error("--token (or HOTPLOTS_RECEIVER_TOKEN) is needed, or --insecure-no-token")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    with HotplotsReceiver(options.bind, options.port, options.drive, options.token, not options.no_direct_io,
+                          options.lease_dir, options.timeout, options.insecure_no_token) as receiver:
+        logging.info("receiving plots into %s on %s:%s" % (", ".join(options.drive), options.bind, options.port))
+        receiver.serve_forever()
@@ -0,0 +1,226 @@
+import json
+import shlex
+
+import paramiko
+
+
+class RemoteCommandError(Exception):
+    pass
+
+
+class RemoteCommandUnavailableError(RemoteCommandError):
+    """
+    The host can't run the commands at all (it has no python3), as opposed to the connection failing on the way or a
+    script failing on something transient, which may well work the next time.
+    """
+    pass
+
+
+# the shell's exit status for a command it can't find
+COMMAND_NOT_FOUND_EXIT_STATUS = 127
+
+
+class RemoteCommands:
+    """
+    Small python programs that run on a remote host in a single round trip, and print their result as compact JSON.
+    Harvesters already run chia, so python3 is assumed to be available there.
+    """
+
+    # argv[1]: JSON list of drive paths, argv[2] (optional): {"dir": lease directory, "ttl": lease seconds}
+    # prints: {"time": now, "drives": {path: {"f_bavail", "f_frsize", "f_blocks", "in_flight": [[filename, size, mtime], ...]}},
+    #          "leases": [[lease filename, owner, plot filename], ...]}, with the live transfer slot leases if asked for
+    PROBE_TARGET_DRIVES_SCRIPT = r'''
+import json, os, stat, sys, time
+leases = []
+if len(sys.argv) > 2:
+    lease_request = json.loads(sys.argv[2])
+    try:
+        with os.scandir(lease_request["dir"]) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".lease"):
+                    continue
+                try:
+                    if time.time() - entry.stat().st_mtime > lease_request["ttl"]:
+                        continue
+                    with open(entry.path) as lease_file:
+                        lease = json.load(lease_file)
+                    leases.append([entry.name, lease["owner"], lease["plot"]])
+                except (OSError, ValueError, KeyError):
+                    # gone, or just created and not written yet
+                    continue
+    except OSError:
+        # no lease directory yet, or one this user can't read, which shouldn't fail the whole probe
+        pass
+drives = {}
+for path in json.loads(sys.argv[1]):
+    try:
+        st = os.statvfs(path)
+        in_flight = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not (entry.name.startswith(".") and ".plot" in entry.name):
+                    continue
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISREG(entry_stat.st_mode):
+                    in_flight.append([entry.name, entry_stat.st_size, entry_stat.st_mtime])
+        drives[path] = {"f_bavail": st.f_bavail, "f_frsize": st.f_frsize, "f_blocks": st.f_blocks, "in_flight": in_flight}
+    except OSError as e:
+        drives[path] = {"error": str(e)}
+print(json.dumps({"time": time.time(), "drives": drives, "leases": leases}, separators=(",", ":")))
+'''
+
+    # argv[1]: JSON list of directories
+    # prints: {"dirs": {path: {"plots": [[filename, size], ...]}}}, finished plot files only
+    LIST_PLOTS_SCRIPT = r'''
+import json, os, stat, sys
+dirs = {}
+for path in json.loads(sys.argv[1]):
+    try:
+        plots = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.name.endswith(".plot"):
+                    continue
+                try:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISREG(entry_stat.st_mode):
+                    plots.append([entry.name, entry_stat.st_size])
+        dirs[path] = {"plots": plots}
+    except OSError as e:
+        dirs[path] = {"error": str(e)}
+print(json.dumps({"dirs": dirs}, separators=(",", ":")))
+'''
+
+    # argv[1]: file path, argv[2]: JSON list of [offset, length] blocks, or null for the whole file
+    # prints: {"hashes": [sha256 hex per block]}
+    HASH_FILE_SCRIPT = r'''
+import hashlib, json, os, sys
+blocks = json.loads(sys.argv[2])
+fd = os.open(json.loads(sys.argv[1]), os.O_RDONLY)
+if blocks is None:
+    digest = hashlib.sha256()
+    offset = 0
+    while True:
+        data = os.pread(fd, 8388608, offset)
+        if not data:
+            break
+        digest.update(data)
+        offset += len(data)
+    hashes = [digest.hexdigest()]
+else:
+    hashes = [hashlib.sha256(os.pread(fd, length, offset)).hexdigest() for (offset, length) in blocks]
+print(json.dumps({"hashes": hashes}))
+'''
+
+    # argv[1]: {"action": "acquire", "dir", "ttl", "owner", "plot", "groups": [[lease name, slots], ...]}
+    #          or {"action": "renew" or "release", "dir", "owner", "leases": [lease path, ...]}
+    # prints: acquire: {"leases": [lease path per group]}, or {"leases": null} if a group has no free slot
+    #         renew: {"lost": [lease paths no longer held]}, release: {}
+    # A lease is a file created with O_EXCL, so only one plotter can hold it. It expires when its mtime (by this host's
+    # clock) is older than ttl, its holder keeps touching it while the transfer runs.
+    LEASE_SCRIPT = r'''
+import json, os, sys, time
+request = json.loads(sys.argv[1])
+
+def owner_of(path):
+    try:
+        with open(path) as lease_file:
+            return json.load(lease_file)["owner"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def is_expired(path):
+    try:
+        return time.time() - os.stat(path).st_mtime > request["ttl"]
+    except FileNotFoundError:
+        return True
+
+def create(path):
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as lease_file:
+        json.dump({"owner": request["owner"], "plot": request["plot"]}, lease_file)
+    return True
+
+def take(path):
+    if create(path):
+        return True
+    if not is_expired(path):
+        return False
+    # move the expired lease aside first, only one plotter can
+    aside = "%s.%s.expired" % (path, request["owner"])
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return create(path)
+    if not is_expired(aside):
+        # renewed or taken over between the check and the move, put it back
+        try:
+            os.link(aside, path)
+        except FileExistsError:
+            pass
+        os.unlink(aside)
+        return False
+    os.unlink(aside)
+    return create(path)
+
+result = {}
+if request["action"] == "acquire":
+    os.makedirs(request["dir"], exist_ok=True)
+    taken = []
+    for (name, slots) in request["groups"]:
+        for slot in range(slots):
+            path = os.path.join(request["dir"], "%s.%s.lease" % (name, slot))
+            if take(path):
+                taken.append(path)
+                break
+        else:
+            for path in taken:
+                os.unlink(path)
+            taken = None
+            break
+    result["leases"] = taken
+elif request["action"] == "renew":
+    result["lost"] = []
+    for path in request["leases"]:
+        if owner_of(path) == request["owner"]:
+            os.utime(path)
+        else:
+            result["lost"].append(path)
+elif request["action"] == "release":
+    for path in request["leases"]:
+        if owner_of(path) == request["owner"]:
+            os.unlink(path)
+print(json.dumps(result))
+'''
+
+    @staticmethod
+    def build_python_command(script: str, *args) -> str:
+        return " ".join(["python3", "-c", shlex.quote(script)] + [shlex.quote(json.dumps(arg)) for arg in args])
+
+    @staticmethod
+    def run_python(client: paramiko.SSHClient, script: str, *args, timeout: float = None):
+        command = RemoteCommands.build_python_command(script, *args)
+        try:
+            _, stdout, stderr = client.exec_command(command, timeout=timeout)
+            output = stdout.read()
+            exit_status = stdout.channel.recv_exit_status()
+        except (paramiko.SSHException, OSError) as e:
+            raise RemoteCommandError("could not run remote command: %s" % e) from e
+
+        if exit_status == COMMAND_NOT_FOUND_EXIT_STATUS:
+            raise RemoteCommandUnavailableError("python3 is not available: %s" % stderr.read().decode(errors="replace").strip())
+        if exit_status != 0:
+            raise RemoteCommandError("remote command exited with status %s: %s" % (exit_status, stderr.read().decode(errors="replace").strip()))
+
+        try:
+            return json.loads(output)
+        except ValueError as e:
+            raise RemoteCommandError("remote command returned malformed output: %s" % e) from e
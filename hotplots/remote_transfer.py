@@ -0,0 +1,175 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import shlex
+import subprocess
+import tempfile
+from typing import Callable
+
+import paramiko
+
+from hotplots.bandwidth import BandwidthThrottle
+from hotplots.hotplots_config import RemoteHostConfig
+from hotplots.receiver import ReceiverClient
+from hotplots.ssh_connection_pool import SSHConnectionPool
+
+
+class RemoteTransferBackend(ABC):
+    """
+    Uploads a source plot to a (temporary) path on a remote host. Renaming the finished upload into place and cleaning
+    up after failures is left to the caller, over the sftp channel that is passed in.
+    With an offset, the remote path already holds the first offset bytes of the source and only the rest is uploaded.
+    With a throttle, the upload is held to its bandwidth limits. With progress, it's called with the size of every
+    uploaded chunk, and can raise to stop the upload.
+    """
+    @abstractmethod
+    def upload(self, remote_host_config: RemoteHostConfig, sftp: paramiko.SFTPClient, source_path: str, remote_path: str,
+               offset: int = 0, throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None):
+        pass
+
+    @staticmethod
+    def verify_remote_size(sftp: paramiko.SFTPClient, source_path: str, remote_path: str):
+        source_size = os.path.getsize(source_path)
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != source_size:
+            raise IOError("size mismatch after upload of %s: %s != %s" % (source_path, remote_size, source_size))
+
+
+class SftpTransferBackend(RemoteTransferBackend):
+    """
+    Writes the plot with pipelined sftp writes, so paramiko doesn't wait for an acknowledgement per request. The sftp
+    channel is expected to be opened with the configured (large) window and packet sizes.
+    """
+    def upload(self, remote_host_config: RemoteHostConfig, sftp: paramiko.SFTPClient, source_path: str, remote_path: str,
+               offset: int = 0, throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None):
+        chunk_size = remote_host_config.transfer.chunk_size_bytes
+        with open(source_path, "rb") as source_file, sftp.open(remote_path, "r+b" if offset else "wb") as remote_file:
+            source_file.seek(offset)
+            remote_file.seek(offset)
+            remote_file.set_pipelined(True)
+            while True:
+                data = source_file.read(chunk_size)
+                if not data:
+                    break
+                if throttle is not None:
+                    throttle.consume(len(data))
+                remote_file.write(data)
+                if progress is not None:
+                    progress(len(data))
+
+        self.verify_remote_size(sftp, source_path, remote_path)
+
+
+class StreamTransferBackend(RemoteTransferBackend):
+    """
+    Streams the raw plot bytes over an ssh exec channel into `cat` on the remote host. This skips the sftp request
+    framing entirely, at the cost of needing a shell on the remote host.
+    """
+    def __init__(self, ssh_connection_pool: SSHConnectionPool):
+        self.__ssh_connection_pool = ssh_connection_pool
+
+    def upload(self, remote_host_config: RemoteHostConfig, sftp: paramiko.SFTPClient, source_path: str, remote_path: str,
+               offset: int = 0, throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None):
+        transfer_config = remote_host_config.transfer
+        transport = self.__ssh_connection_pool.get_client(remote_host_config).get_transport()
+        channel = transport.open_session(
+            window_size=transfer_config.window_size_bytes,
+            max_packet_size=transfer_config.max_packet_size_bytes
+        )
+        try:
+            channel.exec_command("cat %s %s" % (">>" if offset else ">", shlex.quote(remote_path)))
+            with open(source_path, "rb") as source_file:
+                source_file.seek(offset)
+                while True:
+                    data = source_file.read(transfer_config.chunk_size_bytes)
+                    if not data:
+                        break
+                    if throttle is not None:
+                        throttle.consume(len(data))
+                    channel.sendall(data)
+                    if progress is not None:
+                        progress(len(data))
+            channel.shutdown_write()
+
+            exit_status = channel.recv_exit_status()
+            if exit_status != 0:
+                raise IOError("remote write of %s exited with status %s: %s" % (remote_path, exit_status, channel.recv_stderr(4096).decode(errors="replace").strip()))
+        finally:
+            channel.close()
+
+        self.verify_remote_size(sftp, source_path, remote_path)
+
+
+class ReceiverTransferBackend(RemoteTransferBackend):
+    """
+    Streams the raw plot bytes to `hotplots receive` on the remote host, which reserves the space for the rest of the
+    plot and writes it to disk with direct I/O. The host's receiver has to be configured.
+    """
+    def __init__(self, receiver_client: ReceiverClient):
+        self.__receiver_client = receiver_client
+
+    def upload(self, remote_host_config: RemoteHostConfig, sftp: paramiko.SFTPClient, source_path: str, remote_path: str,
+               offset: int = 0, throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None):
+        if not remote_host_config.receiver.port:
+            raise IOError("the receiver backend needs a receiver port for %s" % remote_host_config.hostname)
+        self.__receiver_client.upload(remote_host_config, source_path, remote_path, offset, throttle, progress)
+
+        self.verify_remote_size(sftp, source_path, remote_path)
+
+
+class RsyncTransferBackend(RemoteTransferBackend):
+    """
+    Hands the upload to rsync over the system ssh client. Key based authentication has to be set up for the system ssh
+    client, the same as for the pooled connection.
+    """
+    # progress is called (with 0 bytes) this often while rsync runs, so it can stop the upload
+    POLL_SECONDS = 1
+
+    def upload(self, remote_host_config: RemoteHostConfig, sftp: paramiko.SFTPClient, source_path: str, remote_path: str,
+               offset: int = 0, throttle: BandwidthThrottle = None, progress: Callable[[int], None] = None):
+        ssh_command = ["ssh", "-p", str(remote_host_config.port), "-o", "BatchMode=yes"]
+        if remote_host_config.transfer.cipher:
+            ssh_command += ["-c", remote_host_config.transfer.cipher]
+
+        command = [
+            "rsync",
+            # write straight into our temporary file instead of rsync's own, so it's seen as an in-flight transfer
+            "--inplace",
+            "--whole-file",
+            "--protect-args",
+        ]
+        if throttle is not None and throttle.get_max_bytes_per_second() > 0:
+            # rsync paces itself, so it can't share the token buckets with other transfers. It gets the tightest
+            # limit that applies when it starts instead.
+            command.append("--bwlimit=%sK" % max(1, throttle.get_max_bytes_per_second() // 1024))
+        if offset:
+            # only send what's missing, then checksum the whole file (and redo it if that doesn't match)
+            command.append("--append-verify")
+        command += [
+            "-e", " ".join(shlex.quote(arg) for arg in ssh_command),
+            source_path,
+            "%s@%s:%s" % (remote_host_config.username, remote_host_config.hostname, remote_path)
+        ]
+        logging.debug("running %s" % command)
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            try:
+                while True:
+                    try:
+                        returncode = process.wait(self.POLL_SECONDS)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if progress is not None:
+                            progress(0)
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if returncode != 0:
+                stderr_file.seek(0)
+                raise IOError("rsync of %s exited with status %s: %s" % (source_path, returncode, stderr_file.read().decode(errors="replace").strip()))
+        # rsync doesn't report its progress along the way, all of it is reported at the end
+        if progress is not None:
+            progress(os.path.getsize(source_path) - offset)
+
+        self.verify_remote_size(sftp, source_path, remote_path)
@@ -0,0 +1,162 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Optional
+
+from hotplots.cycle_trigger import CycleTrigger
+from hotplots.hotplots_config import SourceConfig
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyUnavailableError(Exception):
+    pass
+
+
+class Inotify:
+    """
+    Minimal ctypes binding to the Linux inotify API, so watching doesn't need a third party package.
+    """
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise InotifyUnavailableError("inotify is only available on Linux")
+        try:
+            self.__libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self.__libc.inotify_init1.argtypes = [ctypes.c_int]
+            self.__libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        except (OSError, AttributeError) as e:
+            raise InotifyUnavailableError("could not load inotify from libc: %s" % e) from e
+
+        self.fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailableError("inotify_init1 failed: %s" % os.strerror(ctypes.get_errno()))
+
+        self.__paths_by_watch_descriptor: dict[int, str] = {}
+
+    def add_watch(self, path: str, mask: int):
+        watch_descriptor = self.__libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if watch_descriptor < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_add_watch failed for %s: %s" % (path, os.strerror(errno)))
+        self.__paths_by_watch_descriptor[watch_descriptor] = path
+
+    def read_events(self):
+        """
+        Yields (path, mask, filename) for every event that can be read without blocking.
+        """
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+
+            offset = 0
+            while offset < len(data):
+                watch_descriptor, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                filename = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+                offset += name_length
+                yield self.__paths_by_watch_descriptor.get(watch_descriptor), mask, filename
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SourceWatcher:
+    """
+    Watches the source drives for finished plots, and triggers a pairing cycle once they stop arriving for the debounce
+    period. Plotters either rename a finished plot into place (IN_MOVED_TO) or write it out directly (IN_CLOSE_WRITE).
+    Watching is best effort: where inotify isn't available, or a drive can't be watched, the regular poll interval
+    still picks up new plots.
+    """
+    def __init__(self, source_config: SourceConfig, cycle_trigger: CycleTrigger):
+        self.__source_config = source_config
+        self.__cycle_trigger = cycle_trigger
+        self.__inotify: Optional[Inotify] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__stop_read_fd, self.__stop_write_fd = None, None
+
+    def start(self) -> bool:
+        """
+        Returns False if no source drive could be watched, leaving only the poll.
+        """
+        try:
+            self.__inotify = Inotify()
+        except InotifyUnavailableError as e:
+            logging.info("not watching source drives, new plots are found by polling: %s" % e)
+            return False
+
+        watched = 0
+        for source_drive_config in self.__source_config.drives:
+            try:
+                self.__inotify.add_watch(source_drive_config.path, IN_MOVED_TO | IN_CLOSE_WRITE)
+                watched += 1
+            except OSError as e:
+                logging.warning("could not watch source drive %s, it is only polled: %s" % (source_drive_config.path, e))
+
+        if watched == 0:
+            self.__inotify.close()
+            self.__inotify = None
+            return False
+
+        self.__stop_read_fd, self.__stop_write_fd = os.pipe()
+        self.__thread = threading.Thread(target=self.__watch, name="hotplots-source-watcher", daemon=True)
+        self.__thread.start()
+        return True
+
+    def close(self):
+        if self.__thread is None:
+            return
+        os.write(self.__stop_write_fd, b"\0")
+        self.__thread.join()
+        self.__thread = None
+        self.__inotify.close()
+        os.close(self.__stop_read_fd)
+        os.close(self.__stop_write_fd)
+
+    def __watch(self):
+        debounce_seconds = self.__source_config.watch_debounce_seconds
+        # the first new plot of a burst that hasn't triggered a cycle yet, and when the burst is considered over
+        pending_plot: Optional[str] = None
+        trigger_at = 0.0
+
+        while True:
+            timeout = max(0.0, trigger_at - time.monotonic()) if pending_plot is not None else None
+            readable, _, _ = select.select([self.__inotify.fd, self.__stop_read_fd], [], [], timeout)
+            if self.__stop_read_fd in readable:
+                return
+
+            if self.__inotify.fd in readable:
+                for (path, mask, filename) in self.__inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        # events were dropped, so there may well be new plots
+                        pending_plot = pending_plot or "(event queue overflow)"
+                    elif mask & IN_IGNORED:
+                        logging.warning("source drive %s is no longer watched, it is only polled from now on" % path)
+                        continue
+                    elif filename.endswith(".plot"):
+                        logging.debug("new plot %s on %s" % (filename, path))
+                        pending_plot = pending_plot or os.path.join(path, filename)
+                    else:
+                        continue
+                    trigger_at = time.monotonic() + debounce_seconds
+
+            if pending_plot is not None and time.monotonic() >= trigger_at:
+                self.__cycle_trigger.trigger("new plot %s" % pending_plot)
+                pending_plot = None
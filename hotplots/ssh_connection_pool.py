@@ -0,0 +1,171 @@
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import paramiko
+
+from hotplots.hotplots_config import SSHConnectionConfig, RemoteHostConfig
+from hotplots.models import TargetHostId
+
+
+class SSHConnectionUnavailableError(Exception):
+    pass
+
+
+@dataclass
+class PooledConnection:
+    client: Optional[paramiko.SSHClient] = None
+    consecutive_failures: int = 0
+    next_attempt_at: float = 0.0
+
+
+class SSHConnectionPool:
+    """
+    Keeps one SSH transport per remote host alive across cycles. Probes and uploads each open their own SFTP channel
+    on the shared transport, so the handshake and key exchange are only paid when a connection actually drops.
+    """
+    def __init__(self, connection_config: SSHConnectionConfig):
+        self.__connection_config = connection_config
+        self.__lock = threading.Lock()
+        self.__host_locks: dict[TargetHostId, threading.Lock] = {}
+        self.__connections: dict[TargetHostId, PooledConnection] = {}
+        self.__dns_cache: dict[str, tuple[str, float]] = {}
+
+    def get_client(self, remote_host_config: RemoteHostConfig) -> paramiko.SSHClient:
+        target_host_id = TargetHostId.from_(remote_host_config)
+        with self.__get_host_lock(target_host_id):
+            connection = self.__connections.setdefault(target_host_id, PooledConnection())
+            if connection.client is not None and self.__is_alive(connection.client):
+                return connection.client
+
+            if connection.client is not None:
+                logging.info("ssh connection to %s dropped, reconnecting" % remote_host_config.hostname)
+                self.__close_quietly(connection.client)
+                connection.client = None
+
+            now = time.monotonic()
+            if now < connection.next_attempt_at:
+                raise SSHConnectionUnavailableError(
+                    "not reconnecting to %s for another %.0f seconds after %s failed attempts" %
+                    (remote_host_config.hostname, connection.next_attempt_at - now, connection.consecutive_failures)
+                )
+
+            try:
+                connection.client = self.__connect(remote_host_config)
+            except Exception:
+                connection.consecutive_failures += 1
+                backoff_seconds = min(
+                    self.__connection_config.reconnect_backoff_seconds * 2 ** (connection.consecutive_failures - 1),
+                    self.__connection_config.max_reconnect_backoff_seconds
+                )
+                connection.next_attempt_at = time.monotonic() + backoff_seconds
+                # the name may have moved to a new address
+                self.__dns_cache.pop(remote_host_config.hostname, None)
+                raise
+
+            connection.consecutive_failures = 0
+            connection.next_attempt_at = 0.0
+            return connection.client
+
+    @contextmanager
+    def sftp(self, remote_host_config: RemoteHostConfig, window_size: int = None, max_packet_size: int = None):
+        """
+        Opens a new SFTP channel on the pooled transport for the host, closing only the channel when done.
+        """
+        client = self.get_client(remote_host_config)
+        if window_size or max_packet_size:
+            sftp = paramiko.SFTPClient.from_transport(client.get_transport(), window_size, max_packet_size)
+        else:
+            sftp = client.open_sftp()
+        try:
+            yield sftp
+        except Exception:
+            if not self.__is_alive(client):
+                self.invalidate(remote_host_config)
+            raise
+        finally:
+            sftp.close()
+
+    def invalidate(self, remote_host_config: RemoteHostConfig):
+        target_host_id = TargetHostId.from_(remote_host_config)
+        with self.__get_host_lock(target_host_id):
+            connection = self.__connections.get(target_host_id)
+            if connection is not None and connection.client is not None:
+                self.__close_quietly(connection.client)
+                connection.client = None
+
+    def close_all(self):
+        with self.__lock:
+            connections = list(self.__connections.values())
+            self.__connections.clear()
+        for connection in connections:
+            if connection.client is not None:
+                self.__close_quietly(connection.client)
+
+    def resolve(self, hostname: str) -> str:
+        now = time.monotonic()
+        cached = self.__dns_cache.get(hostname)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        resolved_ip = socket.gethostbyname(hostname)
+        self.__dns_cache[hostname] = (resolved_ip, now + self.__connection_config.dns_cache_ttl_seconds)
+        return resolved_ip
+
+    def __connect(self, remote_host_config: RemoteHostConfig) -> paramiko.SSHClient:
+        logging.info("opening ssh connection to %s" % remote_host_config.hostname)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        connect_kwargs = {}
+        cipher = remote_host_config.transfer.cipher
+        if cipher:
+            supported_ciphers = SSHConnectionPool.get_supported_ciphers()
+            if cipher in supported_ciphers:
+                # paramiko has no cipher preference option, so disable every other cipher instead
+                connect_kwargs["disabled_algorithms"] = {"ciphers": [c for c in supported_ciphers if c != cipher]}
+            else:
+                logging.warning("cipher %s is not supported, using the defaults for %s" % (cipher, remote_host_config.hostname))
+
+        try:
+            client.connect(
+                self.resolve(remote_host_config.hostname),
+                port=remote_host_config.port,
+                username=remote_host_config.username,
+                timeout=self.__connection_config.connect_timeout_seconds,
+                **connect_kwargs
+            )
+            client.get_transport().set_keepalive(self.__connection_config.keepalive_seconds)
+        except Exception:
+            self.__close_quietly(client)
+            raise
+        return client
+
+    @staticmethod
+    def get_supported_ciphers() -> Tuple[str, ...]:
+        # read off a transport that's never started
+        with socket.socket() as sock:
+            transport = paramiko.Transport(sock)
+            try:
+                return tuple(transport.get_security_options().ciphers)
+            finally:
+                transport.close()
+
+    def __get_host_lock(self, target_host_id: TargetHostId) -> threading.Lock:
+        with self.__lock:
+            return self.__host_locks.setdefault(target_host_id, threading.Lock())
+
+    @staticmethod
+    def __is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    @staticmethod
+    def __close_quietly(client: paramiko.SSHClient):
+        try:
+            client.close()
+        except Exception as e:
+            logging.warning("error while closing ssh connection: %s" % e)
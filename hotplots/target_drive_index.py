@@ -0,0 +1,237 @@
+import bisect
+import math
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from hotplots.constants import Constants
+from hotplots.models import HotPlotTargetDrive, TargetHostId, TargetDriveId
+from hotplots.throughput_history import ThroughputHistory
+
+# assumed for drives without a throughput measurement, when there are no measurements at all
+DEFAULT_BYTES_PER_SECOND = 100 * 1000 * 1000
+
+
+@dataclass(eq=False)
+class IndexedTargetDrive:
+    hot_plot_target_drive: HotPlotTargetDrive
+    target_host_id: TargetHostId
+    target_drive_id: TargetDriveId
+    # order in the list of all target drives, the tie breaker between drives of equal rank
+    position: int
+    config_order: int
+    transfers_in_flight: int = 0
+    bytes_in_flight: int = 0
+    # of transfers whose plot size is known exactly (this process's own), which don't need the fudge factor
+    exact_bytes_in_flight: int = 0
+    # the entry in its partition's ordered index while the drive's own cap isn't reached, None once it is
+    index_entry: Optional[Tuple] = None
+    # measured rate of a single transfer to the drive, and of all transfers to its host together
+    drive_bytes_per_second: float = DEFAULT_BYTES_PER_SECOND
+    host_bytes_per_second: float = math.inf
+
+    def get_available_bytes(self) -> float:
+        # the same fudge factor as for staged files, see Constants.STAGED_FILES_ERROR_TERM
+        return self.hot_plot_target_drive.target_drive_info.free_bytes - self.bytes_in_flight * Constants.STAGED_FILES_ERROR_TERM \
+            - self.exact_bytes_in_flight
+
+    def get_uncommitted_bytes(self) -> int:
+        return self.hot_plot_target_drive.target_drive_info.free_bytes - self.bytes_in_flight - self.exact_bytes_in_flight
+
+
+class TargetDriveIndex:
+    """
+    Answers "which is the best eligible target drive for a plot of this size" without ranking every drive again.
+    Drive and host IDs are computed once. Drives whose own inbound cap is reached are dropped from the index. The
+    others are kept in a sorted list per host preference partition (local and remote drives, or all of them), ordered
+    by the target selection strategy's rank. Hosts whose inbound cap is reached are kept apart, and their drives are
+    skipped by the search, so capping a host doesn't touch its drives' entries.
+    With drive_with_least_space_remaining the best drive is found by bisecting on the uncommitted bytes, and with
+    drive_with_most_space_remaining the search stops at the first drive that's too small. The other strategies walk
+    the partition from its best drive until one fits, and random picks among all the drives that fit.
+    Committing a pairing moves only the drive it went to (and, with fastest_expected_completion, whose rank depends
+    on the host's transfers, the other drives of its host). That's a remove and an insort into a python list, which
+    is O(n) in the number of drives, but a memmove of a few thousand pointers at most, as even a large farm has no more
+    drives than that. A tree or heap per partition wouldn't pay off at that size, and heaps can't bisect.
+    """
+    def __init__(self, selection_strategy: str, target_host_preference: str, throughput_history: Optional[ThroughputHistory] = None):
+        self.__selection_strategy = selection_strategy
+        self.__target_host_preference = target_host_preference
+        self.__throughput_history = throughput_history
+        self.__indexed_target_drives: List[IndexedTargetDrive] = []
+        self.__indexed_target_drives_by_id: dict[TargetDriveId, IndexedTargetDrive] = {}
+        self.__indexed_target_drives_by_host: dict[TargetHostId, List[IndexedTargetDrive]] = {}
+        self.__host_transfers_in_flight: dict[TargetHostId, int] = {}
+        # hosts whose inbound cap is reached
+        self.__capped_target_host_ids: set[TargetHostId] = set()
+        self.__partitions: List[List[Tuple]] = [[] for _ in self.__get_partition_order()]
+        self.__uncapped_count = 0
+
+    def add_target_drive(self, hot_plot_target_drive: HotPlotTargetDrive, config_order: int) -> IndexedTargetDrive:
+        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+        target_drive_id = TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)
+        indexed_target_drive = IndexedTargetDrive(
+            hot_plot_target_drive, target_host_id, target_drive_id, len(self.__indexed_target_drives), config_order
+        )
+        if self.__throughput_history is not None:
+            # unmeasured drives are assumed to be as fast as the fastest one, so they get tried and measured
+            indexed_target_drive.drive_bytes_per_second = self.__throughput_history.get_drive_bytes_per_second(target_drive_id) \
+                or self.__throughput_history.get_fastest_drive_bytes_per_second() or DEFAULT_BYTES_PER_SECOND
+            indexed_target_drive.host_bytes_per_second = self.__throughput_history.get_host_bytes_per_second(target_host_id) or math.inf
+        self.__indexed_target_drives.append(indexed_target_drive)
+        self.__indexed_target_drives_by_id[target_drive_id] = indexed_target_drive
+        self.__indexed_target_drives_by_host.setdefault(target_host_id, []).append(indexed_target_drive)
+        self.__host_transfers_in_flight.setdefault(target_host_id, 0)
+        if self.__host_transfers_in_flight[target_host_id] >= hot_plot_target_drive.host_config.max_concurrent_inbound_transfers:
+            self.__capped_target_host_ids.add(target_host_id)
+        self.__insert(indexed_target_drive)
+        return indexed_target_drive
+
+    def get(self, hot_plot_target_drive: HotPlotTargetDrive) -> IndexedTargetDrive:
+        target_host_id = TargetHostId.from_(hot_plot_target_drive.host_config)
+        return self.__indexed_target_drives_by_id[TargetDriveId.from_(target_host_id, hot_plot_target_drive.target_drive_info.target_drive_config)]
+
+    def get_by_id(self, target_drive_id: TargetDriveId) -> Optional[IndexedTargetDrive]:
+        return self.__indexed_target_drives_by_id.get(target_drive_id)
+
+    def get_all(self) -> List[IndexedTargetDrive]:
+        return self.__indexed_target_drives
+
+    def get_host_transfers_in_flight(self, target_host_id: TargetHostId) -> int:
+        return self.__host_transfers_in_flight.get(target_host_id, 0)
+
+    def add_host_transfer(self, target_host_id: TargetHostId):
+        """
+        Counts a transfer against a host without a drive in the index (e.g. one this process runs to a drive that
+        didn't answer this cycle).
+        """
+        self.__host_transfers_in_flight[target_host_id] = self.__host_transfers_in_flight.get(target_host_id, 0) + 1
+        indexed_target_drives = self.__indexed_target_drives_by_host.get(target_host_id, [])
+        if not indexed_target_drives:
+            return
+        host_config = indexed_target_drives[0].hot_plot_target_drive.host_config
+        if self.__host_transfers_in_flight[target_host_id] >= host_config.max_concurrent_inbound_transfers:
+            self.__capped_target_host_ids.add(target_host_id)
+        if self.__selection_strategy == "fastest_expected_completion":
+            for indexed_target_drive in indexed_target_drives:
+                self.__reindex(indexed_target_drive)
+
+    def add_transfer(self, target_drive_id: TargetDriveId, target_host_id: TargetHostId, num_bytes: int, exact: bool = False):
+        indexed_target_drive = self.__indexed_target_drives_by_id.get(target_drive_id)
+        if indexed_target_drive is not None:
+            indexed_target_drive.transfers_in_flight += 1
+            if exact:
+                indexed_target_drive.exact_bytes_in_flight += num_bytes
+            else:
+                indexed_target_drive.bytes_in_flight += num_bytes
+            self.__reindex(indexed_target_drive)
+        self.add_host_transfer(target_host_id)
+
+    def is_capped(self, indexed_target_drive: IndexedTargetDrive) -> bool:
+        if indexed_target_drive.target_host_id in self.__capped_target_host_ids:
+            return True
+        target_drive_config = indexed_target_drive.hot_plot_target_drive.target_drive_info.target_drive_config
+        return indexed_target_drive.transfers_in_flight >= target_drive_config.max_concurrent_inbound_transfers
+
+    def has_capped_target_drives(self) -> bool:
+        return self.__uncapped_count < len(self.__indexed_target_drives) or len(self.__capped_target_host_ids) > 0
+
+    def get_rank_key(self, indexed_target_drive: IndexedTargetDrive) -> Tuple:
+        """
+        Sorting by this key (ascending) ranks drives by the target selection strategy, ignoring the host preference.
+        """
+        if self.__selection_strategy == "config_order":
+            return indexed_target_drive.config_order, indexed_target_drive.position
+        elif self.__selection_strategy == "drive_with_least_space_remaining":
+            return indexed_target_drive.get_uncommitted_bytes(), indexed_target_drive.position
+        elif self.__selection_strategy == "drive_with_most_space_remaining":
+            return -indexed_target_drive.get_uncommitted_bytes(), indexed_target_drive.position
+        elif self.__selection_strategy == "drive_with_lowest_percent_space_remaining":
+            total_bytes = indexed_target_drive.hot_plot_target_drive.target_drive_info.total_bytes
+            return indexed_target_drive.get_uncommitted_bytes() / total_bytes, indexed_target_drive.position
+        elif self.__selection_strategy == "drive_with_highest_percent_space_remaining":
+            total_bytes = indexed_target_drive.hot_plot_target_drive.target_drive_info.total_bytes
+            return -(indexed_target_drive.get_uncommitted_bytes() / total_bytes), indexed_target_drive.position
+        elif self.__selection_strategy == "fastest_expected_completion":
+            return self.get_expected_seconds_per_byte(indexed_target_drive), indexed_target_drive.position
+        elif self.__selection_strategy == "random":
+            return 0, indexed_target_drive.position
+        raise ValueError("unknown target selection strategy %s" % self.__selection_strategy)
+
+    def get_expected_seconds_per_byte(self, indexed_target_drive: IndexedTargetDrive) -> float:
+        """
+        How long one more transfer to the drive would take per byte, sharing the drive with the transfers already
+        running to it, and the host's link with the transfers running to any of its drives. Multiplied by the bytes
+        left to transfer, it ranks drives by expected completion time the same way for every plot.
+        """
+        drive_seconds_per_byte = (indexed_target_drive.transfers_in_flight + 1) / indexed_target_drive.drive_bytes_per_second
+        host_transfers_in_flight = self.__host_transfers_in_flight[indexed_target_drive.target_host_id]
+        host_seconds_per_byte = (host_transfers_in_flight + 1) / indexed_target_drive.host_bytes_per_second
+        return max(drive_seconds_per_byte, host_seconds_per_byte)
+
+    def get_partition(self, indexed_target_drive: IndexedTargetDrive) -> int:
+        return self.__get_partition_order().index(self.__get_partition_name(indexed_target_drive))
+
+    def find_best(self, needed_bytes: int) -> Optional[IndexedTargetDrive]:
+        """
+        The best ranked uncapped drive with room for needed_bytes, preferring the partition of the host preference.
+        """
+        for partition in self.__partitions:
+            if self.__selection_strategy == "random":
+                eligible = [entry[-1] for entry in partition if self.is_eligible(entry[-1], needed_bytes)]
+                if eligible:
+                    return random.choice(eligible)
+                continue
+
+            start = 0
+            if self.__selection_strategy == "drive_with_least_space_remaining":
+                # available bytes are never more than the uncommitted bytes, so every drive before this is too small
+                start = bisect.bisect_left(partition, (needed_bytes,))
+            for i in range(start, len(partition)):
+                indexed_target_drive = partition[i][-1]
+                if indexed_target_drive.target_host_id in self.__capped_target_host_ids:
+                    continue
+                if indexed_target_drive.get_available_bytes() >= needed_bytes:
+                    return indexed_target_drive
+                if self.__selection_strategy == "drive_with_most_space_remaining" and indexed_target_drive.get_uncommitted_bytes() < needed_bytes:
+                    # and every drive from here on is smaller still
+                    break
+        return None
+
+    def is_eligible(self, indexed_target_drive: IndexedTargetDrive, needed_bytes: int) -> bool:
+        return indexed_target_drive.index_entry is not None and indexed_target_drive.target_host_id not in self.__capped_target_host_ids \
+            and indexed_target_drive.get_available_bytes() >= needed_bytes
+
+    def __reindex(self, indexed_target_drive: IndexedTargetDrive):
+        self.__remove(indexed_target_drive)
+        self.__insert(indexed_target_drive)
+
+    def __insert(self, indexed_target_drive: IndexedTargetDrive):
+        target_drive_config = indexed_target_drive.hot_plot_target_drive.target_drive_info.target_drive_config
+        if indexed_target_drive.transfers_in_flight >= target_drive_config.max_concurrent_inbound_transfers:
+            return
+        index_entry = self.get_rank_key(indexed_target_drive) + (indexed_target_drive,)
+        bisect.insort(self.__partitions[self.get_partition(indexed_target_drive)], index_entry)
+        indexed_target_drive.index_entry = index_entry
+        self.__uncapped_count += 1
+
+    def __remove(self, indexed_target_drive: IndexedTargetDrive):
+        if indexed_target_drive.index_entry is None:
+            return
+        partition = self.__partitions[self.get_partition(indexed_target_drive)]
+        # rank keys end with the drive's unique position, so the entry is found exactly
+        del partition[bisect.bisect_left(partition, indexed_target_drive.index_entry[:-1])]
+        indexed_target_drive.index_entry = None
+        self.__uncapped_count -= 1
+
+    def __get_partition_order(self) -> List[str]:
+        if self.__target_host_preference == "local":
+            return ["local", "remote"]
+        elif self.__target_host_preference == "remote":
+            return ["remote", "local"]
+        return ["all"]
+
+    def __get_partition_name(self, indexed_target_drive: IndexedTargetDrive) -> str:
+        if self.__target_host_preference not in ("local", "remote"):
+            return "all"
+        return "local" if indexed_target_drive.hot_plot_target_drive.is_local() else "remote"
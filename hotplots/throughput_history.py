@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+from hotplots.models import TargetHostId, TargetDriveId
+
+# below this, a transfer is too short for its rate to say much about the drive (e.g. resuming a nearly done partial)
+MIN_MEASURED_BYTES = 1024 * 1024 * 1024
+
+
+@dataclass
+class ThroughputRecord:
+    # exponentially weighted moving average of the measured rates
+    bytes_per_second: float
+    transfers: int
+    updated: float
+
+
+class ThroughputHistory:
+    """
+    Measured transfer throughput per target drive and per target host, kept in a JSON file so it survives restarts.
+    A drive's rate is the per-transfer rate of transfers to it. A host's rate is its aggregate rate, the per-transfer
+    rate times the transfers to the host running on average at the time, since concurrent transfers to a host share its
+    link.
+    """
+    def __init__(self, path: Optional[str], smoothing: float = 0.3, clock: Callable[[], float] = time.time):
+        self.__path = path
+        self.__smoothing = smoothing
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__drive_records: dict[str, ThroughputRecord] = {}
+        self.__host_records: dict[str, ThroughputRecord] = {}
+        self.__load()
+
+    def record(self, target_drive_id: TargetDriveId, num_bytes: int, seconds: float, concurrent_host_transfers: float = 1):
+        if num_bytes < MIN_MEASURED_BYTES or seconds <= 0:
+            return
+
+        bytes_per_second = num_bytes / seconds
+        with self.__lock:
+            self.__update(self.__drive_records, self.__get_drive_key(target_drive_id), bytes_per_second)
+            self.__update(self.__host_records, self.__get_host_key(target_drive_id.target_host_id), bytes_per_second * max(1, concurrent_host_transfers))
+            self.__save()
+
+    def get_drive_bytes_per_second(self, target_drive_id: TargetDriveId) -> Optional[float]:
+        with self.__lock:
+            record = self.__drive_records.get(self.__get_drive_key(target_drive_id))
+        return record.bytes_per_second if record is not None else None
+
+    def get_host_bytes_per_second(self, target_host_id: TargetHostId) -> Optional[float]:
+        with self.__lock:
+            record = self.__host_records.get(self.__get_host_key(target_host_id))
+        return record.bytes_per_second if record is not None else None
+
+    def get_fastest_drive_bytes_per_second(self) -> Optional[float]:
+        """
+        Drives without a measurement are assumed to be this fast, so they're tried (and measured) early.
+        """
+        with self.__lock:
+            return max((record.bytes_per_second for record in self.__drive_records.values()), default=None)
+
+    def __update(self, records: dict[str, ThroughputRecord], key: str, bytes_per_second: float):
+        record = records.get(key)
+        if record is None:
+            records[key] = ThroughputRecord(bytes_per_second, 1, self.__clock())
+            return
+        record.bytes_per_second += self.__smoothing * (bytes_per_second - record.bytes_per_second)
+        record.transfers += 1
+        record.updated = self.__clock()
+
+    @staticmethod
+    def __get_host_key(target_host_id: TargetHostId) -> str:
+        return ("local:" if target_host_id.is_local else "remote:") + target_host_id.hostname
+
+    @staticmethod
+    def __get_drive_key(target_drive_id: TargetDriveId) -> str:
+        return ThroughputHistory.__get_host_key(target_drive_id.target_host_id) + ":" + target_drive_id.drive_path
+
+    def __load(self):
+        if not self.__path or not os.path.exists(self.__path):
+            return
+        try:
+            with open(self.__path, "r") as history_file:
+                contents = json.load(history_file)
+            self.__drive_records = {key: ThroughputRecord(**record) for key, record in contents.get("drives", {}).items()}
+            self.__host_records = {key: ThroughputRecord(**record) for key, record in contents.get("hosts", {}).items()}
+        except (OSError, ValueError, TypeError) as e:
+            # only an optimization, start over rather than fail
+            logging.warning("ignoring throughput history %s, it can't be read: %s" % (self.__path, e))
+
+    def __save(self):
+        if not self.__path:
+            return
+        contents = {
+            "drives": {key: asdict(record) for key, record in self.__drive_records.items()},
+            "hosts": {key: asdict(record) for key, record in self.__host_records.items()},
+        }
+        temp_path = self.__path + ".tmp"
+        try:
+            with open(temp_path, "w") as history_file:
+                json.dump(contents, history_file, indent=2, sort_keys=True)
+            os.replace(temp_path, self.__path)
+        except OSError as e:
+            logging.warning("could not save throughput history to %s: %s" % (self.__path, e))
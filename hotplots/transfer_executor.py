@@ -0,0 +1,74 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List, Tuple
+
+from hotplots.models import HotPlot, HotPlotTargetDrive
+
+
+class TransferExecutor:
+    """
+    Runs plot transfers in the background so that the main loop can keep polling while multi-hour copies are running.
+    The set of live transfers is exposed so that the next pairing cycle can count them against the concurrency caps
+    before their temporary files even show up on the target drive. on_transfer_finished is called when a transfer
+    succeeds, i.e. transfer_func returns True. A failed one, or one that didn't go ahead (e.g. no free transfer slot),
+    isn't retried until the next regular cycle, so a transfer that can't happen doesn't go around in a tight loop.
+    """
+    def __init__(self, transfer_func, max_workers: int, on_transfer_finished: Callable[[], None] = None):
+        self.__transfer_func = transfer_func
+        self.__on_transfer_finished = on_transfer_finished
+        self.__thread_pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="hotplots-transfer")
+        self.__lock = threading.Lock()
+        self.__in_flight_changed = threading.Condition(self.__lock)
+        self.__in_flight: dict[str, Tuple[HotPlot, HotPlotTargetDrive, Future]] = {}
+
+    def submit(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive) -> bool:
+        source_path = hot_plot.source_plot.absolute_reference
+        with self.__lock:
+            if source_path in self.__in_flight:
+                logging.warning("transfer of %s is already in flight, not submitting it again" % source_path)
+                return False
+
+            future = self.__thread_pool.submit(self.__transfer_func, hot_plot, hot_plot_target_drive)
+            self.__in_flight[source_path] = (hot_plot, hot_plot_target_drive, future)
+
+        future.add_done_callback(lambda f: self.__on_transfer_done(source_path, f))
+        return True
+
+    def get_in_flight_pairings(self) -> List[Tuple[HotPlot, HotPlotTargetDrive]]:
+        with self.__lock:
+            return [(hot_plot, hot_plot_target_drive) for (hot_plot, hot_plot_target_drive, _) in self.__in_flight.values()]
+
+    def get_in_flight_count(self) -> int:
+        with self.__lock:
+            return len(self.__in_flight)
+
+    def wait_for_all(self):
+        with self.__in_flight_changed:
+            self.__in_flight_changed.wait_for(lambda: not self.__in_flight)
+
+    def shutdown(self):
+        """
+        Waits for the running transfers to return, after they've been interrupted, and drops the ones that haven't
+        started.
+        """
+        with self.__lock:
+            in_flight = list(self.__in_flight.values())
+        for (hot_plot, hot_plot_target_drive, future) in in_flight:
+            if not future.running():
+                continue
+            logging.info("waiting for the transfer of %s to %s to stop" % (hot_plot.source_plot.absolute_reference, hot_plot_target_drive.target_drive_info.target_drive_config.path))
+        self.__thread_pool.shutdown(wait=True, cancel_futures=True)
+
+    def __on_transfer_done(self, source_path: str, future: Future):
+        with self.__in_flight_changed:
+            self.__in_flight.pop(source_path, None)
+            self.__in_flight_changed.notify_all()
+
+        exception = future.exception()
+        if exception is not None:
+            logging.error("transfer of %s failed" % source_path, exc_info=exception)
+            return
+
+        if future.result() and self.__on_transfer_finished is not None:
+            self.__on_transfer_finished()
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from hotplots.constants import Constants
+from hotplots.models import HotPlot, HotPlotTargetDrive
+
+# the current rate is sampled at most this often, and smoothed over the samples
+RATE_SAMPLE_SECONDS = 1.0
+RATE_SMOOTHING = 0.3
+
+
+@dataclass(frozen=True)
+class TransferProgressSnapshot:
+    source_reference: str
+    # the target drive, as host:path for remote hosts
+    destination: str
+    plot_id: str
+    total_bytes: int
+    # on the target drive so far, including what a resumed transfer started from
+    bytes_done: int
+    # since the transfer started, and over the last few seconds
+    average_bytes_per_second: float
+    current_bytes_per_second: float
+    eta_seconds: Optional[float]
+
+    def get_remaining_bytes(self) -> int:
+        return self.total_bytes - self.bytes_done
+
+
+class TransferProgress:
+    """
+    The progress of one running transfer. Its copy loop reports each chunk with advance, everyone else reads
+    snapshots.
+    """
+    def __init__(self, source_reference: str, destination: str, plot_id: str, total_bytes: int, start_offset: int,
+                 log_seconds: float, clock: Callable[[], float]):
+        self.__source_reference = source_reference
+        self.__destination = destination
+        self.__plot_id = plot_id
+        self.__total_bytes = total_bytes
+        self.__start_offset = start_offset
+        self.__log_seconds = log_seconds
+        self.__clock = clock
+        self.__lock = threading.Lock()
+
+        self.__started = clock()
+        self.__bytes_done = start_offset
+        self.__sampled_at = self.__started
+        self.__sampled_bytes_done = start_offset
+        self.__current_bytes_per_second = 0.0
+        self.__logged_at = self.__started
+
+    def advance(self, num_bytes: int):
+        now = self.__clock()
+        with self.__lock:
+            self.__bytes_done += num_bytes
+            if now - self.__sampled_at >= RATE_SAMPLE_SECONDS:
+                rate = (self.__bytes_done - self.__sampled_bytes_done) / (now - self.__sampled_at)
+                self.__current_bytes_per_second = rate if not self.__current_bytes_per_second else \
+                    RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.__current_bytes_per_second
+                (self.__sampled_at, self.__sampled_bytes_done) = (now, self.__bytes_done)
+            should_log = self.__log_seconds > 0 and now - self.__logged_at >= self.__log_seconds
+            if should_log:
+                self.__logged_at = now
+        if should_log:
+            self.__log(self.get_snapshot())
+
+    def get_snapshot(self) -> TransferProgressSnapshot:
+        now = self.__clock()
+        with self.__lock:
+            elapsed = now - self.__started
+            average_bytes_per_second = (self.__bytes_done - self.__start_offset) / elapsed if elapsed > 0 else 0.0
+            remaining_bytes = self.__total_bytes - self.__bytes_done
+            rate = self.__current_bytes_per_second or average_bytes_per_second
+            return TransferProgressSnapshot(
+                self.__source_reference,
+                self.__destination,
+                self.__plot_id,
+                self.__total_bytes,
+                self.__bytes_done,
+                average_bytes_per_second,
+                self.__current_bytes_per_second,
+                remaining_bytes / rate if rate > 0 else None
+            )
+
+    @staticmethod
+    def __log(snapshot: TransferProgressSnapshot):
+        logging.info("%s to %s: %.0f%% (%.1f of %.1f GB) at %.0f MB/s, %s" % (
+            snapshot.source_reference,
+            snapshot.destination,
+            100 * snapshot.bytes_done / snapshot.total_bytes if snapshot.total_bytes else 100,
+            snapshot.bytes_done / Constants.GIGABYTE,
+            snapshot.total_bytes / Constants.GIGABYTE,
+            snapshot.current_bytes_per_second / Constants.MEGABYTE,
+            "about %.0f minutes left" % (snapshot.eta_seconds / 60) if snapshot.eta_seconds is not None else "no estimate yet"
+        ))
+
+
+class TransferProgressTable:
+    """
+    The progress of all running transfers, by source plot. Transfers are added when their copy starts (when the
+    offset a resumed transfer starts from is known) and removed when it ends, however it ends.
+    """
+    def __init__(self, log_seconds: float = 0, clock: Callable[[], float] = time.monotonic):
+        self.__log_seconds = log_seconds
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__transfers: dict[str, TransferProgress] = {}
+
+    def start(self, hot_plot: HotPlot, hot_plot_target_drive: HotPlotTargetDrive, start_offset: int) -> TransferProgress:
+        dest_dir = hot_plot_target_drive.target_drive_info.target_drive_config.path
+        source_reference = hot_plot.source_plot.absolute_reference
+        progress = TransferProgress(
+            source_reference,
+            dest_dir if hot_plot_target_drive.is_local() else "%s:%s" % (hot_plot_target_drive.host_config.hostname, dest_dir),
+            hot_plot.source_plot.plot_name_metadata().plot_id,
+            hot_plot.source_plot.size,
+            start_offset,
+            self.__log_seconds,
+            self.__clock
+        )
+        with self.__lock:
+            self.__transfers[source_reference] = progress
+        return progress
+
+    def finish(self, progress: TransferProgress):
+        source_reference = progress.get_snapshot().source_reference
+        with self.__lock:
+            if self.__transfers.get(source_reference) is progress:
+                del self.__transfers[source_reference]
+
+    def get_all(self) -> List[TransferProgressSnapshot]:
+        with self.__lock:
+            transfers = list(self.__transfers.values())
+        return [progress.get_snapshot() for progress in transfers]
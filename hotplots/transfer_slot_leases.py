@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import socket
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from hotplots.hotplots_config import RemoteHostConfig, TargetDriveConfig
+from hotplots.remote_commands import RemoteCommands
+
+HOST_LEASE_NAME = "host"
+# how often held leases are checked for renewal when none is held yet
+DEFAULT_RENEW_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class TransferSlotLease:
+    remote_host_config: RemoteHostConfig
+    plot_filename: str
+    # lease file paths on the host, one for the host slot and one for the drive slot
+    paths: Tuple[str, ...]
+
+
+class TransferSlotLeases:
+    """
+    Transfer slots of remote hosts, reserved across all plotters sharing a host by lease files on the host itself. A
+    lease file is created with O_EXCL, so of plotters racing for a slot only one gets it, and the host's clock decides
+    when a lease has expired, so the plotters' clocks don't have to agree. Reserving a host and a drive slot is a single
+    round trip, and held leases are renewed in the background while their transfers run.
+    """
+    def __init__(self, run_remote_python: Callable[..., dict], owner: str = None):
+        # HotplotsIO.run_remote_python
+        self.__run_remote_python = run_remote_python
+        # unique per process, so leases of a restarted plotter aren't mistaken for its own
+        self.owner = owner or "%s-%s-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.__lock = threading.Lock()
+        self.__held: List[TransferSlotLease] = []
+        self.__stopped = threading.Event()
+        self.__renewal_thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def get_drive_lease_name(target_drive_config: TargetDriveConfig) -> str:
+        # drive paths can't be file names, a hash of them can
+        return "drive-%s" % hashlib.sha1(target_drive_config.path.encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def get_lease_name(lease_filename: str) -> str:
+        # <lease name>.<slot>.lease
+        return lease_filename.split(".", 1)[0]
+
+    def acquire(self, remote_host_config: RemoteHostConfig, target_drive_config: TargetDriveConfig,
+                plot_filename: str) -> Optional[TransferSlotLease]:
+        """
+        Reserves a slot on the host and one on the drive for a transfer of the plot, or returns None if either has no
+        free slot. Raises RemoteCommandError if the host can't run the lease command.
+        """
+        result = self.__run_remote_python(
+            remote_host_config,
+            RemoteCommands.LEASE_SCRIPT,
+            {
+                "action": "acquire",
+                "dir": remote_host_config.coordination_directory,
+                "ttl": remote_host_config.lease_ttl_seconds,
+                "owner": self.owner,
+                "plot": plot_filename,
+                "groups": [
+                    [HOST_LEASE_NAME, remote_host_config.max_concurrent_inbound_transfers],
+                    [TransferSlotLeases.get_drive_lease_name(target_drive_config), target_drive_config.max_concurrent_inbound_transfers],
+                ],
+            }
+        )
+        if result["leases"] is None:
+            return None
+
+        lease = TransferSlotLease(remote_host_config, plot_filename, tuple(result["leases"]))
+        with self.__lock:
+            self.__held.append(lease)
+            if self.__renewal_thread is None:
+                self.__renewal_thread = threading.Thread(target=self.__renew_until_stopped, name="hotplots-leases", daemon=True)
+                self.__renewal_thread.start()
+        return lease
+
+    def release(self, lease: TransferSlotLease):
+        with self.__lock:
+            if lease in self.__held:
+                self.__held.remove(lease)
+        try:
+            self.__run(lease.remote_host_config, "release", list(lease.paths))
+        except Exception as e:
+            # it expires on its own
+            logging.warning("could not release transfer slot lease for %s on %s: %s" % (lease.plot_filename, lease.remote_host_config.hostname, e))
+
+    def renew_all(self):
+        with self.__lock:
+            held = list(self.__held)
+        for remote_host_config in {lease.remote_host_config.hostname: lease.remote_host_config for lease in held}.values():
+            paths = [path for lease in held if lease.remote_host_config.hostname == remote_host_config.hostname for path in lease.paths]
+            try:
+                result = self.__run(remote_host_config, "renew", paths)
+            except Exception as e:
+                logging.warning("could not renew transfer slot leases on %s: %s" % (remote_host_config.hostname, e))
+                continue
+            if result["lost"]:
+                # expired while the host couldn't be reached, and taken over since. The transfer goes on, the host
+                # just holds one more than its limit for a while.
+                logging.warning("transfer slot leases %s on %s expired and were taken by another plotter" % (result["lost"], remote_host_config.hostname))
+
+    def close(self):
+        self.__stopped.set()
+        if self.__renewal_thread is not None:
+            self.__renewal_thread.join()
+        with self.__lock:
+            held = list(self.__held)
+        for lease in held:
+            self.release(lease)
+
+    def __run(self, remote_host_config: RemoteHostConfig, action: str, paths: List[str]):
+        return self.__run_remote_python(
+            remote_host_config,
+            RemoteCommands.LEASE_SCRIPT,
+            {"action": action, "dir": remote_host_config.coordination_directory, "owner": self.owner, "leases": paths}
+        )
+
+    def __get_renew_seconds(self) -> float:
+        with self.__lock:
+            if not self.__held:
+                return DEFAULT_RENEW_SECONDS
+            # renewed well before they expire, a missed renewal or two is fine
+            return min(lease.remote_host_config.lease_ttl_seconds for lease in self.__held) / 3
+
+    def __renew_until_stopped(self):
+        while not self.__stopped.wait(self.__get_renew_seconds()):
+            self.renew_all()
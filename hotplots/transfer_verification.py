@@ -0,0 +1,58 @@
+import hashlib
+import os
+import random
+from typing import List, Optional, Tuple
+
+# bytes read per hashing call when hashing a whole file
+HASH_READ_BYTES = 8 * 1024 * 1024
+
+
+class TransferVerification:
+    """
+    Compares a transferred plot against its source before the source is removed, either by hashing blocks at random
+    offsets of both (sampled, a few MB read per transfer) or by hashing both whole (full). Each side is hashed where it
+    lives, so a remote copy is hashed on its host and never travels over the network again.
+    """
+
+    @staticmethod
+    def get_sample_blocks(size: int, count: int, block_bytes: int, rng: random.Random = None) -> List[Tuple[int, int]]:
+        """
+        (offset, length) of the blocks to compare: the first and last block, since a short or misaligned copy shows
+        there first, and the rest at random offsets.
+        """
+        rng = rng or random.SystemRandom()
+        if size <= count * block_bytes:
+            return [(0, size)]
+        offsets = {0, size - block_bytes}
+        while len(offsets) < count:
+            offsets.add(rng.randrange(0, size - block_bytes))
+        return [(offset, block_bytes) for offset in sorted(offsets)]
+
+    @staticmethod
+    def hash_local_file(path: str, blocks: Optional[List[Tuple[int, int]]]) -> List[str]:
+        """
+        sha256 hex digest of each of the blocks of the file, or of the whole file if blocks is None.
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if blocks is None:
+                digest = hashlib.sha256()
+                offset = 0
+                while True:
+                    data = os.pread(fd, HASH_READ_BYTES, offset)
+                    if not data:
+                        break
+                    digest.update(data)
+                    offset += len(data)
+                return [digest.hexdigest()]
+            return [hashlib.sha256(os.pread(fd, length, offset)).hexdigest() for (offset, length) in blocks]
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def hash_sftp_file(sftp, path: str, blocks: List[Tuple[int, int]]) -> List[str]:
+        """
+        sha256 hex digest of each of the blocks of a remote file, read over sftp in one pipelined request.
+        """
+        with sftp.open(path, "rb") as remote_file:
+            return [hashlib.sha256(data).hexdigest() for data in remote_file.readv(blocks)]